@@ -0,0 +1,140 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how fast L{twisted.protocols.amp} parses boxes, and how many commands
+per second a pipelined client can have answered over an in-memory connection.
+"""
+
+from __future__ import print_function
+
+import time
+
+from twisted.protocols import amp
+
+
+class Job(amp.Command):
+    arguments = [('id', amp.Integer()), ('payload', amp.String())]
+    response = [('id', amp.Integer()), ('status', amp.String())]
+
+
+
+class Worker(amp.AMP):
+    @Job.responder
+    def job(self, id, payload):
+        return {'id': id, 'status': 'done'}
+
+
+
+class BufferTransport(object):
+    """
+    A transport which keeps written data until it is delivered to the peer.
+    """
+    disconnecting = False
+
+    def __init__(self):
+        self.written = []
+        self.writes = 0
+
+
+    def write(self, data):
+        self.written.append(data)
+        self.writes += 1
+
+
+    def take(self):
+        data = ''.join(self.written)
+        del self.written[:]
+        return data
+
+
+    def getPeer(self):
+        return 'peer'
+
+
+    def getHost(self):
+        return 'host'
+
+
+    def loseConnection(self):
+        pass
+
+
+
+class BoxCounter(object):
+    def __init__(self):
+        self.boxes = 0
+
+
+    def startReceivingBoxes(self, sender):
+        pass
+
+
+    def ampBoxReceived(self, box):
+        self.boxes += 1
+
+
+    def stopReceivingBoxes(self, reason):
+        pass
+
+
+
+def benchmarkParsing(boxes, chunkSize):
+    """
+    Parse C{boxes} boxes delivered in chunks of C{chunkSize} bytes and return
+    the number of boxes parsed per second.
+    """
+    box = amp.Box(_command='job', _ask='1', id='12345', payload='x' * 100)
+    data = box.serialize() * boxes
+    chunks = [data[i:i + chunkSize] for i in range(0, len(data), chunkSize)]
+    counter = BoxCounter()
+    protocol = amp.BinaryBoxProtocol(counter)
+    protocol.makeConnection(BufferTransport())
+    before = time.time()
+    for chunk in chunks:
+        protocol.dataReceived(chunk)
+    elapsed = time.time() - before
+    assert counter.boxes == boxes
+    return boxes / elapsed
+
+
+
+def benchmarkCommands(commands, outstanding):
+    """
+    Have C{commands} L{Job} commands answered, with at most C{outstanding}
+    awaiting an answer at once, and return the number of commands answered
+    per second and the number of writes made by the worker.
+    """
+    client = amp.AMP()
+    client.maxOutstandingRequests = outstanding
+    worker = Worker()
+    clientTransport = BufferTransport()
+    workerTransport = BufferTransport()
+    client.makeConnection(clientTransport)
+    worker.makeConnection(workerTransport)
+
+    answered = []
+    before = time.time()
+    for i in range(commands):
+        client.callRemote(Job, id=i, payload='x' * 100).addCallback(
+            answered.append)
+    while len(answered) < commands:
+        worker.dataReceived(clientTransport.take())
+        client.dataReceived(workerTransport.take())
+    elapsed = time.time() - before
+    return commands / elapsed, workerTransport.writes
+
+
+
+def main():
+    for chunkSize in (64, 1460, 65536):
+        rate = benchmarkParsing(20000, chunkSize)
+        print("parse, %5d byte chunks  %8d boxes/sec" % (chunkSize, rate))
+    for outstanding in (1, 10, 100):
+        rate, writes = benchmarkCommands(20000, outstanding)
+        print("commands, %3d outstanding  %8d commands/sec  %5d writes" % (
+                outstanding, rate, writes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how fast L{twisted.spread.banana.Banana} encodes and decodes very large
+and deeply nested expressions, with the encoded data delivered in chunks the
+size of typical TCP segments.
+"""
+
+from __future__ import print_function
+
+import time
+
+from twisted.spread import banana
+
+
+CHUNK_SIZE = 1460
+
+
+
+class Transport(object):
+    def __init__(self):
+        self.written = []
+
+
+    def write(self, data):
+        self.written.append(data)
+
+
+
+def largePayload():
+    """
+    A long list of small strings and integers, like the arguments of a PB call
+    which passes a large table.
+    """
+    return [["row%d" % (i,), i, i * 1.5, ["a", "b", -i]] for i in range(20000)]
+
+
+
+def largeString():
+    """
+    A single string of almost the largest size Banana accepts.
+    """
+    return "x" * (banana.SIZE_LIMIT - 1)
+
+
+
+def nestedPayload():
+    """
+    Many lists, each nested a few hundred levels deep.
+    """
+    payload = []
+    for i in range(50):
+        value = [i]
+        for depth in range(400):
+            value = [value, depth]
+        payload.append(value)
+    return payload
+
+
+
+def connectedBanana():
+    protocol = banana.Banana()
+    protocol.makeConnection(Transport())
+    protocol._selectDialect("none")
+    protocol.expressionReceived = lambda expression: None
+    return protocol
+
+
+
+def benchmark(payload, iterations):
+    """
+    Encode and decode C{payload} C{iterations} times and return the number of
+    megabytes encoded and decoded per second.
+    """
+    protocol = connectedBanana()
+
+    before = time.time()
+    for i in range(iterations):
+        protocol.sendEncoded(payload)
+    encodeTime = time.time() - before
+
+    encoded = protocol.transport.written[0]
+    chunks = [encoded[i:i + CHUNK_SIZE]
+              for i in range(0, len(encoded), CHUNK_SIZE)]
+    before = time.time()
+    for i in range(iterations):
+        for chunk in chunks:
+            protocol.dataReceived(chunk)
+    decodeTime = time.time() - before
+
+    megabytes = len(encoded) * iterations / 1024.0 / 1024.0
+    return megabytes / encodeTime, megabytes / decodeTime
+
+
+
+def main():
+    for label, payload, iterations in [
+            ("large list", largePayload(), 5),
+            ("large string", largeString(), 20),
+            ("deeply nested", nestedPayload(), 20)]:
+        encodeRate, decodeRate = benchmark(payload, iterations)
+        print("%-14s encode %8.2f MB/sec  decode %8.2f MB/sec" % (
+                label, encodeRate, decodeRate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Compare the speed of decoding a typical DNS response with the file based
+L{twisted.names.dns.Message.decode} and with
+L{twisted.names.dns.Message.fromStr}, which decodes record payloads only when
+they are accessed.
+"""
+
+from __future__ import print_function
+
+import time
+from io import BytesIO
+
+from twisted.names import dns
+
+
+def buildResponse():
+    """
+    Encode a response with a few answers and a populated authority and
+    additional section, as returned by a recursive server.
+    """
+    message = dns.Message(id=1234, answer=1, recDes=1, recAv=1)
+    message.addQuery(b'www.example.com', dns.A)
+    for i in range(4):
+        message.answers.append(dns.RRHeader(
+            b'www.example.com', dns.A, ttl=300,
+            payload=dns.Record_A('10.0.0.%d' % (i,), 300)))
+    for i in range(4):
+        nameserver = b'ns%d.example.com' % (i,)
+        message.authority.append(dns.RRHeader(
+            b'example.com', dns.NS, ttl=86400,
+            payload=dns.Record_NS(nameserver, 86400)))
+        message.additional.append(dns.RRHeader(
+            nameserver, dns.AAAA, ttl=86400,
+            payload=dns.Record_AAAA('2001:db8::%d' % (i,), 86400)))
+    return message.toStr()
+
+
+
+def decodeFile(data):
+    dns.Message().decode(BytesIO(data))
+
+
+
+def decodeBytes(data):
+    dns.Message().fromStr(data)
+
+
+
+def decodeBytesPayloads(data):
+    message = dns.Message()
+    message.fromStr(data)
+    for section in (message.answers, message.authority, message.additional):
+        for record in section:
+            record.payload
+
+
+
+def benchmark(decode, data, iterations):
+    """
+    Call C{decode} with C{data} C{iterations} times and return the number of
+    messages decoded per second.
+    """
+    before = time.time()
+    for i in range(iterations):
+        decode(data)
+    after = time.time()
+    return iterations / (after - before)
+
+
+
+def main():
+    data = buildResponse()
+    for label, decode in [
+            ("Message.decode", decodeFile),
+            ("Message.fromStr", decodeBytes),
+            ("Message.fromStr, payloads", decodeBytesPayloads)]:
+        rate = benchmark(decode, data, 20000)
+        print("%-28s %8d messages/sec" % (label, rate))
+
+
+if __name__ == '__main__':
+    main()
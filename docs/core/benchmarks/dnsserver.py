@@ -0,0 +1,91 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how many queries per second an authoritative
+L{twisted.names.server.DNSServerFactory} can answer, with and without its cache
+of encoded responses.
+
+Queries are delivered directly to a L{twisted.names.dns.DNSDatagramProtocol}
+with an in-memory transport, so the result reflects the cost of decoding
+queries, looking up records and encoding responses only.
+"""
+
+from __future__ import print_function
+
+import time
+
+from twisted.names import authority, common, dns, server
+
+
+NAMES = [b'www.example.com', b'mail.example.com', b'example.com']
+
+
+
+class MemoryAuthority(authority.FileAuthority):
+    def __init__(self, soa, records):
+        common.ResolverBase.__init__(self)
+        self.soa = soa
+        self.records = records
+
+
+
+class NullTransport(object):
+    def write(self, data, address=None):
+        pass
+
+
+
+def buildFactory():
+    soa = dns.Record_SOA(
+        mname=b'ns1.example.com', rname=b'root.example.com', ttl=3600)
+    records = {
+        b'example.com': [
+            soa,
+            dns.Record_NS(b'ns1.example.com', ttl=3600),
+            dns.Record_MX(10, b'mail.example.com', ttl=3600)],
+        b'ns1.example.com': [dns.Record_A('10.0.0.1', ttl=3600)],
+        b'www.example.com': [
+            dns.Record_A('10.0.0.2', ttl=3600),
+            dns.Record_A('10.0.0.3', ttl=3600),
+            dns.Record_AAAA('2001:db8::2', ttl=3600)],
+        b'mail.example.com': [dns.Record_A('10.0.0.4', ttl=3600)],
+        }
+    return server.DNSServerFactory(
+        authorities=[MemoryAuthority((b'example.com', soa), records)])
+
+
+
+def benchmark(factory, queries):
+    """
+    Deliver C{queries} queries to C{factory} and return the number of queries
+    answered per second.
+    """
+    protocol = dns.DNSDatagramProtocol(factory)
+    protocol.makeConnection(NullTransport())
+    datagrams = []
+    for i, name in enumerate(NAMES):
+        message = dns.Message(id=i, recDes=1)
+        message.addQuery(name, dns.ALL_RECORDS)
+        datagrams.append(message.toStr())
+    address = ('127.0.0.1', 53)
+
+    before = time.time()
+    for i in range(queries):
+        protocol.datagramReceived(datagrams[i % len(datagrams)], address)
+    after = time.time()
+    return queries / (after - before)
+
+
+
+def main():
+    for cached in (False, True):
+        factory = buildFactory()
+        if not cached:
+            factory._responseCache = None
+        rate = benchmark(factory, 20000)
+        print("response cache: %-5s  %8d queries/sec" % (cached, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how fast L{twisted.mail.imap4.IMAP4Server} answers FETCH requests for
+whole large messages and for partial ranges of them, and how fast it accepts
+a large APPEND, along with the peak resident memory of the process, which
+should stay well below the size of the messages.
+"""
+
+from __future__ import print_function
+
+import os
+import resource
+import tempfile
+import time
+
+from zope.interface import implementer
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.mail import imap4
+
+
+MESSAGE_SIZE = 20 * 1024 * 1024
+APPEND_SIZE = 5 * 1024 * 1024
+
+
+
+def scheduler(iterator):
+    """
+    Run C{iterator} to completion synchronously, waiting on any L{Deferred}s
+    it produces, instead of one step per reactor iteration.
+    """
+    d = Deferred()
+    def go(ignored):
+        for result in iterator:
+            if isinstance(result, Deferred):
+                result.addCallback(go)
+                return
+        d.callback(None)
+    go(None)
+    return d
+
+
+
+class CountingTransport(object):
+    """
+    A transport which counts the bytes written to it instead of keeping them,
+    and which asks a registered pull producer for data until it is done.
+    """
+    disconnecting = False
+
+    def __init__(self):
+        self.written = 0
+        self.producer = None
+
+
+    def write(self, data):
+        self.written += len(data)
+
+
+    def writeSequence(self, data):
+        self.written += sum(map(len, data))
+
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        if not streaming:
+            while self.producer is not None:
+                producer.resumeProducing()
+
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+    def getPeer(self):
+        return 'peer'
+
+
+    def getHost(self):
+        return 'host'
+
+
+    def loseConnection(self):
+        pass
+
+
+
+@implementer(imap4.IMessage, imap4.IMessageFile)
+class FileMessage(object):
+    """
+    A message kept in a file on disk, with a short header.
+    """
+    def __init__(self, path):
+        self.path = path
+
+
+    def open(self):
+        return open(self.path, 'rb')
+
+
+    def getBodyFile(self):
+        f = self.open()
+        f.readline()
+        f.readline()
+        return f
+
+
+    def getHeaders(self, negate, *names):
+        return {'subject': 'large'}
+
+
+    def getUID(self):
+        return 1
+
+
+    def getFlags(self):
+        return ()
+
+
+    def getInternalDate(self):
+        return 'Fri, 02 Nov 2003 21:25:10 GMT'
+
+
+    def getSize(self):
+        return os.path.getsize(self.path)
+
+
+    def isMultipart(self):
+        return False
+
+
+    def getSubPart(self, part):
+        raise TypeError("Not a multipart message")
+
+
+
+class Mailbox(object):
+    """
+    A mailbox holding a single L{FileMessage}, which counts the bytes of
+    messages appended to it without keeping them.
+    """
+    def __init__(self, message):
+        self.message = message
+        self.appended = 0
+
+
+    def fetch(self, messages, uid):
+        return [(1, self.message)]
+
+
+    def addMessage(self, message, flags, date=None):
+        for chunk in iter(lambda: message.read(65536), ''):
+            self.appended += len(chunk)
+        return succeed(None)
+
+
+    def getMessageCount(self):
+        return 1
+
+
+
+class Account(object):
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+
+    def select(self, name, rw=True):
+        return self.mailbox
+
+
+
+def connectedServer(mailbox):
+    """
+    Create an L{imap4.IMAP4Server} with C{mailbox} selected.
+    """
+    server = imap4.IMAP4Server(scheduler=scheduler)
+    server.makeConnection(CountingTransport())
+    server.setTimeout(None)
+    server.account = Account(mailbox)
+    server.mbox = mailbox
+    server.state = 'select'
+    return server
+
+
+
+def fetch(server, query, count):
+    """
+    Have C{server} answer the FETCH C{query} C{count} times and return the
+    number of megabytes written per second.
+    """
+    transport = server.transport
+    transport.written = 0
+    before = time.time()
+    for i in range(count):
+        server.dataReceived('a%d FETCH 1 (%s)\r\n' % (i, query))
+    elapsed = time.time() - before
+    return transport.written / 1024.0 / 1024.0 / elapsed
+
+
+
+def append(server, mailbox, size):
+    """
+    Have C{server} accept an APPEND of a C{size} byte message, delivered in
+    64KB chunks, and return the number of megabytes accepted per second.
+    """
+    chunk = 'x' * 65536
+    before = time.time()
+    server.dataReceived('a APPEND inbox {%d}\r\n' % (size,))
+    remaining = size
+    while remaining:
+        data = chunk[:remaining]
+        server.dataReceived(data)
+        remaining -= len(data)
+    server.dataReceived('\r\n')
+    elapsed = time.time() - before
+    assert mailbox.appended == size
+    return size / 1024.0 / 1024.0 / elapsed
+
+
+
+def main():
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write('Subject: large\r\n\r\n')
+            line = 'x' * 78 + '\r\n'
+            for i in range(MESSAGE_SIZE // len(line)):
+                f.write(line)
+        mailbox = Mailbox(FileMessage(path))
+        server = connectedServer(mailbox)
+
+        rate = fetch(server, 'BODY[]', 5)
+        print("FETCH BODY[], %dMB          %8.1f MB/sec" % (
+                MESSAGE_SIZE // 1024 // 1024, rate))
+        before = time.time()
+        for i in range(1000):
+            server.dataReceived(
+                'p%d FETCH 1 (BODY[TEXT]<%d.4096>)\r\n' % (
+                    i, i * 16384))
+        elapsed = time.time() - before
+        print("FETCH BODY[TEXT]<n.4096>    %8d requests/sec" % (
+                1000 / elapsed,))
+        rate = append(server, mailbox, APPEND_SIZE)
+        print("APPEND, %dMB                %8.1f MB/sec" % (
+                APPEND_SIZE // 1024 // 1024, rate))
+        print("peak resident memory        %8d KB" % (
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how many messages per second a L{twisted.words.service.Group} with
+10000 L{IRCUser} members can deliver, with each message formatted once for
+all members, and formatted separately for each member as it used to be.
+"""
+
+from __future__ import print_function
+
+import time
+
+from twisted.words import service
+
+
+MEMBERS = 10000
+
+
+
+class Transport(object):
+    """
+    A transport which counts the bytes written to it.
+    """
+    disconnecting = False
+
+    def __init__(self):
+        self.written = 0
+
+
+    def write(self, data):
+        self.written += len(data)
+
+
+    def getPeer(self):
+        return 'peer'
+
+
+    def getHost(self):
+        return 'host'
+
+
+    def loseConnection(self):
+        pass
+
+
+
+class PerMemberIRCUser(service.IRCUser):
+    """
+    An L{IRCUser} which formats each message sent to a group for itself.
+    """
+    def receive(self, sender, recipient, message):
+        return service.IRCUser.receive(self, sender, recipient, message)
+
+
+
+def channel(protocol):
+    """
+    Create a group with C{MEMBERS} connected members built from C{protocol}.
+    """
+    realm = service.InMemoryWordsRealm("example.com")
+    factory = service.IRCFactory(realm, None)
+    factory.protocol = protocol
+    group = service.Group(u"channel")
+    for i in range(MEMBERS):
+        user = factory.buildProtocol(None)
+        user.makeConnection(Transport())
+        user.name = u"user%d" % (i,)
+        # Joining each member through Group.add would tell every other
+        # member about it, which is not what is being measured here.
+        group.users[user.name] = user
+    return group
+
+
+
+def benchmark(protocol, duration):
+    """
+    Send messages to a group of C{protocol} members for about C{duration}
+    seconds and return the number of messages and of megabytes delivered
+    per second.
+    """
+    group = channel(protocol)
+    sender = service.User(u"sender")
+    message = {"text": "a typical line of chat, neither long nor short"}
+    sent = 0
+    before = time.time()
+    while time.time() - before < duration:
+        group.receive(sender, group, message)
+        sent += 1
+    elapsed = time.time() - before
+    written = sum([user.transport.written for user in group.users.values()])
+    return sent / elapsed, written / 1024.0 / 1024.0 / elapsed
+
+
+
+def main():
+    for label, protocol in [
+            ("formatted per member", PerMemberIRCUser),
+            ("formatted once", service.IRCUser)]:
+        messages, megabytes = benchmark(protocol, 3)
+        print("%-22s %8.1f messages/sec  %8.1f MB/sec" % (
+                label, messages, megabytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how many lines per second L{twisted.words.protocols.irc.IRCClient}
+parses and dispatches when replaying the traffic of a busy channel: mostly
+messages, with some actions, joins, parts, quits, nick changes and mode
+changes.
+"""
+
+from __future__ import print_function
+
+import random
+import time
+
+from twisted.words.protocols import irc
+
+
+LINES = 200000
+CHUNK_SIZE = 4096
+
+
+
+class Transport(object):
+    disconnecting = False
+
+    def write(self, data):
+        pass
+
+
+    def writeSequence(self, data):
+        pass
+
+
+
+class Bot(irc.IRCClient):
+    """
+    A client which receives everything a busy channel sends it and does
+    nothing with it.
+    """
+    performLogin = False
+
+    def privmsg(self, user, channel, message):
+        pass
+
+
+    def action(self, user, channel, data):
+        pass
+
+
+    def userJoined(self, user, channel):
+        pass
+
+
+    def userLeft(self, user, channel):
+        pass
+
+
+    def userQuit(self, user, quitMessage):
+        pass
+
+
+    def userRenamed(self, oldname, newname):
+        pass
+
+
+    def modeChanged(self, user, channel, set, modes, args):
+        pass
+
+
+
+def channelLog(lines):
+    """
+    Generate C{lines} lines of the traffic of a busy channel, the same every
+    time.
+    """
+    random.seed(0)
+    words = ("the quick brown fox jumps over a lazy dog while everyone "
+             "in the channel talks about something else entirely").split()
+    nicks = ["user%d" % (i,) for i in range(500)]
+    log = []
+    for i in range(lines):
+        nick = random.choice(nicks)
+        prefix = ":%s!~%s@host-%d.example.com" % (nick, nick, i % 97)
+        kind = random.random()
+        text = " ".join(random.sample(words, random.randint(3, 12)))
+        if kind < 0.85:
+            log.append("%s PRIVMSG #busy :%s" % (prefix, text))
+        elif kind < 0.90:
+            log.append("%s PRIVMSG #busy :\x01ACTION %s\x01" % (prefix, text))
+        elif kind < 0.94:
+            log.append("%s JOIN :#busy" % (prefix,))
+        elif kind < 0.97:
+            log.append("%s PART #busy :%s" % (prefix, text))
+        elif kind < 0.99:
+            log.append("%s QUIT :Quit: %s" % (prefix, text))
+        elif kind < 0.995:
+            log.append("%s NICK :%s_" % (prefix, nick))
+        else:
+            log.append("%s MODE #busy +v %s" % (prefix, random.choice(nicks)))
+    return "\r\n".join(log) + "\r\n"
+
+
+
+def benchmark(data):
+    """
+    Replay C{data} to a L{Bot} in C{CHUNK_SIZE} byte reads and return the
+    number of lines handled per second.
+    """
+    bot = Bot()
+    bot.makeConnection(Transport())
+    bot.nickname = "bot"
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    before = time.time()
+    for chunk in chunks:
+        bot.dataReceived(chunk)
+    return LINES / (time.time() - before)
+
+
+
+def main():
+    data = channelLog(LINES)
+    for i in range(3):
+        print("busy channel replay  %8d lines/sec" % (benchmark(data),))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how many typical PB call payloads L{twisted.spread.pb.Broker} can
+serialize and unserialize per second with L{twisted.spread.jelly}.
+"""
+
+from __future__ import print_function
+
+import time
+
+from twisted.spread import pb
+
+
+class Point(pb.Copyable, pb.RemoteCopy):
+    def __init__(self, x, y, label):
+        self.x = x
+        self.y = y
+        self.label = label
+
+pb.setUnjellyableForClass(Point, Point)
+
+
+
+class Row(object):
+    def __init__(self, key, values):
+        self.key = key
+        self.values = values
+
+
+
+def copyablesPayload():
+    """
+    The arguments of a call passing a long list of L{pb.Copyable}s.
+    """
+    return ([Point(i, i * 2.5, "point%d" % (i,)) for i in range(200)],
+            {"offset": 0, "count": 200})
+
+
+
+def primitivesPayload():
+    """
+    The arguments of a call passing a table of strings and numbers.
+    """
+    return ([["name%d" % (i,), i, i * 0.5, i * 100000000000] for i in range(200)],
+            {"page": 1, "sorted": True})
+
+
+
+def instancesPayload():
+    """
+    The arguments of a call passing plain instances, which are copied by
+    their class name.
+    """
+    return ([Row("key%d" % (i,), [i, i + 1]) for i in range(200)],)
+
+
+
+def benchmark(broker, payload, duration):
+    """
+    Serialize and unserialize C{payload} with C{broker} for about C{duration}
+    seconds and return the number of round trips per second.
+    """
+    calls = 0
+    before = time.time()
+    while time.time() - before < duration:
+        for i in range(10):
+            broker.unserialize(broker.serialize(payload))
+        calls += 10
+    return calls / (time.time() - before)
+
+
+
+def main():
+    broker = pb.Broker()
+    broker.security.allowInstancesOf(Row)
+    for label, payload in [
+            ("copyables", copyablesPayload()),
+            ("primitives", primitivesPayload()),
+            ("instances", instancesPayload())]:
+        rate = benchmark(broker, payload, 3)
+        print("%-12s %8.1f calls/sec" % (label, rate))
+
+
+if __name__ == '__main__':
+    main()
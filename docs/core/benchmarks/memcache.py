@@ -0,0 +1,113 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how many commands per second L{twisted.protocols.memcache} clients
+have answered by fake memcached servers listening on the loopback interface
+in another process: a single L{MemCacheProtocol}, and a
+L{ShardedMemCacheClient} spreading the same keys over several servers.
+"""
+
+from __future__ import print_function
+
+import subprocess
+import sys
+import time
+
+from twisted.internet import reactor, protocol
+from twisted.internet.defer import inlineCallbacks, gatherResults, returnValue
+from twisted.protocols.basic import LineReceiver
+from twisted.protocols.memcache import MemCacheProtocol, ShardedMemCacheClient
+
+
+class FakeMemcached(LineReceiver):
+    """
+    A memcached server which understands just enough of the protocol for
+    C{get} and C{set}.
+    """
+    pendingSet = None
+
+    def lineReceived(self, line):
+        if self.pendingSet is not None:
+            self.factory.values[self.pendingSet] = line
+            self.pendingSet = None
+            self.transport.write("STORED\r\n")
+            return
+        parts = line.split()
+        if parts[0] == "set":
+            self.pendingSet = parts[1]
+        elif parts[0] == "get":
+            answer = []
+            for key in parts[1:]:
+                value = self.factory.values.get(key)
+                if value is not None:
+                    answer.append("VALUE %s 0 %d\r\n%s\r\n" % (
+                            key, len(value), value))
+            answer.append("END\r\n")
+            self.transport.write("".join(answer))
+
+
+
+def listen():
+    factory = protocol.ServerFactory()
+    factory.protocol = FakeMemcached
+    factory.values = {}
+    return reactor.listenTCP(0, factory, interface="127.0.0.1")
+
+
+
+@inlineCallbacks
+def run(client, keys, rounds):
+    """
+    Set and then get every key of C{keys}, in parallel, C{rounds} times, and
+    return the number of commands answered per second.
+    """
+    before = time.time()
+    for i in range(rounds):
+        yield gatherResults([client.set(key, "x" * 100) for key in keys])
+        yield gatherResults([client.get(key) for key in keys])
+    yield client.getMultiple(keys)
+    elapsed = time.time() - before
+    returnValue(len(keys) * (2 * rounds + 1) / elapsed)
+
+
+def serve():
+    """
+    Run three fake servers and print their port numbers.
+    """
+    ports = [listen() for i in range(3)]
+    print(" ".join([str(port.getHost().port) for port in ports]))
+    sys.stdout.flush()
+    reactor.run()
+
+
+
+@inlineCallbacks
+def main(ports):
+    keys = ["key%d" % (i,) for i in range(1000)]
+    try:
+        single = yield protocol.ClientCreator(
+            reactor, MemCacheProtocol).connectTCP("127.0.0.1", ports[0])
+        rate = yield run(single, keys, 20)
+        print("single connection   %8d commands/sec" % (rate,))
+
+        sharded = ShardedMemCacheClient(
+            [("127.0.0.1", port) for port in ports])
+        rate = yield run(sharded, keys, 20)
+        print("sharded, 3 servers  %8d commands/sec" % (rate,))
+    finally:
+        reactor.stop()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ["serve"]:
+        serve()
+    else:
+        servers = subprocess.Popen([sys.executable, __file__, "serve"],
+                                   stdout=subprocess.PIPE)
+        try:
+            ports = [int(port) for port in servers.stdout.readline().split()]
+            reactor.callWhenRunning(main, ports)
+            reactor.run()
+        finally:
+            servers.terminate()
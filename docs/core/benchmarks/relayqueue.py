@@ -0,0 +1,120 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how long L{twisted.mail.relaymanager.Queue} takes to open a queue
+directory of 100000 messages for 1000 domains, with and without its index,
+and how many times per second L{SmartHostSMTPRelayingManager.checkState} can
+run when most of those domains are backed off.
+"""
+
+from __future__ import print_function
+
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from twisted.internet.defer import Deferred
+from twisted.mail import relaymanager
+
+
+MESSAGES = 100000
+DOMAINS = 1000
+
+
+
+class Queue(relaymanager.Queue):
+    noisy = False
+
+
+
+class Factory(object):
+    def __init__(self, messages, manager):
+        self.messages = messages
+        self.manager = manager
+
+
+
+class MXCalculator(object):
+    def getMX(self, domain):
+        return Deferred()
+
+
+
+def fill(directory):
+    """
+    Write C{MESSAGES} messages, for recipients in C{DOMAINS} domains, to
+    C{directory}.
+    """
+    for i in range(MESSAGES):
+        name = os.path.join(directory, "message%d" % (i,))
+        with open(name + "-H", "wb") as f:
+            pickle.dump(["sender@example.com",
+                         "user%d@domain%d.example" % (i, i % DOMAINS)], f)
+        with open(name + "-D", "wb") as f:
+            f.write("Subject: message %d\n\nbody\n" % (i,))
+
+
+
+def openQueue(directory):
+    """
+    Open a queue on C{directory} and have the domains of all of its messages
+    found, and return the queue and the time taken.
+    """
+    before = time.time()
+    queue = Queue(directory)
+    queue.nextDomains(0)
+    return queue, time.time() - before
+
+
+
+def checkStates(queue, duration):
+    """
+    Back off all domains but one of C{queue}, then call C{checkState} on a
+    manager for it for about C{duration} seconds and return the number of
+    calls per second.
+    """
+    for domain in queue.nextDomains(DOMAINS):
+        if domain != "domain0.example":
+            queue.deferDomain(domain)
+        queue.releaseDomain(domain)
+
+    # Let the directory settle, so that it is not listed again.
+    time.sleep(queue._settleTime)
+    manager = relaymanager.SmartHostSMTPRelayingManager(queue)
+    manager.factory = Factory
+    manager.mxcalc = MXCalculator()
+    calls = 0
+    before = time.time()
+    while time.time() - before < duration:
+        manager.checkState()
+        for factory in list(manager.managed):
+            for message in factory.messages:
+                queue.setWaiting(os.path.basename(message))
+            del manager.managed[factory]
+            queue.releaseDomain(factory.manager.domain)
+        calls += 1
+    return calls / (time.time() - before)
+
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        fill(directory)
+        queue, elapsed = openQueue(directory)
+        print("open without index  %8.2f sec" % (elapsed,))
+        queue._closeJournal()
+        queue, elapsed = openQueue(directory)
+        print("open with index     %8.2f sec" % (elapsed,))
+        rate = checkStates(queue, 3)
+        print("checkState, 1 of %d domains due  %8d calls/sec" % (
+                DOMAINS, rate))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
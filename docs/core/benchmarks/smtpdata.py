@@ -0,0 +1,120 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how many megabytes of message data per second L{twisted.mail.smtp.SMTP}
+receives in 64KB reads: split into lines one at a time, as it used to be,
+delivered line by line to an L{IMessage}, and delivered in chunks to an
+L{IChunkedMessage}.
+"""
+
+from __future__ import print_function
+
+import time
+
+from zope.interface import implementer
+
+from twisted.internet.defer import succeed
+from twisted.mail import smtp
+from twisted.protocols import basic
+from twisted.test.proto_helpers import StringTransport
+
+
+MESSAGE_SIZE = 10 * 1024 * 1024
+READ_SIZE = 65536
+
+
+
+@implementer(smtp.IMessage)
+class LineMessage(object):
+    def __init__(self):
+        self.size = 0
+
+
+    def lineReceived(self, line):
+        self.size += len(line) + 1
+
+
+    def eomReceived(self):
+        return succeed(None)
+
+
+    def connectionLost(self):
+        pass
+
+
+
+@implementer(smtp.IChunkedMessage)
+class ChunkMessage(LineMessage):
+    def chunkReceived(self, chunk):
+        self.size += len(chunk)
+
+
+
+@implementer(smtp.IMessageDelivery)
+class Delivery(object):
+    def __init__(self, messageFactory):
+        self.messageFactory = messageFactory
+
+
+    def receivedHeader(self, helo, origin, recipients):
+        return None
+
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+
+    def validateTo(self, user):
+        return self.messageFactory
+
+
+
+def messageData():
+    """
+    A dot-stuffed message of about C{MESSAGE_SIZE} bytes, with its terminator.
+    """
+    lines = ["Subject: benchmark", ""]
+    while len(lines) * 60 < MESSAGE_SIZE:
+        lines.append("%-58d" % (len(lines),))
+        lines.append("..a line beginning with a dot")
+    return "\r\n".join(lines) + "\r\n.\r\n"
+
+
+
+def benchmark(messageFactory, receive, data):
+    """
+    Have an L{smtp.SMTP} server receive a message made of C{data} by passing
+    it to C{receive} in C{READ_SIZE} pieces, and return the number of
+    megabytes received per second.
+    """
+    server = smtp.SMTP(Delivery(messageFactory))
+    server.makeConnection(StringTransport())
+    server.dataReceived(
+        "HELO example.com\r\n"
+        "MAIL FROM:<alice@example.com>\r\n"
+        "RCPT TO:<bob@example.com>\r\n"
+        "DATA\r\n")
+    before = time.time()
+    for i in range(0, len(data), READ_SIZE):
+        receive(server, data[i:i + READ_SIZE])
+    elapsed = time.time() - before
+    assert server.transport.value().endswith("250 Delivery in progress\r\n")
+    server.connectionLost(None)
+    return len(data) / 1024.0 / 1024.0 / elapsed
+
+
+
+def main():
+    data = messageData()
+    for label, messageFactory, receive in [
+            ("one line at a time", LineMessage,
+             basic.LineOnlyReceiver.dataReceived),
+            ("IMessage", LineMessage, smtp.SMTP.dataReceived),
+            ("IChunkedMessage", ChunkMessage, smtp.SMTP.dataReceived)]:
+        rate = benchmark(messageFactory, receive, data)
+        print("%-20s %8.1f MB/sec" % (label, rate))
+
+
+if __name__ == '__main__':
+    main()
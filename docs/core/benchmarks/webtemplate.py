@@ -0,0 +1,99 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Compare flattening an L{twisted.web.template.Element} from its compiled
+template, as the flattener does for an element which does not override
+C{render}, with flattening the template as loaded, which walks and escapes
+every static tag each time.
+"""
+
+from __future__ import print_function
+
+import time
+
+from twisted.web.template import (
+    Element, XMLString, renderer, flattenString)
+
+
+TEMPLATE = """\
+<html xmlns:t="http://twistedmatrix.com/ns/twisted.web.template/0.1">
+  <head>
+    <title t:render="title" />
+    <link rel="stylesheet" href="/static/site.css" />
+  </head>
+  <body>
+    <div class="header">
+      <h1>Benchmark &amp; friends</h1>
+      <ul class="menu">
+        <li><a href="/">Home</a></li>
+        <li><a href="/about">About</a></li>
+        <li><a href="/contact">Contact</a></li>
+      </ul>
+    </div>
+    <table class="listing">
+      <tr><th>Name</th><th>Value</th></tr>
+      <tr t:render="rows"><td><t:slot name="name" /></td>
+        <td><t:slot name="value" /></td></tr>
+    </table>
+    <div class="footer">
+      <p>Copyright &lt;somebody&gt;.  All rights reserved.</p>
+    </div>
+  </body>
+</html>
+"""
+
+
+
+class Page(Element):
+    loader = XMLString(TEMPLATE)
+
+    def __init__(self, rows):
+        Element.__init__(self)
+        self.rowCount = rows
+
+
+    @renderer
+    def title(self, request, tag):
+        return tag(u"Benchmark")
+
+
+    @renderer
+    def rows(self, request, tag):
+        for i in range(self.rowCount):
+            yield tag.clone().fillSlots(
+                name=u"row %d" % (i,), value=u"<%d>" % (i,))
+
+
+
+class UncompiledPage(Page):
+    def render(self, request):
+        return self.loader.load()
+
+
+
+def benchmark(factory, rows, iterations):
+    """
+    Flatten C{iterations} elements created by C{factory} and return the number
+    of elements flattened per second.
+    """
+    results = []
+    before = time.time()
+    for i in range(iterations):
+        flattenString(None, factory(rows)).addCallback(results.append)
+    after = time.time()
+    assert len(results) == iterations
+    return iterations / (after - before)
+
+
+
+def main():
+    for rows in (0, 10, 100):
+        for factory in (UncompiledPage, Page):
+            rate = benchmark(factory, rows, 2000)
+            print("%-14s  rows: %3d  %8d renders/sec" % (
+                    factory.__name__, rows, rate))
+
+
+if __name__ == '__main__':
+    main()
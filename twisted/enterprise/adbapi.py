@@ -7,8 +7,10 @@ An asynchronous mapping to U{DB-API 2.0<http://www.python.org/topics/database/Da
 """
 
 import sys
+import threading
+from collections import OrderedDict
 
-from twisted.internet import threads
+from twisted.internet import defer, threads
 from twisted.python import reflect, log
 from twisted.python.deprecate import deprecated
 from twisted.python.versions import Version
@@ -23,6 +25,163 @@ class ConnectionLost(Exception):
 
 
 
+class ConnectionPoolTimeout(Exception):
+    """
+    This exception means that no pooled connection became available within
+    the pool's C{wait_timeout}.  The request was not run.
+    """
+
+
+
+class _CheckOut(object):
+    """
+    A request for a pooled connection which is waiting for a pool thread.
+
+    A check-out is either started by a pool thread or expired by the reactor
+    thread, never both.
+
+    @ivar queuedAt: The time at which the request was made.
+
+    @ivar expired: Whether the request has been given up on.
+
+    @ivar timeoutCall: The L{IDelayedCall} which will expire the request, or
+        C{None}.
+    """
+    timeoutCall = None
+
+    def __init__(self, queuedAt):
+        self.queuedAt = queuedAt
+        self._lock = threading.Lock()
+        self._started = False
+        self.expired = False
+
+
+    def start(self):
+        """
+        Claim the request for a pool thread.
+
+        @return: C{False} if the request has already expired.
+        """
+        with self._lock:
+            if self.expired:
+                return False
+            self._started = True
+            return True
+
+
+    def expire(self):
+        """
+        Give up on the request.
+
+        @return: C{False} if a pool thread has already started it.
+        """
+        with self._lock:
+            if self._started:
+                return False
+            self.expired = True
+            return True
+
+
+
+class _Arrivals(object):
+    """
+    A barrier for a fixed number of pool threads.
+
+    @ivar remaining: The number of threads which have not arrived yet.
+    """
+
+    def __init__(self, count):
+        self._condition = threading.Condition()
+        self.remaining = count
+
+
+    def arrive(self, timeout):
+        """
+        Note that the calling thread has arrived and wait, for at most
+        C{timeout} seconds, until all the other threads have too.
+        """
+        with self._condition:
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self._condition.notifyAll()
+            else:
+                self._condition.wait(timeout)
+
+
+
+class _PoolStatistics(object):
+    """
+    Counters describing how busy a L{ConnectionPool} is.  They are updated
+    from both the reactor thread and the pool threads.
+
+    @ivar waiting: The number of requests waiting for a pool thread.
+    @ivar active: The number of requests being run by pool threads.
+    @ivar saturated: The number of requests which found every connection in
+        use and had to wait.
+    @ivar completed: The number of requests which have been run.
+    @ivar timedOut: The number of requests which expired while waiting.
+    @ivar queueWaitTotal: The total number of seconds requests spent waiting.
+    @ivar queueWaitMax: The longest wait of any request, in seconds.
+    @ivar queryTimeTotal: The total number of seconds spent running requests.
+    @ivar queryTimeMax: The longest time spent running any request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.saturated = 0
+        self.completed = 0
+        self.timedOut = 0
+        self.queueWaitTotal = 0.0
+        self.queueWaitMax = 0.0
+        self.queryTimeTotal = 0.0
+        self.queryTimeMax = 0.0
+
+
+    def queued(self, capacity):
+        with self._lock:
+            if self.waiting + self.active >= capacity:
+                self.saturated += 1
+            self.waiting += 1
+
+
+    def expired(self):
+        with self._lock:
+            self.waiting -= 1
+            self.timedOut += 1
+
+
+    def started(self, wait):
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+            self.queueWaitTotal += wait
+            self.queueWaitMax = max(self.queueWaitMax, wait)
+
+
+    def finished(self, elapsed):
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+            self.queryTimeTotal += elapsed
+            self.queryTimeMax = max(self.queryTimeMax, elapsed)
+
+
+    def snapshot(self):
+        with self._lock:
+            return {'waiting': self.waiting,
+                    'active': self.active,
+                    'saturated': self.saturated,
+                    'completed': self.completed,
+                    'timedOut': self.timedOut,
+                    'queueWaitTotal': self.queueWaitTotal,
+                    'queueWaitMax': self.queueWaitMax,
+                    'queryTimeTotal': self.queryTimeTotal,
+                    'queryTimeMax': self.queryTimeMax}
+
+
+
 class Connection(object):
     """
     A wrapper for a DB-API connection instance.
@@ -143,9 +302,20 @@ class ConnectionPool:
     @ivar _reactor: The reactor which will be used to schedule startup and
         shutdown events.
     @type _reactor: L{IReactorCore} provider
+
+    @ivar _statistics: The L{_PoolStatistics} of this pool.
+
+    @ivar _statements: A C{dict} mapping thread ids to an C{OrderedDict} of
+        cached cursors of that thread's connection, keyed on SQL statement
+        and in least recently used order.
+
+    @ivar _batch: C{None}, or a C{list} of C{(args, kw, Deferred)} tuples
+        describing the operations queued by L{runBatchedOperation} during
+        the current reactor iteration.
     """
 
-    CP_ARGS = "min max name noisy openfun reconnect good_sql".split()
+    CP_ARGS = ("min max name noisy openfun reconnect good_sql wait_timeout "
+               "statement_cache warmup").split()
 
     noisy = False # if true, generate informational log messages
     min = 3 # minimum number of connections in pool
@@ -154,6 +324,9 @@ class ConnectionPool:
     openfun = None # A function to call on new connections
     reconnect = False # reconnect when connections fail
     good_sql = 'select 1' # a query which should always succeed
+    wait_timeout = None # seconds a request may wait for a connection
+    statement_cache = 0 # cursors cached per connection, keyed on statement
+    warmup = False # open min connections when the pool starts
 
     running = False # true when the pool is operating
     connectionFactory = Connection
@@ -162,6 +335,10 @@ class ConnectionPool:
     # Initialize this to None so it's available in close() even if start()
     # never runs.
     shutdownID = None
+    _batch = None
+
+    # How long a warm-up thread waits for the others to connect.
+    _warmUpTimeout = 30
 
     def __init__(self, dbapiName, *connargs, **connkw):
         """Create a new ConnectionPool.
@@ -197,6 +374,20 @@ class ConnectionPool:
         @param cp_reactor: use this reactor instead of the global reactor
             (added in Twisted 10.2).
         @type cp_reactor: L{IReactorCore} provider
+
+        @param cp_wait_timeout: the number of seconds a request may wait for
+            a free connection before it fails with L{ConnectionPoolTimeout}
+            (default C{None}, wait forever)
+
+        @param cp_statement_cache: the number of cursors to keep open on each
+            connection for reuse by L{runQuery}, L{runOperation} and
+            L{runBatchedOperation}, keyed on their SQL statement, so that
+            drivers which prepare statements per cursor prepare them only
+            once (default 0, no cache)
+
+        @param cp_warmup: open C{cp_min} connections when the pool starts
+            rather than when they are first used (default False); see
+            L{warmUp}
         """
 
         self.dbapiName = dbapiName
@@ -226,6 +417,8 @@ class ConnectionPool:
         self.max = max(self.min, self.max)
 
         self.connections = {}  # all connections, hashed on thread id
+        self._statements = {}
+        self._statistics = _PoolStatistics()
 
         # these are optional so import them here
         from twisted.python import threadpool
@@ -253,6 +446,37 @@ class ConnectionPool:
             self.shutdownID = self._reactor.addSystemEventTrigger(
                 'during', 'shutdown', self.finalClose)
             self.running = True
+            if self.warmup:
+                self.warmUp().addErrback(
+                    log.err, "Connection pool warm-up failed")
+
+
+    def warmUp(self):
+        """
+        Open C{min} connections now, one in each of C{min} pool threads, so
+        that the first requests do not pay for connection setup.
+
+        Each warm-up thread waits for the others before it is released, so
+        that no thread takes two warm-up calls.
+
+        @return: a Deferred which fires with C{None} once the connections
+            are open, or with the Failure of the first connection attempt
+            which failed.
+        """
+        arrivals = _Arrivals(self.min)
+        return defer.gatherResults(
+            [threads.deferToThreadPool(self._reactor, self.threadpool,
+                                       self._warmUpConnection, arrivals)
+             for i in range(self.min)],
+            consumeErrors=True).addCallbacks(
+            lambda ignored: None, lambda reason: reason.value.subFailure)
+
+
+    def _warmUpConnection(self, arrivals):
+        try:
+            self.connect()
+        finally:
+            arrivals.arrive(self._warmUpTimeout)
 
 
     def runWithConnection(self, func, *args, **kw):
@@ -276,10 +500,7 @@ class ConnectionPool:
         @return: a Deferred which will fire the return value of
             C{func(Transaction(...), *args, **kw)}, or a Failure.
         """
-        from twisted.internet import reactor
-        return threads.deferToThreadPool(reactor, self.threadpool,
-                                         self._runWithConnection,
-                                         func, *args, **kw)
+        return self._deferToPool(self._runWithConnection, func, *args, **kw)
 
 
     def _runWithConnection(self, func, *args, **kw):
@@ -326,10 +547,88 @@ class ConnectionPool:
         @return: a Deferred which will fire the return value of
             'interaction(Transaction(...), *args, **kw)', or a Failure.
         """
-        from twisted.internet import reactor
-        return threads.deferToThreadPool(reactor, self.threadpool,
-                                         self._runInteraction,
-                                         interaction, *args, **kw)
+        return self._deferToPool(self._runInteraction,
+                                 interaction, *args, **kw)
+
+
+    def _deferToPool(self, f, *args, **kw):
+        """
+        Call C{f} in a pool thread once one is free, keeping the pool's
+        statistics and honouring C{wait_timeout}.
+
+        @return: A L{Deferred} which fires with the result of C{f}, or fails
+            with L{ConnectionPoolTimeout} if no thread became free in time.
+        """
+        d = defer.Deferred()
+        checkOut = _CheckOut(self._reactor.seconds())
+        self._statistics.queued(self.max)
+        if self.wait_timeout is not None:
+            checkOut.timeoutCall = self._reactor.callLater(
+                self.wait_timeout, self._expire, checkOut, d)
+
+        def deliver(success, result):
+            if checkOut.expired:
+                # The request has already been failed.
+                return
+            if (checkOut.timeoutCall is not None and
+                    checkOut.timeoutCall.active()):
+                checkOut.timeoutCall.cancel()
+            if success:
+                d.callback(result)
+            else:
+                d.errback(result)
+
+        def onResult(success, result):
+            self._reactor.callFromThread(deliver, success, result)
+
+        self.threadpool.callInThreadWithCallback(
+            onResult, self._runCheckedOut, checkOut, f, *args, **kw)
+        return d
+
+
+    def _expire(self, checkOut, d):
+        """
+        Fail a request which is still waiting for a pool thread.
+        """
+        if checkOut.expire():
+            self._statistics.expired()
+            d.errback(ConnectionPoolTimeout(
+                    "No connection available after %s seconds" % (
+                        self.wait_timeout,)))
+
+
+    def _runCheckedOut(self, checkOut, f, *args, **kw):
+        """
+        Run C{f} in a pool thread unless its request has expired.
+        """
+        if not checkOut.start():
+            raise ConnectionPoolTimeout()
+        started = self._reactor.seconds()
+        self._statistics.started(started - checkOut.queuedAt)
+        try:
+            return f(*args, **kw)
+        finally:
+            self._statistics.finished(self._reactor.seconds() - started)
+
+
+    def statistics(self):
+        """
+        Describe how busy the pool is.
+
+        @return: A C{dict} with the keys C{'max'} (the number of connections
+            the pool may open), C{'waiting'} and C{'active'} (the number of
+            requests waiting for and holding a connection), C{'saturated'}
+            (how many requests found every connection in use),
+            C{'completed'}, C{'timedOut'} (how many requests failed with
+            L{ConnectionPoolTimeout}), C{'queueWaitTotal'} and
+            C{'queueWaitMax'} (the total and longest time requests waited for
+            a connection, in seconds) and C{'queryTimeTotal'} and
+            C{'queryTimeMax'} (the total and longest time requests held a
+            connection, in seconds).
+        """
+        statistics = self._statistics.snapshot()
+        statistics['max'] = self.max
+        return statistics
 
 
     def runQuery(self, *args, **kw):
@@ -371,6 +670,49 @@ class ConnectionPool:
         return self.runInteraction(self._runOperation, *args, **kw)
 
 
+    def runBatchedOperation(self, *args, **kw):
+        """Execute an SQL query as part of a batch and return None.
+
+        This is like L{runOperation}, except that all the operations queued
+        with this method during one reactor iteration are run together in a
+        single transaction by one pool thread.  Consecutive operations with
+        the same SQL statement and a single parameter sequence or mapping
+        each are run by one call to the DB-API cursor's 'executemany'
+        method.
+
+        If any operation of a batch fails, the whole transaction is rolled
+        back and every operation of the batch fails.
+
+        @return: a Deferred which will fire None or a Failure.
+        """
+        d = defer.Deferred()
+        if self._batch is None:
+            self._batch = []
+            self._reactor.callLater(0, self._runBatch)
+        self._batch.append((args, kw, d))
+        return d
+
+
+    def _runBatch(self):
+        """
+        Run the operations queued by L{runBatchedOperation} in one
+        interaction, and fire their L{Deferred}s.
+        """
+        batch, self._batch = self._batch, None
+        result = self.runInteraction(
+            self._runOperations, [(args, kw) for (args, kw, d) in batch])
+
+        def succeeded(ignored):
+            for (args, kw, d) in batch:
+                d.callback(None)
+
+        def failed(reason):
+            for (args, kw, d) in batch:
+                d.errback(reason)
+
+        result.addCallbacks(succeeded, failed)
+
+
     def close(self):
         """
         Close all pool connections and shutdown the pool.
@@ -389,6 +731,7 @@ class ConnectionPool:
         self.shutdownID = None
         self.threadpool.stop()
         self.running = False
+        self._statements.clear()
         for conn in self.connections.values():
             self._close(conn)
         self.connections.clear()
@@ -428,6 +771,8 @@ class ConnectionPool:
         if conn is not self.connections.get(tid):
             raise Exception("wrong connection for thread")
         if conn is not None:
+            # Cached cursors die with their connection.
+            self._statements.pop(tid, None)
             self._close(conn)
             del self.connections[tid]
 
@@ -459,11 +804,103 @@ class ConnectionPool:
 
 
     def _runQuery(self, trans, *args, **kw):
-        trans.execute(*args, **kw)
-        return trans.fetchall()
+        return self._execute(trans, 'execute', args, kw, True)
 
     def _runOperation(self, trans, *args, **kw):
-        trans.execute(*args, **kw)
+        self._execute(trans, 'execute', args, kw)
+
+
+    def _runOperations(self, trans, operations):
+        """
+        Run a batch of operations, using C{executemany} for consecutive
+        operations which share a statement.
+
+        @param operations: A C{list} of C{(args, kw)} tuples, as passed to
+            L{runBatchedOperation}.
+        """
+        i = 0
+        while i < len(operations):
+            args, kw = operations[i]
+            end = i + 1
+            if len(args) == 2 and not kw:
+                while end < len(operations):
+                    nextArgs, nextKw = operations[end]
+                    if (len(nextArgs) != 2 or nextKw
+                            or nextArgs[0] != args[0]):
+                        break
+                    end += 1
+            if end - i > 1:
+                self._execute(
+                    trans, 'executemany',
+                    (args[0], [operations[j][0][1] for j in range(i, end)]),
+                    {})
+            else:
+                self._execute(trans, 'execute', args, kw)
+            i = end
+
+
+    def _execute(self, trans, method, args, kw, fetch=False):
+        """
+        Call the cursor method named C{method} with C{args} and C{kw}, using
+        a cursor from the statement cache if it is enabled.
+
+        @param fetch: If true, return the result of the cursor's
+            C{fetchall} afterwards.
+        """
+        if not self.statement_cache or not args:
+            getattr(trans, method)(*args, **kw)
+            if fetch:
+                return trans.fetchall()
+            return None
+
+        statement = args[0]
+        cursor = self._cachedCursor(trans, statement)
+        try:
+            getattr(cursor, method)(*args, **kw)
+            result = None
+            if fetch:
+                result = cursor.fetchall()
+        except:
+            # The cursor may be in any state; don't reuse it.
+            self._closeCursor(cursor)
+            raise
+        self._cacheCursor(statement, cursor)
+        return result
+
+
+    def _cachedCursor(self, trans, statement):
+        """
+        Take the cursor cached for C{statement} on this thread's connection,
+        or open a new one.
+        """
+        cache = self._statements.get(self.threadID())
+        if cache is not None:
+            cursor = cache.pop(statement, None)
+            if cursor is not None:
+                return cursor
+        return trans._connection.cursor()
+
+
+    def _cacheCursor(self, statement, cursor):
+        """
+        Keep C{cursor} for reuse by C{statement}, closing the least recently
+        used cursors beyond C{statement_cache}.
+        """
+        tid = self.threadID()
+        cache = self._statements.get(tid)
+        if cache is None:
+            cache = self._statements[tid] = OrderedDict()
+        cache[statement] = cursor
+        while len(cache) > self.statement_cache:
+            statement, cursor = cache.popitem(last=False)
+            self._closeCursor(cursor)
+
+
+    def _closeCursor(self, cursor):
+        try:
+            cursor.close()
+        except:
+            log.err(None, "Cursor close failed")
 
     def __getstate__(self):
         return {'dbapiName': self.dbapiName,
@@ -472,6 +909,9 @@ class ConnectionPool:
                 'noisy': self.noisy,
                 'reconnect': self.reconnect,
                 'good_sql': self.good_sql,
+                'wait_timeout': self.wait_timeout,
+                'statement_cache': self.statement_cache,
+                'warmup': self.warmup,
                 'connargs': self.connargs,
                 'connkw': self.connkw}
 
@@ -480,4 +920,104 @@ class ConnectionPool:
         self.__init__(self.dbapiName, *self.connargs, **self.connkw)
 
 
-__all__ = ['Transaction', 'ConnectionPool']
+
+class RoutingConnectionPool(object):
+    """
+    Spread the queries of an application over read replicas of its database.
+
+    L{runQuery} is sent to the replica pool with the least load, that is the
+    fewest waiting and running requests for each of its connections, or to
+    the primary pool if there are no replicas.  Everything else, which may
+    write, is sent to the primary pool.  Replicas may lag behind the
+    primary, so a query which must see the application's own writes should
+    be run with C{primary.runQuery} or L{runInteraction}.
+
+    @ivar primary: The L{ConnectionPool} of the primary database.
+
+    @ivar replicas: A C{list} of the L{ConnectionPool}s of the replicas.
+    """
+
+    def __init__(self, primary, replicas=()):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self._next = 0
+
+
+    def _load(self, pool):
+        statistics = pool.statistics()
+        return (statistics['waiting'] + statistics['active']) / float(
+            statistics['max'] or 1)
+
+
+    def _pickReplica(self):
+        """
+        Choose the least loaded replica, going round the replicas in turn
+        among equally loaded ones.
+        """
+        if not self.replicas:
+            return self.primary
+        count = len(self.replicas)
+        candidates = [self.replicas[(self._next + i) % count]
+                      for i in range(count)]
+        self._next = (self._next + 1) % count
+        return min(candidates, key=self._load)
+
+
+    def start(self):
+        """
+        Start the primary and replica pools.
+        """
+        for pool in [self.primary] + self.replicas:
+            pool.start()
+
+
+    def close(self):
+        """
+        Close the primary and replica pools.
+        """
+        for pool in [self.primary] + self.replicas:
+            pool.close()
+
+
+    def runQuery(self, *args, **kw):
+        """
+        Run a query on the least loaded replica; see
+        L{ConnectionPool.runQuery}.
+        """
+        return self._pickReplica().runQuery(*args, **kw)
+
+
+    def runOperation(self, *args, **kw):
+        """
+        Run an operation on the primary; see L{ConnectionPool.runOperation}.
+        """
+        return self.primary.runOperation(*args, **kw)
+
+
+    def runBatchedOperation(self, *args, **kw):
+        """
+        Run an operation on the primary as part of a batch; see
+        L{ConnectionPool.runBatchedOperation}.
+        """
+        return self.primary.runBatchedOperation(*args, **kw)
+
+
+    def runInteraction(self, interaction, *args, **kw):
+        """
+        Run an interaction on the primary; see
+        L{ConnectionPool.runInteraction}.
+        """
+        return self.primary.runInteraction(interaction, *args, **kw)
+
+
+    def runWithConnection(self, func, *args, **kw):
+        """
+        Run a function with a connection to the primary; see
+        L{ConnectionPool.runWithConnection}.
+        """
+        return self.primary.runWithConnection(func, *args, **kw)
+
+
+
+__all__ = ['Transaction', 'ConnectionPool', 'ConnectionLost',
+           'ConnectionPoolTimeout', 'RoutingConnectionPool']
@@ -273,7 +273,7 @@ class FileWrapper:
     @ivar finalname: The name of the file in which the message should be
         stored.
     """
-    implements(smtp.IMessage)
+    implements(smtp.IChunkedMessage)
 
     def __init__(self, filename):
         """
@@ -295,6 +295,16 @@ class FileWrapper:
         self.fp.write(line + '\n')
 
 
+    def chunkReceived(self, chunk):
+        """
+        Write received lines to the temporary file.
+
+        @type chunk: L{bytes}
+        @param chunk: Received lines of the message, each ending in C{"\n"}.
+        """
+        self.fp.write(chunk)
+
+
     def eomReceived(self):
         """
         Handle end of message by writing the message to the file.
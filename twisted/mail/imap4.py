@@ -293,10 +293,22 @@ class LiteralString:
 class LiteralFile:
     _memoryFileLimit = 1024 * 1024 * 10
 
-    def __init__(self, size, defered):
+    def __init__(self, size, defered, memoryFileLimit=None):
+        """
+        @param size: The number of octets of the literal.
+
+        @param defered: A L{Deferred} to call back with the literal and the
+            rest of the line.
+
+        @param memoryFileLimit: The largest literal kept in memory; larger
+            ones are spooled to a temporary file.  If C{None},
+            C{_memoryFileLimit} is used.
+        """
         self.size = size
         self.defer = defered
-        if size > self._memoryFileLimit:
+        if memoryFileLimit is None:
+            memoryFileLimit = self._memoryFileLimit
+        if size > memoryFileLimit:
             self.data = tempfile.TemporaryFile()
         else:
             self.data = StringIO.StringIO()
@@ -517,6 +529,10 @@ class IMAP4Server(basic.LineReceiver, policies.TimeoutMixin):
     # Maximum length to accept for a "short" string literal
     _literalStringLimit = 4096
 
+    # Maximum length of a literal, such as the message given to APPEND, to
+    # hold in memory; longer ones are spooled to a temporary file.
+    _literalFileLimit = 1024 * 1024
+
     # IChallengeResponse factories for AUTHENTICATE command
     challengers = None
 
@@ -698,7 +714,7 @@ class IMAP4Server(basic.LineReceiver, policies.TimeoutMixin):
     def _fileLiteral(self, size):
         d = defer.Deferred()
         self.parseState = 'pending'
-        self._pendingLiteral = LiteralFile(size, d)
+        self._pendingLiteral = LiteralFile(size, d, self._literalFileLimit)
         self.sendContinuationRequest('Ready for %d octets of data' % size)
         self.setRawMode()
         return d
@@ -1898,6 +1914,10 @@ class IMAP4Server(basic.LineReceiver, policies.TimeoutMixin):
                 )
 
     def __ebSpewMessage(self, failure):
+        if failure.check(error.ConnectionLost):
+            # The connection was lost while a message was being written;
+            # there is nobody left to deliver the rest of the response to.
+            return
         # This indicates a programming error.
         # There's no reliable way to indicate anything to the client, since we
         # may have already written an arbitrary amount of data in response to
@@ -1952,6 +1972,46 @@ class IMAP4Server(basic.LineReceiver, policies.TimeoutMixin):
             ).beginProducing(self.transport
             )
 
+
+    def _spewPartial(self, part, data, _w):
+        """
+        Write a literal holding the octets of C{data} which C{part} asked for.
+
+        @param part: The requested section, with the partial range of octets
+            it asked for, if any.
+        @type part: L{_FetchParser.Body}
+
+        @param data: The contents of the whole section.
+        @type data: L{bytes}
+        """
+        if part.partialBegin is not None:
+            data = data[part.partialBegin:
+                        part.partialBegin + part.partialLength]
+        _w(_partialLabel(part) + ' ' + _literal(data))
+
+
+    def _produceFile(self, part, f, _f):
+        """
+        Stream a literal holding the octets of the file C{f} which C{part}
+        asked for, from its current position.
+
+        @param part: The requested section, with the partial range of octets
+            it asked for, if any.
+        @type part: L{_FetchParser.Body}
+
+        @param f: A file-like object holding the section.
+
+        @param _f: A callable which flushes the buffered part of the response.
+
+        @return: A L{Deferred} which fires when the literal is written.
+        """
+        length = None
+        if part.partialBegin is not None:
+            f.seek(part.partialBegin, 1)
+            length = part.partialLength
+        _f()
+        return FileProducer(f, length).beginProducing(self.transport)
+
     def spew_rfc822size(self, id, msg, _w=None, _f=None):
         if _w is None:
             _w = self.transport.write
@@ -1992,29 +2052,26 @@ class IMAP4Server(basic.LineReceiver, policies.TimeoutMixin):
 
         if part.header:
             hdrs = msg.getHeaders(part.header.negate, *part.header.fields)
-            hdrs = _formatHeaders(hdrs)
-            _w(str(part) + ' ' + _literal(hdrs))
+            self._spewPartial(part, _formatHeaders(hdrs), _w)
         elif part.text:
-            _w(str(part) + ' ')
-            _f()
-            return FileProducer(msg.getBodyFile()
-                ).beginProducing(self.transport
-                )
+            _w(_partialLabel(part) + ' ')
+            return self._produceFile(part, msg.getBodyFile(), _f)
         elif part.mime:
-            hdrs = _formatHeaders(msg.getHeaders(True))
-            _w(str(part) + ' ' + _literal(hdrs))
+            self._spewPartial(part, _formatHeaders(msg.getHeaders(True)), _w)
         elif part.empty:
-            _w(str(part) + ' ')
-            _f()
+            _w(_partialLabel(part) + ' ')
             if part.part:
-                return FileProducer(msg.getBodyFile()
-                    ).beginProducing(self.transport
-                    )
+                return self._produceFile(part, msg.getBodyFile(), _f)
             else:
                 mf = IMessageFile(msg, None)
                 if mf is not None:
-                    return FileProducer(mf.open()).beginProducing(self.transport)
-                return MessageProducer(msg, None, self._scheduler).beginProducing(self.transport)
+                    return self._produceFile(part, mf.open(), _f)
+                _f()
+                producer = MessageProducer(msg, None, self._scheduler)
+                if part.partialBegin is not None:
+                    producer.partialBegin = part.partialBegin
+                    producer.partialLength = part.partialLength
+                return producer.beginProducing(self.transport)
 
         else:
             _w('BODY ' + collapseNestedLists([getBodyStructure(msg)]))
@@ -4355,6 +4412,18 @@ def _quote(s):
 def _literal(s):
     return '{%d}\r\n%s' % (len(s), s)
 
+def _partialLabel(part):
+    """
+    Format the name of a fetched body section as it appears in a response,
+    where a partial range is given by its origin octet only.
+
+    @type part: L{_FetchParser.Body}
+    """
+    label = str(part)
+    if part.partialBegin is not None:
+        label = label[:label.rindex('<')] + '<%d>' % (part.partialBegin,)
+    return label
+
 class DontQuoteMe:
     def __init__(self, value):
         self.value = value
@@ -5679,6 +5748,10 @@ def iterateInReactor(i):
 class MessageProducer:
     CHUNK_SIZE = 2 ** 2 ** 2 ** 2
 
+    # The range of octets of the message to produce, if not all of them.
+    partialBegin = None
+    partialLength = None
+
     def __init__(self, msg, buffer = None, scheduler = None):
         """Produce this message.
 
@@ -5737,8 +5810,13 @@ class MessageProducer:
                 else:
                     break
         if self.consumer:
-            self.buffer.seek(0, 0)
-            yield FileProducer(self.buffer
+            length = None
+            if self.partialBegin is None:
+                self.buffer.seek(0, 0)
+            else:
+                self.buffer.seek(self.partialBegin, 0)
+                length = self.partialLength
+            yield FileProducer(self.buffer, length
                 ).beginProducing(self.consumer
                 ).addCallback(lambda _: self
                 )
@@ -6060,12 +6138,22 @@ class _FetchParser:
         return end + 1
 
 class FileProducer:
+    """
+    Write the contents of a file to a consumer as a literal, a chunk each time
+    the consumer asks for more.
+
+    @ivar f: The file, read from its current position.
+
+    @ivar length: The largest number of octets to produce, or C{None} to
+        produce the rest of the file.
+    """
     CHUNK_SIZE = 2 ** 2 ** 2 ** 2
 
     firstWrite = True
 
-    def __init__(self, f):
+    def __init__(self, f, length=None):
         self.f = f
+        self.length = length
 
     def beginProducing(self, consumer):
         self.consumer = consumer
@@ -6075,13 +6163,17 @@ class FileProducer:
         return d
 
     def resumeProducing(self):
+        if not self.f:
+            return
         b = ''
         if self.firstWrite:
-            b = '{%d}\r\n' % self._size()
+            self._remaining = self._size()
+            b = '{%d}\r\n' % self._remaining
             self.firstWrite = False
-        if not self.f:
-            return
-        b = b + self.f.read(self.CHUNK_SIZE)
+        if self._remaining > 0:
+            chunk = self.f.read(min(self.CHUNK_SIZE, self._remaining))
+            self._remaining -= len(chunk)
+            b = b + chunk
         if not b:
             self.consumer.unregisterProducer()
             self._onDone.callback(self)
@@ -6093,14 +6185,24 @@ class FileProducer:
         pass
 
     def stopProducing(self):
-        pass
+        """
+        Give up producing because the consumer went away, failing the
+        L{Deferred} returned by L{beginProducing} with L{error.ConnectionLost}.
+        """
+        if self._onDone is not None:
+            d = self._onDone
+            self._onDone = self.f = self.consumer = None
+            d.errback(error.ConnectionLost("Stopped producing a literal"))
 
     def _size(self):
         b = self.f.tell()
         self.f.seek(0, 2)
         e = self.f.tell()
         self.f.seek(b, 0)
-        return e - b
+        size = max(e - b, 0)
+        if self.length is not None:
+            size = min(size, self.length)
+        return size
 
 def parseTime(s):
     # XXX - This may require localization :(
@@ -502,7 +502,7 @@ class FileMessage:
     @ivar name: See L{__init__}.
     @ivar finalName: See L{__init__}.
     """
-    implements(smtp.IMessage)
+    implements(smtp.IChunkedMessage)
 
     def __init__(self, fp, name, finalName):
         """
@@ -532,6 +532,16 @@ class FileMessage:
         self.fp.write(line+'\n')
 
 
+    def chunkReceived(self, chunk):
+        """
+        Write received lines to the file.
+
+        @type chunk: L{bytes}
+        @param chunk: Received lines, each ending in C{"\n"}.
+        """
+        self.fp.write(chunk)
+
+
     def eomReceived(self):
         """
         At the end of message, rename the file holding the message to its
@@ -8,8 +8,9 @@ Maildir-style mailbox support.
 """
 
 import os
-import stat
 import socket
+import tempfile
+import time
 from hashlib import md5
 
 from zope.interface import implementer
@@ -149,6 +150,17 @@ class MaildirMessage(mail.FileMessage):
         self.size += len(line)+1
 
 
+    def chunkReceived(self, chunk):
+        """
+        Write lines to the file.
+
+        @type chunk: L{bytes}
+        @param chunk: Received lines, each ending in C{"\n"}.
+        """
+        mail.FileMessage.chunkReceived(self, chunk)
+        self.size += len(chunk)
+
+
     def eomReceived(self):
         """
         At the end of message, rename the file holding the message to its final
@@ -467,7 +479,7 @@ class _MaildirMailboxAppendMessageTask:
                     newname = None
                     break
         if newname is not None:
-            self.mbox.list.append(newname)
+            self.mbox._appended(newname)
             self.defer.callback(None)
             self.defer = None
 
@@ -495,6 +507,206 @@ class _MaildirMailboxAppendMessageTask:
 
 
 
+def _flagsFromName(subdir, name):
+    """
+    Get the flags of a message from its file name.
+
+    @type subdir: L{bytes}
+    @param subdir: The subdirectory of the message, I{cur} or I{new}.
+
+    @type name: L{bytes}
+    @param name: The file name of the message.
+
+    @rtype: L{bytes}
+    @return: The flag letters following I{:2,} in the name of a message in
+        I{cur/}, or an empty string.
+    """
+    if subdir == 'cur':
+        info = name.rpartition(':2,')[2]
+        if info != name:
+            return info
+    return ''
+
+
+
+class _MaildirIndex(object):
+    """
+    A persistent index of the sizes, UIDLs and flags of the messages of a
+    maildir mailbox.
+
+    The index is kept in a file at the top of the maildir.  When it is
+    refreshed, a subdirectory whose modification time has not changed is
+    not read at all, and only the messages which are new to the index are
+    examined in one which has.
+
+    @type path: L{bytes}
+    @ivar path: The directory name of the maildir.
+
+    @type entries: L{dict} mapping L{bytes} to L{dict} mapping L{bytes} to
+        3-L{tuple} of (0) L{int}, (1) L{bytes}, (2) L{bytes}
+    @ivar entries: Maps the I{cur} and I{new} subdirectories to a mapping of
+        the file names of their messages to the size, UIDL and flags of each
+        message.
+
+    @type mtimes: L{dict} mapping L{bytes} to L{float} or L{NoneType
+        <types.NoneType>}
+    @ivar mtimes: Maps the subdirectories to their modification time when
+        they were last read, or to C{None} if the time is too recent to tell
+        whether they have changed since.
+    """
+    indexName = 'twisted-maildir.index'
+    _header = 'twisted-maildir-index 1'
+
+    # Changes to a directory made within this many seconds of reading it may
+    # not change its modification time.
+    _settleTime = 2
+
+    _now = time.time
+
+    def __init__(self, path):
+        """
+        @type path: L{bytes}
+        @param path: The directory name of the maildir.
+        """
+        self.path = path
+        self.entries = {'cur': {}, 'new': {}}
+        self.mtimes = {'cur': None, 'new': None}
+        self._load()
+
+
+    def _load(self):
+        """
+        Read the index file, leaving the index empty if it is missing or
+        unreadable.
+        """
+        try:
+            f = open(os.path.join(self.path, self.indexName), 'rb')
+        except IOError:
+            return
+        try:
+            try:
+                lines = f.read().split('\n')
+                if lines[0] != self._header:
+                    return
+                entries = {'cur': {}, 'new': {}}
+                mtimes = {}
+                for line in lines[1:]:
+                    if not line:
+                        continue
+                    fields = line.split(' ', 4)
+                    if fields[0] == 'mtime':
+                        if fields[2] == '-':
+                            mtimes[fields[1]] = None
+                        else:
+                            mtimes[fields[1]] = float(fields[2])
+                    else:
+                        subdir, size, uidl, flags, name = fields
+                        if flags == '-':
+                            flags = ''
+                        entries[subdir][name] = (int(size), uidl, flags)
+            except (ValueError, KeyError, IndexError):
+                return
+        finally:
+            f.close()
+        self.entries = entries
+        self.mtimes.update(mtimes)
+
+
+    def save(self):
+        """
+        Write the index file, replacing it atomically.
+        """
+        lines = [self._header]
+        for subdir in ('cur', 'new'):
+            mtime = self.mtimes[subdir]
+            if mtime is None:
+                mtime = '-'
+            else:
+                mtime = repr(mtime)
+            lines.append('mtime %s %s' % (subdir, mtime))
+        for subdir in ('cur', 'new'):
+            for name, (size, uidl, flags) in self.entries[subdir].iteritems():
+                lines.append('%s %d %s %s %s' % (
+                    subdir, size, uidl, flags or '-', name))
+        indexPath = os.path.join(self.path, self.indexName)
+        tempPath = None
+        try:
+            # A name of its own, so that several processes or mailboxes
+            # saving the index at once don't write to the same file.
+            fd, tempPath = tempfile.mkstemp(
+                prefix=self.indexName + '.', suffix='.tmp', dir=self.path)
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write('\n'.join(lines) + '\n')
+            finally:
+                f.close()
+            os.rename(tempPath, indexPath)
+        except (IOError, OSError):
+            log.err(None, "Could not save the maildir index of %s" % (
+                    self.path,))
+            if tempPath is not None:
+                try:
+                    os.remove(tempPath)
+                except OSError:
+                    pass
+
+
+    def refresh(self):
+        """
+        Bring the index up to date with the I{cur} and I{new}
+        subdirectories, and save it if it changed.
+        """
+        changed = False
+        now = self._now()
+        for subdir in ('cur', 'new'):
+            directory = os.path.join(self.path, subdir)
+            mtime = os.stat(directory).st_mtime
+            if mtime == self.mtimes[subdir]:
+                continue
+            old = self.entries[subdir]
+            new = {}
+            for name in os.listdir(directory):
+                entry = old.get(name)
+                if entry is None:
+                    try:
+                        size = os.stat(os.path.join(directory, name)).st_size
+                    except OSError:
+                        # Moved away since the directory was listed.
+                        continue
+                    entry = (size, md5(name).hexdigest(),
+                             _flagsFromName(subdir, name))
+                new[name] = entry
+            if now - mtime < self._settleTime:
+                mtime = None
+            if new != old or mtime != self.mtimes[subdir]:
+                changed = True
+            self.entries[subdir] = new
+            self.mtimes[subdir] = mtime
+        if changed:
+            self.save()
+
+
+    def messages(self):
+        """
+        List the messages of the maildir.
+
+        @rtype: L{list} of 4-L{tuple} of (0) L{bytes}, (1) L{int}, (2)
+            L{bytes}, (3) L{bytes}
+        @return: The full path name, size, UIDL and flags of each message,
+            ordered by file name.
+        """
+        messages = []
+        for subdir in ('cur', 'new'):
+            prefix = os.path.join(self.path, subdir, '')
+            messages.extend([
+                    (name, prefix + name, size, uidl, flags)
+                    for name, (size, uidl, flags)
+                    in self.entries[subdir].iteritems()])
+        messages.sort()
+        return [message[1:] for message in messages]
+
+
+
 class MaildirMailbox(pop3.Mailbox):
     """
     A maildir-backed mailbox.
@@ -513,6 +725,15 @@ class MaildirMailbox(pop3.Mailbox):
     @type deleted: A mapping of the information about a file before it was
         deleted to the full path name of the deleted file in the I{.Trash/}
         subfolder.
+
+    @type _index: L{_MaildirIndex}
+    @ivar _index: The index of the mailbox, which the listing of messages is
+        read from.
+
+    @type _info: L{dict} mapping L{bytes} to 2-L{tuple} of (0) L{int},
+        (1) L{bytes}
+    @ivar _info: Maps the full path names of the messages listed when the
+        mailbox was opened to their size and UIDL.
     """
     AppendFactory = _MaildirMailboxAppendMessageTask
 
@@ -524,12 +745,14 @@ class MaildirMailbox(pop3.Mailbox):
         self.path = path
         self.list = []
         self.deleted = {}
+        self._info = {}
         initializeMaildir(path)
-        for name in ('cur', 'new'):
-            for file in os.listdir(os.path.join(path, name)):
-                self.list.append((file, os.path.join(path, name, file)))
-        self.list.sort()
-        self.list = [e[1] for e in self.list]
+        self._index = _MaildirIndex(path)
+        self._index.refresh()
+        messages = self._index.messages()
+        self.list = [message[0] for message in messages]
+        self._info = dict([(filename, (size, uidl))
+                           for (filename, size, uidl, flags) in messages])
 
 
     def listMessages(self, i=None):
@@ -553,11 +776,11 @@ class MaildirMailbox(pop3.Mailbox):
             ret = []
             for mess in self.list:
                 if mess:
-                    ret.append(os.stat(mess)[stat.ST_SIZE])
+                    ret.append(self._info[mess][0])
                 else:
                     ret.append(0)
             return ret
-        return self.list[i] and os.stat(self.list[i])[stat.ST_SIZE] or 0
+        return self.list[i] and self._info[self.list[i]][0] or 0
 
 
     def getMessage(self, i):
@@ -590,9 +813,9 @@ class MaildirMailbox(pop3.Mailbox):
         @raise IndexError: When the index does not correspond to a message in
             the mailbox.
         """
-        # Returning the actual filename is a mistake.  Hash it.
-        base = os.path.basename(self.list[i])
-        return md5(base).hexdigest()
+        # Returning the actual filename is a mistake.  The index holds its
+        # hash.
+        return self._info[self.list[i]][1]
 
 
     def deleteMessage(self, i):
@@ -640,6 +863,18 @@ class MaildirMailbox(pop3.Mailbox):
         self.deleted.clear()
 
 
+    def _appended(self, filename):
+        """
+        List a message added by L{appendMessage}.
+
+        @type filename: L{bytes}
+        @param filename: The full path name of the message.
+        """
+        self._info[filename] = (os.stat(filename).st_size,
+                                md5(os.path.basename(filename)).hexdigest())
+        self.list.append(filename)
+
+
     def appendMessage(self, txt):
         """
         Add a message to the mailbox.
@@ -14,6 +14,8 @@ the recipient and sends on the message.
 import rfc822
 import os
 import time
+from collections import OrderedDict
+from heapq import heappush, heappop
 
 try:
     import cPickle as pickle
@@ -25,7 +27,7 @@ from twisted.python.failure import Failure
 from twisted.mail import relay
 from twisted.mail import bounce
 from twisted.internet import protocol
-from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.defer import Deferred, DeferredList, succeed
 from twisted.internet.error import DNSLookupError
 from twisted.mail import smtp
 from twisted.application import internet
@@ -37,7 +39,14 @@ class ManagedRelayerMixin:
 
     Notify the manager about successful mail, failed mail
     and broken connections
+
+    When the relayer was given a pool, it does not disconnect once it has
+    sent its messages but waits in the pool to be given more with
+    L{_reuse}.
     """
+    _pool = None
+    _exchange = None
+
     def __init__(self, manager):
         self.manager = manager
 
@@ -50,6 +59,8 @@ class ManagedRelayerMixin:
         message = self.names[0]
         if code in smtp.SUCCESS:
             self.manager.notifySuccess(self.factory, message)
+        elif 400 <= code < 500:
+            self.manager.notifyTemporaryFailure(self.factory, message)
         else:
             self.manager.notifyFailure(self.factory, message)
         del self.messages[0]
@@ -61,9 +72,40 @@ class ManagedRelayerMixin:
 
         notify manager we will try to send no more e-mail
         """
+        if self._pool is not None:
+            self._pool.discard(self)
         self.manager.notifyDone(self.factory)
 
 
+    def smtpState_from(self, code, resp):
+        """
+        Begin sending the next message or, when there is none and the relayer
+        has a pool, report the attempt done and wait in the pool.
+        """
+        if self._pool is not None and not self.messages:
+            self.manager.notifyDone(self.factory)
+            # Anything the server says while the session is idle ends it.
+            self._expected = xrange(0, 1000)
+            self._okresponse = self.smtpState_disconnect
+            self._pool.add(self)
+        else:
+            smtp.SMTPClient.smtpState_from(self, code, resp)
+
+
+    def _reuse(self, factory):
+        """
+        Send the messages of another attempt over this idle session.
+
+        @type factory: L{SMTPManagedRelayerFactory}
+        @param factory: The factory created for the attempt, which will not
+            be used to connect.
+        """
+        self.factory = factory
+        self.manager = factory.manager
+        self.loadMessages(factory.messages)
+        self.smtpState_from(-1, '')
+
+
 
 class SMTPManagedRelayer(ManagedRelayerMixin, relay.SMTPRelayer):
     """
@@ -148,9 +190,21 @@ class SMTPManagedRelayerFactory(protocol.ClientFactory):
 
     @type pKwArgs: L{dict}
     @ivar pKwArgs: Keyword arguments for L{SMTPClient.__init__}
+
+    @type _pool: L{_RelayerPool} or L{NoneType <types.NoneType>}
+    @ivar _pool: The pool the relayer waits in once its messages are sent,
+        or C{None} if it should disconnect.
+
+    @type _exchange: 2-L{tuple} of (0) L{bytes}, (1) L{int} or L{NoneType
+        <types.NoneType>}
+    @ivar _exchange: The hostname and port of the mail exchange the relayer
+        connects to.
     """
     protocol = SMTPManagedRelayer
 
+    _pool = None
+    _exchange = None
+
     def __init__(self, messages, manager, *args, **kw):
         """
         @type messages: L{list} of L{bytes}
@@ -185,6 +239,8 @@ class SMTPManagedRelayerFactory(protocol.ClientFactory):
         protocol = self.protocol(self.messages, self.manager, *self.pArgs,
             **self.pKwArgs)
         protocol.factory = self
+        protocol._pool = self._pool
+        protocol._exchange = self._exchange
         return protocol
 
 
@@ -262,6 +318,8 @@ class ESMTPManagedRelayerFactory(SMTPManagedRelayerFactory):
         protocol = self.protocol(self.messages, self.manager, s,
             self.contextFactory, *self.pArgs, **self.pKwArgs)
         protocol.factory = self
+        protocol._pool = self._pool
+        protocol._exchange = self._exchange
         return protocol
 
 
@@ -270,6 +328,14 @@ class Queue:
     """
     A queue for messages to be relayed.
 
+    Waiting messages are grouped by the domain of their recipient, which is
+    read from their envelope once and remembered in an index file kept in
+    the queue directory.  Each domain has a time of next attempt, and the
+    domains with waiting messages are kept in a heap ordered by that time,
+    so that a relaying manager only looks at the domains which are due.  A
+    domain which cannot be reached is retried after an exponentially
+    growing delay.
+
     @ivar directory: See L{__init__}
 
     @type n: L{int}
@@ -285,9 +351,61 @@ class Queue:
     @type noisy: L{bool}
     @ivar noisy: A flag which determines whether informational log messages
         will be generated (C{True}) or not (C{False}).
+
+    @type retryDelay: L{int}
+    @ivar retryDelay: The number of seconds before a domain is retried after
+        its first failure.  The delay doubles with each further failure.
+
+    @type maxRetryDelay: L{int}
+    @ivar maxRetryDelay: The longest delay before a domain is retried.
+
+    @type maxQueueTime: L{int}
+    @ivar maxQueueTime: The number of seconds a message may stay in the queue
+        while it is rejected with transient errors, after which it is bounced.
+
+    @type _domains: L{dict} mapping L{bytes} to L{bytes} or L{NoneType
+        <types.NoneType>}
+    @ivar _domains: Maps the base filenames of indexed messages to the domain
+        of their recipient, or to C{None} if it has no valid one.
+
+    @type _unindexed: L{OrderedDict} of L{bytes}
+    @ivar _unindexed: The waiting messages whose domain is not known yet.
+
+    @type _waitingByDomain: L{dict} mapping L{bytes} to L{OrderedDict} of
+        L{bytes}
+    @ivar _waitingByDomain: Maps domains to their waiting messages, oldest
+        first.
+
+    @type _backoff: L{dict} mapping L{bytes} to 2-L{tuple} of (0) L{int},
+        (1) L{float}
+    @ivar _backoff: Maps domains which have failed to their number of
+        consecutive failures and the time of their next attempt.
+
+    @type _heap: L{list} of 2-L{tuple} of (0) L{float}, (1) L{bytes}
+    @ivar _heap: A heap of the next attempt times of domains.  An entry is
+        current only if C{_scheduled} maps its domain to its time.
+
+    @type _scheduled: L{dict} mapping L{bytes} to L{float}
+    @ivar _scheduled: Maps the domains in C{_heap} to their next attempt
+        time.
+
+    @type _busy: L{set} of L{bytes}
+    @ivar _busy: The domains handed out by L{nextDomains} and not released
+        yet.
     """
     noisy = True
 
+    indexName = 'twisted-queue.index'
+    retryDelay = 30
+    maxRetryDelay = 3600
+    maxQueueTime = 5 * 24 * 60 * 60
+
+    # Changes to the directory made within this many seconds of reading it
+    # may not change its modification time.
+    _settleTime = 2
+
+    _now = time.time
+
     def __init__(self, directory):
         """
         Initialize non-volatile state.
@@ -307,7 +425,18 @@ class Queue:
         self.n = 0
         self.waiting = {}
         self.relayed = {}
+        self._domains = {}
+        self._unindexed = OrderedDict()
+        self._waitingByDomain = {}
+        self._backoff = {}
+        self._heap = []
+        self._scheduled = {}
+        self._busy = set()
+        self._mtime = None
+        self._journal = None
+        self._loadIndex()
         self.readDirectory()
+        self._compactIndex()
 
 
     def __getstate__(self):
@@ -332,15 +461,300 @@ class Queue:
         self._init()
 
 
+    def _loadIndex(self):
+        """
+        Replay the index file of the queue directory, if there is one.
+
+        The index is a log of lines of the form C{M <message> <domain>} when
+        the domain of a message is found, C{D <message>} when a message
+        leaves the queue, and C{B <domain> <failures> <time>} when the
+        backoff of a domain changes.  Lines which cannot be parsed are
+        ignored.
+        """
+        try:
+            f = open(os.path.join(self.directory, self.indexName), 'rb')
+        except IOError:
+            return
+        try:
+            for line in f:
+                fields = line.split()
+                try:
+                    if fields[0] == 'M':
+                        domain = fields[2]
+                        if domain == '-':
+                            domain = None
+                        self._domains[fields[1]] = domain
+                    elif fields[0] == 'D':
+                        self._domains.pop(fields[1], None)
+                    elif fields[0] == 'B':
+                        failures = int(fields[2])
+                        if failures:
+                            self._backoff[fields[1]] = (
+                                failures, float(fields[3]))
+                        else:
+                            self._backoff.pop(fields[1], None)
+                except (IndexError, ValueError):
+                    continue
+        finally:
+            f.close()
+
+
+    def _compactIndex(self):
+        """
+        Rewrite the index file with only the entries of the messages now in
+        the queue and the current backoffs.
+        """
+        for message in self._domains.keys():
+            if message not in self.waiting and message not in self.relayed:
+                del self._domains[message]
+        lines = []
+        for message, domain in self._domains.iteritems():
+            lines.append('M %s %s\n' % (message, domain or '-'))
+        for domain, (failures, when) in self._backoff.iteritems():
+            lines.append('B %s %d %r\n' % (domain, failures, when))
+        self._closeJournal()
+        indexPath = os.path.join(self.directory, self.indexName)
+        try:
+            f = open(indexPath + '.tmp', 'wb')
+            try:
+                f.writelines(lines)
+            finally:
+                f.close()
+            os.rename(indexPath + '.tmp', indexPath)
+        except (IOError, OSError):
+            log.err(None, "Could not save the queue index of " +
+                    self.directory)
+
+
+    def _record(self, lines):
+        """
+        Append entries to the index file.
+
+        @type lines: L{list} of L{bytes}
+        @param lines: The entries, each ending with a newline.
+        """
+        try:
+            if self._journal is None:
+                self._journal = open(
+                    os.path.join(self.directory, self.indexName), 'ab')
+            self._journal.writelines(lines)
+            self._journal.flush()
+        except (IOError, OSError):
+            # The index only saves work: it is rebuilt from the envelopes.
+            log.err(None, "Could not update the queue index of " +
+                    self.directory)
+            self._closeJournal()
+
+
+    def _closeJournal(self):
+        if self._journal is not None:
+            try:
+                self._journal.close()
+            except (IOError, OSError):
+                pass
+            self._journal = None
+
+
     def readDirectory(self):
         """
         Scan the message directory for new messages.
+
+        The directory is not read again if its modification time has not
+        changed since it was last read.
         """
+        mtime = os.stat(self.directory).st_mtime
+        if mtime == self._mtime:
+            return
         for message in os.listdir(self.directory):
             # Skip non data files
             if message[-2:] != '-D':
                 continue
             self.addMessage(message[:-2])
+        if self._now() - mtime < self._settleTime:
+            mtime = None
+        self._mtime = mtime
+
+
+    def _addWaiting(self, message):
+        """
+        File a message which has become waiting under its domain.
+        """
+        if message not in self._domains:
+            self._unindexed[message] = None
+            return
+        domain = self._domains[message]
+        if domain is None:
+            return
+        messages = self._waitingByDomain.get(domain)
+        if messages is None:
+            messages = self._waitingByDomain[domain] = OrderedDict()
+        messages[message] = None
+        self._schedule(domain)
+
+
+    def _removeWaiting(self, message):
+        """
+        Remove a message which is no longer waiting from its domain.
+        """
+        if message in self._unindexed:
+            del self._unindexed[message]
+            return
+        domain = self._domains.get(message)
+        messages = self._waitingByDomain.get(domain)
+        if messages is not None:
+            messages.pop(message, None)
+            if not messages:
+                del self._waitingByDomain[domain]
+
+
+    def _domainOf(self, message):
+        """
+        Read the domain of the recipient of a message from its envelope.
+
+        @rtype: L{bytes} or L{NoneType <types.NoneType>}
+        @return: The domain, or C{None} if the recipient has none.
+        """
+        from_, to = self.getEnvelope(message)
+        try:
+            name, addr = rfc822.parseaddr(to)
+        except (TypeError, AttributeError):
+            addr = ''
+        parts = addr.split('@', 1)
+        if len(parts) != 2 or not parts[1] or len(parts[1].split()) != 1:
+            log.err("Illegal message destination: " + repr(to))
+            return None
+        return parts[1]
+
+
+    def _indexWaiting(self):
+        """
+        Find and record the domains of the waiting messages which are not
+        indexed yet.
+        """
+        lines = []
+        unindexed, self._unindexed = self._unindexed, OrderedDict()
+        for message in unindexed:
+            try:
+                domain = self._domainOf(message)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                log.err(None, "Could not read the envelope of " + message)
+                continue
+            self._domains[message] = domain
+            lines.append('M %s %s\n' % (message, domain or '-'))
+            self._addWaiting(message)
+        if lines:
+            self._record(lines)
+
+
+    def _schedule(self, domain):
+        """
+        Put a domain with waiting messages which is not being relayed in the
+        heap, at the time of its next attempt.
+        """
+        if (domain in self._scheduled or domain in self._busy or
+                domain not in self._waitingByDomain):
+            return
+        when = self._backoff.get(domain, (0, 0.0))[1]
+        self._scheduled[domain] = when
+        heappush(self._heap, (when, domain))
+
+
+    def nextDomains(self, limit):
+        """
+        Hand out the domains with waiting messages whose next attempt is due,
+        earliest first.  A domain is not handed out again until it is
+        released with L{releaseDomain}.
+
+        @type limit: L{int}
+        @param limit: The largest number of domains to return.
+
+        @rtype: L{list} of L{bytes}
+        @return: The domains.
+        """
+        self._indexWaiting()
+        now = self._now()
+        domains = []
+        while self._heap and len(domains) < limit:
+            when, domain = self._heap[0]
+            if self._scheduled.get(domain) != when:
+                heappop(self._heap)
+                continue
+            if when > now:
+                break
+            heappop(self._heap)
+            del self._scheduled[domain]
+            if domain in self._waitingByDomain:
+                self._busy.add(domain)
+                domains.append(domain)
+        return domains
+
+
+    def takeWaiting(self, domain, limit):
+        """
+        Mark the oldest waiting messages for a domain as being relayed.
+
+        @type domain: L{bytes}
+        @param domain: A domain returned by L{nextDomains}.
+
+        @type limit: L{int}
+        @param limit: The largest number of messages to take.
+
+        @rtype: L{list} of L{bytes}
+        @return: The base filenames of the messages.
+        """
+        messages = []
+        for message in self._waitingByDomain.get(domain, ()):
+            if len(messages) >= limit:
+                break
+            messages.append(message)
+        for message in messages:
+            self.setRelaying(message)
+        return messages
+
+
+    def releaseDomain(self, domain):
+        """
+        Note that the messages of a domain handed out by L{nextDomains} are no
+        longer being relayed, so that it is scheduled again if it still has
+        waiting messages.
+
+        @type domain: L{bytes}
+        @param domain: The domain.
+        """
+        self._busy.discard(domain)
+        self._schedule(domain)
+
+
+    def deferDomain(self, domain):
+        """
+        Note that a domain could not be reached, and put its next attempt off
+        by C{retryDelay} seconds, doubled for each consecutive failure, up to
+        C{maxRetryDelay}.
+
+        @type domain: L{bytes}
+        @param domain: The domain.
+        """
+        failures = self._backoff.get(domain, (0, 0.0))[0] + 1
+        delay = min(self.retryDelay * 2 ** min(failures - 1, 32),
+                    self.maxRetryDelay)
+        when = self._now() + delay
+        self._backoff[domain] = (failures, when)
+        self._record(['B %s %d %r\n' % (domain, failures, when)])
+        if domain in self._scheduled:
+            del self._scheduled[domain]
+            self._schedule(domain)
+
+
+    def domainSucceeded(self, domain):
+        """
+        Note that a message was relayed to a domain, ending its backoff.
+
+        @type domain: L{bytes}
+        @param domain: The domain.
+        """
+        if domain in self._backoff:
+            del self._backoff[domain]
+            self._record(['B %s 0 0\n' % (domain,)])
 
 
     def getWaiting(self):
@@ -385,6 +799,7 @@ class Queue:
         """
         del self.waiting[message]
         self.relayed[message] = 1
+        self._removeWaiting(message)
 
 
     def setWaiting(self, message):
@@ -396,6 +811,7 @@ class Queue:
         """
         del self.relayed[message]
         self.waiting[message] = 1
+        self._addWaiting(message)
 
 
     def addMessage(self, message):
@@ -406,8 +822,9 @@ class Queue:
         @type message: L{bytes}
         @param message: The base filename of a message.
         """
-        if message not in self.relayed:
+        if message not in self.relayed and message not in self.waiting:
             self.waiting[message] = 1
+            self._addWaiting(message)
             if self.noisy:
                 log.msg('Set ' + message + ' waiting')
 
@@ -423,6 +840,27 @@ class Queue:
         os.remove(self.getPath(message) + '-D')
         os.remove(self.getPath(message) + '-H')
         del self.relayed[message]
+        if self._domains.pop(message, None) is not None:
+            self._record(['D %s\n' % (message,)])
+
+
+    def expired(self, message):
+        """
+        Determine whether a message has been in the queue for longer than
+        C{maxQueueTime}, according to the modification time of its envelope,
+        which is written once when the message is queued.
+
+        @type message: L{bytes}
+        @param message: The base filename of a message.
+
+        @rtype: L{bool}
+        @return: C{True} if the message has been queued for too long.
+        """
+        try:
+            queued = os.path.getmtime(self.getPath(message) + '-H')
+        except OSError:
+            return False
+        return self._now() - queued > self.maxQueueTime
 
 
     def getPath(self, message):
@@ -486,12 +924,125 @@ class Queue:
 
 
 
+class _RelayerPool(object):
+    """
+    Relayers whose sessions with mail exchanges are idle, kept for sending
+    further messages to the same exchanges.
+
+    @type idleTimeout: L{float}
+    @ivar idleTimeout: The number of seconds a relayer is kept idle before
+        it ends its session.
+
+    @type clock: L{IReactorTime <twisted.internet.interfaces.IReactorTime>}
+        provider
+    @ivar clock: A reactor which will be used to schedule idle timeouts.
+
+    @type _idle: L{dict} mapping 2-L{tuple} of (0) L{bytes}, (1) L{int} to
+        L{list} of L{ManagedRelayerMixin}
+    @ivar _idle: Maps the hostname and port of exchanges to their idle
+        relayers, the most recently used last.
+
+    @type _timeouts: L{dict} mapping L{ManagedRelayerMixin} to
+        L{IDelayedCall <twisted.internet.interfaces.IDelayedCall>} provider
+    @ivar _timeouts: The idle timeouts of the relayers in the pool.
+    """
+    def __init__(self, idleTimeout, clock=None):
+        self.idleTimeout = idleTimeout
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self._idle = {}
+        self._timeouts = {}
+
+
+    def add(self, relayer):
+        """
+        Put an idle relayer in the pool.
+
+        @type relayer: L{ManagedRelayerMixin}
+        @param relayer: The relayer, connected to C{relayer._exchange}.
+        """
+        self._idle.setdefault(relayer._exchange, []).append(relayer)
+        self._timeouts[relayer] = self.clock.callLater(
+            self.idleTimeout, self._expire, relayer)
+
+
+    def take(self, exchange):
+        """
+        Remove the most recently used idle relayer for an exchange from the
+        pool.
+
+        @type exchange: 2-L{tuple} of (0) L{bytes}, (1) L{int}
+        @param exchange: The hostname and port of the exchange.
+
+        @rtype: L{ManagedRelayerMixin} or L{NoneType <types.NoneType>}
+        @return: The relayer, or C{None} if there is none.
+        """
+        relayers = self._idle.get(exchange)
+        if not relayers:
+            return None
+        relayer = relayers.pop()
+        if not relayers:
+            del self._idle[exchange]
+        self._timeouts.pop(relayer).cancel()
+        return relayer
+
+
+    def discard(self, relayer):
+        """
+        Remove a relayer from the pool, if it is in it.
+
+        @type relayer: L{ManagedRelayerMixin}
+        @param relayer: The relayer.
+        """
+        timeout = self._timeouts.pop(relayer, None)
+        if timeout is None:
+            return
+        if timeout.active():
+            timeout.cancel()
+        relayers = self._idle[relayer._exchange]
+        relayers.remove(relayer)
+        if not relayers:
+            del self._idle[relayer._exchange]
+
+
+    def _expire(self, relayer):
+        """
+        End the session of a relayer which was idle for too long.
+        """
+        self.discard(relayer)
+        relayer._disconnectFromServer()
+
+
+
 class _AttemptManager(object):
     """
     Manage the state of a single attempt to flush the relay queue.
+
+    @ivar manager: See L{__init__}.
+    @ivar domain: See L{__init__}.
+
+    @type _succeeded: L{bool}
+    @ivar _succeeded: Whether a message was relayed.
+
+    @type _throttled: L{bool}
+    @ivar _throttled: Whether the server rejected a message temporarily.
     """
-    def __init__(self, manager):
+    _succeeded = False
+    _throttled = False
+
+    def __init__(self, manager, domain=None):
+        """
+        @type manager: L{SmartHostSMTPRelayingManager}
+        @param manager: The relaying manager which started the attempt.
+
+        @type domain: L{bytes} or L{NoneType <types.NoneType>}
+        @param domain: The domain the messages are relayed to, if they were
+            handed out by the queue for it.  Its backoff is updated with the
+            outcome of the attempt.
+        """
         self.manager = manager
+        self.domain = domain
         self._completionDeferreds = []
 
 
@@ -512,9 +1063,27 @@ class _AttemptManager(object):
         """
         if self.manager.queue.noisy:
             log.msg("success sending %s, removing from queue" % message)
+        self._succeeded = True
+        if self.domain is not None:
+            self.manager.queue.domainSucceeded(self.domain)
         self._finish(relay, message)
 
 
+    def notifyTemporaryFailure(self, relay, message):
+        """
+        Relaying the message failed with a transient error; it will be tried
+        again once the relay is done, unless it has been in the queue for
+        longer than L{Queue.maxQueueTime}, in which case it is bounced.
+        """
+        self._throttled = True
+        if self.manager.queue.expired(os.path.basename(message)):
+            if self.manager.queue.noisy:
+                log.msg("giving up on %s, queued for too long" % (message,))
+            self.notifyFailure(relay, message)
+        elif self.manager.queue.noisy:
+            log.msg("could not relay %s yet, will retry" % (message,))
+
+
     def notifyFailure(self, relay, message):
         """Relaying the message has failed."""
         if self.manager.queue.noisy:
@@ -543,6 +1112,10 @@ class _AttemptManager(object):
         unmark all pending messages under this relay's responsibility
         as being relayed, and remove the relay.
         """
+        if self._completionDeferreds is None:
+            # An idle relayer which had already reported its attempt done
+            # has disconnected.
+            return
         for message in self.manager.managed.get(relay, ()):
             if self.manager.queue.noisy:
                 log.msg("Setting " + message + " waiting")
@@ -551,6 +1124,7 @@ class _AttemptManager(object):
             del self.manager.managed[relay]
         except KeyError:
             pass
+        self.manager._attemptDone(self)
         notifications = self._completionDeferreds
         self._completionDeferreds = None
         for d in notifications:
@@ -572,12 +1146,8 @@ class _AttemptManager(object):
         if self.manager.queue.noisy:
             log.msg("Backing off on delivery of " + str(msgs))
 
-        def setWaiting(queue, messages):
-            map(queue.setWaiting, messages)
-
-        from twisted.internet import reactor
-        reactor.callLater(30, setWaiting, self.manager.queue, msgs)
         del self.manager.managed[relay]
+        self.manager._backOff(msgs, self.domain)
 
 
 
@@ -625,6 +1195,30 @@ class SmartHostSMTPRelayingManager:
         L{bytes}
     @ivar managed: A mapping of factory for a managed relayer to
         filenames of messages the managed relayer is responsible for.
+
+    @type idleTimeout: L{float} or L{NoneType <types.NoneType>}
+    @ivar idleTimeout: The number of seconds a session with a mail exchange
+        is kept open after its messages are sent, so that further messages
+        for the exchange can be sent over it, or C{None} to end sessions
+        once their messages are sent.
+
+    @type maxConnectionsPerDomain: L{int}
+    @ivar maxConnectionsPerDomain: The largest number of concurrent
+        connections relaying messages to one domain.  A domain starts with
+        one, gains one each time an attempt relays messages without a
+        transient failure, and loses half of them each time a server rejects
+        a message with a transient failure.
+
+    @type _domainLimits: L{dict} mapping L{bytes} to L{int}
+    @ivar _domainLimits: Maps domains to the number of concurrent connections
+        currently allowed to them, if it is not one.
+
+    @type _active: L{dict} mapping L{bytes} to L{int}
+    @ivar _active: Maps domains to the number of attempts in progress for
+        them.
+
+    @type _pool: L{_RelayerPool} or L{NoneType <types.NoneType>}
+    @ivar _pool: The idle relayers, if sessions are kept open.
     """
     factory = SMTPManagedRelayerFactory
 
@@ -632,6 +1226,11 @@ class SmartHostSMTPRelayingManager:
 
     mxcalc = None
 
+    idleTimeout = None
+    maxConnectionsPerDomain = 4
+
+    _pool = None
+
     def __init__(self, queue, maxConnections=2, maxMessagesPerConnection=10):
         """
         Initialize a smart host.
@@ -656,6 +1255,8 @@ class SmartHostSMTPRelayingManager:
         self.queue = queue
         self.fArgs = ()
         self.fKwArgs = {}
+        self._domainLimits = {}
+        self._active = {}
 
 
     def __getstate__(self):
@@ -667,6 +1268,8 @@ class SmartHostSMTPRelayingManager:
         """
         dct = self.__dict__.copy()
         del dct['managed']
+        for name in ('_domainLimits', '_active', '_pool'):
+            dct.pop(name, None)
         return dct
 
 
@@ -680,6 +1283,8 @@ class SmartHostSMTPRelayingManager:
         """
         self.__dict__.update(state)
         self.managed = {}
+        self._domainLimits = {}
+        self._active = {}
 
 
     def checkState(self):
@@ -702,30 +1307,28 @@ class SmartHostSMTPRelayingManager:
 
 
     def _checkStateMX(self):
-        nextMessages = self.queue.getWaiting()
-        nextMessages.reverse()
-
-        exchanges = {}
-        for msg in nextMessages:
-            from_, to = self.queue.getEnvelope(msg)
-            name, addr = rfc822.parseaddr(to)
-            parts = addr.split('@', 1)
-            if len(parts) != 2:
-                log.err("Illegal message destination: " + to)
-                continue
-            domain = parts[1]
-
-            self.queue.setRelaying(msg)
-            exchanges.setdefault(domain, []).append(self.queue.getPath(msg))
-            if len(exchanges) >= (self.maxConnections - len(self.managed)):
-                break
+        batches = []
+        free = self.maxConnections - len(self.managed)
+        for domain in self.queue.nextDomains(free):
+            limit = self._domainLimits.get(domain, 1)
+            while free > 0 and self._active.get(domain, 0) < limit:
+                msgs = self.queue.takeWaiting(
+                    domain, self.maxMessagesPerConnection)
+                if not msgs:
+                    break
+                self._active[domain] = self._active.get(domain, 0) + 1
+                batches.append(
+                    (domain, [self.queue.getPath(msg) for msg in msgs]))
+                free -= 1
+            if domain not in self._active:
+                self.queue.releaseDomain(domain)
 
         if self.mxcalc is None:
             self.mxcalc = MXCalculator()
 
         relays = []
-        for (domain, msgs) in exchanges.iteritems():
-            manager = _AttemptManager(self)
+        for (domain, msgs) in batches:
+            manager = _AttemptManager(self, domain)
             factory = self.factory(msgs, manager, *self.fArgs, **self.fKwArgs)
             self.managed[factory] = map(os.path.basename, msgs)
             relayAttemptDeferred = manager.getCompletionDeferred()
@@ -757,6 +1360,15 @@ class SmartHostSMTPRelayingManager:
         @param factory: A factory which can create a relayer for the mail
             exchange server.
         """
+        if self.idleTimeout is not None:
+            if self._pool is None:
+                self._pool = _RelayerPool(self.idleTimeout)
+            relayer = self._pool.take((address, port))
+            if relayer is not None:
+                relayer._reuse(factory)
+                return
+            factory._pool = self._pool
+            factory._exchange = (address, port)
         from twisted.internet import reactor
         reactor.connectTCP(address, port, factory)
 
@@ -781,12 +1393,57 @@ class SmartHostSMTPRelayingManager:
         log.err('Error setting up managed relay factory for ' + domain)
         log.err(failure)
 
-        def setWaiting(queue, messages):
-            map(queue.setWaiting, messages)
+        messages = self.managed.pop(factory)
+        self._backOff(messages, domain)
+        self._attemptDone(factory.manager)
 
-        from twisted.internet import reactor
-        reactor.callLater(30, setWaiting, self.queue, self.managed[factory])
-        del self.managed[factory]
+
+    def _backOff(self, messages, domain):
+        """
+        Return messages which could not be relayed to the queue, and put off
+        the next attempt to relay to their domain.
+
+        @type messages: L{list} of L{bytes}
+        @param messages: The base filenames of the messages.
+
+        @type domain: L{bytes} or L{NoneType <types.NoneType>}
+        @param domain: The domain of the messages, if it is known.
+        """
+        for message in messages:
+            self.queue.setWaiting(message)
+        if domain is not None:
+            self.queue.deferDomain(domain)
+
+
+    def _attemptDone(self, attempt):
+        """
+        Adjust the number of concurrent connections allowed to the domain of
+        a finished attempt, and release the domain to the queue once no
+        attempt for it is in progress.
+
+        @type attempt: L{_AttemptManager}
+        @param attempt: The attempt.
+        """
+        domain = attempt.domain
+        if domain is None:
+            return
+        limit = self._domainLimits.get(domain, 1)
+        if attempt._throttled:
+            limit = max(limit // 2, 1)
+            self.queue.deferDomain(domain)
+        elif attempt._succeeded:
+            limit = min(limit + 1, self.maxConnectionsPerDomain)
+        if limit > 1:
+            self._domainLimits[domain] = limit
+        else:
+            self._domainLimits.pop(domain, None)
+
+        active = self._active.get(domain, 1) - 1
+        if active > 0:
+            self._active[domain] = active
+        else:
+            self._active.pop(domain, None)
+            self.queue.releaseDomain(domain)
 
 
 
@@ -875,9 +1532,20 @@ class MXCalculator:
     @ivar fallbackToDomain: A flag indicating whether to attempt to use the
         hostname directly when no mail exchange can be found (C{True}) or
         not (C{False}).
+
+    @type maxCacheTime: L{int}
+    @ivar maxCacheTime: The longest time in seconds for which the records of
+        a mail exchange lookup are reused, whatever their TTL.
+
+    @type _mailExchanges: L{dict} mapping L{bytes} to 2-L{tuple} of (0)
+        L{float}, (1) 3-L{tuple} of L{list} of L{RRHeader
+        <twisted.names.dns.RRHeader>}
+    @ivar _mailExchanges: Maps domains to the time at which the records
+        found by their last mail exchange lookup expire, and those records.
     """
     timeOutBadMX = 60 * 60  # One hour
     fallbackToDomain = True
+    maxCacheTime = 60 * 60
 
     def __init__(self, resolver=None, clock=None):
         """
@@ -890,6 +1558,7 @@ class MXCalculator:
         @param clock: A reactor which will be used to schedule timeouts.
         """
         self.badMXs = {}
+        self._mailExchanges = {}
         if resolver is None:
             from twisted.names.client import createResolver
             resolver = createResolver()
@@ -939,7 +1608,7 @@ class MXCalculator:
         @return: A deferred which succeeds with the MX record for the mail
             exchange server for the domain or fails if none can be found.
         """
-        mailExchangeDeferred = self.resolver.lookupMailExchange(domain)
+        mailExchangeDeferred = self._lookupMailExchange(domain)
         mailExchangeDeferred.addCallback(self._filterRecords)
         mailExchangeDeferred.addCallback(
             self._cbMX, domain, maximumCanonicalChainLength)
@@ -947,6 +1616,53 @@ class MXCalculator:
         return mailExchangeDeferred
 
 
+    def _lookupMailExchange(self, domain):
+        """
+        Look up the mail exchange records of a domain, reusing the records of
+        an earlier lookup until their TTL expires.
+
+        @type domain: L{bytes}
+        @param domain: A domain name.
+
+        @rtype: L{Deferred} which successfully fires with a 3-L{tuple} of
+            L{list} of L{RRHeader <twisted.names.dns.RRHeader>}
+        @return: A deferred which succeeds with the answer, authority and
+            additional records.
+        """
+        cached = self._mailExchanges.get(domain)
+        if cached is not None:
+            expires, records = cached
+            if self.clock.seconds() < expires:
+                return succeed(records)
+            del self._mailExchanges[domain]
+        d = self.resolver.lookupMailExchange(domain)
+        d.addCallback(self._cacheRecords, domain)
+        return d
+
+
+    def _cacheRecords(self, records, domain):
+        """
+        Remember the records of a mail exchange lookup for the smallest TTL
+        of its answers.
+
+        @type records: 3-L{tuple} of L{list} of L{RRHeader
+            <twisted.names.dns.RRHeader>}
+        @param records: Answer, authority and additional records.
+
+        @type domain: L{bytes}
+        @param domain: The domain name which was looked up.
+
+        @return: C{records}
+        """
+        if records[0]:
+            ttl = min([answer.ttl for answer in records[0]])
+            ttl = min(ttl, self.maxCacheTime)
+            if ttl > 0:
+                self._mailExchanges[domain] = (
+                    self.clock.seconds() + ttl, records)
+        return records
+
+
     def _filterRecords(self, records):
         """
         Organize the records of a DNS response by record name.
@@ -498,6 +498,21 @@ class IMessage(Interface):
         semantics should be to discard the message
         """
 
+class IChunkedMessage(IMessage):
+    """
+    A message which can be given many lines at once as it is received over
+    SMTP, rather than one line at a time.
+    """
+
+    def chunkReceived(chunk):
+        """
+        Handle the next part of the message.
+
+        @type chunk: C{str}
+        @param chunk: One or more whole lines of the message, with
+            dot-stuffing removed and each line ending in C{"\n"}.
+        """
+
 class SMTP(basic.LineOnlyReceiver, policies.TimeoutMixin):
     """
     SMTP server-side protocol.
@@ -527,6 +542,10 @@ class SMTP(basic.LineOnlyReceiver, policies.TimeoutMixin):
     # Cred cleanup function.
     _onLogout = None
 
+    # The Deferred result of a MAIL or RCPT command whose address has not been
+    # validated yet; no further input is handled until it fires.
+    _validating = None
+
     def __init__(self, delivery=None, deliveryFactory=None):
         self.mode = COMMAND
         self._from = None
@@ -563,6 +582,105 @@ class SMTP(basic.LineOnlyReceiver, policies.TimeoutMixin):
         self.sendLine('%3.3d %s' % (code,
                                     lastline and lastline[0] or ''))
 
+    def dataReceived(self, data):
+        """
+        Split received bytes into command lines, or, while a message is being
+        received, into as many whole lines of the message as are available.
+        """
+        self._buffer += data
+        while not self.transport.disconnecting and self._validating is None:
+            if self.mode is DATA:
+                if not self._rawDataReceived():
+                    return
+                continue
+            end = self._buffer.find(self.delimiter)
+            if end == -1:
+                if len(self._buffer) > self.MAX_LENGTH:
+                    line, self._buffer = self._buffer, ''
+                    self.lineLengthExceeded(line)
+                return
+            line = self._buffer[:end]
+            self._buffer = self._buffer[end + len(self.delimiter):]
+            if len(line) > self.MAX_LENGTH:
+                self._buffer = ''
+                self.lineLengthExceeded(line)
+                return
+            self.lineReceived(line)
+
+
+    def _rawDataReceived(self):
+        """
+        Deliver all whole lines of message data in the buffer, ending the
+        message if its terminating C{"."} line is among them.
+
+        @return: C{True} if the message ended, C{False} if more data is
+            needed.
+        """
+        self.resetTimeout()
+        end = self._buffer.rfind('\r\n')
+        if end == -1:
+            if len(self._buffer) > self.MAX_LENGTH:
+                line, self._buffer = self._buffer, ''
+                self.lineLengthExceeded(line)
+            return False
+        # A leading line break lets the terminator and dot-stuffing on the
+        # first line be found the same way as on every other line.
+        block = '\r\n' + self._buffer[:end + 2]
+        stop = block.find('\r\n.\r\n')
+        if stop == -1:
+            self._buffer = self._buffer[end + 2:]
+        else:
+            self._buffer = block[stop + 5:] + self._buffer[end + 2:]
+            block = block[:stop + 2]
+        if len(block) > 2:
+            self._dataChunkReceived(block.replace('\r\n.', '\r\n')[2:])
+        if stop == -1:
+            return False
+        self._dataEnded()
+        return True
+
+
+    def _dataChunkReceived(self, data):
+        """
+        Deliver whole lines of message data to the messages being received,
+        in one piece to those providing L{IChunkedMessage} and line by line
+        to the others.
+
+        @param data: Lines of the message, dot-unstuffed, each ending in
+            C{"\r\n"}.
+        """
+        if self.datafailed:
+            return
+        if not self.__inheader and not self.__inbody:
+            first = data[:data.find('\r\n')]
+            if ':' in first:
+                self.__inheader = 1
+            else:
+                # Add a blank line between the generated Received:-header
+                # and the message body if the message comes in without any
+                # headers
+                if first:
+                    data = '\r\n' + data
+                self.__inbody = 1
+        chunk = lines = None
+        try:
+            for message in self.__messages:
+                if IChunkedMessage.providedBy(message):
+                    if chunk is None:
+                        chunk = data.replace('\r\n', '\n')
+                    message.chunkReceived(chunk)
+                else:
+                    if lines is None:
+                        lines = data.split('\r\n')
+                        lines.pop()
+                    for line in lines:
+                        message.lineReceived(line)
+        except SMTPServerError, e:
+            self.datafailed = e
+            for message in self.__messages:
+                message.connectionLost()
+
+
     def lineReceived(self, line):
         self.resetTimeout()
         return getattr(self, 'state_' + self.mode)(line)
@@ -648,6 +766,28 @@ class SMTP(basic.LineOnlyReceiver, policies.TimeoutMixin):
 
         validated = defer.maybeDeferred(self.validateFrom, self._helo, addr)
         validated.addCallbacks(self._cbFromValidate, self._ebFromValidate)
+        self._waitForValidation(validated)
+
+
+    def _waitForValidation(self, validated):
+        """
+        Hold back any further commands or message data which have already been
+        received, such as those sent by a pipelining client, until
+        C{validated} has fired.
+
+        @type validated: L{Deferred}
+        @param validated: The result of validating the address of a MAIL or
+            RCPT command.
+        """
+        if validated.called:
+            return
+        self._validating = validated
+        def resume(result):
+            self._validating = None
+            if self._buffer:
+                self.dataReceived('')
+            return result
+        validated.addBoth(resume)
 
 
     def _cbFromValidate(self, from_, code=250, msg='Sender address accepted'):
@@ -690,6 +830,7 @@ class SMTP(basic.LineOnlyReceiver, policies.TimeoutMixin):
             self._ebToValidate,
             callbackArgs=(user,)
         )
+        self._waitForValidation(d)
 
     def _cbToValidate(self, to, user=None, code=250, msg='Recipient address accepted'):
         if user is None:
@@ -780,22 +921,30 @@ class SMTP(basic.LineOnlyReceiver, policies.TimeoutMixin):
         self._to = []
         self.sendCode(250, 'I remember nothing.')
 
+    def _dataEnded(self):
+        """
+        Finish receiving the current message, once its terminating C{"."}
+        line has been received.
+        """
+        self.mode = COMMAND
+        if self.datafailed:
+            self.sendCode(self.datafailed.code,
+                          self.datafailed.resp)
+            return
+        if not self.__messages:
+            self._messageHandled("thrown away")
+            return
+        defer.DeferredList([
+            m.eomReceived() for m in self.__messages
+        ], consumeErrors=True).addCallback(self._messageHandled
+                                           )
+        del self.__messages
+
+
     def dataLineReceived(self, line):
         if line[:1] == '.':
             if line == '.':
-                self.mode = COMMAND
-                if self.datafailed:
-                    self.sendCode(self.datafailed.code,
-                                  self.datafailed.resp)
-                    return
-                if not self.__messages:
-                    self._messageHandled("thrown away")
-                    return
-                defer.DeferredList([
-                    m.eomReceived() for m in self.__messages
-                ], consumeErrors=True).addCallback(self._messageHandled
-                                                   )
-                del self.__messages
+                self._dataEnded()
                 return
             line = line[1:]
 
@@ -990,6 +1139,11 @@ class SMTPClient(basic.LineReceiver, policies.TimeoutMixin):
     It then calls L{SMTPClient.getMailFrom} again; if it returns C{None}, the
     client will disconnect, otherwise it will continue as normal i.e. call
     L{SMTPClient.getMailTo} and L{SMTPClient.getMailData} and send a new email.
+
+    If the server supports pipelining (RFC 2920), the I{MAIL FROM}, I{RCPT
+    TO} and I{DATA} commands of a message, and the I{RSET} ending the
+    previous one, are sent together and their responses are handled as they
+    arrive.
     """
 
     # If enabled then log SMTP client server communication
@@ -999,6 +1153,12 @@ class SMTPClient(basic.LineReceiver, policies.TimeoutMixin):
     # None, perform no timeout checking.
     timeout = None
 
+    # Whether the server accepts pipelined commands.
+    _pipelining = False
+
+    # Whether the session must be reset before the next mail transaction.
+    _resetPending = False
+
     def __init__(self, identity, logsize=10):
         self.identity = identity or ''
         self.toAddressesResult = []
@@ -1015,6 +1175,20 @@ class SMTPClient(basic.LineReceiver, policies.TimeoutMixin):
 
         basic.LineReceiver.sendLine(self,line)
 
+
+    def _sendLines(self, lines):
+        """
+        Send several commands in a single write.
+
+        @type lines: L{list} of L{bytes}
+        @param lines: The commands, without line delimiters.
+        """
+        if self.debug:
+            for line in lines:
+                self.log.append('>>> ' + line)
+        self.transport.write(
+            ''.join([line + self.delimiter for line in lines]))
+
     def connectionMade(self):
         self.setTimeout(self.timeout)
 
@@ -1085,7 +1259,9 @@ class SMTPClient(basic.LineReceiver, policies.TimeoutMixin):
     def smtpState_from(self, code, resp):
         self._from = self.getMailFrom()
         self._failresponse = self.smtpTransferFailed
-        if self._from is not None:
+        if self._from is not None and self._pipelining:
+            self._pipelineTransaction()
+        elif self._from is not None:
             self.sendLine('MAIL FROM:%s' % quoteaddr(self._from))
             self._expected = [250]
             self._okresponse = self.smtpState_to
@@ -1140,10 +1316,94 @@ class SMTPClient(basic.LineReceiver, policies.TimeoutMixin):
 
         self.toAddressesResult = []
         self._from = None
+        if self._pipelining:
+            # Send the RSET along with the next transaction.
+            self._resetPending = True
+            return self.smtpState_from(code, resp)
         self.sendLine('RSET')
         self._expected = SUCCESS
         self._okresponse = self.smtpState_from
 
+
+    def _pipelineTransaction(self):
+        """
+        Send the I{MAIL FROM}, I{RCPT TO} and I{DATA} commands for the
+        message from L{getMailFrom} in one write, preceded by the I{RSET}
+        ending the previous transaction if it has not been sent yet.
+        """
+        self._pipelinedTo = list(self.getMailTo())
+        self.toAddressesResult = []
+        self.successAddresses = []
+        lines = ['MAIL FROM:%s' % quoteaddr(self._from)]
+        for address in self._pipelinedTo:
+            lines.append('RCPT TO:%s' % quoteaddr(address))
+        lines.append('DATA')
+        self._expected = xrange(0, 1000)
+        if self._resetPending:
+            self._resetPending = False
+            lines.insert(0, 'RSET')
+            self._okresponse = self._smtpState_pipelinedReset
+        else:
+            self._okresponse = self._smtpState_pipelinedMail
+        self._sendLines(lines)
+
+
+    def _smtpState_pipelinedReset(self, code, resp):
+        self._okresponse = self._smtpState_pipelinedMail
+
+
+    def _smtpState_pipelinedMail(self, code, resp):
+        self._mailResponse = (code, resp)
+        if self._pipelinedTo:
+            self._okresponse = self._smtpState_pipelinedTo
+        else:
+            self._okresponse = self._smtpState_pipelinedData
+
+
+    def _smtpState_pipelinedTo(self, code, resp):
+        address = self._pipelinedTo[len(self.toAddressesResult)]
+        self.toAddressesResult.append((address, code, resp))
+        if code in SUCCESS:
+            self.successAddresses.append(address)
+        if len(self.toAddressesResult) == len(self._pipelinedTo):
+            self._okresponse = self._smtpState_pipelinedData
+
+
+    def _smtpState_pipelinedData(self, code, resp):
+        """
+        Handle the response to a pipelined I{DATA} command, now that the
+        responses to the I{MAIL FROM} and I{RCPT TO} commands before it are
+        known.
+        """
+        mailCode, mailResp = self._mailResponse
+        if mailCode != 250:
+            failure = (mailCode, mailResp)
+        elif not self.successAddresses:
+            if self.toAddressesResult:
+                failure = (self.toAddressesResult[-1][1],
+                           'No recipients accepted')
+            else:
+                failure = (0, 'No recipients accepted')
+        elif code == 354:
+            return self.smtpState_data(code, resp)
+        else:
+            return self.smtpTransferFailed(code, resp)
+
+        # The transaction failed before DATA.  If the server accepted the
+        # DATA command anyway, end the message it expects at once.
+        self._resetPending = True
+        if code == 354:
+            self._pipelinedFailure = failure
+            self._expected = xrange(0, 1000)
+            self._okresponse = self._smtpState_pipelinedAbandoned
+            self.sendLine('.')
+        else:
+            self.smtpState_msgSent(*failure)
+
+
+    def _smtpState_pipelinedAbandoned(self, code, resp):
+        self.smtpState_msgSent(*self._pipelinedFailure)
+
     ##
     ## Helpers for FileSender
     ##
@@ -1344,6 +1604,7 @@ class ESMTPClient(SMTPClient):
             else:
                 items[e[0]] = None
 
+        self._pipelining = 'PIPELINING' in items
         self.tryTLS(code, resp, items)
 
 
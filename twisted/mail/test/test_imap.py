@@ -17,7 +17,7 @@ import locale
 import os
 import types
 
-from zope.interface import implements
+from zope.interface import implements, directlyProvides
 
 from twisted.python.filepath import FilePath
 from twisted.mail.imap4 import MessageSet
@@ -305,6 +305,62 @@ class IMAP4HelperTestCase(unittest.TestCase):
         return d.addCallback(cbProduced)
 
 
+    def test_fileProducerLength(self):
+        """
+        L{imap4.FileProducer} given a length produces a literal of at most
+        that many octets from the current position of the file.
+        """
+        f = StringIO('x' * 100 + 'y' * 10 + 'z' * 100)
+        f.seek(100)
+        c = BufferingConsumer()
+        p = imap4.FileProducer(f, 10)
+        p.CHUNK_SIZE = 3
+        d = p.beginProducing(c)
+        self.successResultOf(d)
+        self.assertEqual(''.join(c.buffer), '{10}\r\n' + 'y' * 10)
+        self.assertTrue(max(map(len, c.buffer[1:])) <= 3)
+
+
+    def test_fileProducerLengthPastEnd(self):
+        """
+        L{imap4.FileProducer} given a length beyond the end of the file
+        produces the rest of the file.
+        """
+        c = BufferingConsumer()
+        self.successResultOf(
+            imap4.FileProducer(StringIO('abc'), 10).beginProducing(c))
+        self.assertEqual(''.join(c.buffer), '{3}\r\nabc')
+
+
+    def test_fileProducerStopped(self):
+        """
+        When L{imap4.FileProducer.stopProducing} is called, the L{Deferred}
+        returned by L{imap4.FileProducer.beginProducing} fails with
+        L{error.ConnectionLost} and nothing more is produced.
+        """
+        consumer = StringTransport()
+        p = imap4.FileProducer(StringIO('x' * 1000))
+        d = p.beginProducing(consumer)
+        p.resumeProducing()
+        p.stopProducing()
+        self.failureResultOf(d, error.ConnectionLost)
+        written = consumer.value()
+        p.resumeProducing()
+        self.assertEqual(consumer.value(), written)
+
+
+    def test_literalFileSpooled(self):
+        """
+        A literal longer than the C{memoryFileLimit} given to
+        L{imap4.LiteralFile} is written to a temporary file, and a shorter
+        one is kept in memory.
+        """
+        large = imap4.LiteralFile(11, defer.Deferred(), 10)
+        small = imap4.LiteralFile(10, defer.Deferred(), 10)
+        self.assertNotIsInstance(large.data, type(StringIO()))
+        self.assertIsInstance(small.data, type(StringIO()))
+
+
     def test_wildcard(self):
         cases = [
             ['foo/%gum/bar',
@@ -4143,6 +4199,91 @@ class NewFetchTestCase(unittest.TestCase, IMAP4HelperMixin):
         return d
 
 
+    def _fetchPartialWork(self, **kw):
+        """
+        Fetch a section of the message in C{self.msgObjs} with
+        L{IMAP4Client.fetchSpecific} called with C{kw}, and compare the
+        result to C{self.expected}.
+        """
+        self.function = self.client.fetchSpecific
+        self.messages = '1'
+
+        def result(R):
+            self.result = R
+
+        self.connected.addCallback(
+            lambda _: self.function(self.messages, **kw))
+        self.connected.addCallback(result)
+        self.connected.addCallback(self._cbStopClient)
+        self.connected.addErrback(self._ebGeneral)
+
+        d = loopback.loopbackTCP(self.server, self.client, noisy=False)
+        d.addCallback(lambda ign: self.assertEqual(self.result, self.expected))
+        return d
+
+
+    def test_fetchPartialText(self):
+        """
+        A request for a range of octets of the text of a message is answered
+        with those octets only, labelled with the origin octet.
+        """
+        self.msgObjs = [FakeyMessage(
+                {'Header': 'Value'}, (), None, '0123456789' * 10, 123, None)]
+        self.expected = {0: [['BODY', ['TEXT'], '<15>', '56789012']]}
+        return self._fetchPartialWork(headerType='TEXT', offset=15, length=8)
+
+
+    def test_fetchPartialPastEnd(self):
+        """
+        A request for a range of octets beginning past the end of the text of
+        a message is answered with an empty literal.
+        """
+        self.msgObjs = [FakeyMessage(
+                {'Header': 'Value'}, (), None, 'short', 123, None)]
+        self.expected = {0: [['BODY', ['TEXT'], '<100>', '']]}
+        return self._fetchPartialWork(headerType='TEXT', offset=100, length=8)
+
+
+    def test_fetchPartialHeader(self):
+        """
+        A request for a range of octets of header fields of a message is
+        answered with those octets only.
+        """
+        headers = util.OrderedDict()
+        headers['from'] = 'sender@host'
+        self.msgObjs = [FakeyMessage(headers, (), None, '', 123, None)]
+        self.expected = {
+            0: [['BODY', ['HEADER.FIELDS', ['From']], '<2>', 'om: se']]}
+        return self._fetchPartialWork(
+            headerType='HEADER.FIELDS', headerArgs=['FROM'], offset=2, length=6)
+
+
+    def test_fetchPartialMessageFile(self):
+        """
+        A request for a range of octets of a whole message providing
+        L{imap4.IMessageFile} is answered with those octets of the file.
+        """
+        msg = FakeyMessage({}, (), None, '', 123, None)
+        msg.open = lambda: StringIO('Subject: x\r\n\r\n' + 'body' * 100)
+        directlyProvides(msg, imap4.IMessageFile)
+        self.msgObjs = [msg]
+        self.expected = {0: [['BODY', [], '<9>', 'x\r\n\r\nbody']]}
+        return self._fetchPartialWork(offset=9, length=9)
+
+
+    def test_fetchPartialMessage(self):
+        """
+        A request for a range of octets of a whole message without
+        L{imap4.IMessageFile} is answered with those octets of the message
+        generated from its parts.
+        """
+        headers = util.OrderedDict()
+        headers['subject'] = 'x'
+        self.msgObjs = [FakeyMessage(headers, (), None, 'body', 123, None)]
+        self.expected = {0: [['BODY', [], '<4>', 'ect: x\r\n\r\nbody']]}
+        return self._fetchPartialWork(offset=4, length=14)
+
+
     def testFetchSize(self, uid=0):
         self.function = self.client.fetchSize
         self.messages = '1:100,2:*'
@@ -13,6 +13,7 @@ import StringIO
 import rfc822
 import tempfile
 import signal
+import time
 from hashlib import md5
 
 from zope.interface.verify import verifyClass
@@ -51,6 +52,7 @@ import twisted.cred.checkers
 import twisted.cred.portal
 
 from twisted.test.proto_helpers import LineSendingProtocol
+from twisted.test.proto_helpers import StringTransportWithDisconnection
 
 class DomainWithDefaultsTestCase(unittest.TestCase):
     def testMethods(self):
@@ -201,6 +203,19 @@ class FileMessageTestCase(unittest.TestCase):
         self.fp.eomReceived()
         self.assertEqual(file(self.final).read(), contents)
 
+    def test_chunkContents(self):
+        """
+        Lines given to L{mail.mail.FileMessage.chunkReceived}, mixed with
+        lines given to C{lineReceived}, are written to the file in order.
+        """
+        self.fp.lineReceived("first line")
+        self.fp.chunkReceived("second line\nthird line\n")
+        self.fp.lineReceived("fourth line")
+        self.fp.eomReceived()
+        self.assertEqual(
+            file(self.final).read(),
+            "first line\nsecond line\nthird line\nfourth line\n")
+
     def testInterrupted(self):
         contents = "first line\nsecond line\n"
         for line in contents.splitlines():
@@ -572,6 +587,139 @@ class MaildirTestCase(unittest.TestCase):
         self.failUnless(os.path.exists(j(self.d, msgs[5])))
 
 
+    def _addMessage(self, subdir, contents, name=None):
+        """
+        Write a message file into C{subdir} of the maildir and return its
+        name.
+        """
+        if name is None:
+            name = mail.maildir._generateMaildirName()
+        fObj = file(os.path.join(self.d, subdir, name), 'w')
+        fObj.write(contents)
+        fObj.close()
+        return name
+
+
+    def _settle(self):
+        """
+        Make the index consider the modification times of the maildir's
+        subdirectories old enough to trust.
+        """
+        self.patch(mail.maildir._MaildirIndex, '_now',
+                   lambda self: time.time() + 10)
+
+
+    def test_index(self):
+        """
+        L{MaildirMailbox} saves an index of the sizes, UIDLs and flags of its
+        messages, and UIDLs are the MD5 hash of the file names.
+        """
+        first = self._addMessage('new', 'x' * 3)
+        second = self._addMessage('cur', 'x' * 5, 'message:2,FS')
+        mb = mail.maildir.MaildirMailbox(self.d)
+        self.assertEqual(mb.getUidl(0), md5(first).hexdigest())
+        self.assertEqual(mb.getUidl(1), md5(second).hexdigest())
+
+        index = mail.maildir._MaildirIndex(self.d)
+        self.assertEqual(index.entries, {
+                'new': {first: (3, md5(first).hexdigest(), '')},
+                'cur': {second: (5, md5(second).hexdigest(), 'FS')}})
+
+
+    def test_unchangedMaildirNotRead(self):
+        """
+        Opening a L{MaildirMailbox} whose subdirectories have not changed
+        since its index was saved reads neither the subdirectories nor the
+        messages.
+        """
+        self._addMessage('new', 'x' * 3)
+        self._addMessage('cur', 'x' * 5)
+        self._settle()
+        mail.maildir.MaildirMailbox(self.d)
+
+        def fail(*args):
+            self.fail("Maildir read")
+        self.patch(os, 'listdir', fail)
+        mb = mail.maildir.MaildirMailbox(self.d)
+        self.assertEqual(mb.listMessages(), [3, 5])
+
+
+    def test_incrementalRescan(self):
+        """
+        When a subdirectory has changed, only the messages which are new to
+        the index are examined, and messages which are gone are dropped.
+        """
+        kept = self._addMessage('new', 'x' * 3)
+        gone = self._addMessage('new', 'x' * 4)
+        self._settle()
+        mail.maildir.MaildirMailbox(self.d)
+
+        os.remove(os.path.join(self.d, 'new', gone))
+        added = self._addMessage('new', 'x' * 6)
+        stat = os.stat
+        examined = []
+        def recordingStat(path):
+            examined.append(path)
+            return stat(path)
+        self.patch(os, 'stat', recordingStat)
+        mb = mail.maildir.MaildirMailbox(self.d)
+        self.assertEqual(mb.listMessages(), [3, 6])
+        self.assertEqual(
+            [os.path.basename(path) for path in examined
+             if os.path.dirname(path) == os.path.join(self.d, 'new')],
+            [added])
+        self.assertEqual(mb.getUidl(1), md5(added).hexdigest())
+
+
+    def test_recentChangesRescanned(self):
+        """
+        A subdirectory modified too recently to trust its modification time
+        is read again the next time the mailbox is opened.
+        """
+        self._addMessage('new', 'x' * 3)
+        mail.maildir.MaildirMailbox(self.d)
+        index = mail.maildir._MaildirIndex(self.d)
+        self.assertIdentical(index.mtimes['new'], None)
+
+
+    def test_unreadableIndex(self):
+        """
+        An index file which cannot be parsed is rebuilt.
+        """
+        self._addMessage('new', 'x' * 3)
+        indexPath = os.path.join(self.d, mail.maildir._MaildirIndex.indexName)
+        fObj = file(indexPath, 'w')
+        fObj.write('twisted-maildir-index 1\nnew 3\n')
+        fObj.close()
+        mb = mail.maildir.MaildirMailbox(self.d)
+        self.assertEqual(mb.listMessages(), [3])
+        self.assertEqual(
+            len(mail.maildir._MaildirIndex(self.d).entries['new']), 1)
+
+
+    def test_saveUniqueTemporaryFile(self):
+        """
+        Each save of the index writes a temporary file with a name of its own
+        in the maildir, so that concurrent saves do not write to the same
+        file, and renames it over the index.
+        """
+        self._addMessage('new', 'x' * 3)
+        index = mail.maildir._MaildirIndex(self.d)
+        renamed = []
+        rename = os.rename
+        def recordingRename(source, destination):
+            renamed.append(source)
+            rename(source, destination)
+        self.patch(os, 'rename', recordingRename)
+        index.save()
+        index.save()
+        self.assertEqual(len(set(renamed)), 2)
+        for source in renamed:
+            self.assertEqual(os.path.dirname(source), os.path.abspath(self.d))
+            self.assertFalse(os.path.exists(source))
+        self.assertTrue(os.path.exists(os.path.join(self.d, index.indexName)))
+
+
 
 class AbstractMaildirDomainTestCase(unittest.TestCase):
     """
@@ -1085,6 +1233,514 @@ class DirectoryQueueTestCase(unittest.TestCase):
                 ['header', i]
             )
 
+
+
+
+class RecordingRelayerFactory(object):
+    """
+    A stand-in for L{mail.relaymanager.SMTPManagedRelayerFactory} which
+    records the messages it is given.
+    """
+    created = None
+
+    def __init__(self, messages, manager):
+        self.messages = messages
+        self.manager = manager
+        self.created.append(self)
+
+
+
+class NeverMXCalculator(object):
+    """
+    A stand-in for L{mail.relaymanager.MXCalculator} whose lookups never
+    finish.
+    """
+    def __init__(self):
+        self.lookups = []
+
+
+    def getMX(self, domain):
+        self.lookups.append(domain)
+        return Deferred()
+
+
+
+class DomainQueueTestCase(unittest.TestCase):
+    """
+    Tests for the grouping of the messages of L{mail.relaymanager.Queue} by
+    domain, the backoff of domains and the index of the queue.
+    """
+    def setUp(self):
+        self.tmpdir = self.mktemp()
+        os.mkdir(self.tmpdir)
+        self.now = 1000.0
+        self.queue = self.openQueue()
+
+
+    def openQueue(self):
+        """
+        Open the queue directory, with the clock of the test.
+        """
+        queue = mail.relaymanager.Queue(self.tmpdir)
+        queue.noisy = False
+        queue._now = lambda: self.now
+        return queue
+
+
+    def addMessage(self, to):
+        """
+        Add a message for the recipient C{to} to the queue directory.
+
+        @return: The base filename of the message.
+        """
+        hdrF, msgF = self.queue.createNewMessage()
+        pickle.dump(['sender@example.com', to], hdrF)
+        hdrF.close()
+        msgF.lineReceived('To: ' + to)
+        msgF.eomReceived()
+        return os.path.basename(hdrF.name)[:-2]
+
+
+    def countEnvelopeReads(self, queue):
+        """
+        Count the calls to the C{getEnvelope} method of C{queue}.
+
+        @return: A L{list} with an item for each call.
+        """
+        reads = []
+        getEnvelope = queue.getEnvelope
+        def countingGetEnvelope(message):
+            reads.append(message)
+            return getEnvelope(message)
+        queue.getEnvelope = countingGetEnvelope
+        return reads
+
+
+    def test_nextDomains(self):
+        """
+        L{Queue.nextDomains} hands out each domain with waiting messages once,
+        up to the given number, until it is released.
+        """
+        self.addMessage('a@one.example')
+        self.addMessage('b@two.example')
+        self.addMessage('c@one.example')
+        self.queue.readDirectory()
+
+        first = self.queue.nextDomains(1)
+        second = self.queue.nextDomains(5)
+        self.assertEqual(
+            sorted(first + second), ['one.example', 'two.example'])
+        self.assertEqual(self.queue.nextDomains(5), [])
+
+        self.queue.releaseDomain(first[0])
+        self.assertEqual(self.queue.nextDomains(5), first)
+
+
+    def test_takeWaiting(self):
+        """
+        L{Queue.takeWaiting} marks the oldest waiting messages of a domain as
+        being relayed, up to the given number.
+        """
+        messages = [self.addMessage('a@one.example') for i in range(3)]
+        other = self.addMessage('b@two.example')
+        self.queue.readDirectory()
+
+        self.assertEqual(self.queue.nextDomains(1), ['one.example'])
+        taken = self.queue.takeWaiting('one.example', 2)
+        self.assertEqual(len(taken), 2)
+        self.assertEqual(sorted(self.queue.getRelayed()), sorted(taken))
+        self.assertEqual(
+            sorted(self.queue.getWaiting()),
+            sorted(set(messages + [other]) - set(taken)))
+
+        for message in taken:
+            self.queue.setWaiting(message)
+        self.queue.releaseDomain('one.example')
+        self.assertEqual(
+            sorted(self.queue.takeWaiting('one.example', 5)), sorted(messages))
+
+
+    def test_illegalDestination(self):
+        """
+        Messages whose recipient has no domain are indexed as such and never
+        handed out.
+        """
+        message = self.addMessage('nobody')
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+
+        self.assertEqual(self.queue.nextDomains(5), ['one.example'])
+        self.assertIdentical(self.queue._domains[message], None)
+        self.assertEqual(len(self.queue.getWaiting()), 2)
+
+
+    def test_backoff(self):
+        """
+        After L{Queue.deferDomain}, a domain is not handed out until a delay
+        which doubles with each failure, up to C{maxRetryDelay}, has passed.
+        L{Queue.domainSucceeded} ends the backoff.
+        """
+        self.queue.retryDelay = 10
+        self.queue.maxRetryDelay = 35
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+
+        for delay in [10, 20, 35, 35]:
+            self.assertEqual(self.queue.nextDomains(1), ['one.example'])
+            self.queue.deferDomain('one.example')
+            self.queue.releaseDomain('one.example')
+            self.now += delay - 1
+            self.assertEqual(self.queue.nextDomains(1), [])
+            self.now += 1
+
+        self.assertEqual(self.queue.nextDomains(1), ['one.example'])
+        self.queue.domainSucceeded('one.example')
+        self.queue.deferDomain('one.example')
+        self.queue.releaseDomain('one.example')
+        self.now += 10
+        self.assertEqual(self.queue.nextDomains(1), ['one.example'])
+
+
+    def test_backoffOrder(self):
+        """
+        Domains are handed out in the order of their next attempts.
+        """
+        self.addMessage('a@one.example')
+        self.addMessage('b@two.example')
+        self.queue.readDirectory()
+        self.queue.nextDomains(2)
+        self.queue.deferDomain('one.example')
+        self.queue.deferDomain('one.example')
+        self.queue.deferDomain('two.example')
+        self.queue.releaseDomain('one.example')
+        self.queue.releaseDomain('two.example')
+
+        self.now += 3600
+        self.assertEqual(
+            self.queue.nextDomains(2), ['two.example', 'one.example'])
+
+
+    def test_indexPersists(self):
+        """
+        A queue opened on a directory with an index does not read the
+        envelopes of the messages it lists, and keeps the backoffs of their
+        domains.
+        """
+        self.addMessage('a@one.example')
+        self.addMessage('b@two.example')
+        self.queue.readDirectory()
+        self.queue.nextDomains(2)
+        self.queue.deferDomain('two.example')
+
+        queue = self.openQueue()
+        reads = self.countEnvelopeReads(queue)
+        self.assertEqual(queue.nextDomains(5), ['one.example'])
+        self.now += queue.retryDelay
+        self.assertEqual(queue.nextDomains(5), ['two.example'])
+        self.assertEqual(reads, [])
+
+
+    def test_indexForgetsDone(self):
+        """
+        Messages which are done are removed from the index.
+        """
+        message = self.addMessage('a@one.example')
+        self.addMessage('b@one.example')
+        self.queue.readDirectory()
+        self.queue.nextDomains(1)
+        self.queue.setRelaying(message)
+        self.queue.done(message)
+
+        queue = self.openQueue()
+        self.assertNotIn(message, queue._domains)
+        self.assertEqual(len(queue._domains), 1)
+
+
+    def test_damagedIndex(self):
+        """
+        Lines of the index which cannot be parsed are ignored, and the
+        envelopes of messages missing from the index are read instead.
+        """
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+        self.queue.nextDomains(1)
+        self.queue._closeJournal()
+        path = os.path.join(self.tmpdir, self.queue.indexName)
+        f = open(path, 'wb')
+        f.write('M\nB one.example many\ngarbage\n')
+        f.close()
+
+        queue = self.openQueue()
+        reads = self.countEnvelopeReads(queue)
+        self.assertEqual(queue.nextDomains(1), ['one.example'])
+        self.assertEqual(len(reads), 1)
+
+
+    def test_checkStateDueDomainsOnly(self):
+        """
+        L{SmartHostSMTPRelayingManager.checkState} starts relays only for
+        domains which are due, with at most C{maxMessagesPerConnection}
+        messages each, and does not read the envelopes of other messages
+        again.
+        """
+        RecordingRelayerFactory.created = created = []
+        for i in range(5):
+            self.addMessage('a@one.example')
+        for i in range(50):
+            self.addMessage('b%d@backoff.example' % (i,))
+        self.queue.readDirectory()
+        self.queue.nextDomains(5)
+        self.queue.deferDomain('backoff.example')
+        self.queue.releaseDomain('one.example')
+        self.queue.releaseDomain('backoff.example')
+
+        manager = mail.relaymanager.SmartHostSMTPRelayingManager(
+            self.queue, maxConnections=2, maxMessagesPerConnection=3)
+        manager.factory = RecordingRelayerFactory
+        manager.mxcalc = NeverMXCalculator()
+        reads = self.countEnvelopeReads(self.queue)
+        manager.checkState()
+
+        self.assertEqual(manager.mxcalc.lookups, ['one.example'])
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(created[0].messages), 3)
+        self.assertEqual(reads, [])
+
+
+    def test_noConnectionBacksOff(self):
+        """
+        When a relay cannot connect, its messages are waiting again at once
+        but their domain is not handed out before its retry delay.
+        """
+        RecordingRelayerFactory.created = created = []
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+        manager = mail.relaymanager.SmartHostSMTPRelayingManager(self.queue)
+        manager.factory = RecordingRelayerFactory
+        manager.mxcalc = NeverMXCalculator()
+        manager.checkState()
+        factory = created[0]
+
+        factory.manager.notifyNoConnection(factory)
+        factory.manager.notifyDone(factory)
+        self.assertEqual(len(self.queue.getWaiting()), 1)
+        self.assertEqual(manager.managed, {})
+
+        manager.checkState()
+        self.assertEqual(len(created), 1)
+        self.now += self.queue.retryDelay
+        manager.checkState()
+        self.assertEqual(len(created), 2)
+
+
+
+class FakeMXCalculator(object):
+    """
+    A stand-in for L{mail.relaymanager.MXCalculator} which answers every
+    lookup with the same exchange.
+    """
+    def getMX(self, domain):
+        return defer.succeed(Record_MX(0, 'mx.example.com'))
+
+
+
+class PooledRelayingManagerTestCase(unittest.TestCase):
+    """
+    Tests for the reuse of relayer sessions and the concurrency limits of
+    L{mail.relaymanager.SmartHostSMTPRelayingManager}.
+    """
+    def setUp(self):
+        self.tmpdir = self.mktemp()
+        os.mkdir(self.tmpdir)
+        self.queue = mail.relaymanager.Queue(self.tmpdir)
+        self.queue.noisy = False
+        self.clock = task.Clock()
+        self.manager = mail.relaymanager.SmartHostSMTPRelayingManager(
+            self.queue, maxConnections=4, maxMessagesPerConnection=2)
+        self.manager.fArgs = ('relay.example.com',)
+        self.manager.mxcalc = FakeMXCalculator()
+        self.manager.idleTimeout = 30
+        self.manager._pool = mail.relaymanager._RelayerPool(30, self.clock)
+        self.connections = []
+        self.manager._cbExchange = self.recordExchange
+        self.relayers = []
+
+
+    def recordExchange(self, address, port, factory):
+        """
+        Replace the connection attempts of the manager: reuse an idle relayer
+        the way L{SmartHostSMTPRelayingManager._cbExchange} does, or record
+        the factory.
+        """
+        relayer = self.manager._pool.take((address, port))
+        if relayer is not None:
+            relayer._reuse(factory)
+        else:
+            factory._pool = self.manager._pool
+            factory._exchange = (address, port)
+            self.connections.append(factory)
+
+
+    def addMessage(self, to):
+        hdrF, msgF = self.queue.createNewMessage()
+        pickle.dump(['sender@example.com', to], hdrF)
+        hdrF.close()
+        msgF.lineReceived('To: ' + to)
+        msgF.eomReceived()
+
+
+    def connect(self, factory):
+        """
+        Connect a relayer built by C{factory} to a transport and have the
+        server greet it.
+        """
+        relayer = factory.buildProtocol(None)
+        relayer.makeConnection(StringTransportWithDisconnection())
+        relayer.transport.protocol = relayer
+        relayer.dataReceived('220 hello\r\n250 hi\r\n')
+        self.relayers.append(relayer)
+        return relayer
+
+
+    def deliver(self, relayer, code):
+        """
+        Answer the transaction the relayer has begun, ending the message with
+        C{code}.
+        """
+        relayer.dataReceived('250 sender ok\r\n250 recipient ok\r\n'
+                             '354 go ahead\r\n')
+        producer = relayer.transport.producer
+        while relayer.transport.producer is not None:
+            producer.resumeProducing()
+        relayer.dataReceived('%d done\r\n250 reset\r\n' % (code,))
+
+
+    def test_sessionReused(self):
+        """
+        A relayer which has sent its messages waits in the pool and is given
+        the next batch for the same exchange instead of a new connection.
+        """
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+        self.manager.checkState()
+        relayer = self.connect(self.connections[0])
+        self.deliver(relayer, 250)
+        self.assertTrue(relayer.transport.connected)
+        self.assertEqual(self.manager.managed, {})
+
+        self.addMessage('b@two.example')
+        self.queue.readDirectory()
+        relayer.transport.clear()
+        self.manager.checkState()
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(
+            relayer.transport.value(),
+            'MAIL FROM:<sender@example.com>\r\n')
+        self.deliver(relayer, 250)
+        self.assertEqual(self.queue.getWaiting(), [])
+        self.assertEqual(self.queue.getRelayed(), [])
+
+
+    def test_idleTimeout(self):
+        """
+        A relayer left idle in the pool for C{idleTimeout} seconds ends its
+        session.
+        """
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+        self.manager.checkState()
+        relayer = self.connect(self.connections[0])
+        self.deliver(relayer, 250)
+        relayer.transport.clear()
+
+        self.clock.advance(30)
+        self.assertEqual(relayer.transport.value(), 'QUIT\r\n')
+        relayer.dataReceived('221 bye\r\n')
+        self.assertFalse(relayer.transport.connected)
+        self.assertIdentical(self.manager._pool.take(relayer._exchange), None)
+
+
+    def test_idleConnectionLost(self):
+        """
+        A relayer whose idle session is lost leaves the pool.
+        """
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+        self.manager.checkState()
+        relayer = self.connect(self.connections[0])
+        self.deliver(relayer, 250)
+
+        relayer.connectionLost(failure.Failure(Exception()))
+        self.assertIdentical(self.manager._pool.take(relayer._exchange), None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_concurrencyGrows(self):
+        """
+        Once an attempt for a domain relays messages, the next check starts
+        two connections for it.
+        """
+        for i in range(8):
+            self.addMessage('a%d@one.example' % (i,))
+        self.queue.readDirectory()
+        self.manager.idleTimeout = None
+        self.manager.checkState()
+        self.assertEqual(len(self.connections), 1)
+        relayer = self.connect(self.connections[0])
+        factory = self.connections[0]
+        for message in relayer.names[:]:
+            factory.manager.notifySuccess(factory, message)
+        factory.manager.notifyDone(factory)
+
+        self.manager.checkState()
+        self.assertEqual(len(self.connections), 3)
+
+
+    def test_temporaryFailureThrottles(self):
+        """
+        A message rejected with a transient error is returned to the queue
+        instead of bounced, its domain is backed off, and its concurrency
+        limit is halved.
+        """
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+        self.manager._domainLimits['one.example'] = 4
+        self.manager.checkState()
+        relayer = self.connect(self.connections[0])
+        self.deliver(relayer, 451)
+
+        self.assertEqual(len(self.queue.getWaiting()), 1)
+        self.assertEqual(self.queue.getRelayed(), [])
+        self.assertEqual(self.manager._domainLimits['one.example'], 2)
+        self.assertEqual(self.queue.nextDomains(1), [])
+
+
+    def test_temporaryFailureExpired(self):
+        """
+        A message rejected with a transient error after it has been in the
+        queue for longer than L{Queue.maxQueueTime} is bounced instead of
+        being returned to the queue.
+        """
+        self.addMessage('a@one.example')
+        self.queue.readDirectory()
+        message = self.queue.getWaiting()[0]
+        queued = os.path.getmtime(self.queue.getPath(message) + '-H')
+        self.queue._now = lambda: queued + self.queue.maxQueueTime + 1
+        self.manager.checkState()
+        relayer = self.connect(self.connections[0])
+        self.deliver(relayer, 451)
+
+        self.assertEqual(self.queue.getRelayed(), [])
+        self.assertFalse(os.path.exists(self.queue.getPath(message) + '-H'))
+        self.queue.readDirectory()
+        waiting = self.queue.getWaiting()
+        self.assertEqual(len(waiting), 1)
+        self.assertEqual(
+            self.queue.getEnvelope(waiting[0]),
+            ['', 'sender@example.com'])
+
+
+
 from twisted.names import server
 from twisted.names import client
 from twisted.names import common
@@ -1532,6 +2188,87 @@ class MXTestCase(unittest.TestCase):
     def _cbManyRecordsRepeatSpecificResult(self, againMX, nextMX):
         self.assertEqual(str(againMX.name), str(nextMX.name))
 
+
+    def _countingResolver(self, ttl):
+        """
+        Use a resolver which answers MX lookups with a record of the given
+        TTL and counts them.
+
+        @return: A L{list} with an item for each lookup.
+        """
+        lookups = []
+        class DummyResolver(object):
+            def lookupMailExchange(self, name):
+                lookups.append(name)
+                return defer.succeed((
+                        [RRHeader(name=name, type=Record_MX.TYPE, ttl=ttl,
+                                  payload=Record_MX(0, 'mx.' + name))],
+                        [], []))
+        self.mx.resolver = DummyResolver()
+        return lookups
+
+
+    def test_cachedUntilTTL(self):
+        """
+        L{MXCalculator.getMX} reuses the records of an earlier lookup of the
+        same domain until their TTL has passed.
+        """
+        lookups = self._countingResolver(60)
+        self.successResultOf(self.mx.getMX('example.com'))
+        self.clock.advance(59)
+        record = self.successResultOf(self.mx.getMX('example.com'))
+        self.assertEqual(str(record.name), 'mx.example.com')
+        self.assertEqual(lookups, ['example.com'])
+
+        self.clock.advance(1)
+        self.successResultOf(self.mx.getMX('example.com'))
+        self.assertEqual(lookups, ['example.com', 'example.com'])
+
+
+    def test_zeroTTLNotCached(self):
+        """
+        Records with a TTL of zero are not reused.
+        """
+        lookups = self._countingResolver(0)
+        self.successResultOf(self.mx.getMX('example.com'))
+        self.successResultOf(self.mx.getMX('example.com'))
+        self.assertEqual(len(lookups), 2)
+
+
+    def test_maxCacheTime(self):
+        """
+        Records are not reused for longer than C{maxCacheTime} seconds,
+        whatever their TTL.
+        """
+        lookups = self._countingResolver(86400)
+        self.mx.maxCacheTime = 100
+        self.successResultOf(self.mx.getMX('example.com'))
+        self.clock.advance(100)
+        self.successResultOf(self.mx.getMX('example.com'))
+        self.assertEqual(len(lookups), 2)
+
+
+    def test_cachedRecordsMarkedBad(self):
+        """
+        An exchange marked bad is avoided even when the records of its domain
+        are reused.
+        """
+        class DummyResolver(object):
+            def lookupMailExchange(self, name):
+                return defer.succeed((
+                        [RRHeader(name=name, type=Record_MX.TYPE, ttl=60,
+                                  payload=Record_MX(0, 'first.' + name)),
+                         RRHeader(name=name, type=Record_MX.TYPE, ttl=60,
+                                  payload=Record_MX(1, 'second.' + name))],
+                        [], []))
+        self.mx.resolver = DummyResolver()
+        self.successResultOf(self.mx.getMX('example.com'))
+        self.mx.markBad('first.example.com')
+        record = self.successResultOf(self.mx.getMX('example.com'))
+        self.assertEqual(str(record.name), 'second.example.com')
+
+
+
 class LiveFireExercise(unittest.TestCase):
     if interfaces.IReactorUDP(reactor, None) is None:
         skip = "UDP support is required to determining MX records"
@@ -382,6 +382,174 @@ class SMTPClientTestCase(unittest.TestCase, LoopbackMixin):
 
 
 
+class RecordingESMTPClient(smtp.ESMTPClient):
+    """
+    An ESMTP client which sends the messages it is given and records the
+    results.
+    """
+    def __init__(self, messages):
+        smtp.ESMTPClient.__init__(self, None, None, 'foo.baz')
+        self.messages = list(messages)
+        self.results = []
+
+
+    def getMailFrom(self):
+        if self.messages:
+            return self.messages[0][0]
+
+
+    def getMailTo(self):
+        return self.messages[0][1]
+
+
+    def getMailData(self):
+        return StringIO(self.messages[0][2])
+
+
+    def sentMail(self, code, resp, numOk, addresses, log):
+        self.results.append((code, resp, numOk, addresses))
+        del self.messages[0]
+
+
+
+class ESMTPClientPipeliningTests(unittest.TestCase):
+    """
+    Tests for the pipelining of commands by L{smtp.ESMTPClient} when the
+    server supports it.
+    """
+    def connect(self, messages, extensions='PIPELINING'):
+        """
+        Connect a L{RecordingESMTPClient} to a transport and answer its
+        greeting and I{EHLO} command.
+        """
+        client = RecordingESMTPClient(messages)
+        client.makeConnection(StringTransport())
+        client.dataReceived(
+            '220 hello\r\n250-foo.bar greets foo.baz\r\n250 %s\r\n' % (
+                extensions,))
+        return client
+
+
+    def sendData(self, client):
+        """
+        Write the body of the current message to the transport.
+        """
+        while client.transport.producer is not None:
+            client.transport.producer.resumeProducing()
+
+
+    def test_pipelined(self):
+        """
+        The I{MAIL FROM}, I{RCPT TO} and I{DATA} commands of a message are
+        sent together and their responses handled in order.
+        """
+        client = self.connect([
+                ('alice@example.com', ['bob@example.com', 'eve@example.com'],
+                 'hello\n')])
+        self.assertEqual(
+            client.transport.value().splitlines()[-4:],
+            ['MAIL FROM:<alice@example.com>', 'RCPT TO:<bob@example.com>',
+             'RCPT TO:<eve@example.com>', 'DATA'])
+
+        client.transport.clear()
+        client.dataReceived(
+            '250 ok\r\n250 ok\r\n550 no such user\r\n354 go ahead\r\n')
+        self.sendData(client)
+        self.assertEqual(client.transport.value(), 'hello\r\n.\r\n')
+        client.dataReceived('250 accepted\r\n')
+        self.assertEqual(
+            client.results,
+            [(250, 'accepted', 1,
+              [('bob@example.com', 250, 'ok'),
+               ('eve@example.com', 550, 'no such user')])])
+
+
+    def test_resetPipelined(self):
+        """
+        The I{RSET} ending a transaction is sent with the commands of the next
+        one.
+        """
+        client = self.connect([
+                ('alice@example.com', ['bob@example.com'], 'one\n'),
+                ('alice@example.com', ['carol@example.com'], 'two\n')])
+        client.dataReceived('250 ok\r\n250 ok\r\n354 go ahead\r\n')
+        self.sendData(client)
+        client.transport.clear()
+        client.dataReceived('250 accepted\r\n')
+        self.assertEqual(
+            client.transport.value().splitlines(),
+            ['RSET', 'MAIL FROM:<alice@example.com>',
+             'RCPT TO:<carol@example.com>', 'DATA'])
+
+        client.transport.clear()
+        client.dataReceived(
+            '250 reset\r\n250 ok\r\n250 ok\r\n354 go ahead\r\n')
+        self.sendData(client)
+        client.dataReceived('250 accepted\r\n')
+        self.assertEqual(len(client.results), 2)
+        self.assertEqual(client.transport.value(), 'two\r\n.\r\nQUIT\r\n')
+
+
+    def test_noRecipientsAccepted(self):
+        """
+        If no recipient is accepted, the rejected I{DATA} command ends the
+        transaction with a failure.
+        """
+        client = self.connect([
+                ('alice@example.com', ['bob@example.com'], 'hello\n')])
+        client.transport.clear()
+        client.dataReceived(
+            '250 ok\r\n450 try later\r\n554 no valid recipients\r\n')
+        self.assertEqual(
+            client.results,
+            [(450, 'No recipients accepted', 0,
+              [('bob@example.com', 450, 'try later')])])
+        self.assertEqual(client.transport.value(), 'QUIT\r\n')
+
+
+    def test_senderRejected(self):
+        """
+        If the I{MAIL FROM} command is rejected, the transaction ends with
+        its response.
+        """
+        client = self.connect([
+                ('alice@example.com', ['bob@example.com'], 'hello\n')])
+        client.dataReceived(
+            '550 go away\r\n503 need MAIL\r\n503 need MAIL\r\n')
+        self.assertEqual(client.results[0][:2], (550, 'go away'))
+
+
+    def test_dataAcceptedWithoutRecipients(self):
+        """
+        If the server accepts the I{DATA} command although no recipient was
+        accepted, the client ends the message at once and reports the
+        failure once the server answers.
+        """
+        client = self.connect([
+                ('alice@example.com', ['bob@example.com'], 'hello\n')])
+        client.transport.clear()
+        client.dataReceived('250 ok\r\n550 no\r\n354 go ahead\r\n')
+        self.assertEqual(client.transport.value(), '.\r\n')
+        self.assertEqual(client.results, [])
+        client.dataReceived('554 no valid recipients\r\n')
+        self.assertEqual(client.results[0][:3],
+                         (550, 'No recipients accepted', 0))
+
+
+    def test_notAdvertised(self):
+        """
+        If the server does not support pipelining, each command waits for
+        the response to the previous one.
+        """
+        client = self.connect([
+                ('alice@example.com', ['bob@example.com'], 'hello\n')],
+                              extensions='8BITMIME')
+        self.assertEqual(
+            client.transport.value().splitlines()[-1],
+            'MAIL FROM:<alice@example.com>')
+
+
+
 class DummySMTPMessage:
 
     def __init__(self, protocol, users):
@@ -1261,6 +1429,227 @@ class SMTPServerTestCase(unittest.TestCase):
 
 
 
+class LineMessage(object):
+    """
+    An L{smtp.IMessage} which records the lines delivered to it.
+
+    @ivar lines: The lines received so far.
+    @ivar state: C{"receiving"}, C{"received"} or C{"lost"}.
+    """
+    implements(smtp.IMessage)
+
+    def __init__(self):
+        self.lines = []
+        self.state = "receiving"
+
+
+    def lineReceived(self, line):
+        self.lines.append(line)
+
+
+    def eomReceived(self):
+        self.state = "received"
+        return defer.succeed("saved")
+
+
+    def connectionLost(self):
+        self.state = "lost"
+
+
+
+class ChunkMessage(LineMessage):
+    """
+    An L{smtp.IChunkedMessage} which records the lines and chunks delivered to
+    it.
+
+    @ivar chunks: The chunks received so far.
+    """
+    implements(smtp.IChunkedMessage)
+
+    def __init__(self):
+        LineMessage.__init__(self)
+        self.chunks = []
+
+
+    def chunkReceived(self, chunk):
+        self.chunks.append(chunk)
+
+
+
+class RecordingDelivery(object):
+    """
+    An L{smtp.IMessageDelivery} which accepts all addresses and delivers to a
+    message made by C{messageFactory}.
+
+    @ivar validations: If not C{None}, a list to which a L{Deferred} is
+        appended for each recipient validated, to be fired by the test.
+    @ivar messages: The messages created so far.
+    """
+    implements(smtp.IMessageDelivery)
+
+    validations = None
+
+    def __init__(self, messageFactory):
+        self.messageFactory = messageFactory
+        self.messages = []
+
+
+    def receivedHeader(self, helo, origin, recipients):
+        return "Received: by test"
+
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+
+    def validateTo(self, user):
+        def factory():
+            message = self.messageFactory()
+            self.messages.append(message)
+            return message
+        if self.validations is None:
+            return factory
+        d = defer.Deferred()
+        self.validations.append(d)
+        return d.addCallback(lambda ignored: factory)
+
+
+
+class SMTPServerDataTests(unittest.TestCase):
+    """
+    Tests for the receipt of message data by L{smtp.SMTP}.
+    """
+    envelope = ('HELO example.com\r\n'
+                'MAIL FROM:<alice@example.com>\r\n'
+                'RCPT TO:<bob@example.com>\r\n'
+                'DATA\r\n')
+
+    def connect(self, messageFactory):
+        """
+        Connect an L{smtp.SMTP} server delivering to messages created by
+        C{messageFactory} to a L{StringTransport}.
+        """
+        self.delivery = RecordingDelivery(messageFactory)
+        self.server = smtp.SMTP(self.delivery)
+        self.transport = StringTransport()
+        self.server.makeConnection(self.transport)
+        self.addCleanup(self.server.connectionLost, error.ConnectionDone())
+        self.transport.clear()
+
+
+    def replies(self):
+        """
+        Return the codes of the replies sent by the server so far.
+        """
+        return [line[:3] for line in self.transport.value().splitlines()]
+
+
+    def test_chunkedMessage(self):
+        """
+        Message data received in one piece is delivered to an
+        L{smtp.IChunkedMessage} in one chunk, with dot-stuffing removed and
+        lines ending in C{"\\n"}, after the I{Received} header.
+        """
+        self.connect(ChunkMessage)
+        self.server.dataReceived(
+            self.envelope +
+            'Subject: hello\r\n\r\n..leading dot\r\nbody\r\n.\r\n')
+        [message] = self.delivery.messages
+        self.assertEqual(message.lines, ["Received: by test"])
+        self.assertEqual(
+            message.chunks,
+            ['Subject: hello\n\n.leading dot\nbody\n'])
+        self.assertEqual(message.state, "received")
+        self.assertEqual(self.replies(), ['250'] * 3 + ['354', '250'])
+
+
+    def test_lineMessage(self):
+        """
+        Message data is delivered line by line to an L{smtp.IMessage} which
+        does not provide L{smtp.IChunkedMessage}.
+        """
+        self.connect(LineMessage)
+        self.server.dataReceived(
+            self.envelope + 'Subject: hello\r\n\r\n..dot\r\na\nb\r\n.\r\n')
+        [message] = self.delivery.messages
+        self.assertEqual(
+            message.lines,
+            ["Received: by test", "Subject: hello", "", ".dot", "a\nb"])
+        self.assertEqual(message.state, "received")
+
+
+    def test_dataInPieces(self):
+        """
+        Message data received a byte at a time, with line breaks, the
+        terminator and dot-stuffing split across reads, is delivered the same
+        as if it had been received in one piece.
+        """
+        self.connect(ChunkMessage)
+        self.server.dataReceived(self.envelope)
+        for byte in 'Subject: hello\r\n\r\n..one\r\ntwo\r\n.\r\nQUIT\r\n':
+            self.server.dataReceived(byte)
+        [message] = self.delivery.messages
+        self.assertEqual(''.join(message.chunks),
+                         'Subject: hello\n\n.one\ntwo\n')
+        self.assertEqual(message.state, "received")
+        self.assertEqual(self.replies(), ['250'] * 3 + ['354', '250', '221'])
+
+
+    def test_headerlessMessage(self):
+        """
+        A blank line is added between the I{Received} header and a message
+        which has no headers of its own.
+        """
+        self.connect(ChunkMessage)
+        self.server.dataReceived(self.envelope + 'just a body\r\n.\r\n')
+        [message] = self.delivery.messages
+        self.assertEqual(message.chunks, ['\njust a body\n'])
+
+
+    def test_emptyMessage(self):
+        """
+        A message with no data at all is delivered without any chunks.
+        """
+        self.connect(ChunkMessage)
+        self.server.dataReceived(self.envelope + '.\r\n')
+        [message] = self.delivery.messages
+        self.assertEqual(message.chunks, [])
+        self.assertEqual(message.state, "received")
+
+
+    def test_pipelinedCommandsWaitForValidation(self):
+        """
+        Commands and message data received while a recipient is being
+        validated are not handled until the validation is complete.
+        """
+        self.connect(ChunkMessage)
+        self.delivery.validations = []
+        self.server.dataReceived(
+            self.envelope + 'Subject: hello\r\n\r\nbody\r\n.\r\n')
+        self.assertEqual(self.replies(), ['250', '250'])
+        self.assertEqual(self.delivery.messages, [])
+
+        self.delivery.validations[0].callback(None)
+        [message] = self.delivery.messages
+        self.assertEqual(message.chunks, ['Subject: hello\n\nbody\n'])
+        self.assertEqual(self.replies(), ['250'] * 3 + ['354', '250'])
+
+
+    def test_dataLineTooLong(self):
+        """
+        If more than L{smtp.SMTP.MAX_LENGTH} bytes of message data are
+        received without a line break, the message is abandoned and an error
+        is sent.
+        """
+        self.connect(ChunkMessage)
+        self.server.dataReceived(self.envelope)
+        self.server.dataReceived('x' * (self.server.MAX_LENGTH + 1))
+        [message] = self.delivery.messages
+        self.assertEqual(message.state, "lost")
+        self.assertEqual(self.replies(), ['250'] * 3 + ['354', '500'])
+
+
+
 class ESMTPAuthenticationTestCase(unittest.TestCase):
     def assertServerResponse(self, bytes, response):
         """
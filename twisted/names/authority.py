@@ -16,6 +16,21 @@ from twisted.python.compat import execfile
 
 import common
 
+
+# Incremented whenever the records of any FileAuthority are replaced, so that
+# copies of responses built from them can be discarded.
+_zoneGeneration = 0
+
+def _zonesChanged():
+    """
+    Record that the records of a L{FileAuthority} have been loaded or
+    replaced.
+    """
+    global _zoneGeneration
+    _zoneGeneration += 1
+
+
+
 def getSerial(filename = '/tmp/twisted-names.serial'):
     """Return a monotonically increasing (across program runs) integer.
 
@@ -61,6 +76,176 @@ def getSerial(filename = '/tmp/twisted-names.serial'):
 
 
 
+class _ZoneNode(object):
+    """
+    A node in the label-reversed tree of a L{_ZoneIndex}.
+
+    @ivar name: The name of this node.
+    @ivar children: A L{dict} mapping the next label of names below this node
+        to their L{_ZoneNode}.
+    @ivar records: A L{list} of the records owned by C{name}, or C{None} if
+        this node only exists because names below it do.
+    """
+    __slots__ = ('name', 'children', 'records')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.records = None
+
+
+
+class _ZoneIndex(object):
+    """
+    An index of the records of a L{FileAuthority}, so that lookups don't scan
+    the records of a name and so that the closest enclosing name, wildcards
+    and zone cuts above a name can be found in one walk down from the root.
+
+    @ivar records: The L{dict} mapping names to L{list}s of records which is
+        indexed.
+
+    @ivar generation: The value of L{_zoneGeneration} when C{records} were
+        last indexed.
+
+    @ivar _indexed: A L{dict} mapping each indexed name to a copy of the
+        L{list} of records it was indexed with, so that lists changed in place
+        are noticed.
+
+    @ivar _types: A L{dict} mapping C{(name, type)} to a L{list} of the
+        records of that type owned by that name.
+
+    @ivar _root: The L{_ZoneNode} of the root name.  Nodes are keyed by
+        label from the last label of a name to the first.
+    """
+
+    generation = None
+
+    def __init__(self, records):
+        self._indexed = {}
+        self._types = {}
+        self._root = _ZoneNode('')
+        self.update(records)
+
+
+    def _path(self, name, create):
+        """
+        Find the nodes from the root down to C{name}.
+
+        @param create: If true, add nodes for C{name} and any of its
+            ancestors which are missing.
+
+        @return: A L{list} of the L{_ZoneNode}s from the root to C{name}, or
+            C{None} if C{create} is false and C{name} is not in the tree.
+        """
+        node = self._root
+        path = [node]
+        if name:
+            for label in reversed(name.split('.')):
+                child = node.children.get(label)
+                if child is None:
+                    if not create:
+                        return None
+                    if node.name:
+                        childName = label + '.' + node.name
+                    else:
+                        childName = label
+                    child = node.children[label] = _ZoneNode(childName)
+                node = child
+                path.append(node)
+        return path
+
+
+    def _set(self, name, records):
+        """
+        Replace the records owned by C{name}.
+
+        @param records: The new L{list} of records, or an empty sequence or
+            C{None} to remove the name.
+        """
+        path = self._path(name, bool(records))
+        if path is None:
+            return
+        node = path[-1]
+        for record in node.records or ():
+            self._types.pop((name, record.TYPE), None)
+        if records:
+            node.records = records
+            for record in records:
+                self._types.setdefault((name, record.TYPE), []).append(record)
+            return
+
+        node.records = None
+        # Remove nodes which no longer lead to any records.
+        for i in range(len(path) - 1, 0, -1):
+            node = path[i]
+            if node.records is not None or node.children:
+                break
+            label = node.name.split('.', 1)[0]
+            del path[i - 1].children[label]
+
+
+    def update(self, records):
+        """
+        Index C{records}, only indexing again the names whose records differ
+        from those they were last indexed with.
+
+        @param records: The same L{dict} as C{records} after some of its names
+            have been given new or changed L{list}s of records, or a new
+            L{dict} of records.
+        """
+        indexed = self._indexed
+        for name in list(indexed):
+            if name not in records:
+                self._set(name, None)
+                del indexed[name]
+        for (name, nameRecords) in records.iteritems():
+            if indexed.get(name) != nameRecords:
+                nameRecords = list(nameRecords)
+                self._set(name, nameRecords)
+                indexed[name] = nameRecords
+        self.records = records
+
+
+    def recordsOfType(self, name, type):
+        """
+        @return: The records of the given type owned by C{name}.
+        @rtype: L{list}
+        """
+        return self._types.get((name, type), [])
+
+
+    def find(self, name, zone):
+        """
+        Walk down the tree towards C{name}.
+
+        @param name: The lower-cased name to find.
+
+        @param zone: The lower-cased name of the apex of the zone, below which
+            names owning I{NS} records are zone cuts.
+
+        @return: A L{tuple} of the L{_ZoneNode} of C{name} (or C{None} if
+            there is no such node), the L{_ZoneNode} of its closest existing
+            ancestor or of itself, and the L{_ZoneNode} of the highest zone cut
+            above C{name} (or C{None} if there is no such cut).
+        """
+        labels = name.split('.')[::-1] if name else []
+        zoneLabels = zone.split('.')[::-1] if zone else []
+        apexDepth = len(zoneLabels)
+        inZone = labels[:apexDepth] == zoneLabels
+        types = self._types
+        node = self._root
+        for depth, label in enumerate(labels):
+            if (inZone and depth > apexDepth
+                    and (node.name, dns.NS) in types):
+                return None, node, node
+            child = node.children.get(label)
+            if child is None:
+                return None, node, None
+            node = child
+        return node, node, None
+
+
+
 class FileAuthority(common.ResolverBase):
     """
     An Authority that is loaded from a file.
@@ -69,6 +254,16 @@ class FileAuthority(common.ResolverBase):
         processing will be done.
     @ivar _ADDRESS_TYPES: Record types which are useful for inclusion in the
         additional section generated during additional processing.
+
+    @ivar filename: The name of the file the zone was loaded from.
+
+    @ivar records: A L{dict} mapping lower-cased names to L{list}s of the
+        records they own.  To change the records of the zone, either assign a
+        new L{dict} or change the L{list}s of names in this one and call
+        L{_zonesChanged}.
+
+    @ivar _index: The L{_ZoneIndex} of C{records}, created when it is first
+        needed.
     """
     # See https://twistedmatrix.com/trac/ticket/6650
     _ADDITIONAL_PROCESSING_TYPES = (dns.CNAME, dns.MX, dns.NS)
@@ -76,18 +271,82 @@ class FileAuthority(common.ResolverBase):
 
     soa = None
     records = None
+    filename = None
+    _index = None
 
     def __init__(self, filename):
         common.ResolverBase.__init__(self)
+        self.filename = filename
         self.loadFile(filename)
         self._cache = {}
 
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_index', None)
+        return state
+
+
     def __setstate__(self, state):
         self.__dict__ = state
+        _zonesChanged()
 #        print 'setstate ', self.soa
 
 
+    def _getIndex(self):
+        """
+        Get the index of C{records}, first updating it if they may have changed
+        since they were indexed.
+
+        @rtype: L{_ZoneIndex}
+        """
+        index = self._index
+        if index is None:
+            index = self._index = _ZoneIndex(self.records)
+        elif (index.records is not self.records
+                or index.generation != _zoneGeneration):
+            index.update(self.records)
+        index.generation = _zoneGeneration
+        return index
+
+
+    def reload(self):
+        """
+        Load the zone from C{filename} again if the serial number of its I{SOA}
+        record has changed.
+
+        Only the names whose records changed are indexed again.
+
+        @return: C{True} if the zone was replaced, C{False} if its serial
+            number is unchanged.
+        """
+        serial = self._readSerial(self.filename)
+        if serial is not None:
+            if self.soa is not None and serial == self.soa[1].serial:
+                return False
+            self.loadFile(self.filename)
+            return True
+
+        soa, records = self.soa, self.records
+        self.loadFile(self.filename)
+        if (soa is not None and self.soa is not None
+                and soa[1].serial == self.soa[1].serial):
+            self.soa, self.records = soa, records
+            return False
+        return True
+
+
+    def _readSerial(self, filename):
+        """
+        Find the serial number of the I{SOA} record in C{filename} without
+        loading the zone.
+
+        @return: The serial number, or C{None} if it cannot be found without
+            loading the whole zone.
+        """
+        return None
+
+
     def _additionalRecords(self, answer, authority, ttl):
         """
         Find locally known information that could be useful to the consumer of
@@ -109,11 +368,12 @@ class FileAuthority(common.ResolverBase):
             I{additional} section.  These instances represent extra information
             about the records in C{answer} and C{authority}.
         """
+        index = self._getIndex()
         for record in answer + authority:
             if record.type in self._ADDITIONAL_PROCESSING_TYPES:
                 name = record.payload.name.name
-                for rec in self.records.get(name.lower(), ()):
-                    if rec.TYPE in self._ADDRESS_TYPES:
+                for addressType in self._ADDRESS_TYPES:
+                    for rec in index.recordsOfType(name.lower(), addressType):
                         yield dns.RRHeader(
                             name, rec.TYPE, dns.IN,
                             rec.ttl or ttl, rec, auth=True)
@@ -149,9 +409,50 @@ class FileAuthority(common.ResolverBase):
         additional = []
         default_ttl = max(self.soa[1].minimum, self.soa[1].expire)
 
-        domain_records = self.records.get(name.lower())
+        index = self._getIndex()
+        zone = self.soa[0].lower()
+        node, encloser, cut = index.find(name.lower(), zone)
 
-        if domain_records:
+        if cut is not None:
+            # The name is below a zone cut: refer the client to the child
+            # zone's nameservers.  RFC 1034, section 4.3.2, step 3b.
+            for record in index.recordsOfType(cut.name, dns.NS):
+                if record.ttl is not None:
+                    ttl = record.ttl
+                else:
+                    ttl = default_ttl
+                authority.append(
+                    dns.RRHeader(cut.name, record.TYPE, dns.IN, ttl, record,
+                                 auth=False))
+            additional.extend(
+                self._additionalRecords([], authority, default_ttl))
+            return defer.succeed((results, authority, additional))
+
+        owner = None
+        if node is not None and node.records is not None:
+            owner = node
+        elif node is None and dns._isSubdomainOf(name, zone):
+            # The name does not exist; answer from a wildcard at its closest
+            # encloser, if there is one.  RFC 4592, section 3.3.1.
+            wildcard = encloser.children.get('*')
+            if wildcard is not None and wildcard.records is not None:
+                owner = wildcard
+
+        if owner is not None:
+            if type == dns.ALL_RECORDS:
+                domain_records = owner.records
+            else:
+                domain_records = []
+                for recordType in set([type, dns.CNAME, dns.NS]):
+                    domain_records.extend(
+                        index.recordsOfType(owner.name, recordType))
+        elif node is not None and dns._isSubdomainOf(name, zone):
+            # An empty non-terminal: the name exists but owns no records.
+            domain_records = []
+        else:
+            domain_records = None
+
+        if domain_records is not None:
             for record in domain_records:
                 if record.ttl is not None:
                     ttl = record.ttl
@@ -190,14 +491,12 @@ class FileAuthority(common.ResolverBase):
                 # this response.  RFC 1034, sections 3.7 and 4.3.4, and RFC 2181
                 # section 7.1.
                 authority.append(
-                    dns.RRHeader(self.soa[0], dns.SOA, dns.IN, ttl, self.soa[1], auth=True)
+                    dns.RRHeader(self.soa[0], dns.SOA, dns.IN, default_ttl, self.soa[1], auth=True)
                     )
             return defer.succeed((results, authority, additional))
         else:
             if dns._isSubdomainOf(name, self.soa[0]):
-                # We may be the authority and we didn't find it.
-                # XXX: The QNAME may also be a in a delegated child zone. See
-                # #6581 and #6580
+                # We are the authority and the name does not exist.
                 return defer.fail(failure.Failure(dns.AuthoritativeDomainError(name)))
             else:
                 # The QNAME is not a descendant of this zone. Fail with
@@ -240,17 +539,37 @@ class FileAuthority(common.ResolverBase):
 class PySourceAuthority(FileAuthority):
     """A FileAuthority that is built up from Python source code."""
 
-    def loadFile(self, filename):
+    def _readZone(self, filename):
+        """
+        Execute C{filename} and return the records of the zone it defines.
+
+        @return: A L{list} of C{(name, record)} L{tuple}s.
+        """
         g, l = self.setupConfigNamespace(), {}
         execfile(filename, g, l)
         if not l.has_key('zone'):
             raise ValueError, "No zone defined in " + filename
+        return l['zone']
+
+
+    def _readSerial(self, filename):
+        """
+        Execute C{filename} and find the serial number of the I{SOA} record of
+        the zone it defines, without replacing the records of this authority.
+        """
+        for rr in self._readZone(filename):
+            if isinstance(rr[1], dns.Record_SOA):
+                return rr[1].serial
+        return None
 
+
+    def loadFile(self, filename):
         self.records = {}
-        for rr in l['zone']:
+        for rr in self._readZone(filename):
             if isinstance(rr[1], dns.Record_SOA):
                 self.soa = rr
             self.records.setdefault(rr[0].lower(), []).append(rr[1])
+        _zonesChanged()
 
 
     def wrapRecord(self, type):
@@ -271,42 +590,79 @@ class BindAuthority(FileAuthority):
     """An Authority that loads BIND configuration files"""
 
     def loadFile(self, filename):
+        """
+        Load the zone from C{filename}, parsing it one line at a time.
+        """
         self.origin = os.path.basename(filename) + '.' # XXX - this might suck
-        lines = open(filename).readlines()
-        lines = self.stripComments(lines)
-        lines = self.collapseContinuations(lines)
-        self.parseLines(lines)
+        with open(filename) as zoneFile:
+            lines = self.stripComments(zoneFile)
+            lines = self.collapseContinuations(lines)
+            self.parseLines(lines)
+        _zonesChanged()
+
+
+    def _readSerial(self, filename):
+        """
+        Read C{filename} only as far as its I{SOA} record and return the
+        serial number from it.
+        """
+        with open(filename) as zoneFile:
+            lines = self.collapseContinuations(self.stripComments(zoneFile))
+            for fields in lines:
+                if 'SOA' in fields and not fields[0].startswith('$'):
+                    rdata = fields[fields.index('SOA') + 1:]
+                    if len(rdata) < 3:
+                        return None
+                    return int(rdata[2])
+        return None
 
 
     def stripComments(self, lines):
-        return [
-            a.find(';') == -1 and a or a[:a.find(';')] for a in [
-                b.strip() for b in lines
-            ]
-        ]
+        """
+        Strip surrounding whitespace and comments from C{lines}.
+
+        @param lines: An iterable of lines of a zone file.
+
+        @return: An iterator of the stripped lines.
+        """
+        for line in lines:
+            line = line.strip()
+            comment = line.find(';')
+            if comment != -1:
+                line = line[:comment]
+            yield line
 
 
     def collapseContinuations(self, lines):
-        L = []
-        state = 0
+        """
+        Join lines continued with parentheses and split them into fields.
+
+        @param lines: An iterable of lines without comments.
+
+        @return: An iterator of L{list}s of the fields of each non-empty
+            logical line.
+        """
+        continued = None
         for line in lines:
-            if state == 0:
+            if continued is None:
                 if line.find('(') == -1:
-                    L.append(line)
+                    fields = line.split()
+                    if fields:
+                        yield fields
                 else:
-                    L.append(line[:line.find('(')])
-                    state = 1
+                    continued = line[:line.find('(')]
             else:
                 if line.find(')') != -1:
-                    L[-1] += ' ' + line[:line.find(')')]
-                    state = 0
+                    fields = (continued + ' ' + line[:line.find(')')]).split()
+                    continued = None
+                    if fields:
+                        yield fields
                 else:
-                    L[-1] += ' ' + line
-        lines = L
-        L = []
-        for line in lines:
-            L.append(line.split())
-        return filter(None, L)
+                    continued += ' ' + line
+        if continued is not None:
+            fields = continued.split()
+            if fields:
+                yield fields
 
 
     def parseLines(self, lines):
@@ -315,7 +671,7 @@ class BindAuthority(FileAuthority):
 
         self.records = {}
 
-        for (line, index) in zip(lines, range(len(lines))):
+        for line in lines:
             if line[0] == '$TTL':
                 TTL = dns.str2time(line[1])
             elif line[0] == '$ORIGIN':
@@ -331,7 +687,7 @@ class BindAuthority(FileAuthority):
     def addRecord(self, owner, ttl, type, domain, cls, rdata):
         if not domain.endswith('.'):
             domain = domain + '.' + owner
-        else:
+        if domain.endswith('.'):
             domain = domain[:-1]
         f = getattr(self, 'class_%s' % cls, None)
         if f:
@@ -347,7 +703,6 @@ class BindAuthority(FileAuthority):
             r.ttl = ttl
             self.records.setdefault(domain.lower(), []).append(r)
 
-            print 'Adding IN Record', domain, ttl, r
             if type == 'SOA':
                 self.soa = (domain, r)
         else:
@@ -8,86 +8,349 @@ An in-memory caching resolver.
 
 from __future__ import division, absolute_import
 
+import heapq
+import itertools
+from collections import OrderedDict
+
 from twisted.names import dns, common
+from twisted.names.error import AuthoritativeDomainError, DNSNameError
 from twisted.python import failure, log
 from twisted.internet import defer
 
 
 
+class _CacheEntry(object):
+    """
+    A cached response.
+
+    @ivar when: The time at which the response was cached.
+    @ivar payload: A 3-tuple of lists of L{dns.RRHeader} records, the answer,
+        authority and additional sections of the response.
+    @ivar ttl: The number of seconds for which the response may be used: the
+        minimum TTL of its records, or the negative caching TTL of a negative
+        response.
+    @ivar size: The number of records in C{payload}.
+    @ivar nameError: C{True} if the response is a cached I{NXDOMAIN}.
+    @ivar age: The age in whole seconds of the records in C{result}, or
+        C{None} if they are stale records.
+    @ivar result: C{payload} with the TTL of each record decreased by C{age},
+        shared by all the lookups made during the same second.
+    """
+    __slots__ = ('when', 'payload', 'ttl', 'size', 'nameError', 'age',
+                 'result')
+
+    def __init__(self, when, payload, ttl, size, nameError=False):
+        self.when = when
+        self.payload = payload
+        self.ttl = ttl
+        self.size = size
+        self.nameError = nameError
+        self.age = 0
+        self.result = payload
+
+
+    def expires(self):
+        """
+        @return: The time at which this entry expires.
+        """
+        return self.when + self.ttl
+
+
+    def resultAt(self, now):
+        """
+        Get the records of this entry with their TTLs adjusted for the time
+        elapsed since it was cached.
+
+        The adjusted records are only created once per second, and returned
+        as is by the other lookups made during that second.
+
+        @param now: The current time.
+
+        @return: A 3-tuple of lists of L{dns.RRHeader}, or C{None} if this entry
+            has expired.
+        """
+        age = int(now - self.when)
+        if age > self.ttl:
+            return None
+        if age != self.age:
+            self.age = age
+            self.result = self._withTTL(lambda r: r.ttl - age)
+        ans, auth, add = self.result
+        return list(ans), list(auth), list(add)
+
+
+    def staleResult(self, ttl):
+        """
+        Get the records of this expired entry, to be served while it is
+        refreshed.
+
+        @param ttl: The TTL of the stale records.
+
+        @return: A 3-tuple of lists of L{dns.RRHeader}.
+        """
+        if self.age is not None:
+            self.age = None
+            self.result = self._withTTL(lambda r: ttl)
+        ans, auth, add = self.result
+        return list(ans), list(auth), list(add)
+
+
+    def _withTTL(self, getTTL):
+        """
+        @param getTTL: A one-argument callable returning the new TTL of a
+            record.
+
+        @return: A copy of C{payload} with the TTLs returned by C{getTTL}.
+        """
+        return tuple([
+                [dns.RRHeader(r.name.name, r.type, r.cls, getTTL(r),
+                              r.payload, r.auth) for r in section]
+                for section in self.payload])
+
+
+    def isResult(self, payload):
+        """
+        @return: C{True} if C{payload} holds the records last returned by this
+            entry, rather than new ones.
+        """
+        for section, resultSection in zip(payload, self.result):
+            if len(section) != len(resultSection):
+                return False
+            for record, resultRecord in zip(section, resultSection):
+                if record is not resultRecord:
+                    return False
+        return True
+
+
+
+def _negativeTTL(authority, maxNegativeTTL):
+    """
+    Find the TTL of a negative response, as described in section 5 of RFC
+    2308: the minimum of the TTL and the I{MINIMUM} field of the I{SOA} record
+    in its authority section.
+
+    @param authority: The authority section of a negative response.
+    @type authority: L{list} of L{dns.RRHeader}
+
+    @param maxNegativeTTL: An upper bound for the result.
+
+    @return: A 2-tuple of the TTL and the I{SOA} L{dns.RRHeader} with that TTL,
+        or C{(None, None)} if there is no I{SOA} record and the response must
+        not be cached.
+    """
+    for record in authority:
+        if record.type == dns.SOA:
+            ttl = min(record.ttl, record.payload.minimum, maxNegativeTTL)
+            return ttl, dns.RRHeader(
+                record.name.name, record.type, record.cls, ttl,
+                record.payload, record.auth)
+    return None, None
+
+
+
 class CacheResolver(common.ResolverBase):
     """
     A resolver that serves records from a local, memory cache.
 
+    The cache holds at most C{maxEntries} responses and C{maxRecords} records,
+    evicting the least recently used responses to make room for new ones.
+    Expired responses are removed by a single delayed call, scheduled for the
+    earliest expiration time, rather than one delayed call per response.
+
+    Negative responses are cached as described by RFC 2308: a response without
+    answers (I{NODATA}) given to L{cacheResult}, or an I{NXDOMAIN} given to
+    L{cacheNameError}, is kept for the TTL of the I{SOA} record in its
+    authority section, bounded by its I{MINIMUM} field and C{maxNegativeTTL}.
+    An I{NXDOMAIN} without an I{SOA} record is not cached.
+    Lookups of a cached I{NXDOMAIN} fail with L{AuthoritativeDomainError}.
+
+    If an C{upstream} resolver is given, the cache can refresh the responses
+    which are still being looked up before they expire.  With C{prefetch} set,
+    a lookup made when less than that fraction of the TTL of a response
+    remains queries C{upstream} in the background.  With C{serveStale} set,
+    expired responses are kept for that many more seconds; a lookup of an
+    expired response is answered with its records, with a TTL of
+    C{staleTTL}, and queries C{upstream} in the background.  Only one refresh
+    of a response is in progress at a time.
+
+    @ivar cache: An L{OrderedDict} mapping L{dns.Query} instances to
+        L{_CacheEntry} instances, from the least to the most recently used.
+    @ivar maxEntries: The maximum number of cached responses.
+    @ivar maxRecords: The maximum total number of records in the cached
+        responses, bounding the memory used by the cache.
+    @ivar maxNegativeTTL: The maximum number of seconds for which a negative
+        response is cached.
+    @ivar upstream: The L{interfaces.IResolver} provider queried to refresh
+        responses, or C{None}.
+    @ivar prefetch: The fraction of the TTL of a response under which a lookup
+        refreshes it, or C{0} to disable prefetching.
+    @ivar serveStale: The number of seconds during which expired responses
+        are served, or C{0} to disable serving stale responses.
+    @ivar staleTTL: The TTL of the records of expired responses, as
+        recommended by RFC 8767.
+    @ivar hits: The number of lookups answered from the cache.
+    @ivar misses: The number of lookups not found in the cache.
+    @ivar evictions: The number of responses removed from the cache to make
+        room for new ones, before they expired.
+    @ivar refreshes: The number of queries sent to C{upstream}.
+    @ivar staleHits: The number of lookups answered with stale records.
+    @ivar _refreshing: A C{set} of the L{dns.Query} instances being refreshed.
+    @ivar _records: The total number of records in C{cache}.
+    @ivar _expirations: A heap of C{(removal, serial, query)} tuples, one for
+        each response given to L{cacheResult} or L{cacheNameError} which has
+        not been swept yet, where C{removal} is the time the response expires
+        plus C{serveStale}.  C{serial} keeps queries from being compared.
+        Tuples for responses which have been evicted or replaced are left in
+        place, until there are twice as many tuples as entries and the heap
+        is rebuilt from C{cache}.
+    @ivar _serial: An iterator of the serials for C{_expirations}.
+    @ivar _sweepCall: The L{IDelayedCall} of the next sweep, or C{None}.
     @ivar _reactor: A provider of L{interfaces.IReactorTime}.
     """
     cache = None
+    maxEntries = 10000
+    maxRecords = 100000
+    maxNegativeTTL = 3 * 60 * 60
+    upstream = None
+    prefetch = 0
+    serveStale = 0
+    staleTTL = 30
+    hits = 0
+    misses = 0
+    evictions = 0
+    refreshes = 0
+    staleHits = 0
+    _records = 0
+    _sweepCall = None
 
-    def __init__(self, cache=None, verbose=0, reactor=None):
+    def __init__(self, cache=None, verbose=0, reactor=None, maxEntries=None,
+                 maxRecords=None, maxNegativeTTL=None, upstream=None,
+                 prefetch=0, serveStale=0):
         common.ResolverBase.__init__(self)
 
-        self.cache = {}
         self.verbose = verbose
-        self.cancel = {}
         if reactor is None:
             from twisted.internet import reactor
         self._reactor = reactor
+        if maxEntries is not None:
+            self.maxEntries = maxEntries
+        if maxRecords is not None:
+            self.maxRecords = maxRecords
+        if maxNegativeTTL is not None:
+            self.maxNegativeTTL = maxNegativeTTL
+        self.upstream = upstream
+        self.prefetch = prefetch
+        self.serveStale = serveStale
+        self._refreshing = set()
+        self._clear()
 
         if cache:
             for query, (seconds, payload) in cache.items():
                 self.cacheResult(query, payload, seconds)
 
 
+    def _clear(self):
+        """
+        Empty the cache.
+        """
+        self.cache = OrderedDict()
+        self._records = 0
+        self._expirations = []
+        self._serial = itertools.count()
+
+
     def __setstate__(self, state):
+        cache = state.pop('cache')
+        state.pop('cancel', None)
         self.__dict__ = state
-
-        now = self._reactor.seconds()
-        for (k, (when, (ans, add, ns))) in self.cache.items():
-            diff = now - when
-            for rec in ans + add + ns:
-                if rec.ttl < diff:
-                    del self.cache[k]
-                    break
+        self._refreshing = set()
+        self._clear()
+        for query, (when, payload) in cache.items():
+            self.cacheResult(query, payload, when)
 
 
     def __getstate__(self):
-        for c in self.cancel.values():
-            c.cancel()
-        self.cancel.clear()
-        return self.__dict__
+        if self._sweepCall is not None:
+            self._sweepCall.cancel()
+            self._sweepCall = None
+        state = self.__dict__.copy()
+        for name in ('_records', '_expirations', '_serial', '_refreshing'):
+            state.pop(name, None)
+        state['cache'] = dict([
+                (query, (entry.when, entry.payload))
+                for (query, entry) in self.cache.items()
+                if not entry.nameError])
+        return state
 
 
     def _lookup(self, name, cls, type, timeout):
-        now = self._reactor.seconds()
         q = dns.Query(name, type, cls)
-        try:
-            when, (ans, auth, add) = self.cache[q]
-        except KeyError:
-            if self.verbose > 1:
-                log.msg('Cache miss for ' + repr(name))
-            return defer.fail(failure.Failure(dns.DomainError(name)))
-        else:
-            if self.verbose:
-                log.msg('Cache hit for ' + repr(name))
-            diff = now - when
-
-            try:
-                result = (
-                    [dns.RRHeader(r.name.name, r.type, r.cls, r.ttl - diff,
-                                  r.payload) for r in ans],
-                    [dns.RRHeader(r.name.name, r.type, r.cls, r.ttl - diff,
-                                  r.payload) for r in auth],
-                    [dns.RRHeader(r.name.name, r.type, r.cls, r.ttl - diff,
-                                  r.payload) for r in add])
-            except ValueError:
-                return defer.fail(failure.Failure(dns.DomainError(name)))
-            else:
+        entry = self.cache.get(q)
+        if entry is not None:
+            now = self._reactor.seconds()
+            result = entry.resultAt(now)
+            if result is None:
+                if now < entry.expires() + self.serveStale:
+                    self.staleHits += 1
+                    result = entry.staleResult(self.staleTTL)
+                    self._refresh(q)
+            elif (self.prefetch and
+                    entry.expires() - now < entry.ttl * self.prefetch):
+                self._refresh(q)
+            if result is not None:
+                self.hits += 1
+                # Mark as most recently used.
+                del self.cache[q]
+                self.cache[q] = entry
+                if self.verbose:
+                    log.msg('Cache hit for ' + repr(name))
+                if entry.nameError:
+                    return defer.fail(failure.Failure(
+                            AuthoritativeDomainError(name)))
                 return defer.succeed(result)
+        self.misses += 1
+        if self.verbose > 1:
+            log.msg('Cache miss for ' + repr(name))
+        return defer.fail(failure.Failure(dns.DomainError(name)))
 
 
     def lookupAllRecords(self, name, timeout = None):
         return defer.fail(failure.Failure(dns.DomainError(name)))
 
 
+    def _refresh(self, query):
+        """
+        Query C{upstream} in the background to replace the cached response to
+        C{query}, unless that is already in progress.
+
+        @param query: a L{dns.Query} instance.
+        """
+        if self.upstream is None or query in self._refreshing:
+            return
+        if self.verbose > 1:
+            log.msg('Refreshing %r' % (query,))
+        self._refreshing.add(query)
+        self.refreshes += 1
+
+        def refreshed(result):
+            self.cacheResult(query, result)
+
+        def failed(reason):
+            nameError = reason.check(DNSNameError) and reason.value.args
+            if nameError and isinstance(nameError[0], dns.Message):
+                self.cacheNameError(query, nameError[0].authority)
+            elif self.verbose:
+                log.msg('Refreshing %r failed: %s' % (
+                        query, reason.getErrorMessage()))
+
+        def done(ignored):
+            self._refreshing.discard(query)
+
+        d = defer.maybeDeferred(self.upstream.query, query)
+        d.addCallbacks(refreshed, failed)
+        d.addBoth(done)
+
+
     def cacheResult(self, query, payload, cacheTime=None):
         """
         Cache a DNS entry.
@@ -96,30 +359,144 @@ class CacheResolver(common.ResolverBase):
 
         @param payload: a 3-tuple of lists of L{dns.RRHeader} records, the
             matching result of the query (answers, authority and additional).
+            If there are no answers and the authority section includes an
+            I{SOA} record, this is a negative response and its TTL is that of
+            the I{SOA} record.
 
         @param cacheTime: The time (seconds since epoch) at which the entry is
             considered to have been added to the cache. If C{None} is given,
             the current time is used.
         """
+        entry = self.cache.get(query)
+        if entry is not None and entry.isResult(payload):
+            # This is a response from this cache, which the server is giving
+            # back.
+            return
         if self.verbose > 1:
             log.msg('Adding %r to cache' % query)
 
-        self.cache[query] = (cacheTime or self._reactor.seconds(), payload)
+        ans, auth, add = payload
+        soa = None
+        if not ans:
+            ttl, soa = _negativeTTL(auth, self.maxNegativeTTL)
+        if soa is not None:
+            payload = ([], [soa], [])
+        else:
+            payload = (list(ans), list(auth), list(add))
+            ttl = min([r.ttl for r in payload[0] + payload[1] + payload[2]]
+                      or [0])
+        self._add(query, _CacheEntry(
+                cacheTime or self._reactor.seconds(), payload, ttl,
+                len(payload[0]) + len(payload[1]) + len(payload[2])))
 
-        if query in self.cancel:
-            self.cancel[query].cancel()
 
-        s = list(payload[0]) + list(payload[1]) + list(payload[2])
-        if s:
-            m = s[0].ttl
-            for r in s:
-                m = min(m, r.ttl)
-        else:
-            m = 0
+    def cacheNameError(self, query, authority, cacheTime=None):
+        """
+        Cache an I{NXDOMAIN} response.
 
-        self.cancel[query] = self._reactor.callLater(m, self.clearEntry, query)
+        @param query: a L{dns.Query} instance.
+
+        @param authority: The authority section of the response, a L{list} of
+            L{dns.RRHeader}.  The response is only cached if it includes an
+            I{SOA} record.
+
+        @param cacheTime: The time (seconds since epoch) at which the entry is
+            considered to have been added to the cache. If C{None} is given,
+            the current time is used.
+        """
+        ttl, soa = _negativeTTL(authority, self.maxNegativeTTL)
+        if soa is None:
+            return
+        if self.verbose > 1:
+            log.msg('Adding name error for %r to cache' % query)
+        self._add(query, _CacheEntry(
+                cacheTime or self._reactor.seconds(), ([], [soa], []), ttl, 1,
+                nameError=True))
+
+
+    def _add(self, query, entry):
+        """
+        Add an entry to the cache, evict the least recently used entries if it
+        is full, and schedule the removal of the entry when it expires.
+
+        @param query: a L{dns.Query} instance.
+        @param entry: a L{_CacheEntry} instance.
+        """
+        now = self._reactor.seconds()
+        if entry.size > self.maxRecords or entry.resultAt(now) is None:
+            return
+        self._remove(query)
+        self.cache[query] = entry
+        self._records += entry.size
+        while (len(self.cache) > self.maxEntries or
+               self._records > self.maxRecords):
+            self._remove(next(iter(self.cache)))
+            self.evictions += 1
+
+        expires = entry.expires() + self.serveStale
+        heapq.heappush(
+            self._expirations, (expires, next(self._serial), query))
+        if len(self._expirations) > 2 * len(self.cache) + 16:
+            self._rebuildExpirations()
+        call = self._sweepCall
+        if call is None:
+            self._sweepCall = self._reactor.callLater(
+                max(expires - now, 0), self._sweep)
+        elif call.getTime() > expires:
+            call.reset(max(expires - now, 0))
+
+
+    def _rebuildExpirations(self):
+        """
+        Replace C{_expirations} with a heap holding one tuple for each entry
+        of the cache, dropping those for responses no longer cached.
+        """
+        serveStale = self.serveStale
+        serial = self._serial
+        self._expirations = [
+            (entry.expires() + serveStale, next(serial), query)
+            for (query, entry) in self.cache.items()]
+        heapq.heapify(self._expirations)
+
+
+    def _remove(self, query):
+        """
+        Remove the entry for C{query} from the cache, if there is one.
+        """
+        entry = self.cache.pop(query, None)
+        if entry is not None:
+            self._records -= entry.size
+
+
+    def _sweep(self):
+        """
+        Remove all the expired entries from the cache and schedule the next
+        sweep for the earliest expiration time of the remaining ones.
+        """
+        self._sweepCall = None
+        now = self._reactor.seconds()
+        expirations = self._expirations
+        cache = self.cache
+        while expirations and expirations[0][0] <= now:
+            query = heapq.heappop(expirations)[2]
+            entry = cache.get(query)
+            # The entry may have been evicted or replaced since.
+            if (entry is not None and
+                    entry.expires() + self.serveStale <= now):
+                self.clearEntry(query)
+        if expirations:
+            self._sweepCall = self._reactor.callLater(
+                expirations[0][0] - now, self._sweep)
 
 
     def clearEntry(self, query):
-        del self.cache[query]
-        del self.cancel[query]
+        """
+        Remove the entry for C{query} from the cache.
+
+        @param query: a L{dns.Query} instance.
+
+        @raise KeyError: If there is no such entry.
+        """
+        if query not in self.cache:
+            raise KeyError(query)
+        self._remove(query)
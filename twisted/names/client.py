@@ -37,6 +37,67 @@ moduleProvides(interfaces.IResolver)
 
 
 
+class _ServerStatistics(object):
+    """
+    Round trip time estimates for one name server, kept as TCP keeps them for
+    its retransmission timer (RFC 6298).
+
+    @ivar srtt: The smoothed round trip time in seconds, or C{None} if no
+        response has been measured yet.
+
+    @ivar rttvar: The smoothed mean deviation of the round trip time in
+        seconds, or C{None} if no response has been measured yet.
+    """
+    srtt = None
+    rttvar = None
+
+    def observe(self, rtt):
+        """
+        Update the estimates with a measured round trip time.
+
+        @param rtt: The round trip time in seconds.
+        @type rtt: L{float}
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+
+    def expectedLatency(self):
+        """
+        @return: The expected round trip time in seconds.  Servers which have
+            not been measured are expected to be fastest, so that they are
+            tried.
+        """
+        if self.srtt is None:
+            return 0.0
+        return self.srtt
+
+
+    def retransmissionTimeout(self, minimum, maximum):
+        """
+        @return: The number of seconds to wait for a response before trying
+            another server, between C{minimum} and C{maximum}.  This is
+            C{maximum} for a server which has not been measured.
+        """
+        if self.srtt is None:
+            return maximum
+        return min(max(self.srtt + 4 * self.rttvar, minimum), maximum)
+
+
+    def decay(self, factor):
+        """
+        Reduce the smoothed round trip time by C{factor}, so that servers
+        which are not being used are eventually measured again.
+        """
+        if self.srtt is not None:
+            self.srtt *= factor
+
+
+
 class Resolver(common.ResolverBase):
     """
     @ivar _waiting: A C{dict} mapping tuple keys of query name/type/class to
@@ -50,9 +111,26 @@ class Resolver(common.ResolverBase):
     @ivar _reactor: A provider of L{IReactorTCP}, L{IReactorUDP}, and
         L{IReactorTime} which will be used to set up network resources and
         track timeouts.
+
+    @ivar race: If true, UDP queries are first sent to the two servers with
+        the lowest expected latency at once and the first answer is used.
+
+    @ivar minimumTimeout: The fewest seconds to wait for an answer from a
+        server with a measured round trip time before trying the next server.
+
+    @ivar decay: The factor by which the expected latency of the other servers
+        is reduced whenever a server is chosen, so that slow servers are
+        eventually tried again.
+
+    @ivar _statistics: A C{dict} mapping server addresses to their
+        L{_ServerStatistics}.
     """
     index = 0
     timeout = None
+    race = False
+    minimumTimeout = 0.1
+    decay = 0.98
+    _statistics = None
 
     factory = None
     servers = None
@@ -64,13 +142,15 @@ class Resolver(common.ResolverBase):
     _lastResolvTime = None
     _resolvReadInterval = 60
 
-    def __init__(self, resolv=None, servers=None, timeout=(1, 3, 11, 45), reactor=None):
+    def __init__(self, resolv=None, servers=None, timeout=(1, 3, 11, 45),
+                 reactor=None, race=False):
         """
         Construct a resolver which will query domain name servers listed in
         the C{resolv.conf(5)}-format file given by C{resolv} as well as
-        those in the given C{servers} list.  Servers are queried in a
-        round-robin fashion.  If given, C{resolv} is periodically checked
-        for modification and re-parsed if it is noticed to have changed.
+        those in the given C{servers} list.  Servers are queried in order of
+        their measured round trip time, fastest first.  If given, C{resolv} is
+        periodically checked for modification and re-parsed if it is noticed
+        to have changed.
 
         @type servers: C{list} of C{(str, int)} or C{None}
         @param servers: If not None, interpreted as a list of (host, port)
@@ -92,6 +172,9 @@ class Resolver(common.ResolverBase):
             for DNS datagrams, and enforce timeouts.  If not provided, the
             global reactor will be used.
 
+        @type race: C{bool}
+        @param race: See L{Resolver.race}.
+
         @raise ValueError: Raised if no nameserver addresses can be found.
         """
         common.ResolverBase.__init__(self)
@@ -101,6 +184,8 @@ class Resolver(common.ResolverBase):
         self._reactor = reactor
 
         self.timeout = timeout
+        self.race = race
+        self._statistics = {}
 
         if servers is None:
             self.servers = []
@@ -193,22 +278,64 @@ class Resolver(common.ResolverBase):
 
     def pickServer(self):
         """
-        Return the address of a nameserver.
+        Return the address of the nameserver with the lowest expected latency.
 
-        TODO: Weight servers for response time so faster ones can be
-        preferred.
+        Servers with the same expected latency, such as those which have not
+        been measured, are picked in turn.
         """
-        if not self.servers and not self.dynServers:
+        addresses = self.servers + list(self.dynServers)
+        if not addresses:
             return None
-        serverL = len(self.servers)
-        dynL = len(self.dynServers)
-
         self.index += 1
-        self.index %= (serverL + dynL)
-        if self.index < serverL:
-            return self.servers[self.index]
-        else:
-            return self.dynServers[self.index - serverL]
+        self.index %= len(addresses)
+        addresses = addresses[self.index:] + addresses[:self.index]
+        addresses = self._byLatency(addresses)
+        self._chosen(addresses[0], addresses)
+        return addresses[0]
+
+
+    def _statisticsFor(self, address):
+        """
+        Get the L{_ServerStatistics} of the server at C{address}.
+        """
+        if self._statistics is None:
+            self._statistics = {}
+        try:
+            return self._statistics[address]
+        except KeyError:
+            statistics = self._statistics[address] = _ServerStatistics()
+            return statistics
+
+
+    def _byLatency(self, addresses):
+        """
+        Sort server addresses by expected latency, keeping the given order of
+        servers with the same expected latency.
+        """
+        return sorted(
+            addresses,
+            key=lambda address: self._statisticsFor(address).expectedLatency())
+
+
+    def _chosen(self, address, addresses):
+        """
+        Note that C{address} was chosen from C{addresses}, decaying the
+        expected latency of the others.
+        """
+        for other in addresses:
+            if other != address:
+                self._statisticsFor(other).decay(self.decay)
+
+
+    def _attemptTimeout(self, address, timeout):
+        """
+        Compute how long to wait for an answer from C{address} before trying
+        the next server.
+
+        @param timeout: The longest time to wait.
+        """
+        return self._statisticsFor(address).retransmissionTimeout(
+            self.minimumTimeout, timeout)
 
 
     def _connectedProtocol(self):
@@ -261,9 +388,17 @@ class Resolver(common.ResolverBase):
             query.
         """
         protocol = self._connectedProtocol()
+        address, timeout = args[0], args[2]
+        started = self._reactor.seconds()
         d = protocol.query(*args)
         def cbQueried(result):
             protocol.transport.stopListening()
+            if not isinstance(result, failure.Failure):
+                self._statisticsFor(address).observe(
+                    self._reactor.seconds() - started)
+            elif result.check(dns.DNSQueryTimeoutError):
+                # The answer took at least this long.
+                self._statisticsFor(address).observe(timeout)
             return result
         d.addBoth(cbQueried)
         return d
@@ -280,6 +415,12 @@ class Resolver(common.ResolverBase):
         @param timeout: Number of seconds after which to reissue the query.
         When the last timeout expires, the query is considered failed.
 
+        Servers are tried fastest first.  During the first timeout period,
+        the query is reissued to the next server once the measured round trip
+        time of a server has passed without an answer, rather than after the
+        whole period.  If L{Resolver.race} is set, the query is first sent to
+        the two fastest servers at once.
+
         @rtype: C{Deferred}
         @raise C{twisted.internet.defer.TimeoutError}: When the query times
         out.
@@ -287,21 +428,61 @@ class Resolver(common.ResolverBase):
         if timeout is None:
             timeout = self.timeout
 
-        addresses = self.servers + list(self.dynServers)
+        addresses = self._byLatency(self.servers + list(self.dynServers))
         if not addresses:
             return defer.fail(IOError("No domain name servers available"))
+        self._chosen(addresses[0], addresses)
 
-        # Make sure we go through servers in the list in the order they were
-        # specified.
+        # Pop servers off the end of the list, fastest first.
         addresses.reverse()
 
-        used = addresses.pop()
-        d = self._query(used, queries, timeout[0])
-        d.addErrback(self._reissue, addresses, [used], queries, timeout)
+        used = [addresses.pop()]
+        if self.race and addresses:
+            used.append(addresses.pop())
+            d = self._race([
+                    self._query(address, queries,
+                                self._attemptTimeout(address, timeout[0]))
+                    for address in used])
+        else:
+            d = self._query(
+                used[0], queries, self._attemptTimeout(used[0], timeout[0]))
+        d.addErrback(self._reissue, addresses, used, queries, timeout, True)
         return d
 
 
-    def _reissue(self, reason, addressesLeft, addressesUsed, query, timeout):
+    def _race(self, attempts):
+        """
+        Wait for the first of several attempts at a query to succeed.
+
+        @param attempts: A C{list} of L{Deferred}s for the same query.
+
+        @return: A L{Deferred} which fires with the first result of
+            C{attempts}, or fails with the failure of the last of them if
+            they all fail.
+        """
+        d = defer.Deferred()
+        failures = []
+        def succeeded(result):
+            if not d.called:
+                d.callback(result)
+        def failed(reason):
+            failures.append(reason)
+            if len(failures) == len(attempts) and not d.called:
+                d.errback(reason)
+        for attempt in attempts:
+            attempt.addCallbacks(succeeded, failed)
+        return d
+
+
+    def _reissue(self, reason, addressesLeft, addressesUsed, query, timeout,
+                 adaptive=False):
+        """
+        Reissue a query which timed out to the next server.
+
+        @param adaptive: If true, this is the first timeout period, in which
+            servers are given as long as their round trip time suggests rather
+            than the whole period.
+        """
         reason.trap(dns.DNSQueryTimeoutError)
 
         # If there are no servers left to be tried, adjust the timeout
@@ -312,6 +493,7 @@ class Resolver(common.ResolverBase):
             addressesLeft.reverse()
             addressesUsed = []
             timeout = timeout[1:]
+            adaptive = False
 
         # If all timeout values have been used this query has failed.  Tell the
         # protocol we're giving up on it and return a terminal timeout failure
@@ -326,8 +508,13 @@ class Resolver(common.ResolverBase):
 
         # Issue a query to a server.  Use the current timeout.  Add this
         # function as a timeout errback in case another retry is required.
-        d = self._query(address, query, timeout[0], reason.value.id)
-        d.addErrback(self._reissue, addressesLeft, addressesUsed, query, timeout)
+        if adaptive:
+            attemptTimeout = self._attemptTimeout(address, timeout[0])
+        else:
+            attemptTimeout = timeout[0]
+        d = self._query(address, query, attemptTimeout, reason.value.id)
+        d.addErrback(self._reissue, addressesLeft, addressesUsed, query,
+                     timeout, adaptive)
         return d
 
 
@@ -410,12 +597,51 @@ class Resolver(common.ResolverBase):
 
     # This one doesn't ever belong on UDP
     def lookupZone(self, name, timeout=10):
+        d = defer.Deferred()
+        return self._transferZone(AXFRController(name, d), d, timeout)
+
+
+    def lookupIncrementalZone(self, name, soa, timeout=10):
+        """
+        Perform an incremental zone transfer (RFC 1995) of the zone C{name}
+        from the version identified by C{soa}.
+
+        @param name: The name of the zone.
+        @type name: C{str}
+
+        @param soa: The I{SOA} record of the version of the zone which is
+            already known.
+        @type soa: L{dns.Record_SOA}
+
+        @return: A L{Deferred} which fires with a three-tuple of the records
+            of the response and two empty lists, as L{lookupZone} does.  The
+            records are either a single I{SOA} record if the zone has not
+            changed, the whole zone as returned by L{lookupZone}, or the
+            differences between the versions as described by RFC 1995 section
+            4.  It fails if the server returns an error.
+        """
+        d = defer.Deferred()
+        controller = IXFRController(name, soa, d, self.exceptionForCode)
+        return self._transferZone(controller, d, timeout)
+
+
+    def _transferZone(self, controller, d, timeout):
+        """
+        Connect to a server with TCP and let C{controller} perform a zone
+        transfer.
+
+        @param controller: An L{AXFRController} which will fire C{d}.
+
+        @param d: The L{Deferred} which C{controller} fires with the records
+            of the response.
+
+        @param timeout: The number of seconds to wait for the transfer to
+            complete.
+        """
         address = self.pickServer()
         if address is None:
             return defer.fail(IOError('No domain name servers available'))
         host, port = address
-        d = defer.Deferred()
-        controller = AXFRController(name, d)
         factory = DNSClientFactory(controller, timeout)
         factory.noisy = False #stfu
 
@@ -423,7 +649,9 @@ class Resolver(common.ResolverBase):
         controller.timeoutCall = self._reactor.callLater(
             timeout or 10, self._timeoutZone, d, controller,
             connector, timeout or 10)
-        return d.addCallback(self._cbLookupZone, connector)
+        return d.addCallbacks(
+            self._cbLookupZone, self._ebLookupZone,
+            callbackArgs=(connector,), errbackArgs=(connector,))
 
 
     def _timeoutZone(self, d, controller, connector, seconds):
@@ -438,6 +666,11 @@ class Resolver(common.ResolverBase):
         return (result, [], [])
 
 
+    def _ebLookupZone(self, reason, connector):
+        connector.disconnect()
+        return reason
+
+
 
 class AXFRController:
     timeoutCall = None
@@ -486,6 +719,89 @@ class AXFRController:
 
 
 
+
+class IXFRController(AXFRController):
+    """
+    Perform an incremental zone transfer (RFC 1995) over a single connection.
+
+    The response is complete when it consists of a single I{SOA} record for
+    the known version, when it is a whole zone ending with its I{SOA} record,
+    or when it is a sequence of differences followed by the I{SOA} record
+    which began it.
+
+    @ivar knownSOA: The L{dns.Record_SOA} of the version of the zone which is
+        already known.
+
+    @ivar exceptionForCode: A callable returning the exception class for a
+        response code other than L{dns.OK}.
+
+    @ivar _soaCount: The number of I{SOA} records received after the first.
+    """
+
+    def __init__(self, name, soa, deferred, exceptionForCode):
+        AXFRController.__init__(self, name, deferred)
+        self.knownSOA = soa
+        self.exceptionForCode = exceptionForCode
+        self._soaCount = 0
+
+
+    def connectionMade(self, protocol):
+        message = dns.Message(protocol.pickID(), recDes=0)
+        message.queries = [dns.Query(self.name, dns.IXFR, dns.IN)]
+        message.authority = [dns.RRHeader(
+                self.name, dns.SOA, dns.IN, self.knownSOA.ttl or 0,
+                self.knownSOA)]
+        protocol.writeMessage(message)
+
+
+    def messageReceived(self, message, protocol):
+        if message.rCode != dns.OK:
+            self._finish(failure.Failure(
+                    self.exceptionForCode(message.rCode)(message)))
+            return
+
+        records = self.records
+        for record in message.answers:
+            if records and record.type == dns.SOA:
+                self._soaCount += 1
+            records.append(record)
+        if not records or records[0].type != dns.SOA:
+            return
+
+        serial = records[0].payload.serial
+        if len(records) == 1:
+            # The zone has not changed.
+            complete = serial == self.knownSOA.serial
+        elif records[1].type != dns.SOA:
+            # The whole zone, as for AXFR.
+            complete = records[-1].type == dns.SOA
+        else:
+            # Differences, each starting with the SOA record of the old
+            # version and with that of the new one, then the SOA record of the
+            # latest version again.
+            complete = (records[-1].type == dns.SOA
+                        and self._soaCount % 2 == 1
+                        and records[-1].payload.serial == serial)
+        if complete:
+            self._finish(records)
+
+
+    def _finish(self, result):
+        """
+        Fire the L{Deferred} with C{result} and stop waiting for a response.
+        """
+        if self.timeoutCall is not None:
+            self.timeoutCall.cancel()
+            self.timeoutCall = None
+        if self.deferred is not None:
+            d, self.deferred = self.deferred, None
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+
 from twisted.internet.base import ThreadedResolver as _ThreadedResolverImpl
 
 class ThreadedResolver(_ThreadedResolverImpl):
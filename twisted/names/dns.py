@@ -96,9 +96,14 @@ if _PY3:
         """
         return '[%s]' % (
             ', '.join([_nicebytes(b) for b in list]),)
+
+
+    # Indexing bytes already produces integers.
+    _octets = bytes
 else:
     _ord2bytes = chr
     _nicebytes = _nicebyteslist = repr
+    _octets = bytearray
 
 
 
@@ -2298,10 +2303,343 @@ class Message(tputil.FancyEqMixin):
         Decode a byte string in the format described by RFC 1035 into this
         L{Message}.
 
+        The header, queries and record headers are decoded immediately, but
+        the payload of each record is only decoded when it is first accessed.
+        Use L{decode} to read a message from a file instead.
+
         @param str: L{bytes}
         """
-        strio = BytesIO(str)
-        self.decode(strio)
+        self.maxSize = 0
+        decoder = _MessageDecoder(str)
+        nqueries, nans, nns, nadd = decoder.decodeHeader(self)
+        offset = self.headerSize
+
+        self.queries = []
+        self.answers = []
+        self.authority = []
+        self.additional = []
+        try:
+            for i in range(nqueries):
+                query, offset = decoder.decodeQuery(offset)
+                self.queries.append(query)
+
+            for (section, n) in ((self.answers, nans),
+                                 (self.authority, nns),
+                                 (self.additional, nadd)):
+                for i in range(n):
+                    header, offset = decoder.decodeRecord(offset, self)
+                    if header is not None:
+                        section.append(header)
+        except EOFError:
+            # Like decode, keep whatever was decoded before the message ran
+            # out.
+            pass
+
+
+
+class _MessageDecoder(object):
+    """
+    Decode the wire format of a L{Message} directly from the byte string it
+    was received as.
+
+    Rather than reading through a file object, fields are unpacked in place at
+    offsets into C{data} with precompiled L{struct.Struct} instances.  Every
+    name decoded is remembered by the offset at which it starts so that
+    compression pointers to it (and to any of its suffixes) are resolved with
+    a single dictionary lookup.
+
+    @ivar data: The encoded message.
+    @type data: L{bytes}
+
+    @ivar _octets: C{data} indexable by integer octet values.
+
+    @ivar _names: A L{dict} mapping the offset of every label decoded so far to
+        a L{tuple} of the name starting at that label and the offset just
+        past its encoding.
+    """
+    _header = struct.Struct(Message.headerFmt)
+    _question = struct.Struct("!HH")
+    _rr = struct.Struct(RRHeader.fmt)
+    _preference = struct.Struct("!H")
+    _soa = struct.Struct("!LlllL")
+
+    def __init__(self, data):
+        self.data = data
+        self._octets = _octets(data)
+        self._names = {}
+
+
+    def decodeName(self, offset):
+        """
+        Decode the name encoded at C{offset}.
+
+        @param offset: The offset of the first label of the name.
+        @type offset: L{int}
+
+        @return: A L{tuple} of the name as L{bytes} and the offset of the
+            first byte following its encoding.
+
+        @raise EOFError: If the name runs past the end of the message.
+
+        @raise ValueError: If the name contains a compression loop.
+        """
+        names = self._names
+        cached = names.get(offset)
+        if cached is not None:
+            return cached
+
+        data = self.data
+        octets = self._octets
+        size = len(data)
+        start = offset
+        labels = []
+        # Lists of [label offset, label index, end of encoding] for each label
+        # decoded, to be added to the cache once the whole name is known.
+        pending = []
+        run = 0
+        end = None
+        suffix = None
+        visited = None
+        while True:
+            if offset >= size:
+                raise EOFError()
+            length = octets[offset]
+            if length == 0:
+                runEnd = offset + 1
+                break
+            if (length >> 6) == 3:
+                if offset + 2 > size:
+                    raise EOFError()
+                runEnd = offset + 2
+                for label in pending[run:]:
+                    label[2] = runEnd
+                run = len(pending)
+                if end is None:
+                    end = runEnd
+                target = (length & 63) << 8 | octets[offset + 1]
+                cached = names.get(target)
+                if cached is not None:
+                    suffix = cached[0]
+                    break
+                if visited is None:
+                    visited = set()
+                if target in visited:
+                    raise ValueError("Compression loop in encoded name")
+                visited.add(target)
+                offset = target
+                continue
+            offset += 1
+            if offset + length > size:
+                raise EOFError()
+            pending.append([offset - 1, len(labels), None])
+            labels.append(data[offset:offset + length])
+            offset += length
+
+        for label in pending[run:]:
+            label[2] = runEnd
+        if end is None:
+            end = runEnd
+        if suffix:
+            labels.append(suffix)
+        for (labelOffset, index, labelEnd) in pending:
+            names[labelOffset] = (b'.'.join(labels[index:]), labelEnd)
+        if not pending or pending[0][0] != start:
+            names[start] = (b'.'.join(labels), end)
+        return names[start]
+
+
+    def decodeHeader(self, message):
+        """
+        Decode the fixed size header into the fields and flags of C{message}.
+
+        @type message: L{Message}
+
+        @return: A L{tuple} of the number of queries, answers, authority and
+            additional records which follow the header.
+
+        @raise EOFError: If the message is too short to hold a header.
+        """
+        if len(self.data) < message.headerSize:
+            raise EOFError()
+        (message.id, byte3, byte4,
+         nqueries, nans, nns, nadd) = self._header.unpack_from(self.data)
+        message.answer = (byte3 >> 7) & 1
+        message.opCode = (byte3 >> 3) & 0xf
+        message.auth = (byte3 >> 2) & 1
+        message.trunc = (byte3 >> 1) & 1
+        message.recDes = byte3 & 1
+        message.recAv = (byte4 >> 7) & 1
+        message.authenticData = (byte4 >> 5) & 1
+        message.checkingDisabled = (byte4 >> 4) & 1
+        message.rCode = byte4 & 0xf
+        return nqueries, nans, nns, nadd
+
+
+    def decodeQuery(self, offset):
+        """
+        Decode the question encoded at C{offset}.
+
+        @return: A L{tuple} of a L{Query} and the offset following it.
+
+        @raise EOFError: If the question runs past the end of the message.
+        """
+        name, offset = self.decodeName(offset)
+        if offset + 4 > len(self.data):
+            raise EOFError()
+        type, cls = self._question.unpack_from(self.data, offset)
+        return Query(name, type, cls), offset + 4
+
+
+    def decodeRecord(self, offset, message):
+        """
+        Decode the header of the resource record encoded at C{offset}.
+
+        If the record data can be decoded in place, it is checked now but not
+        decoded until the C{payload} of the result is first accessed;
+        otherwise it is decoded now.  Either way a malformed record is
+        reported here, while the message is decoded.
+
+        @param message: The L{Message} the record belongs to.
+
+        @return: A L{tuple} of a L{_LazyRRHeader}, or C{None} if
+            C{message} ignores the record type, and the offset of the next
+            record.
+
+        @raise EOFError: If the record runs past the end of the message.
+
+        @raise ValueError: If a name in the record contains a compression
+            loop.
+        """
+        name, offset = self.decodeName(offset)
+        rdata = offset + 10
+        if rdata > len(self.data):
+            raise EOFError()
+        type, cls, ttl, rdlength = self._rr.unpack_from(self.data, offset)
+        end = rdata + rdlength
+        if end > len(self.data):
+            raise EOFError()
+        recordType = message.lookupRecordType(type)
+        if not recordType:
+            return None, end
+        header = _LazyRRHeader(name, type, cls, ttl, auth=message.auth)
+        if self._checkInPlace(recordType, rdata, rdlength):
+            header._pending = (self, recordType, rdata, rdlength)
+        else:
+            header.payload = self.decodePayload(
+                recordType, rdata, rdlength, ttl)
+        header.rdlength = rdlength
+        return header, end
+
+
+    def _checkInPlace(self, recordType, offset, length):
+        """
+        Check that the record data of C{length} bytes encoded at C{offset}
+        can be decoded in place by L{decodePayload}.
+
+        The names it contains are decoded, and so remembered, so that
+        decoding the payload later cannot fail.
+
+        @return: C{True} if the record data can be decoded in place, or
+            C{False} if it must be decoded by the C{decode} method of
+            C{recordType}.
+
+        @raise EOFError: If a name or the fields of the record run past the
+            end of the message.
+
+        @raise ValueError: If a name contains a compression loop.
+        """
+        if recordType is Record_A:
+            return length == 4
+        elif recordType is Record_AAAA:
+            return length == 16
+        elif recordType in self._simpleRecordTypes:
+            self.decodeName(offset)
+        elif recordType is Record_MX:
+            if length < 3:
+                return False
+            self.decodeName(offset + 2)
+        elif recordType is Record_SOA:
+            offset = self.decodeName(offset)[1]
+            offset = self.decodeName(offset)[1]
+            if offset + 20 > len(self.data):
+                raise EOFError()
+        elif recordType is not UnknownRecord:
+            return False
+        return True
+
+
+    def decodePayload(self, recordType, offset, length, ttl):
+        """
+        Decode the record data of C{length} bytes encoded at C{offset} into a
+        new C{recordType} instance.
+
+        Common record types which L{_checkInPlace} accepts are decoded in
+        place; any other type is decoded by its own C{decode} method from a
+        file positioned at C{offset}.
+
+        @return: An instance of C{recordType}.
+        """
+        payload = recordType(ttl=ttl)
+        data = self.data
+        if recordType is Record_A and length == 4:
+            payload.address = data[offset:offset + 4]
+        elif recordType is Record_AAAA and length == 16:
+            payload.address = data[offset:offset + 16]
+        elif recordType in self._simpleRecordTypes:
+            payload.name = Name(self.decodeName(offset)[0])
+        elif recordType is Record_MX and length >= 3:
+            payload.preference = self._preference.unpack_from(data, offset)[0]
+            payload.name = Name(self.decodeName(offset + 2)[0])
+        elif recordType is Record_SOA:
+            mname, offset = self.decodeName(offset)
+            rname, offset = self.decodeName(offset)
+            if offset + 20 > len(data):
+                raise EOFError()
+            payload.mname, payload.rname = Name(mname), Name(rname)
+            (payload.serial, payload.refresh, payload.retry, payload.expire,
+             payload.minimum) = self._soa.unpack_from(data, offset)
+        elif recordType is UnknownRecord:
+            payload.data = data[offset:offset + length]
+        else:
+            strio = BytesIO(data)
+            strio.seek(offset)
+            payload.decode(strio, length)
+        return payload
+
+
+    _simpleRecordTypes = frozenset([
+        Record_NS, Record_MD, Record_MF, Record_CNAME, Record_MB, Record_MG,
+        Record_MR, Record_PTR, Record_DNAME])
+
+
+
+class _LazyRRHeader(RRHeader, object):
+    """
+    An L{RRHeader} decoded by L{_MessageDecoder} whose payload is only decoded
+    the first time it is accessed.
+
+    @ivar _pending: C{None} once the payload has been decoded or assigned,
+        otherwise a L{tuple} of the L{_MessageDecoder}, the record class and
+        the offset and length of the record data, which has already been
+        checked by L{_MessageDecoder._checkInPlace}.
+    """
+    _pending = None
+    _payload = None
+
+    def _getPayload(self):
+        if self._pending is not None:
+            decoder, recordType, offset, length = self._pending
+            self._payload = decoder.decodePayload(
+                recordType, offset, length, self.ttl)
+            self._pending = None
+        return self._payload
+
+
+    def _setPayload(self, payload):
+        self._pending = None
+        self._payload = payload
+
+    payload = property(_getPayload, _setPayload)
 
 
 
@@ -9,6 +9,7 @@ from twisted.names import dns
 from twisted.names import common
 from twisted.names import client
 from twisted.names import resolve
+from twisted.names import authority
 from twisted.names.authority import FileAuthority
 
 from twisted.python import log, failure
@@ -130,9 +131,19 @@ class SecondaryAuthority(FileAuthority):
 
 
     def transfer(self):
+        """
+        Update the zone from the primary.
+
+        Once a zone has been transferred, only the differences since then are
+        requested (RFC 1995), falling back to transferring the whole zone if
+        the primary cannot provide them.
+
+        @return: A L{Deferred} which fires when the transfer is complete, or
+            C{None} if a transfer is already in progress.
+        """
         if self.transferring:
             return
-        self.transfering = True
+        self.transferring = True
 
         reactor = self._reactor
         if reactor is None:
@@ -140,10 +151,40 @@ class SecondaryAuthority(FileAuthority):
 
         resolver = client.Resolver(
             servers=[(self.primary, self._port)], reactor=reactor)
-        return resolver.lookupZone(self.domain
-            ).addCallback(self._cbZone
-            ).addErrback(self._ebZone
-            )
+        if self.soa is not None and self.records is not None:
+            d = resolver.lookupIncrementalZone(self.domain, self.soa[1])
+            d.addCallbacks(
+                self._cbIncrementalZone, self._ebIncrementalZone,
+                callbackArgs=(resolver,), errbackArgs=(resolver,))
+        else:
+            d = resolver.lookupZone(self.domain).addCallback(self._cbZone)
+        d.addErrback(self._ebZone)
+        d.addBoth(self._transferDone)
+        return d
+
+
+    def _transferDone(self, result):
+        self.transferring = False
+        return result
+
+
+    def notify(self, soa=None):
+        """
+        Handle a I{NOTIFY} (RFC 1996) from the primary by transferring the
+        zone now rather than when it is next polled.
+
+        @param soa: The L{dns.Record_SOA} included in the I{NOTIFY}, if any.
+            No transfer is made if its serial number is that of the current
+            version of the zone.
+        @type soa: L{dns.Record_SOA} or C{None}
+
+        @return: The L{Deferred} returned by L{transfer}, or C{None} if no
+            transfer was started.
+        """
+        if (soa is not None and self.soa is not None
+                and soa.serial == self.soa[1].serial):
+            return
+        return self.transfer()
 
 
     def _lookup(self, name, cls, type, timeout=None):
@@ -155,11 +196,109 @@ class SecondaryAuthority(FileAuthority):
     def _cbZone(self, zone):
         ans, _, _ = zone
         self.records = r = {}
+        self.soa = None
         for rec in ans:
             if not self.soa and rec.type == dns.SOA:
                 self.soa = (str(rec.name).lower(), rec.payload)
             else:
                 r.setdefault(str(rec.name).lower(), []).append(rec.payload)
+        authority._zonesChanged()
+
+
+    def _cbIncrementalZone(self, zone, resolver):
+        """
+        Apply the response to an incremental zone transfer.
+
+        If the differences cannot be applied to the current records, transfer
+        the whole zone instead.
+        """
+        ans, _, _ = zone
+        if len(ans) > 1 and ans[1].type != dns.SOA:
+            # The primary sent the whole zone.  RFC 1995, section 4.
+            return self._cbZone(zone)
+        try:
+            self._applyDifferences(ans)
+        except ValueError as e:
+            log.msg("Incremental transfer of %s from %s could not be "
+                    "applied (%s), transferring the whole zone" % (
+                        self.domain, self.primary, e))
+            return resolver.lookupZone(self.domain).addCallback(self._cbZone)
+
+
+    def _ebIncrementalZone(self, reason, resolver):
+        """
+        Transfer the whole zone after an incremental zone transfer failed.
+        """
+        log.msg("Incremental transfer of %s from %s failed (%s), "
+                "transferring the whole zone" % (
+                    self.domain, self.primary, reason.getErrorMessage()))
+        return resolver.lookupZone(self.domain).addCallback(self._cbZone)
+
+
+    def _applyDifferences(self, records):
+        """
+        Apply the differences in an incremental zone transfer response.
+
+        The records of the zone are copied and only the names which change
+        are given new lists of records, so that only those are indexed again.
+
+        @param records: The L{dns.RRHeader}s of the response: the I{SOA} record
+            of the new version, then for each difference the I{SOA} record of
+            the old version, the deleted records, the I{SOA} record of the
+            newer version and the added records, and then the I{SOA} record of
+            the new version again.
+
+        @raise ValueError: If the differences do not start from the current
+            version of the zone or delete records which are not in it.
+        """
+        newSOA = records[0].payload
+        serial = self.soa[1].serial
+        if len(records) == 1:
+            if newSOA.serial != serial:
+                raise ValueError("zone serial changed to %d without "
+                                 "differences" % (newSOA.serial,))
+            return
+
+        zone = dict(self.records)
+        changed = {}
+        def recordsOf(name):
+            if name not in changed:
+                changed[name] = zone[name] = list(zone.get(name, ()))
+            return changed[name]
+
+        deleting = False
+        for rec in records[1:-1]:
+            if rec.type == dns.SOA:
+                if deleting:
+                    serial = rec.payload.serial
+                elif rec.payload.serial != serial:
+                    raise ValueError("difference from serial %d applied to "
+                                     "serial %d" % (rec.payload.serial, serial))
+                deleting = not deleting
+            elif deleting:
+                existing = recordsOf(str(rec.name).lower())
+                if rec.payload not in existing:
+                    raise ValueError("deleted record %r is not in the "
+                                     "zone" % (rec,))
+                existing.remove(rec.payload)
+            else:
+                recordsOf(str(rec.name).lower()).append(rec.payload)
+        if deleting or serial != newSOA.serial:
+            raise ValueError("differences end at serial %d, not %d" % (
+                    serial, newSOA.serial))
+
+        # The SOA records delimiting differences stand for the SOA record of
+        # the zone itself.
+        apex = recordsOf(self.soa[0])
+        apex[:] = [rec for rec in apex if rec.TYPE != dns.SOA]
+        apex.append(newSOA)
+        for (name, nameRecords) in changed.iteritems():
+            if not nameRecords:
+                del zone[name]
+
+        self.soa = (self.soa[0], newSOA)
+        self.records = zone
+        authority._zonesChanged()
 
 
     def _ebZone(self, failure):
@@ -176,6 +315,6 @@ class SecondaryAuthority(FileAuthority):
 
 
     def _ebTransferred(self, failure):
-        self.transferred = False
+        self.transferring = False
         log.msg("Transferring %s from %s failed after zone transfer" % (self.domain, self.primary))
         log.err(failure)
@@ -17,10 +17,13 @@ for resolvers to deal with.  Fix it.
 @author: Jp Calderone
 """
 
+import struct
 import time
+from collections import OrderedDict
 
-from twisted.internet import protocol
-from twisted.names import dns, resolve
+from twisted.internet import protocol, defer
+from twisted.names import dns, resolve, authority, secondary
+from twisted.names.error import DNSNameError
 from twisted.python import log
 
 
@@ -31,7 +34,9 @@ class DNSServerFactory(protocol.ServerFactory):
 
     @ivar cache: A L{Cache<twisted.names.cache.Cache>} instance whose
         C{cacheResult} method is called when a response is received from one of
-        C{clients}. Defaults to L{None} if no caches are specified. See
+        C{clients}, and whose C{cacheNameError} method, if it has one, is called
+        when one of C{clients} receives an I{NXDOMAIN} response. Defaults to
+        L{None} if no caches are specified. See
         C{caches} of L{__init__} for more details.
     @type cache: L{Cache<twisted.names.cache.Cache} or L{None}
 
@@ -59,10 +64,30 @@ class DNSServerFactory(protocol.ServerFactory):
     @ivar _messageFactory: A response message constructor with an initializer
          signature matching L{dns.Message.__init__}.
     @type _messageFactory: C{callable}
+
+    @ivar responseCacheSize: The maximum number of encoded responses kept by a
+        purely authoritative server, one whose resolvers are all
+        L{authority.FileAuthority} instances.  Such a server answers a query
+        it has already answered by copying the encoded response and patching
+        its message ID, until the zones of any L{authority.FileAuthority} are
+        loaded again.  When it is full, the least recently used response is
+        discarded.  C{0} disables this cache.
+    @type responseCacheSize: L{int}
+
+    @ivar _responseCache: An L{OrderedDict} mapping the key returned by
+        L{_responseCacheKey} to encoded responses, from the least to the most
+        recently used, or L{None} if responses are not cached.
+
+    @ivar _responseCacheGeneration: The value of
+        L{authority._zoneGeneration} when the responses in C{_responseCache}
+        were encoded.
     """
 
     protocol = dns.DNSProtocol
     cache = None
+    responseCacheSize = 10000
+    _responseCache = None
+    _responseCacheGeneration = None
     _messageFactory = dns.Message
 
 
@@ -101,6 +126,13 @@ class DNSServerFactory(protocol.ServerFactory):
             self.cache = caches[-1]
         self.connections = []
 
+        if resolvers and self.responseCacheSize:
+            for resolver in resolvers:
+                if not isinstance(resolver, authority.FileAuthority):
+                    break
+            else:
+                self._responseCache = OrderedDict()
+
 
     def _verboseLog(self, *args, **kwargs):
         """
@@ -260,6 +292,76 @@ class DNSServerFactory(protocol.ServerFactory):
         return response
 
 
+    def _responseCacheKey(self, message):
+        """
+        Get the key of the response to C{message} in C{_responseCache}: the
+        fields of the query which determine the response, apart from its ID.
+
+        @param message: A query message.
+        @type message: L{dns.Message}
+
+        @return: A hashable key, or L{None} if the response to C{message} must
+            not be cached.
+        """
+        if self._responseCache is None or len(message.queries) != 1:
+            return None
+        if self._responseCacheGeneration != authority._zoneGeneration:
+            self._responseCache.clear()
+            self._responseCacheGeneration = authority._zoneGeneration
+        query = message.queries[0]
+        return (query.name.name, query.type, query.cls, message.recDes,
+                message.maxSize)
+
+
+    def _cacheResponse(self, key, response):
+        """
+        Encode C{response} and keep it for future queries with the same key,
+        unless it had to be truncated.
+
+        @param key: The key returned by L{_responseCacheKey}.
+
+        @param response: A response message.
+        @type response: L{dns.Message}
+
+        @return: C{response} in its encoded form, to be sent in its place so
+            that it is not encoded again.
+        @rtype: L{_EncodedMessage}
+        """
+        encoded = response.toStr()
+        if not response.trunc:
+            cache = self._responseCache
+            if len(cache) >= self.responseCacheSize:
+                cache.popitem(last=False)
+            cache[key] = encoded
+        return _EncodedMessage(encoded, response)
+
+
+    def _sendCachedReply(self, protocol, message, encoded, address):
+        """
+        Send a cached response, patched with the ID of C{message}.
+
+        @param protocol: The DNS protocol instance to which to send the
+            response.
+        @type protocol: L{dns.DNSDatagramProtocol} or L{dns.DNSProtocol}
+
+        @param message: The query message.
+        @type message: L{dns.Message}
+
+        @param encoded: The encoded response to a query like C{message}.
+        @type encoded: L{bytes}
+
+        @param address: The address to which the response will be sent or
+            L{None} if C{protocol} is a stream protocol.
+        @type address: L{tuple} or L{None}
+        """
+        response = _EncodedMessage(struct.pack('!H', message.id) + encoded[2:])
+        if address is None:
+            protocol.writeMessage(response)
+        else:
+            protocol.writeMessage(response, address)
+        self._verboseLog("Replied from the response cache")
+
+
     def gotResolverResponse(self, (ans, auth, add), protocol, message, address):
         """
         A callback used by L{DNSServerFactory.handleQuery} for handling the
@@ -298,6 +400,9 @@ class DNSServerFactory(protocol.ServerFactory):
         response = self._responseFromMessage(
             message=message, rCode=dns.OK,
             answers=ans, authority=auth, additional=add)
+        key = self._responseCacheKey(message)
+        if key is not None:
+            response = self._cacheResponse(key, response)
         self.sendReply(protocol, response, address)
 
         l = len(ans) + len(auth) + len(add)
@@ -346,6 +451,16 @@ class DNSServerFactory(protocol.ServerFactory):
         self.sendReply(protocol, response, address)
         self._verboseLog("Lookup failed")
 
+        if self.cache and failure.check(DNSNameError):
+            # The resolver received an NXDOMAIN response, which is kept by
+            # the cache if it includes an SOA record (RFC 2308).
+            cacheNameError = getattr(self.cache, 'cacheNameError', None)
+            nameErrorMessage = (failure.value.args or [None])[0]
+            if (cacheNameError is not None and
+                    isinstance(nameErrorMessage, dns.Message)):
+                cacheNameError(
+                    message.queries[0], nameErrorMessage.authority)
+
 
     def handleQuery(self, message, protocol, address):
         """
@@ -380,6 +495,14 @@ class DNSServerFactory(protocol.ServerFactory):
             the first query in C{message}.
         @rtype: L{Deferred<twisted.internet.defer.Deferred>}
         """
+        key = self._responseCacheKey(message)
+        if key is not None:
+            encoded = self._responseCache.pop(key, None)
+            if encoded is not None:
+                self._responseCache[key] = encoded
+                self._sendCachedReply(protocol, message, encoded, address)
+                return defer.succeed(None)
+
         query = message.queries[0]
 
         return self.resolver.query(query).addCallback(
@@ -450,7 +573,11 @@ class DNSServerFactory(protocol.ServerFactory):
         Called by L{DNSServerFactory.messageReceived} when a notify message is
         received.
 
-        Replies with a I{Not Implemented} error by default.
+        If the message is from the primary of a zone served by a
+        L{secondary.SecondaryAuthority} of this factory, the zone is
+        transferred without waiting for it to be polled, and the message is
+        acknowledged (RFC 1996).  Otherwise replies with a I{Not Implemented}
+        error.
 
         An error message will be logged if C{DNSServerFactory.verbose} is C{>1}.
 
@@ -468,11 +595,55 @@ class DNSServerFactory(protocol.ServerFactory):
             or L{None} if C{protocol} is a stream protocol.
         @type address: L{tuple} or L{None}
         """
-        message.rCode = dns.ENOTIMP
-        self.sendReply(protocol, message, address)
+        notified = False
+        if address is None:
+            transport = getattr(protocol, 'transport', None)
+            if transport is None:
+                peer = None
+            else:
+                peer = transport.getPeer().host
+        else:
+            peer = address[0]
+        if message.queries and peer is not None:
+            name = message.queries[0].name.name.lower()
+            soa = None
+            for record in message.answers:
+                if record.type == dns.SOA:
+                    soa = record.payload
+            for zone in self._secondaryAuthorities(self.resolver.resolvers):
+                if (zone.domain is not None and zone.domain.lower() == name
+                        and peer == zone.primary):
+                    zone.notify(soa)
+                    notified = True
+
+        if notified:
+            response = self._responseFromMessage(message=message)
+            response.opCode = dns.OP_NOTIFY
+            response.auth = True
+            self.sendReply(protocol, response, address)
+        else:
+            message.rCode = dns.ENOTIMP
+            self.sendReply(protocol, message, address)
         self._verboseLog("Notify message from %r" % (address,))
 
 
+    def _secondaryAuthorities(self, resolvers):
+        """
+        Find the L{secondary.SecondaryAuthority} instances among C{resolvers},
+        including those inside L{resolve.ResolverChain}s.
+
+        @param resolvers: A L{list} of L{IResolver} providers.
+
+        @return: An iterator of L{secondary.SecondaryAuthority} instances.
+        """
+        for resolver in resolvers:
+            if isinstance(resolver, secondary.SecondaryAuthority):
+                yield resolver
+            elif isinstance(resolver, resolve.ResolverChain):
+                for zone in self._secondaryAuthorities(resolver.resolvers):
+                    yield zone
+
+
     def handleOther(self, message, protocol, address):
         """
         Called by L{DNSServerFactory.messageReceived} when a message with
@@ -592,3 +763,38 @@ class DNSServerFactory(protocol.ServerFactory):
         @rtype: L{bool}
         """
         return len(message.queries)
+
+
+
+class _EncodedMessage(object):
+    """
+    A response which has already been encoded, given to the C{writeMessage}
+    method of L{dns.DNSDatagramProtocol} and L{dns.DNSProtocol} in place of a
+    L{dns.Message}.
+
+    Other attributes are looked up on the message which was encoded, if any,
+    so that it can also be logged by L{DNSServerFactory.sendReply}.
+
+    @ivar _encoded: The encoded message.
+    @type _encoded: L{bytes}
+
+    @ivar _message: The message which was encoded, or L{None}.
+    @type _message: L{dns.Message}
+    """
+    def __init__(self, encoded, message=None):
+        self._encoded = encoded
+        self._message = message
+
+
+    def __getattr__(self, name):
+        if self._message is None:
+            raise AttributeError(name)
+        return getattr(self._message, name)
+
+
+    def toStr(self):
+        """
+        @return: The encoded message.
+        @rtype: L{bytes}
+        """
+        return self._encoded
@@ -23,6 +23,12 @@ class Options(usage.Options):
         ["resolv-conf", None, None,
             "Override location of resolv.conf (implies --recursive)"],
         ["hosts-file", None, None, "Perform lookups with a hosts file"],
+        ["prefetch", None, None,
+            "Refresh cached records looked up when less than this fraction "
+            "of their TTL remains (implies --cache)"],
+        ["serve-stale", None, None,
+            "Answer with expired cached records for up to this many seconds "
+            "while they are refreshed (implies --cache)"],
     ]
 
     optFlags = [
@@ -111,6 +117,25 @@ class Options(usage.Options):
         except ValueError:
             raise usage.UsageError("Invalid port: %r" % (self['port'],))
 
+        if self['prefetch'] is not None:
+            try:
+                self['prefetch'] = float(self['prefetch'])
+            except ValueError:
+                self['prefetch'] = None
+            if self['prefetch'] is None or not 0 < self['prefetch'] < 1:
+                raise usage.UsageError(
+                    "--prefetch must be a fraction between 0 and 1")
+            self['cache'] = True
+        if self['serve-stale'] is not None:
+            try:
+                self['serve-stale'] = int(self['serve-stale'])
+            except ValueError:
+                self['serve-stale'] = -1
+            if self['serve-stale'] < 0:
+                raise usage.UsageError(
+                    "--serve-stale must be a number of seconds")
+            self['cache'] = True
+
 
 def _buildResolvers(config):
     """
@@ -123,15 +148,21 @@ def _buildResolvers(config):
     @return: Two-item tuple of a list of cache resovers and a list of client
         resolvers
     """
-    from twisted.names import client, cache, hosts
+    from twisted.names import client, cache, hosts, resolve
 
     ca, cl = [], []
-    if config['cache']:
-        ca.append(cache.CacheResolver(verbose=config['verbose']))
     if config['hosts-file']:
         cl.append(hosts.Resolver(file=config['hosts-file']))
     if config['recursive']:
         cl.append(client.createResolver(resolvconf=config['resolv-conf']))
+    if config['cache']:
+        upstream = None
+        if cl:
+            upstream = resolve.ResolverChain(cl)
+        ca.append(cache.CacheResolver(
+                verbose=config['verbose'], upstream=upstream,
+                prefetch=config['prefetch'] or 0,
+                serveStale=config['serve-stale'] or 0))
     return ca, cl
 
 
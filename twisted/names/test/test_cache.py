@@ -13,8 +13,8 @@ from zope.interface.verify import verifyClass
 
 from twisted.trial import unittest
 
-from twisted.names import dns, cache
-from twisted.internet import task, interfaces
+from twisted.names import dns, cache, error
+from twisted.internet import defer, task, interfaces
 
 
 class Caching(unittest.TestCase):
@@ -142,3 +142,358 @@ class Caching(unittest.TestCase):
 
         return self.assertFailure(
             c.lookupAddress(b"example.com"), dns.DomainError)
+
+
+    def test_hitSharesRecords(self):
+        """
+        Lookups made during the same second return the same L{dns.RRHeader}
+        instances, with their TTLs adjusted once, in new lists.
+        """
+        clock = task.Clock()
+        c = cache.CacheResolver(reactor=clock)
+        c.cacheResult(
+            dns.Query(name=b"example.com", type=dns.A, cls=dns.IN),
+            ([dns.RRHeader(b"example.com", dns.A, dns.IN, 60,
+                           dns.Record_A("127.0.0.1", 60))], [], []))
+        clock.advance(1.5)
+
+        results = []
+        c.lookupAddress(b"example.com").addCallback(results.append)
+        clock.advance(0.4)
+        c.lookupAddress(b"example.com").addCallback(results.append)
+        first, second = results
+        self.assertEqual(first[0][0].ttl, 59)
+        self.assertIs(first[0][0], second[0][0])
+        self.assertIsNot(first[0], second[0])
+
+
+    def test_counters(self):
+        """
+        L{cache.CacheResolver.hits} and L{cache.CacheResolver.misses} count
+        the lookups which were and were not answered from the cache.
+        """
+        clock = task.Clock()
+        c = cache.CacheResolver(reactor=clock)
+        c.cacheResult(
+            dns.Query(name=b"example.com", type=dns.A, cls=dns.IN),
+            ([dns.RRHeader(b"example.com", dns.A, dns.IN, 60,
+                           dns.Record_A("127.0.0.1", 60))], [], []))
+        c.lookupAddress(b"example.com")
+        c.lookupAddress(b"example.com")
+        self.failureResultOf(
+            c.lookupAddress(b"example.org"), dns.DomainError)
+        self.assertEqual((c.hits, c.misses, c.evictions), (2, 1, 0))
+
+
+
+class BoundedCacheTests(unittest.TestCase):
+    """
+    Tests for the size limits and the expiration of L{cache.CacheResolver}.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+
+
+    def _query(self, name):
+        return dns.Query(name=name, type=dns.A, cls=dns.IN)
+
+
+    def _payload(self, name, ttl=60, count=1):
+        return ([dns.RRHeader(name, dns.A, dns.IN, ttl,
+                              dns.Record_A("127.0.0.%d" % (i,), ttl))
+                 for i in range(count)], [], [])
+
+
+    def test_maxEntries(self):
+        """
+        When the cache holds C{maxEntries} responses, adding a new one evicts
+        the least recently used one.
+        """
+        c = cache.CacheResolver(reactor=self.clock, maxEntries=2)
+        c.cacheResult(self._query(b"a.example"), self._payload(b"a.example"))
+        c.cacheResult(self._query(b"b.example"), self._payload(b"b.example"))
+        c.lookupAddress(b"a.example")
+        c.cacheResult(self._query(b"c.example"), self._payload(b"c.example"))
+        self.assertEqual(
+            list(c.cache),
+            [self._query(b"a.example"), self._query(b"c.example")])
+        self.assertEqual(c.evictions, 1)
+
+
+    def test_expirationsBounded(self):
+        """
+        The heap of expiration times holds at most about twice as many
+        entries as the cache, however many long lived responses are evicted
+        from it.
+        """
+        c = cache.CacheResolver(reactor=self.clock, maxEntries=10)
+        for i in range(1000):
+            name = b"host%d.example" % (i,)
+            c.cacheResult(self._query(name), self._payload(name, ttl=86400))
+        self.assertEqual(len(c.cache), 10)
+        self.assertTrue(len(c._expirations) <= 2 * 10 + 16)
+        self.assertTrue(set(c.cache) <= set(
+                [query for (removal, serial, query) in c._expirations]))
+
+
+    def test_maxRecords(self):
+        """
+        The least recently used responses are evicted to keep the total number
+        of cached records at most C{maxRecords}, and a response with more
+        records than that is not cached.
+        """
+        c = cache.CacheResolver(reactor=self.clock, maxRecords=5)
+        c.cacheResult(self._query(b"a.example"),
+                      self._payload(b"a.example", count=3))
+        c.cacheResult(self._query(b"b.example"),
+                      self._payload(b"b.example", count=2))
+        c.cacheResult(self._query(b"c.example"),
+                      self._payload(b"c.example", count=2))
+        self.assertEqual(
+            list(c.cache),
+            [self._query(b"b.example"), self._query(b"c.example")])
+        c.cacheResult(self._query(b"d.example"),
+                      self._payload(b"d.example", count=6))
+        self.assertNotIn(self._query(b"d.example"), c.cache)
+        self.assertEqual(c.evictions, 1)
+
+
+    def test_replace(self):
+        """
+        Caching a new response for a query replaces the previous one, which
+        does not cause the new one to be removed when it expires.
+        """
+        c = cache.CacheResolver(reactor=self.clock, maxRecords=3)
+        query = self._query(b"a.example")
+        c.cacheResult(query, self._payload(b"a.example", ttl=10, count=2))
+        c.cacheResult(query, self._payload(b"a.example", ttl=20, count=3))
+        self.assertEqual(c.evictions, 0)
+        self.clock.advance(10)
+        self.assertIn(query, c.cache)
+        self.clock.advance(10)
+        self.assertNotIn(query, c.cache)
+
+
+    def test_singleDelayedCall(self):
+        """
+        However many responses are cached, expiration uses a single delayed
+        call, for the earliest expiration time.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        for i, ttl in enumerate([30, 10, 20, 10]):
+            name = b"host" + str(i).encode("ascii")
+            c.cacheResult(self._query(name), self._payload(name, ttl=ttl))
+        self.assertEqual(len(self.clock.calls), 1)
+        self.assertEqual(self.clock.calls[0].getTime(), 10)
+
+        self.clock.advance(10)
+        self.assertEqual(len(c.cache), 2)
+        self.assertEqual(self.clock.calls[0].getTime(), 20)
+        self.clock.advance(20)
+        self.assertEqual(len(c.cache), 0)
+        self.assertEqual(self.clock.calls, [])
+
+
+    def _soa(self, ttl=600, minimum=300):
+        return dns.RRHeader(
+            b"example.com", dns.SOA, dns.IN, ttl,
+            dns.Record_SOA(b"ns1.example.com", b"root.example.com",
+                           minimum=minimum, ttl=ttl))
+
+
+    def test_noData(self):
+        """
+        A response without answers whose authority section includes an I{SOA}
+        record is cached for the minimum of the I{SOA} TTL and its I{MINIMUM}
+        field, and returned with the I{SOA} TTL adjusted accordingly.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        query = dns.Query(name=b"example.com", type=dns.MX, cls=dns.IN)
+        c.cacheResult(query, ([], [self._soa(ttl=600, minimum=300)], []))
+        self.clock.advance(100)
+        ans, auth, add = self.successResultOf(
+            c.lookupMailExchange(b"example.com"))
+        self.assertEqual((ans, add), ([], []))
+        self.assertEqual([r.ttl for r in auth], [200])
+        self.clock.advance(200)
+        self.assertNotIn(query, c.cache)
+
+
+    def test_nameError(self):
+        """
+        L{cache.CacheResolver.cacheNameError} caches an I{NXDOMAIN} response,
+        and lookups fail with L{error.AuthoritativeDomainError} until it
+        expires.
+        """
+        c = cache.CacheResolver(reactor=self.clock, maxNegativeTTL=60)
+        c.cacheNameError(self._query(b"example.com"), [self._soa()])
+        self.clock.advance(59)
+        self.failureResultOf(
+            c.lookupAddress(b"example.com"), error.AuthoritativeDomainError)
+        self.clock.advance(1)
+        self.failureResultOf(c.lookupAddress(b"example.com"), dns.DomainError)
+
+
+    def test_nameErrorWithoutSOA(self):
+        """
+        An I{NXDOMAIN} response without an I{SOA} record is not cached.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        c.cacheNameError(self._query(b"example.com"), [])
+        self.assertEqual(len(c.cache), 0)
+
+
+    def test_pickle(self):
+        """
+        A pickled L{cache.CacheResolver} keeps its positive responses, which
+        are scheduled to expire when it is unpickled.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        c.cacheResult(self._query(b"a.example"), self._payload(b"a.example"))
+        c.cacheNameError(self._query(b"b.example"), [self._soa()])
+        state = c.__getstate__()
+        self.assertEqual(self.clock.calls, [])
+
+        restored = cache.CacheResolver(reactor=self.clock)
+        restored.__setstate__(state)
+        self.assertEqual(list(restored.cache), [self._query(b"a.example")])
+        self.clock.advance(60)
+        self.assertEqual(len(restored.cache), 0)
+
+
+
+class FakeUpstream(object):
+    """
+    A fake L{interfaces.IResolver} which records its queries.
+
+    @ivar queries: A C{list} of C{(query, Deferred)} tuples, one for each
+        call to L{query}.
+    """
+    def __init__(self):
+        self.queries = []
+
+
+    def query(self, query, timeout=None):
+        d = defer.Deferred()
+        self.queries.append((query, d))
+        return d
+
+
+
+class RefreshTests(unittest.TestCase):
+    """
+    Tests for the prefetching and serve-stale behaviour of
+    L{cache.CacheResolver}.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.upstream = FakeUpstream()
+        self.query = dns.Query(name=b"example.com", type=dns.A, cls=dns.IN)
+
+
+    def _payload(self, address="127.0.0.1", ttl=100):
+        return ([dns.RRHeader(b"example.com", dns.A, dns.IN, ttl,
+                              dns.Record_A(address, ttl))], [], [])
+
+
+    def test_prefetch(self):
+        """
+        A lookup made when less than C{prefetch} of the TTL of a response
+        remains is answered from the cache and queries C{upstream}, whose
+        response replaces the cached one.
+        """
+        c = cache.CacheResolver(
+            reactor=self.clock, upstream=self.upstream, prefetch=0.1)
+        c.cacheResult(self.query, self._payload())
+        self.clock.advance(85)
+        self.successResultOf(c.lookupAddress(b"example.com"))
+        self.assertEqual(self.upstream.queries, [])
+
+        self.clock.advance(6)
+        ans, auth, add = self.successResultOf(c.lookupAddress(b"example.com"))
+        self.assertEqual(ans[0].ttl, 9)
+        c.lookupAddress(b"example.com")
+        self.assertEqual(len(self.upstream.queries), 1)
+        self.assertEqual(c.refreshes, 1)
+
+        query, d = self.upstream.queries[0]
+        self.assertEqual(query, self.query)
+        d.callback(self._payload("127.0.0.2"))
+        self.clock.advance(50)
+        ans, auth, add = self.successResultOf(c.lookupAddress(b"example.com"))
+        self.assertEqual(ans[0].payload.dottedQuad(), "127.0.0.2")
+        self.assertEqual(ans[0].ttl, 50)
+
+
+    def test_prefetchDisabled(self):
+        """
+        Without C{prefetch}, lookups never query C{upstream}.
+        """
+        c = cache.CacheResolver(reactor=self.clock, upstream=self.upstream)
+        c.cacheResult(self.query, self._payload())
+        self.clock.advance(99)
+        self.successResultOf(c.lookupAddress(b"example.com"))
+        self.assertEqual(self.upstream.queries, [])
+
+
+    def test_serveStale(self):
+        """
+        With C{serveStale}, a lookup of a response which expired less than
+        C{serveStale} seconds ago is answered with its records, with a TTL of
+        C{staleTTL}, and queries C{upstream}.
+        """
+        c = cache.CacheResolver(
+            reactor=self.clock, upstream=self.upstream, serveStale=600)
+        c.cacheResult(self.query, self._payload())
+        self.clock.advance(300)
+        ans, auth, add = self.successResultOf(c.lookupAddress(b"example.com"))
+        self.assertEqual(ans[0].ttl, c.staleTTL)
+        self.assertEqual(c.staleHits, 1)
+        self.assertEqual(len(self.upstream.queries), 1)
+
+        # The refresh fails: the stale records are still served, and
+        # another refresh is attempted.
+        self.upstream.queries[0][1].errback(defer.TimeoutError())
+        self.successResultOf(c.lookupAddress(b"example.com"))
+        self.assertEqual(len(self.upstream.queries), 2)
+
+        self.clock.advance(400)
+        self.assertNotIn(self.query, c.cache)
+        self.failureResultOf(c.lookupAddress(b"example.com"), dns.DomainError)
+
+
+    def test_staleNotRecached(self):
+        """
+        Stale records given back to L{cache.CacheResolver.cacheResult}, as
+        L{twisted.names.server.DNSServerFactory} does with the responses of
+        its resolvers, do not replace the expired response.
+        """
+        c = cache.CacheResolver(
+            reactor=self.clock, upstream=self.upstream, serveStale=600)
+        c.cacheResult(self.query, self._payload())
+        self.clock.advance(300)
+        result = self.successResultOf(c.lookupAddress(b"example.com"))
+        c.cacheResult(self.query, result)
+        self.clock.advance(350)
+        self.assertEqual(len(c.cache), 1)
+        self.clock.advance(50)
+        self.assertEqual(len(c.cache), 0)
+
+
+    def test_refreshNameError(self):
+        """
+        An I{NXDOMAIN} response to a refresh is cached as a name error.
+        """
+        c = cache.CacheResolver(
+            reactor=self.clock, upstream=self.upstream, serveStale=600)
+        c.cacheResult(self.query, self._payload())
+        self.clock.advance(300)
+        c.lookupAddress(b"example.com")
+        nxdomain = dns.Message(rCode=dns.ENAME)
+        nxdomain.authority = [dns.RRHeader(
+            b"example.com", dns.SOA, dns.IN, 60,
+            dns.Record_SOA(b"ns1.example.com", b"root.example.com",
+                           minimum=60))]
+        self.upstream.queries[0][1].errback(error.DNSNameError(nxdomain))
+        self.failureResultOf(
+            c.lookupAddress(b"example.com"), error.AuthoritativeDomainError)
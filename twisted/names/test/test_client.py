@@ -1192,6 +1192,201 @@ class RetryLogic(unittest.TestCase):
 
 
 
+class ServerStatisticsTests(unittest.TestCase):
+    """
+    Tests for L{client._ServerStatistics}.
+    """
+    def test_unmeasured(self):
+        """
+        A server which has not been measured is expected to answer at once,
+        and is given the longest timeout.
+        """
+        statistics = client._ServerStatistics()
+        self.assertEqual(statistics.expectedLatency(), 0)
+        self.assertEqual(statistics.retransmissionTimeout(0.1, 3), 3)
+
+
+    def test_observe(self):
+        """
+        The first measurement sets the smoothed round trip time and half of it
+        as the deviation; later ones are averaged in.
+        """
+        statistics = client._ServerStatistics()
+        statistics.observe(0.2)
+        self.assertEqual((statistics.srtt, statistics.rttvar), (0.2, 0.1))
+        self.assertAlmostEqual(statistics.retransmissionTimeout(0.1, 3), 0.6)
+        statistics.observe(0.6)
+        self.assertAlmostEqual(statistics.srtt, 0.25)
+        self.assertAlmostEqual(statistics.rttvar, 0.175)
+
+
+    def test_retransmissionTimeoutBounds(self):
+        """
+        L{client._ServerStatistics.retransmissionTimeout} stays between the
+        given bounds.
+        """
+        statistics = client._ServerStatistics()
+        statistics.observe(0.001)
+        self.assertEqual(statistics.retransmissionTimeout(0.1, 3), 0.1)
+        statistics = client._ServerStatistics()
+        statistics.observe(5)
+        self.assertEqual(statistics.retransmissionTimeout(0.1, 3), 3)
+
+
+    def test_decay(self):
+        """
+        L{client._ServerStatistics.decay} reduces the expected latency of a
+        measured server.
+        """
+        statistics = client._ServerStatistics()
+        statistics.decay(0.5)
+        self.assertEqual(statistics.expectedLatency(), 0)
+        statistics.observe(0.4)
+        statistics.decay(0.5)
+        self.assertEqual(statistics.expectedLatency(), 0.2)
+
+
+
+class ServerSelectionTests(unittest.TestCase):
+    """
+    Tests for the choice of servers by measured round trip time in
+    L{client.Resolver}.
+    """
+    servers = [('1.1.1.1', 53), ('2.2.2.2', 53), ('3.3.3.3', 53)]
+
+    def setUp(self):
+        self.clock = Clock()
+        self.protocol = StubDNSDatagramProtocol()
+        self.resolver = client.Resolver(
+            servers=self.servers, reactor=self.clock)
+        self.resolver._connectedProtocol = lambda: self.protocol
+
+
+    def _measure(self, address, rtt):
+        """
+        Answer a query sent to C{address} after C{rtt} seconds.
+        """
+        self.resolver._query(address, [], 10)
+        query = self.protocol.queries.pop()
+        self.clock.advance(rtt)
+        query[-1].callback(dns.Message())
+
+
+    def test_measured(self):
+        """
+        The round trip time of every answered query is recorded for its
+        server, and the timeout of every query which timed out is recorded
+        as its round trip time.
+        """
+        self._measure(self.servers[0], 0.5)
+        d = self.resolver._query(self.servers[1], [], 3)
+        self.protocol.queries.pop()[-1].errback(DNSQueryTimeoutError(0))
+        self.failureResultOf(d, DNSQueryTimeoutError)
+        statistics = self.resolver._statistics
+        self.assertEqual(statistics[self.servers[0]].srtt, 0.5)
+        self.assertEqual(statistics[self.servers[1]].srtt, 3)
+
+
+    def test_fastestFirst(self):
+        """
+        L{client.Resolver.queryUDP} sends a query to the server with the
+        lowest measured round trip time first.
+        """
+        self._measure(self.servers[0], 0.5)
+        self._measure(self.servers[1], 0.3)
+        self._measure(self.servers[2], 0.05)
+        self.resolver.queryUDP([dns.Query(b'example.com')])
+        self.assertEqual(
+            [query[0] for query in self.protocol.queries], [self.servers[2]])
+
+
+    def test_adaptiveTimeout(self):
+        """
+        In the first timeout period, L{client.Resolver.queryUDP} waits for a
+        measured server only as long as its round trip time suggests before
+        trying the next server.  Later periods use the configured timeouts.
+        """
+        self._measure(self.servers[0], 0.05)
+        self._measure(self.servers[1], 0.2)
+        self._measure(self.servers[2], 0.3)
+        self.resolver.queryUDP([dns.Query(b'example.com')], timeout=(1, 3))
+        queries = self.protocol.queries
+        self.assertEqual(queries[0][0], self.servers[0])
+        self.assertAlmostEqual(queries[0][2], 0.15)
+        queries[0][-1].errback(DNSQueryTimeoutError(0))
+        self.assertEqual(queries[1][0], self.servers[1])
+        # Its round trip time decayed when the first server was chosen.
+        self.assertAlmostEqual(queries[1][2], 0.2 * self.resolver.decay + 0.4)
+        queries[1][-1].errback(DNSQueryTimeoutError(0))
+        queries[2][-1].errback(DNSQueryTimeoutError(0))
+        self.assertEqual(queries[3][2], 3)
+
+
+    def test_exploration(self):
+        """
+        Each time a server is chosen, the expected latency of the others
+        decays, so that a server which was once slow is eventually tried
+        again.
+        """
+        self._measure(self.servers[0], 0.01)
+        self._measure(self.servers[1], 0.02)
+        self._measure(self.servers[2], 0.02)
+        picked = [self.resolver.pickServer() for i in range(40)]
+        self.assertEqual(picked[0], self.servers[0])
+        self.assertIn(self.servers[1], picked)
+        self.assertIn(self.servers[2], picked)
+
+
+    def test_pickServerRoundRobin(self):
+        """
+        L{client.Resolver.pickServer} picks servers which have not been
+        measured in turn.
+        """
+        picked = [self.resolver.pickServer() for i in range(3)]
+        self.assertEqual(sorted(picked), sorted(self.servers))
+
+
+    def test_race(self):
+        """
+        If L{client.Resolver.race} is set, L{client.Resolver.queryUDP} sends
+        the query to the two fastest servers at once and uses the first
+        answer.
+        """
+        self.resolver.race = True
+        self._measure(self.servers[0], 0.5)
+        self._measure(self.servers[1], 0.1)
+        self._measure(self.servers[2], 0.2)
+        d = self.resolver.queryUDP([dns.Query(b'example.com')])
+        queries = self.protocol.queries
+        self.assertEqual(
+            [query[0] for query in queries],
+            [self.servers[1], self.servers[2]])
+        answer = dns.Message()
+        queries[1][-1].callback(answer)
+        queries[0][-1].callback(dns.Message())
+        self.assertIs(self.successResultOf(d), answer)
+
+
+    def test_raceBothTimeOut(self):
+        """
+        If neither raced server answers in time, the query is reissued to the
+        remaining servers.
+        """
+        self.resolver.race = True
+        d = self.resolver.queryUDP([dns.Query(b'example.com')])
+        queries = self.protocol.queries
+        self.assertEqual(len(queries), 2)
+        queries[0][-1].errback(DNSQueryTimeoutError(0))
+        self.assertEqual(len(queries), 2)
+        queries[1][-1].errback(DNSQueryTimeoutError(0))
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(queries[2][0], self.servers[2])
+        answer = dns.Message()
+        queries[2][-1].callback(answer)
+        self.assertIs(self.successResultOf(d), answer)
+
+
+
 class ThreadedResolverTests(unittest.TestCase):
     """
     Tests for L{client.ThreadedResolver}.
@@ -11,6 +11,7 @@ from __future__ import division, absolute_import
 from io import BytesIO
 
 import struct
+from random import Random
 
 from zope.interface.verify import verifyClass
 
@@ -867,6 +868,256 @@ class MessageTestCase(unittest.SynchronousTestCase):
 
 
 
+class MessageDecoderTests(unittest.SynchronousTestCase):
+    """
+    Tests for the offset based decoding performed by L{dns.Message.fromStr}.
+    """
+    labels = [b'www', b'mail', b'ns1', b'example', b'twistedmatrix', b'com',
+              b'org', b'x' * 63, b'']
+
+    def randomName(self, random):
+        """
+        Generate a name from a small pool of labels, so that names in one
+        message frequently share suffixes and are compressed.
+        """
+        labels = [random.choice(self.labels[:-1])
+                  for i in range(random.randint(0, 4))]
+        return b'.'.join(labels)
+
+
+    def randomRecord(self, random):
+        """
+        Generate an L{dns.RRHeader} with a random payload.
+        """
+        name = self.randomName
+        ttl = random.randint(0, 2 ** 31)
+        payload = random.choice([
+            lambda: dns.Record_A(
+                '%d.%d.%d.%d' % tuple(random.randint(0, 255)
+                                      for i in range(4)), ttl),
+            lambda: dns.Record_AAAA(
+                '2001:db8::%x' % (random.randint(0, 0xffff),), ttl),
+            lambda: dns.Record_NS(name(random), ttl),
+            lambda: dns.Record_CNAME(name(random), ttl),
+            lambda: dns.Record_PTR(name(random), ttl),
+            lambda: dns.Record_MX(random.randint(0, 65535), name(random), ttl),
+            lambda: dns.Record_SOA(
+                name(random), name(random), random.randint(0, 2 ** 31),
+                random.randint(0, 2 ** 31), random.randint(0, 2 ** 31),
+                random.randint(0, 2 ** 31), random.randint(0, 2 ** 31), ttl),
+            lambda: dns.Record_SRV(
+                random.randint(0, 65535), random.randint(0, 65535),
+                random.randint(0, 65535), name(random), ttl),
+            lambda: dns.Record_TXT(name(random), name(random), ttl=ttl),
+            lambda: dns.Record_HINFO(name(random), name(random), ttl),
+            lambda: dns.UnknownRecord(name(random), ttl),
+            ])()
+        type = getattr(payload, 'TYPE', 4242)
+        return dns.RRHeader(name(random), type, dns.IN, ttl, payload)
+
+
+    def randomMessage(self, random):
+        """
+        Generate a L{dns.Message} with random flags, queries and records.
+        """
+        message = dns.Message(
+            id=random.randint(0, 65535), answer=random.randint(0, 1),
+            auth=random.randint(0, 1), recDes=random.randint(0, 1),
+            rCode=random.randint(0, 15), maxSize=0)
+        for i in range(random.randint(0, 3)):
+            message.addQuery(
+                self.randomName(random), random.choice([dns.A, dns.MX]))
+        for section in (message.answers, message.authority,
+                        message.additional):
+            section.extend(self.randomRecord(random)
+                           for i in range(random.randint(0, 4)))
+        return message
+
+
+    def decodeFromFile(self, data):
+        """
+        Decode C{data} with L{dns.Message.decode}, the file based decoder.
+        """
+        message = dns.Message()
+        message.decode(BytesIO(data))
+        return message
+
+
+    def decodeFromBytes(self, data):
+        """
+        Decode C{data} with L{dns.Message.fromStr}.
+        """
+        message = dns.Message()
+        message.fromStr(data)
+        return message
+
+
+    def test_roundTrip(self):
+        """
+        Randomly generated messages decoded by L{dns.Message.fromStr} are
+        equal to the same messages decoded by L{dns.Message.decode}, and
+        re-encode to the same bytes.
+        """
+        random = Random(1234)
+        for i in range(300):
+            data = self.randomMessage(random).toStr()
+            message = self.decodeFromBytes(data)
+            self.assertEqual(message, self.decodeFromFile(data))
+            self.assertEqual(message.toStr(), data)
+
+
+    def test_truncated(self):
+        """
+        Every prefix of an encoded message decodes with
+        L{dns.Message.fromStr} to the same queries and records as with
+        L{dns.Message.decode}.
+        """
+        random = Random(4321)
+        for i in range(10):
+            data = self.randomMessage(random).toStr()
+            for end in range(dns.Message.headerSize, len(data)):
+                self.assertEqual(self.decodeFromBytes(data[:end]),
+                                 self.decodeFromFile(data[:end]))
+
+
+    def test_truncatedHeader(self):
+        """
+        L{dns.Message.fromStr} raises L{EOFError} if the message is shorter
+        than a header.
+        """
+        self.assertRaises(
+            EOFError, self.decodeFromBytes,
+            b'\x00' * (dns.Message.headerSize - 1))
+
+
+    def test_corrupted(self):
+        """
+        Randomly corrupted messages either fail to decode with
+        L{dns.Message.fromStr}, raising L{EOFError} or L{ValueError}, or
+        decode into records whose payloads can all be accessed.
+        """
+        random = Random(2468)
+        for i in range(300):
+            data = bytearray(self.randomMessage(random).toStr())
+            for j in range(random.randint(1, 4)):
+                data[random.randrange(len(data))] = random.randint(0, 255)
+            data = bytes(data)
+            try:
+                message = self.decodeFromBytes(data)
+            except (EOFError, ValueError):
+                continue
+            for section in (message.answers, message.authority,
+                            message.additional):
+                for record in section:
+                    record.payload
+
+
+    def test_malformedPayload(self):
+        """
+        A record whose data holds a name pointing past the end of the message
+        is not decoded by L{dns.Message.fromStr}, rather than raising when its
+        payload is first accessed.
+        """
+        message = dns.Message()
+        message.answers.append(dns.RRHeader(
+            b'example.com', dns.CNAME, payload=dns.Record_CNAME(b'x')))
+        data = message.toStr()
+        # Replace the one label name of the CNAME with a pointer past the end.
+        data = data[:-3] + b'\xc0\xff\x00'
+        message = self.decodeFromBytes(data)
+        self.assertEqual(message.answers, [])
+
+
+    def test_compressionLoopInPayload(self):
+        """
+        A record whose data holds a name with a compression loop makes
+        L{dns.Message.fromStr} raise L{ValueError}.
+        """
+        message = dns.Message()
+        message.answers.append(dns.RRHeader(
+            b'example.com', dns.NS, payload=dns.Record_NS(b'x')))
+        data = message.toStr()
+        # Replace the one label name of the NS with a pointer to itself.
+        offset = len(data) - 3
+        data = data[:offset] + struct.pack('!HB', 0xc000 | offset, 0)
+        self.assertRaises(ValueError, self.decodeFromBytes, data)
+
+
+    def test_lazyPayload(self):
+        """
+        The payload of a record decoded by L{dns.Message.fromStr} is only
+        decoded when it is first accessed.
+        """
+        response = dns.Message()
+        response.answers.append(dns.RRHeader(
+            b'example.com', dns.MX, payload=dns.Record_MX(10, b'example.com')))
+        message = self.decodeFromBytes(response.toStr())
+        [answer] = message.answers
+        self.assertIsNot(answer._pending, None)
+        self.assertEqual(
+            answer.payload, dns.Record_MX(10, b'example.com', ttl=0))
+        self.assertIs(answer._pending, None)
+        self.assertIs(answer.payload, answer.payload)
+
+
+    def test_assignPayload(self):
+        """
+        Assigning the payload of a record decoded by L{dns.Message.fromStr}
+        replaces the payload which has not been decoded yet.
+        """
+        response = dns.Message()
+        response.answers.append(dns.RRHeader(
+            b'example.com', payload=dns.Record_A('10.0.0.1')))
+        message = self.decodeFromBytes(response.toStr())
+        payload = dns.Record_A('10.0.0.2')
+        message.answers[0].payload = payload
+        self.assertIs(message.answers[0].payload, payload)
+
+
+    def test_ignoredRecordType(self):
+        """
+        Records for which L{dns.Message.lookupRecordType} returns C{None} are
+        skipped by L{dns.Message.fromStr}.
+        """
+        response = dns.Message()
+        response.answers.append(dns.RRHeader(
+            b'example.com', payload=dns.Record_A('10.0.0.1')))
+        response.answers.append(dns.RRHeader(
+            b'example.com', dns.NS, payload=dns.Record_NS(b'example.com')))
+        message = dns.Message()
+        message.lookupRecordType = lambda type: (
+            None if type == dns.A else dns.Record_NS)
+        message.fromStr(response.toStr())
+        self.assertEqual(
+            [r.payload for r in message.answers],
+            [dns.Record_NS(b'example.com', ttl=0)])
+
+
+    def test_compressionPointers(self):
+        """
+        L{dns._MessageDecoder.decodeName} follows compression pointers and
+        remembers every suffix it decodes.
+        """
+        decoder = dns._MessageDecoder(
+            b'\x03foo\x07example\x03com\x00'
+            b'\x03bar\xc0\x04')
+        self.assertEqual(
+            decoder.decodeName(17), (b'bar.example.com', 23))
+        self.assertEqual(decoder.decodeName(4), (b'example.com', 17))
+        self.assertEqual(decoder.decodeName(0), (b'foo.example.com', 17))
+        self.assertEqual(decoder.decodeName(21), (b'example.com', 23))
+
+
+    def test_compressionLoop(self):
+        """
+        L{dns._MessageDecoder.decodeName} raises L{ValueError} if a name
+        contains a compression loop.
+        """
+        decoder = dns._MessageDecoder(b'\x03foo\xc0\x00')
+        self.assertRaises(ValueError, decoder.decodeName, 0)
+
+
+
 class MessageComparisonTests(ComparisonTestsMixin,
                              unittest.SynchronousTestCase):
     """
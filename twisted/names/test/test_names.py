@@ -5,7 +5,7 @@
 Test cases for twisted.names.
 """
 
-import socket, operator, copy
+import os, socket, operator, copy
 from StringIO import StringIO
 from functools import partial, reduce
 from struct import pack
@@ -608,6 +608,249 @@ class AuthorityTests(unittest.TestCase):
 
 
 
+class ZoneIndexTests(unittest.TestCase):
+    """
+    Tests for the wildcard, empty non-terminal and zone cut handling of
+    L{FileAuthority}, which uses a L{authority._ZoneIndex} of its records.
+    """
+    def setUp(self):
+        self.soa = dns.Record_SOA(
+            mname='ns1.example.com', rname='root.example.com', serial=1,
+            minimum=60, expire=120)
+        self.records = {
+            'example.com': [self.soa, dns.Record_NS('ns1.example.com')],
+            'ns1.example.com': [dns.Record_A('10.0.0.1')],
+            'www.example.com': [dns.Record_A('10.0.0.2')],
+            'host.deep.example.com': [dns.Record_A('10.0.0.3')],
+            '*.example.com': [
+                dns.Record_A('10.0.0.4'), dns.Record_MX(10, 'mx.example.com')],
+            'child.example.com': [dns.Record_NS('ns.child.example.com')],
+            'ns.child.example.com': [dns.Record_A('10.0.1.1')],
+            }
+        self.authority = NoFileAuthority(
+            soa=('example.com', self.soa), records=self.records)
+
+
+    def test_exactMatch(self):
+        """
+        Only the records of the queried type are answered for a name which
+        exists.
+        """
+        answer, authority, additional = self.successResultOf(
+            self.authority.lookupAddress('www.example.com'))
+        self.assertEqual(
+            answer, [dns.RRHeader('www.example.com', dns.A, ttl=120,
+                                  payload=dns.Record_A('10.0.0.2'),
+                                  auth=True)])
+
+
+    def test_wildcard(self):
+        """
+        Records for a name which does not exist are synthesised from a
+        wildcard at its closest encloser, owned by the queried name.
+        """
+        answer, authority, additional = self.successResultOf(
+            self.authority.lookupAddress('missing.example.com'))
+        self.assertEqual(
+            answer, [dns.RRHeader('missing.example.com', dns.A, ttl=120,
+                                  payload=dns.Record_A('10.0.0.4'),
+                                  auth=True)])
+
+
+    def test_wildcardNotForExistingName(self):
+        """
+        A wildcard does not supply records for a name which exists but owns no
+        records of the queried type; the response is empty with the I{SOA}
+        record in the authority section.
+        """
+        answer, authority, additional = self.successResultOf(
+            self.authority.lookupMailExchange('www.example.com'))
+        self.assertEqual(answer, [])
+        self.assertEqual(
+            authority, [dns.RRHeader('example.com', dns.SOA, ttl=120,
+                                     payload=self.soa, auth=True)])
+
+
+    def test_emptyNonTerminal(self):
+        """
+        A name which owns no records but has descendants which do exists, so
+        the response is empty rather than a name error and wildcards do not
+        apply to it.
+        """
+        answer, authority, additional = self.successResultOf(
+            self.authority.lookupAddress('deep.example.com'))
+        self.assertEqual(answer, [])
+        self.assertEqual([r.type for r in authority], [dns.SOA])
+
+
+    def test_nameError(self):
+        """
+        A name in the zone which does not exist and is not covered by a
+        wildcard fails with L{dns.AuthoritativeDomainError}.
+        """
+        self.failureResultOf(
+            self.authority.lookupAddress('missing.deep.example.com'),
+            dns.AuthoritativeDomainError)
+
+
+    def test_belowZoneCut(self):
+        """
+        A name below a delegation is answered with a referral to the
+        nameservers of the child zone, including their addresses from the zone.
+        """
+        answer, authority, additional = self.successResultOf(
+            self.authority.lookupAddress('www.child.example.com'))
+        self.assertEqual(answer, [])
+        self.assertEqual(
+            authority,
+            [dns.RRHeader('child.example.com', dns.NS, ttl=120,
+                          payload=dns.Record_NS('ns.child.example.com'),
+                          auth=False)])
+        self.assertEqual(
+            additional,
+            [dns.RRHeader('ns.child.example.com', dns.A, ttl=120,
+                          payload=dns.Record_A('10.0.1.1'), auth=True)])
+
+
+    def test_recordsChanged(self):
+        """
+        Names given new records are indexed again once L{_zonesChanged} has
+        been called.
+        """
+        self.successResultOf(self.authority.lookupAddress('www.example.com'))
+        self.records['www.example.com'] = [dns.Record_A('10.0.0.5')]
+        del self.records['host.deep.example.com']
+        authority._zonesChanged()
+        answer, authority_, additional = self.successResultOf(
+            self.authority.lookupAddress('www.example.com'))
+        self.assertEqual(answer[0].payload, dns.Record_A('10.0.0.5'))
+        # deep.example.com no longer exists, so the wildcard applies.
+        answer, authority_, additional = self.successResultOf(
+            self.authority.lookupAddress('deep.example.com'))
+        self.assertEqual(answer[0].payload, dns.Record_A('10.0.0.4'))
+
+
+    def test_recordsChangedInPlace(self):
+        """
+        Names whose L{list} of records is changed in place are indexed again
+        once L{_zonesChanged} has been called.
+        """
+        self.successResultOf(self.authority.lookupAddress('www.example.com'))
+        self.records['www.example.com'].append(dns.Record_A('10.0.0.5'))
+        authority._zonesChanged()
+        answer, authority_, additional = self.successResultOf(
+            self.authority.lookupAddress('www.example.com'))
+        self.assertEqual(
+            [record.payload for record in answer],
+            [dns.Record_A('10.0.0.2'), dns.Record_A('10.0.0.5')])
+
+
+    def test_recordsReplaced(self):
+        """
+        Assigning a new L{dict} of records to L{FileAuthority.records} replaces
+        the indexed records.
+        """
+        self.successResultOf(self.authority.lookupAddress('www.example.com'))
+        self.authority.records = {
+            'example.com': [self.soa],
+            'www.example.com': [dns.Record_A('10.0.0.6')]}
+        answer, authority_, additional = self.successResultOf(
+            self.authority.lookupAddress('www.example.com'))
+        self.assertEqual(answer[0].payload, dns.Record_A('10.0.0.6'))
+        self.failureResultOf(
+            self.authority.lookupAddress('missing.example.com'),
+            dns.AuthoritativeDomainError)
+
+
+
+class BindAuthorityTests(unittest.TestCase):
+    """
+    Tests for L{authority.BindAuthority}.
+    """
+    def writeZone(self, serial, address):
+        """
+        Write a zone file for I{example.com} and return its name.
+        """
+        directory = self.mktemp()
+        os.mkdir(directory)
+        path = os.path.join(directory, 'example.com')
+        self.writeZoneTo(path, serial, address)
+        return path
+
+
+    def writeZoneTo(self, path, serial, address):
+        """
+        Write a zone file for I{example.com} with the given serial number and
+        address for I{www.example.com} to C{path}.
+        """
+        with open(path, 'w') as zoneFile:
+            zoneFile.write(
+                '$TTL 300\n'
+                '@ IN SOA ns1.example.com. root.example.com. (\n'
+                '    %d ; serial\n'
+                '    3600 600 86400 60 )\n'
+                '@ IN NS ns1.example.com.\n'
+                'ns1 IN A 10.0.0.1 ; the nameserver\n'
+                'www IN A %s\n' % (serial, address))
+
+
+    def test_loadFile(self):
+        """
+        L{authority.BindAuthority} reads the records of a zone file, including
+        records continued over several lines.
+        """
+        zone = authority.BindAuthority(self.writeZone(1, '10.0.0.2'))
+        self.assertEqual(zone.soa[0], 'example.com')
+        self.assertEqual(zone.soa[1].serial, 1)
+        self.assertEqual(zone.soa[1].minimum, 60)
+        self.assertEqual(
+            zone.records['www.example.com'],
+            [dns.Record_A('10.0.0.2', ttl=300)])
+
+
+    def test_reloadUnchangedSerial(self):
+        """
+        L{FileAuthority.reload} keeps the current records and returns C{False}
+        if the serial number of the zone has not changed.
+        """
+        path = self.writeZone(1, '10.0.0.2')
+        zone = authority.BindAuthority(path)
+        records = zone.records
+        self.writeZoneTo(path, 1, '10.0.0.3')
+        self.assertFalse(zone.reload())
+        self.assertIs(zone.records, records)
+
+
+    def test_reloadUnchangedSerialNotParsed(self):
+        """
+        L{FileAuthority.reload} reads the zone file only as far as the serial
+        number, and does not parse the rest of it or discard anything built
+        from the current records, if the serial number has not changed.
+        """
+        path = self.writeZone(1, '10.0.0.2')
+        zone = authority.BindAuthority(path)
+        self.patch(zone, 'parseLines', lambda lines: self.fail("Parsed"))
+        generation = authority._zoneGeneration
+        self.assertFalse(zone.reload())
+        self.assertEqual(authority._zoneGeneration, generation)
+
+
+    def test_reloadChangedSerial(self):
+        """
+        L{FileAuthority.reload} replaces the records and returns C{True} if the
+        serial number of the zone has changed.
+        """
+        path = self.writeZone(1, '10.0.0.2')
+        zone = authority.BindAuthority(path)
+        self.successResultOf(zone.lookupAddress('www.example.com'))
+        self.writeZoneTo(path, 2, '10.0.0.3')
+        self.assertTrue(zone.reload())
+        answer, authority_, additional = self.successResultOf(
+            zone.lookupAddress('www.example.com'))
+        self.assertEqual(answer[0].payload, dns.Record_A('10.0.0.3', ttl=300))
+
+
+
 class AdditionalProcessingTests(unittest.TestCase):
     """
     Tests for L{FileAuthority}'s additional processing for those record types
@@ -944,6 +1187,19 @@ class SecondaryAuthorityTests(unittest.TestCase):
         self.assertEqual(secondary.domain, 'inside.com')
 
 
+    def test_zoneChanged(self):
+        """
+        Each completed zone transfer is recorded as a change of the zones of
+        the authorities, invalidating the responses cached by
+        L{server.DNSServerFactory}.
+        """
+        secondary = SecondaryAuthority('192.168.1.1', 'example.com')
+        generation = authority._zoneGeneration
+        secondary._cbZone(([dns.RRHeader(
+                        b'example.com', dns.SOA, payload=soa_record)], [], []))
+        self.assertEqual(authority._zoneGeneration, generation + 1)
+
+
     def test_transfer(self):
         """
         An attempt is made to transfer the zone for the domain the
@@ -1020,3 +1276,179 @@ class SecondaryAuthorityTests(unittest.TestCase):
         result = self.successResultOf(secondary.lookupAddress('example.com'))
         self.assertEqual((
                 [RRHeader(b'example.com', payload=a, auth=True)], [], []), result)
+
+
+    def _serve(self, reactor, answers, rCode=dns.OK):
+        """
+        Answer the zone transfer query sent over the most recent connection
+        attempt to C{reactor} with a single message.
+
+        @param answers: The L{RRHeader}s of the answer section.
+
+        @return: The query L{Message} which was answered.
+        """
+        host, port, factory, timeout, bindAddress = reactor.tcpClients.pop(0)
+        proto = factory.buildProtocol((host, port))
+        transport = StringTransport()
+        proto.makeConnection(transport)
+
+        query = Message()
+        query.decode(StringIO(transport.value()[2:]))
+        response = Message(id=query.id, answer=1, auth=1, rCode=rCode)
+        response.answers.extend(answers)
+        data = response.toStr()
+        proto.dataReceived(pack('!H', len(data)) + data)
+        return query
+
+
+    def _transferred(self, serial=1):
+        """
+        Create a L{SecondaryAuthority} for I{example.com} which has completed
+        a full zone transfer of a zone with the given serial number.
+        """
+        secondary = SecondaryAuthority.fromServerAddressAndDomain(
+            ('192.168.1.2', 1234), 'example.com')
+        secondary._reactor = MemoryReactorClock()
+        secondary.transfer()
+        soa = self._soa(serial)
+        self._serve(secondary._reactor, [
+                RRHeader('example.com', SOA, payload=soa),
+                RRHeader('www.example.com', payload=Record_A('10.0.0.1')),
+                RRHeader('mail.example.com', payload=Record_A('10.0.0.2')),
+                RRHeader('example.com', SOA, payload=soa)])
+        return secondary
+
+
+    def _soa(self, serial):
+        """
+        Create the I{SOA} record of version C{serial} of I{example.com}.
+        """
+        return Record_SOA(mname='ns1.example.com', rname='root.example.com',
+                          serial=serial, ttl=0)
+
+
+    def test_incrementalTransferQuery(self):
+        """
+        Once a zone has been transferred, L{SecondaryAuthority.transfer} asks
+        for the differences since the version it has.
+        """
+        secondary = self._transferred(1)
+        self.assertFalse(secondary.transferring)
+        secondary.transfer()
+        query = self._serve(secondary._reactor, [
+                RRHeader('example.com', SOA, payload=self._soa(1))])
+        self.assertEqual(
+            [dns.Query('example.com', dns.IXFR, dns.IN)], query.queries)
+        self.assertEqual([r.payload.serial for r in query.authority], [1])
+
+
+    def test_incrementalTransferUpToDate(self):
+        """
+        If the response to an incremental transfer is the I{SOA} record of the
+        version the authority has, its records are not replaced.
+        """
+        secondary = self._transferred(1)
+        records = secondary.records
+        secondary.transfer()
+        self._serve(secondary._reactor, [
+                RRHeader('example.com', SOA, payload=self._soa(1))])
+        self.assertIs(secondary.records, records)
+        self.assertFalse(secondary.transferring)
+
+
+    def test_incrementalTransfer(self):
+        """
+        The differences in the response to an incremental transfer are applied
+        to the records of the authority.
+        """
+        secondary = self._transferred(1)
+        secondary.transfer()
+        self._serve(secondary._reactor, [
+                RRHeader('example.com', SOA, payload=self._soa(3)),
+                RRHeader('example.com', SOA, payload=self._soa(1)),
+                RRHeader('www.example.com', payload=Record_A('10.0.0.1')),
+                RRHeader('example.com', SOA, payload=self._soa(2)),
+                RRHeader('www.example.com', payload=Record_A('10.0.0.3')),
+                RRHeader('example.com', SOA, payload=self._soa(2)),
+                RRHeader('mail.example.com', payload=Record_A('10.0.0.2')),
+                RRHeader('example.com', SOA, payload=self._soa(3)),
+                RRHeader('ftp.example.com', payload=Record_A('10.0.0.4')),
+                RRHeader('example.com', SOA, payload=self._soa(3))])
+
+        self.assertEqual(secondary.soa[1].serial, 3)
+        self.assertEqual(
+            secondary.records, {
+                'example.com': [self._soa(3)],
+                'www.example.com': [Record_A('10.0.0.3', ttl=0)],
+                'ftp.example.com': [Record_A('10.0.0.4', ttl=0)]})
+        answer, authority_, additional = self.successResultOf(
+            secondary.lookupAddress('www.example.com'))
+        self.assertEqual(answer[0].payload, Record_A('10.0.0.3', ttl=0))
+        self.failureResultOf(
+            secondary.lookupAddress('mail.example.com'),
+            dns.AuthoritativeDomainError)
+
+
+    def test_incrementalTransferWholeZone(self):
+        """
+        If the primary answers an incremental transfer with the whole zone, the
+        records of the authority are replaced.
+        """
+        secondary = self._transferred(1)
+        secondary.transfer()
+        soa = self._soa(2)
+        self._serve(secondary._reactor, [
+                RRHeader('example.com', SOA, payload=soa),
+                RRHeader('www.example.com', payload=Record_A('10.0.0.5')),
+                RRHeader('example.com', SOA, payload=soa)])
+        self.assertEqual(secondary.soa[1].serial, 2)
+        self.assertEqual(
+            secondary.records, {
+                'example.com': [soa],
+                'www.example.com': [Record_A('10.0.0.5', ttl=0)]})
+
+
+    def test_incrementalTransferRefused(self):
+        """
+        If the primary refuses an incremental transfer, the whole zone is
+        transferred instead.
+        """
+        secondary = self._transferred(1)
+        secondary.transfer()
+        self._serve(secondary._reactor, [], rCode=dns.ENOTIMP)
+        query = self._serve(secondary._reactor, [])
+        self.assertEqual(
+            [dns.Query('example.com', dns.AXFR, dns.IN)], query.queries)
+
+
+    def test_incrementalTransferMismatch(self):
+        """
+        If the differences in the response to an incremental transfer do not
+        start from the version the authority has, the whole zone is
+        transferred instead.
+        """
+        secondary = self._transferred(1)
+        secondary.transfer()
+        self._serve(secondary._reactor, [
+                RRHeader('example.com', SOA, payload=self._soa(3)),
+                RRHeader('example.com', SOA, payload=self._soa(2)),
+                RRHeader('example.com', SOA, payload=self._soa(3)),
+                RRHeader('example.com', SOA, payload=self._soa(3))])
+        self.assertEqual(secondary.soa[1].serial, 1)
+        query = self._serve(secondary._reactor, [])
+        self.assertEqual(
+            [dns.Query('example.com', dns.AXFR, dns.IN)], query.queries)
+
+
+    def test_notify(self):
+        """
+        L{SecondaryAuthority.notify} starts a transfer of the zone unless the
+        I{SOA} record it is given is that of the version the authority has.
+        """
+        secondary = self._transferred(1)
+        self.assertIs(secondary.notify(self._soa(1)), None)
+        self.assertEqual(secondary._reactor.tcpClients, [])
+        secondary.notify(self._soa(2))
+        self.assertEqual(len(secondary._reactor.tcpClients), 1)
+        self.assertIs(secondary.notify(), None)
+        self.assertEqual(len(secondary._reactor.tcpClients), 1)
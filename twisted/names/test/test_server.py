@@ -9,9 +9,12 @@ from zope.interface.verify import verifyClass
 
 from twisted.internet import defer
 from twisted.internet.interfaces import IProtocolFactory
-from twisted.names import dns, error, resolve, server
+from twisted.names import (
+    authority, common, dns, error, resolve, secondary, server)
 from twisted.python import failure, log
 from twisted.trial import unittest
+from twisted.internet.address import IPv4Address
+from twisted.test.proto_helpers import MemoryReactorClock, StringTransport
 
 
 
@@ -923,6 +926,32 @@ class DNSServerFactoryTests(unittest.TestCase):
         self.assertIs(additional, expectedAdditional)
 
 
+    def test_gotResolverErrorCachesNameError(self):
+        """
+        L{server.DNSServerFactory.gotResolverError} passes the query and the
+        authority section of an I{NXDOMAIN} response received by a client to
+        the C{cacheNameError} method of the cache.
+        """
+        calls = []
+        class NameErrorCache(object):
+            def cacheNameError(self, query, authority):
+                calls.append((query, authority))
+
+        f = NoResponseDNSServerFactory(caches=[NameErrorCache()])
+        request = dns.Message()
+        request.addQuery(b'example.com')
+        nxdomain = dns.Message(rCode=dns.ENAME)
+        nxdomain.authority = [dns.RRHeader(b'example.com', dns.SOA)]
+
+        f.gotResolverError(
+            failure.Failure(error.DNSNameError(nxdomain)),
+            protocol=NoopProtocol(), message=request, address=None)
+        f.gotResolverError(
+            failure.Failure(error.DNSNameError()),
+            protocol=NoopProtocol(), message=request, address=None)
+        self.assertEqual(calls, [(request.queries[0], nxdomain.authority)])
+
+
     def test_gotResolverErrorCallsResponseFromMessage(self):
         """
         L{server.DNSServerFactory.gotResolverError} calls
@@ -1220,6 +1249,79 @@ class DNSServerFactoryTests(unittest.TestCase):
         self.assertEqual(message.rCode, dns.ENOTIMP)
 
 
+    def _notifySecondary(self, address, peer=None):
+        """
+        Deliver a I{NOTIFY} for I{example.com} from C{address}, or over a
+        stream connection from C{peer} if C{address} is C{None}, to a
+        L{server.DNSServerFactory} serving that zone as a secondary of
+        I{192.168.1.2}.
+
+        @return: A L{tuple} of the reply and the number of zone transfers
+            started.
+        """
+        zone = secondary.SecondaryAuthority('192.168.1.2', 'example.com')
+        zone._reactor = reactor = MemoryReactorClock()
+        f = server.DNSServerFactory(
+            authorities=[resolve.ResolverChain([zone])])
+        message = dns.Message(id=7, opCode=dns.OP_NOTIFY)
+        message.addQuery(b'example.com', dns.SOA)
+        protocol = RaisingProtocol()
+        if peer is not None:
+            protocol.transport = StringTransport(
+                peerAddress=IPv4Address('TCP', peer, 53))
+        e = self.assertRaises(
+            RaisingProtocol.WriteMessageArguments,
+            f.handleNotify,
+            message=message, protocol=protocol, address=address)
+        reply = e.args[0][0]
+        return reply, len(reactor.tcpClients)
+
+
+    def test_handleNotifySecondary(self):
+        """
+        L{server.DNSServerFactory.handleNotify} starts a transfer of a zone
+        served by a L{secondary.SecondaryAuthority} when the primary of the
+        zone notifies it, and acknowledges the notification.
+        """
+        reply, transfers = self._notifySecondary(('192.168.1.2', 53))
+        self.assertEqual(transfers, 1)
+        self.assertEqual(
+            (reply.id, reply.answer, reply.opCode, reply.rCode),
+            (7, True, dns.OP_NOTIFY, dns.OK))
+
+
+    def test_handleNotifyOtherAddress(self):
+        """
+        L{server.DNSServerFactory.handleNotify} ignores a notification for a
+        zone served by a L{secondary.SecondaryAuthority} which does not come
+        from the primary of that zone.
+        """
+        reply, transfers = self._notifySecondary(('192.168.1.3', 53))
+        self.assertEqual(transfers, 0)
+        self.assertEqual(reply.rCode, dns.ENOTIMP)
+
+
+    def test_handleNotifyStream(self):
+        """
+        L{server.DNSServerFactory.handleNotify} accepts a notification
+        received over a stream connection from the primary of the zone.
+        """
+        reply, transfers = self._notifySecondary(None, '192.168.1.2')
+        self.assertEqual(transfers, 1)
+        self.assertEqual(reply.rCode, dns.OK)
+
+
+    def test_handleNotifyStreamOtherPeer(self):
+        """
+        L{server.DNSServerFactory.handleNotify} ignores a notification
+        received over a stream connection from a host other than the primary
+        of the zone.
+        """
+        reply, transfers = self._notifySecondary(None, '192.168.1.3')
+        self.assertEqual(transfers, 0)
+        self.assertEqual(reply.rCode, dns.ENOTIMP)
+
+
     def test_handleNotifyLogging(self):
         """
         L{server.DNSServerFactory.handleNotify} logs the message origin address
@@ -1263,3 +1365,162 @@ class DNSServerFactoryTests(unittest.TestCase):
             message=dns.Message(),
             protocol=NoopProtocol(),
             address=('::1', 53))
+
+
+
+class MemoryAuthority(authority.FileAuthority):
+    """
+    A L{authority.FileAuthority} whose records are given to its initializer
+    rather than loaded from a file.
+    """
+    def __init__(self, soa, records):
+        common.ResolverBase.__init__(self)
+        self.soa = soa
+        self.records = records
+
+
+
+class RecordingProtocol(object):
+    """
+    A partial fake L{dns.DNSDatagramProtocol} which records the encoded
+    messages it is asked to write.
+
+    @ivar written: A L{list} of C{(bytes, address)} tuples.
+    """
+    def __init__(self):
+        self.written = []
+
+
+    def writeMessage(self, message, address):
+        self.written.append((message.toStr(), address))
+
+
+
+class ResponseCacheTests(unittest.TestCase):
+    """
+    Tests for the cache of encoded responses of a purely authoritative
+    L{server.DNSServerFactory}.
+    """
+    def setUp(self):
+        soa = dns.Record_SOA(mname=b'ns1.example.com',
+                             rname=b'root.example.com', ttl=300)
+        self.records = {
+            b'example.com': [soa],
+            b'www.example.com': [dns.Record_A('10.0.0.1', ttl=60)]}
+        self.authority = MemoryAuthority((b'example.com', soa), self.records)
+        self.factory = server.DNSServerFactory(authorities=[self.authority])
+        self.protocol = RecordingProtocol()
+
+
+    def _query(self, id, name=b'www.example.com'):
+        """
+        Send a query for C{name} to C{self.factory} and decode the response.
+        """
+        message = dns.Message(id=id)
+        message.addQuery(name)
+        self.factory.messageReceived(message, self.protocol, ('::1', 53))
+        response = dns.Message()
+        response.fromStr(self.protocol.written[-1][0])
+        return response
+
+
+    def test_enabled(self):
+        """
+        Responses are only cached if all the resolvers of the factory are
+        L{authority.FileAuthority} instances.
+        """
+        self.assertEqual(self.factory._responseCache, {})
+        self.assertIs(
+            server.DNSServerFactory(
+                authorities=[self.authority], clients=[object()]
+            )._responseCache, None)
+        self.assertIs(server.DNSServerFactory()._responseCache, None)
+
+
+    def test_cachedResponse(self):
+        """
+        A second identical query is answered from the cache with the same
+        response, apart from its ID.
+        """
+        first = self._query(1)
+        self.authority.records = {}
+        second = self._query(2)
+        self.assertEqual(len(self.factory._responseCache), 1)
+        self.assertEqual((first.id, second.id), (1, 2))
+        first.id = second.id
+        self.assertEqual(first, second)
+        self.assertEqual(second.answers[0].payload.dottedQuad(), '10.0.0.1')
+
+
+    def test_differentQueries(self):
+        """
+        Queries for different names or types get their own responses.
+        """
+        self._query(1)
+        self.assertEqual(
+            self._query(2, b'example.com').answers[0].type, dns.SOA)
+        self.assertEqual(len(self.factory._responseCache), 2)
+
+
+    def test_errorsNotCached(self):
+        """
+        Error responses are not cached.
+        """
+        self.assertEqual(self._query(1, b'nx.example.com').rCode, dns.ENAME)
+        self.assertEqual(self.factory._responseCache, {})
+
+
+    def test_invalidatedByReload(self):
+        """
+        The cache is emptied when the records of an authority are loaded.
+        """
+        self._query(1)
+        self.records[b'www.example.com'] = [dns.Record_A('10.0.0.2', ttl=60)]
+        authority._zonesChanged()
+        response = self._query(2)
+        self.assertEqual(response.answers[0].payload.dottedQuad(), '10.0.0.2')
+
+
+    def test_size(self):
+        """
+        The cache holds at most C{responseCacheSize} responses.
+        """
+        self.factory.responseCacheSize = 1
+        self._query(1)
+        self._query(2, b'example.com')
+        self.assertEqual(len(self.factory._responseCache), 1)
+
+
+    def test_leastRecentlyUsedDiscarded(self):
+        """
+        When the cache is full, the response which was least recently used is
+        discarded to make room for a new one.
+        """
+        self.records[b'ftp.example.com'] = [
+            dns.Record_A('10.0.0.2', ttl=60)]
+        self.factory.responseCacheSize = 2
+        self._query(1)
+        self._query(2, b'example.com')
+        self._query(3)
+        self._query(4, b'ftp.example.com')
+        self.assertEqual(
+            [key[0] for key in self.factory._responseCache],
+            [b'www.example.com', b'ftp.example.com'])
+
+
+    def test_encodedOnce(self):
+        """
+        A response which is cached is only encoded once, and the bytes which
+        are sent are the ones which are cached.
+        """
+        encoded = []
+        toStr = dns.Message.toStr
+        def countingToStr(message):
+            encoded.append(toStr(message))
+            return encoded[-1]
+        self.patch(dns.Message, 'toStr', countingToStr)
+        self._query(1)
+        self.assertEqual(len(encoded), 1)
+        self.assertEqual(
+            list(self.factory._responseCache.values()), encoded)
+        self.assertEqual(self.protocol.written[-1][0], encoded[0])
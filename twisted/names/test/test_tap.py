@@ -12,6 +12,7 @@ from twisted.names.dns import PORT
 from twisted.names.secondary import SecondaryAuthorityService
 from twisted.names.resolve import ResolverChain
 from twisted.names.client import Resolver
+from twisted.names.cache import CacheResolver
 
 class OptionsTests(TestCase):
     """
@@ -97,3 +98,32 @@ class OptionsTests(TestCase):
                     recurser._parseCall.cancel()
 
         self.assertIsInstance(cl[-1], ResolverChain)
+
+
+    def test_prefetchAndServeStale(self):
+        """
+        The I{--prefetch} and I{--serve-stale} options enable caching and
+        configure the L{CacheResolver}, which refreshes records using the
+        other resolvers.
+        """
+        options = Options()
+        options.parseOptions(['--hosts-file', 'hosts.txt',
+                              '--prefetch', '0.2', '--serve-stale', '3600'])
+        ca, cl = _buildResolvers(options)
+        [cache] = ca
+        self.assertIsInstance(cache, CacheResolver)
+        self.assertEqual(cache.prefetch, 0.2)
+        self.assertEqual(cache.serveStale, 3600)
+        self.assertIsInstance(cache.upstream, ResolverChain)
+        self.assertEqual(cache.upstream.resolvers, cl)
+
+
+    def test_invalidPrefetch(self):
+        """
+        L{Options.parseOptions} raises L{UsageError} if the value of
+        I{--prefetch} is not a fraction or that of I{--serve-stale} is not a
+        number of seconds.
+        """
+        for arguments in [['--prefetch', 'x'], ['--prefetch', '1.5'],
+                          ['--serve-stale', 'x'], ['--serve-stale', '-1']]:
+            self.assertRaises(UsageError, Options().parseOptions, arguments)
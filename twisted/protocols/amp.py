@@ -176,7 +176,7 @@ __metaclass__ = type
 import types, warnings
 
 from cStringIO import StringIO
-from struct import pack
+from struct import pack, Struct
 import decimal, datetime
 from itertools import count
 
@@ -194,7 +194,7 @@ from twisted.internet.interfaces import IFileDescriptorReceiver
 from twisted.internet.main import CONNECTION_LOST
 from twisted.internet.error import PeerVerifyError, ConnectionLost
 from twisted.internet.error import ConnectionClosed
-from twisted.internet.defer import Deferred, maybeDeferred, fail
+from twisted.internet.defer import Deferred, maybeDeferred, fail, succeed
 from twisted.protocols.basic import Int16StringReceiver, StatefulStringProtocol
 
 try:
@@ -281,6 +281,8 @@ UNHANDLED_ERROR_CODE = 'UNHANDLED'
 MAX_KEY_LENGTH = 0xff
 MAX_VALUE_LENGTH = 0xffff
 
+_unpackLength = Struct("!H").unpack_from
+
 
 class IArgumentType(Interface):
     """
@@ -664,6 +666,7 @@ class QuitBox(AmpBox):
         Immediately call loseConnection after sending.
         """
         super(QuitBox, self)._sendTo(proto)
+        proto._flushBoxes()
         proto.transport.loseConnection()
 
 
@@ -726,6 +729,18 @@ class BoxDispatcher:
     @ivar boxSender: an object which can send boxes, via the L{_sendBox}
     method, such as an L{AMP} instance.
     @type boxSender: L{IBoxSender}
+
+    @ivar maxOutstandingRequests: The most commands requiring an answer which
+        may be awaiting one at the same time, or C{None} for no limit.  Further
+        commands are queued and sent in order as answers arrive.
+    @type maxOutstandingRequests: C{int} or C{None}
+
+    @ivar _waitingRequests: a list of the commands which have been queued
+        because of L{maxOutstandingRequests}, as tuples of the command name,
+        its box and the L{Deferred} returned for it.
+
+    @ivar _capacityWaiters: a list of the L{Deferred}s returned by
+        L{waitForCapacity} which have not fired yet.
     """
 
     implements(IBoxReceiver)
@@ -734,9 +749,12 @@ class BoxDispatcher:
     _outstandingRequests = None
     _counter = 0L
     boxSender = None
+    maxOutstandingRequests = None
 
     def __init__(self, locator):
         self._outstandingRequests = {}
+        self._waitingRequests = []
+        self._capacityWaiters = []
         self.locator = locator
 
 
@@ -767,8 +785,14 @@ class BoxDispatcher:
         self._failAllReason = reason
         OR = self._outstandingRequests.items()
         self._outstandingRequests = None # we can never send another request
+        waiting = [result for (command, box, result) in self._waitingRequests]
+        waiting.extend(self._capacityWaiters)
+        self._waitingRequests = []
+        self._capacityWaiters = []
         for key, value in OR:
             value.errback(reason)
+        for value in waiting:
+            value.errback(reason)
 
 
     def _nextTag(self):
@@ -781,12 +805,81 @@ class BoxDispatcher:
         return '%x' % (self._counter,)
 
 
-    def _sendBoxCommand(self, command, box, requiresAnswer=True):
+    def _throttled(self):
+        """
+        @return: C{True} if no more commands requiring an answer may be sent
+            until an answer arrives.
+        """
+        limit = self.maxOutstandingRequests
+        return limit is not None and (
+            len(self._outstandingRequests) + len(self._waitingRequests)
+            >= limit)
+
+
+    def waitForCapacity(self):
+        """
+        Wait until a command requiring an answer can be sent without being
+        queued because of L{maxOutstandingRequests}.
+
+        This lets a producer of commands stop producing while the peer is
+        busy, rather than queue commands without bound.
+
+        @return: a L{Deferred} which fires with C{None} when fewer than
+            L{maxOutstandingRequests} commands are awaiting an answer, or
+            fails if the connection is lost first.
+        """
+        if self._failAllReason is not None:
+            return fail(self._failAllReason)
+        if not self._throttled():
+            return succeed(None)
+        waiter = Deferred()
+        self._capacityWaiters.append(waiter)
+        return waiter
+
+
+    def _requestAnswered(self):
+        """
+        Send queued commands while fewer than L{maxOutstandingRequests} are
+        awaiting an answer, then notify those waiting for capacity.
+        """
+        waiting = self._waitingRequests
+        limit = self.maxOutstandingRequests
+        while waiting and (limit is None or
+                           len(self._outstandingRequests) < limit):
+            command, box, result = waiting.pop(0)
+            try:
+                tag = self._sendBox(command, box, True)
+            except:
+                result.errback()
+            else:
+                self._outstandingRequests[tag] = result
+        while self._capacityWaiters and not self._throttled():
+            self._capacityWaiters.pop(0).callback(None)
+
+
+    def _sendBox(self, command, box, requiresAnswer):
+        """
+        Add the keys identifying a command to C{box} and send it.
+
+        @return: the tag the answer to the command will carry.
+        """
+        box[COMMAND] = command
+        tag = self._nextTag()
+        if requiresAnswer:
+            box[ASK] = tag
+        box._sendTo(self.boxSender)
+        return tag
+
+
+    def _sendBoxCommand(self, command, box, requiresAnswer=True,
+                        throttle=True):
         """
         Send a command across the wire with the given C{amp.Box}.
 
         Mutate the given box to give it any additional keys (_command, _ask)
         required for the command and request/response machinery, then send it.
+        If it requires an answer and L{maxOutstandingRequests} commands are
+        already awaiting one, queue it to be sent when one arrives instead.
 
         If requiresAnswer is True, returns a C{Deferred} which fires when a
         response is received. The C{Deferred} is fired with an C{amp.Box} on
@@ -803,6 +896,11 @@ class BoxDispatcher:
         Deferred which will fire when the other side responds to this command.
         If False, return None and do not ask the other side for acknowledgement.
 
+        @param throttle: a boolean.  Defaults to True.  If False, send the
+        command at once even if L{maxOutstandingRequests} would queue it; this
+        is for commands after which the connection changes, such as
+        L{StartTLS}.
+
         @return: a Deferred which fires the AmpBox that holds the response to
         this command, or None, as specified by requiresAnswer.
 
@@ -810,11 +908,11 @@ class BoxDispatcher:
         """
         if self._failAllReason is not None:
             return fail(self._failAllReason)
-        box[COMMAND] = command
-        tag = self._nextTag()
-        if requiresAnswer:
-            box[ASK] = tag
-        box._sendTo(self.boxSender)
+        if requiresAnswer and throttle and self._throttled():
+            result = Deferred()
+            self._waitingRequests.append((command, box, result))
+            return result
+        tag = self._sendBox(command, box, requiresAnswer)
         if requiresAnswer:
             result = self._outstandingRequests[tag] = Deferred()
         else:
@@ -902,6 +1000,7 @@ class BoxDispatcher:
         @param box: an AmpBox with a value for its L{ANSWER} key.
         """
         question = self._outstandingRequests.pop(box[ANSWER])
+        self._requestAnswered()
         question.addErrback(self.unhandledError)
         question.callback(box)
 
@@ -915,6 +1014,7 @@ class BoxDispatcher:
         and L{ERROR_DESCRIPTION} keys.
         """
         question = self._outstandingRequests.pop(box[ERROR])
+        self._requestAnswered()
         question.addErrback(self.unhandledError)
         errorCode = box[ERROR_CODE]
         description = box[ERROR_DESCRIPTION]
@@ -1645,6 +1745,11 @@ class Command:
     method must always be a dictionary adhering to the contract specified by
     L{response}, because clients are always free to request a response if they
     want one.
+
+    @cvar _throttled: a boolean; defaults to True.  If False, this command is
+    sent at once even when L{BoxDispatcher.maxOutstandingRequests} commands
+    are already awaiting an answer, because it changes the connection as soon
+    as it is sent.
     """
 
     class __metaclass__(type):
@@ -1680,6 +1785,7 @@ class Command:
     responseType = Box
 
     requiresAnswer = True
+    _throttled = True
 
 
     def __init__(self, **kw):
@@ -1838,9 +1944,9 @@ class Command:
                                                UnknownRemoteError)
             return Failure(errorType(rje.description))
 
-        d = proto._sendBoxCommand(self.commandName,
-                                  self.makeArguments(self.structured, proto),
-                                  self.requiresAnswer)
+        d = proto._sendBoxCommand(
+            self.commandName, self.makeArguments(self.structured, proto),
+            self.requiresAnswer, throttle=self._throttled)
 
         if self.requiresAnswer:
             d.addCallback(self.parseResponse, proto)
@@ -1975,6 +2081,7 @@ class StartTLS(Command):
                 ("tls_verifyAuthorities", _LocalArgument(optional=True))]
 
     responseType = _TLSBox
+    _throttled = False
 
     def __init__(self, **kw):
         """
@@ -2020,6 +2127,8 @@ class ProtocolSwitchCommand(Command):
     remain secured.
     """
 
+    _throttled = False
+
     def __init__(self, _protoToSwitchToFactory, **kw):
         """
         Create a ProtocolSwitchCommand.
@@ -2098,6 +2207,7 @@ class _DescriptorExchanger(object):
         Assign and return the next ordinal to the given descriptor after sending
         the descriptor over this protocol's transport.
         """
+        self._flushBoxes()
         self.transport.sendFileDescriptor(descriptor)
         return self._sendingDescriptorCounter()
 
@@ -2144,6 +2254,13 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
 
     @ivar boxReceiver: an L{IBoxReceiver} provider, whose L{ampBoxReceived}
     method will be invoked for each L{AmpBox} that is received.
+
+    @ivar _outgoingBoxes: While received data is being processed, a C{list}
+        of the serialized boxes sent meanwhile, which are written to the
+        transport together afterwards; otherwise C{None}.
+
+    @ivar _boxNeeded: The number of bytes which must have been received
+        before the next box can possibly be complete.
     """
 
     implements(IBoxSender)
@@ -2153,6 +2270,8 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
     _locked = False
     _currentKey = None
     _currentBox = None
+    _outgoingBoxes = None
+    _boxNeeded = 0
 
     _keyLengthLimitExceeded = False
 
@@ -2177,6 +2296,7 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
         @param clientFactory: the ClientFactory to send the
         L{clientConnectionLost} notification to.
         """
+        self._flushBoxes()
         # All the data that Int16Receiver has not yet dealt with belongs to our
         # new protocol: luckily it's keeping that in a handy (although
         # ostensibly internal) variable for us:
@@ -2214,10 +2334,49 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
             raise ConnectionLost()
         if self._startingTLSBuffer is not None:
             self._startingTLSBuffer.append(box)
+        elif self._outgoingBoxes is not None:
+            self._outgoingBoxes.append(box.serialize())
         else:
             self.transport.write(box.serialize())
 
 
+    def _startCoalescing(self):
+        """
+        Start collecting the boxes sent with L{sendBox} to write them to the
+        transport together.
+
+        @return: C{True} if boxes were not already being collected, in which
+            case the caller must call L{_stopCoalescing}.
+        """
+        if self._outgoingBoxes is not None:
+            return False
+        self._outgoingBoxes = []
+        return True
+
+
+    def _flushBoxes(self):
+        """
+        Write the boxes collected so far to the transport with a single call.
+
+        This must happen before anything else is done with the transport, so
+        that the boxes stay in order with it.
+        """
+        boxes = self._outgoingBoxes
+        if boxes:
+            data = ''.join(boxes)
+            del boxes[:]
+            if self.transport is not None:
+                self.transport.write(data)
+
+
+    def _stopCoalescing(self):
+        """
+        Write the collected boxes and send any further boxes at once.
+        """
+        self._flushBoxes()
+        self._outgoingBoxes = None
+
+
     def makeConnection(self, transport):
         """
         Notify L{boxReceiver} that it is about to receive boxes from this
@@ -2240,7 +2399,79 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
         if self.innerProtocol is not None:
             self.innerProtocol.dataReceived(data)
             return
-        return Int16StringReceiver.dataReceived(self, data)
+        # Boxes sent in response to the boxes in this data are written out
+        # together.
+        coalescing = self._startCoalescing()
+        try:
+            self._parseBoxes(data)
+        finally:
+            if coalescing:
+                self._stopCoalescing()
+
+
+    def _parseBoxes(self, data):
+        """
+        Decode whole boxes from the received data and deliver them to
+        L{boxReceiver}, keeping any incomplete box for later.
+
+        Like L{Int16StringReceiver.dataReceived}, this keeps the unparsed
+        data in C{_unprocessed} and its offset in C{_compatibilityOffset}, so
+        that the C{recvd} attribute can be read and replaced when switching
+        protocols.
+        """
+        alldata = self._unprocessed + data
+        self._unprocessed = alldata
+        end = len(alldata)
+        if end < self._boxNeeded:
+            return
+        offset = 0
+        unpackLength = _unpackLength
+        maxKeyLength = self._MAX_KEY_LENGTH
+        try:
+            while offset < end and not self.paused:
+                box = AmpBox()
+                position = offset
+                while True:
+                    if position + 2 > end:
+                        self._boxNeeded = position + 2 - offset
+                        return
+                    keyLength = unpackLength(alldata, position)[0]
+                    position += 2
+                    if not keyLength:
+                        break
+                    if keyLength > maxKeyLength:
+                        self._compatibilityOffset = offset
+                        self.lengthLimitExceeded(keyLength)
+                        return
+                    keyEnd = position + keyLength
+                    if keyEnd + 2 > end:
+                        self._boxNeeded = keyEnd + 2 - offset
+                        return
+                    valueStart = keyEnd + 2
+                    valueEnd = valueStart + unpackLength(alldata, keyEnd)[0]
+                    if valueEnd > end:
+                        self._boxNeeded = valueEnd - offset
+                        return
+                    box[alldata[position:keyEnd]] = alldata[valueStart:valueEnd]
+                    position = valueEnd
+
+                offset = position
+                self._compatibilityOffset = offset
+                self.boxReceiver.ampBoxReceived(box)
+
+                # Check to see if the backwards compat "recvd" attribute got
+                # written to because the protocol was switched.  If so, drop
+                # the current data buffer and switch to the new buffer given
+                # by that attribute's value.
+                if 'recvd' in self.__dict__:
+                    alldata = self.__dict__.pop('recvd')
+                    self._unprocessed = alldata
+                    offset = 0
+                    end = len(alldata)
+            self._boxNeeded = 0
+        finally:
+            self._unprocessed = alldata[offset:]
+            self._compatibilityOffset = 0
 
 
     def connectionLost(self, reason):
@@ -2364,6 +2595,7 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
         @param verifyAuthorities: L{twisted.internet.ssl.Certificate} instances
         representing certificate authorities which will verify our peer.
         """
+        self._flushBoxes()
         self.hostCertificate = certificate
         self._justStartedTLS = True
         if verifyAuthorities is None:
@@ -2394,6 +2626,7 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
             "Dropping connection!  To avoid, add errbacks to ALL remote "
             "commands!")
         if self.transport is not None:
+            self._flushBoxes()
             self.transport.loseConnection()
 
 
@@ -21,16 +21,28 @@ To connect to a server, create a factory for L{MemCacheProtocol}::
 All the operations of the memcache protocol are present, but
 L{MemCacheProtocol.set} and L{MemCacheProtocol.get} are the more important.
 
+To spread keys over several servers, use L{ShardedMemCacheClient}::
+
+    from twisted.protocols.memcache import ShardedMemCacheClient
+    client = ShardedMemCacheClient([("cache1", 11211), ("cache2", 11211)])
+    d = client.set("mykey", "a lot of data")
+
 See U{http://code.sixapart.com/svn/memcached/trunk/server/doc/protocol.txt} for
 more information about the protocol.
 """
 
+import struct
+from bisect import bisect
 from collections import deque
+from hashlib import md5
 
 from twisted.protocols.basic import LineReceiver
 from twisted.protocols.policies import TimeoutMixin
 from twisted.internet.defer import Deferred, fail, TimeoutError
+from twisted.internet.defer import gatherResults
+from twisted.internet.protocol import ClientCreator
 from twisted.python import log
+from twisted.python.failure import Failure
 
 
 
@@ -84,8 +96,7 @@ class Command(object):
         """
         self.command = command
         self._deferred = Deferred()
-        for k, v in kwargs.items():
-            setattr(self, k, v)
+        self.__dict__.update(kwargs)
 
 
     def success(self, value):
@@ -127,9 +138,14 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
 
     @ivar _disconnected: indicate if the connectionLost has been called or not.
     @type _disconnected: C{bool}
+
+    @ivar _heldWrites: C{None}, or the C{list} of lines sent while writes are
+        held by L{_holdWrites}.
+    @type _heldWrites: C{list} of C{str}
     """
     MAX_KEY_LENGTH = 250
     _disconnected = False
+    _heldWrites = None
 
     def __init__(self, timeOut=60):
         """
@@ -178,7 +194,29 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
         """
         if not self._current:
             self.setTimeout(self.persistentTimeOut)
-        LineReceiver.sendLine(self, line)
+        if self._heldWrites is not None:
+            self._heldWrites.append(line + self.delimiter)
+        else:
+            LineReceiver.sendLine(self, line)
+
+
+    def _holdWrites(self):
+        """
+        Keep the lines sent from now on until L{_flushWrites} is called, so
+        that the commands sent meanwhile are pipelined in one write.
+        """
+        if self._heldWrites is None:
+            self._heldWrites = []
+
+
+    def _flushWrites(self):
+        """
+        Write the lines kept since L{_holdWrites} was called, and stop
+        keeping them.
+        """
+        lines, self._heldWrites = self._heldWrites, None
+        if lines and not self._disconnected:
+            self.transport.write("".join(lines))
 
 
     def rawDataReceived(self, data):
@@ -544,8 +582,7 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
         length = len(val)
         fullcmd = "%s %s %d %d %d%s" % (
             cmd, key, flags, expireTime, length, cas)
-        self.sendLine(fullcmd)
-        self.sendLine(val)
+        self.sendLine(fullcmd + self.delimiter + val)
         cmdObj = Command(cmd, key=key, flags=flags, length=length)
         self._current.append(cmdObj)
         return cmdObj._deferred
@@ -748,5 +785,424 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
 
 
 
+def _hashKey(key):
+    """
+    Return the position of C{key} on a L{ShardedMemCacheClient} ring.
+    """
+    return struct.unpack("<I", md5(key).digest()[:4])[0]
+
+
+
+def _ketamaPoints(name, count):
+    """
+    Return C{count} positions on a L{ShardedMemCacheClient} ring for the
+    server called C{name}, four from each MD5 digest of C{"name-i"}, as
+    ketama does.
+    """
+    points = []
+    for i in range((count + 3) // 4):
+        digest = md5("%s-%d" % (name, i)).digest()
+        points.extend(struct.unpack("<4I", digest))
+    return points[:count]
+
+
+
+class _Server(object):
+    """
+    The state of one server of a L{ShardedMemCacheClient}.
+
+    @ivar name: C{"host:port"}, which places the server on the ring.
+
+    @ivar protocol: The L{MemCacheProtocol} connected to the server, or
+        C{None}.
+
+    @ivar waiting: C{None}, or the C{list} of L{Deferred}s waiting for a
+        connection attempt in progress.
+
+    @ivar failures: The number of consecutive failures: connection attempts
+        which failed, and connections which were lost or timed out before
+        the server answered a command.
+
+    @ivar failedProtocol: The last protocol whose failure was counted.
+
+    @ivar ejected: Whether the server is out of the ring.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.name = "%s:%d" % (host, port)
+        self.protocol = None
+        self.waiting = None
+        self.failures = 0
+        self.failedProtocol = None
+        self.ejected = False
+
+
+
+class ShardedMemCacheClient(object):
+    """
+    A memcache client which spreads keys over several servers, placing the
+    servers and the keys on a ketama-style consistent hash ring so that
+    adding or removing a server only moves the keys next to it.
+
+    The client connects to each server when it is first needed.  The
+    commands sent to one server during a reactor iteration are pipelined in
+    a single write.  Concurrent L{get}s of the same key share one request,
+    until the key is written.  A server which fails C{failureLimit} times in
+    a row, by refusing connections, losing them or timing out, is ejected
+    from the ring for C{retryDelay} seconds and its keys go to the next
+    servers on the ring.
+
+    @ivar pointsPerServer: The number of positions of each server on the
+        ring.
+    @type pointsPerServer: C{int}
+
+    @ivar failureLimit: The number of consecutive failures which eject a
+        server.
+    @type failureLimit: C{int}
+
+    @ivar retryDelay: The number of seconds an ejected server stays out of
+        the ring.
+    @type retryDelay: C{int}
+
+    @ivar timeOut: The timeout of the connections, in seconds.
+    @type timeOut: C{int}
+
+    @ivar _servers: The L{_Server}s, in the order they were given.
+
+    @ivar _ring: The sorted positions on the ring of the servers which are
+        not ejected, and C{_ringServers} the L{_Server} at each position.
+
+    @ivar _gets: A C{dict} mapping keys to the C{list} of L{Deferred}s
+        waiting for the L{get} of that key in progress.
+
+    @ivar _holding: The L{MemCacheProtocol}s whose writes are held until the
+        end of the current reactor iteration.
+    """
+    pointsPerServer = 160
+    failureLimit = 2
+    retryDelay = 30
+
+    def __init__(self, servers, reactor=None, timeOut=60):
+        """
+        @param servers: The servers to use.
+        @type servers: C{list} of C{(host, port)} tuples
+
+        @param reactor: The reactor to connect and schedule calls with.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.timeOut = timeOut
+        self._servers = [_Server(host, port) for (host, port) in servers]
+        self._gets = {}
+        self._holding = []
+        self._buildRing()
+
+
+    def _buildRing(self):
+        """
+        Place the servers which are not ejected on the ring.
+        """
+        points = []
+        for server in self._servers:
+            if not server.ejected:
+                points.extend(
+                    [(point, server) for point in _ketamaPoints(
+                            server.name, self.pointsPerServer)])
+        points.sort(key=lambda entry: entry[0])
+        self._ring = [point for (point, server) in points]
+        self._ringServers = [server for (point, server) in points]
+
+
+    def _serverFor(self, key):
+        """
+        Return the L{_Server} holding C{key}.
+
+        @raise ClientError: If C{key} is not a valid key.
+        @raise RuntimeError: If every server is ejected.
+        """
+        if not isinstance(key, str):
+            raise ClientError(
+                "Invalid type for key: %s, expecting a string" % (type(key),))
+        if not self._ring:
+            raise RuntimeError("No memcache server available")
+        index = bisect(self._ring, _hashKey(key)) % len(self._ring)
+        return self._ringServers[index]
+
+
+    def _connectServer(self, host, port):
+        """
+        Connect a L{MemCacheProtocol} to a server.
+
+        @return: A L{Deferred} which fires with the connected protocol.
+        """
+        return ClientCreator(self._reactor, MemCacheProtocol,
+                             self.timeOut).connectTCP(host, port)
+
+
+    def _connect(self, server):
+        """
+        Return a L{Deferred} which fires with a protocol connected to
+        C{server}, sharing the connection attempt in progress if any.
+        """
+        d = Deferred()
+        if server.waiting is None:
+            server.waiting = [d]
+            self._connectServer(server.host, server.port).addCallbacks(
+                self._connected, self._connectionFailed,
+                callbackArgs=(server,), errbackArgs=(server,))
+        else:
+            server.waiting.append(d)
+        return d
+
+
+    def _connected(self, protocol, server):
+        server.protocol = protocol
+        waiting, server.waiting = server.waiting, None
+        for d in waiting:
+            d.callback(protocol)
+
+
+    def _connectionFailed(self, reason, server):
+        waiting, server.waiting = server.waiting, None
+        self._failed(server)
+        for d in waiting:
+            d.errback(reason)
+
+
+    def _failed(self, server):
+        """
+        Count a failure of C{server}, ejecting it if it has failed
+        C{failureLimit} times in a row.
+        """
+        server.failures += 1
+        if server.failures >= self.failureLimit and not server.ejected:
+            log.msg("Ejecting memcache server %s" % (server.name,))
+            server.ejected = True
+            self._buildRing()
+            self._reactor.callLater(self.retryDelay, self._restore, server)
+
+
+    def _restore(self, server):
+        """
+        Put an ejected server back in the ring.
+        """
+        server.ejected = False
+        server.failures = 0
+        self._buildRing()
+
+
+    def _send(self, server, method, *args):
+        """
+        Call C{method} with C{args} on the protocol connected to C{server},
+        connecting first if needed.
+        """
+        protocol = server.protocol
+        if protocol is not None and not protocol._disconnected:
+            return self._call(protocol, server, method, *args)
+        return self._connect(server).addCallback(
+            self._call, server, method, *args)
+
+
+    def _call(self, protocol, server, method, *args):
+        """
+        Call C{method} of C{protocol}, pipelining its write with the others
+        of this reactor iteration.
+        """
+        if not self._holding:
+            self._reactor.callLater(0, self._flush)
+        if protocol._heldWrites is None:
+            protocol._holdWrites()
+            self._holding.append(protocol)
+        d = getattr(protocol, method)(*args)
+        if server.failures:
+            d.addCallbacks(self._succeeded, self._commandFailed,
+                           callbackArgs=(server,),
+                           errbackArgs=(server, protocol))
+        else:
+            d.addErrback(self._commandFailed, server, protocol)
+        return d
+
+
+    def _flush(self):
+        holding, self._holding = self._holding, []
+        for protocol in holding:
+            protocol._flushWrites()
+
+
+    def _succeeded(self, result, server):
+        server.failures = 0
+        return result
+
+
+    def _commandFailed(self, reason, server, protocol):
+        # Errors reported by the server say nothing about its health, and
+        # the commands outstanding on a connection which was lost are one
+        # failure.
+        if (protocol is not server.failedProtocol and
+                not reason.check(NoSuchCommand, ClientError, ServerError)):
+            server.failedProtocol = protocol
+            self._failed(server)
+        return reason
+
+
+    def _run(self, key, method, *args):
+        """
+        Call C{method} with C{args} on the protocol of the server holding
+        C{key}.
+        """
+        try:
+            server = self._serverFor(key)
+        except (ClientError, RuntimeError) as e:
+            return fail(e)
+        return self._send(server, method, *args)
+
+
+    def _write(self, key, method, *args):
+        """
+        Like L{_run}, for commands which change the value of C{key}: later
+        L{get}s of C{key} do not share the request of an earlier one.
+        """
+        self._gets.pop(key, None)
+        return self._run(key, method, key, *args)
+
+
+    def get(self, key, withIdentifier=False):
+        """
+        Get the given C{key}; see L{MemCacheProtocol.get}.  Without
+        C{withIdentifier}, a get of a key which is already being got shares
+        the request in progress.
+        """
+        if withIdentifier:
+            return self._run(key, "get", key, True)
+        result = Deferred()
+        waiting = self._gets.get(key)
+        if waiting is not None:
+            waiting.append(result)
+            return result
+        waiting = self._gets[key] = [result]
+        self._run(key, "get", key).addBoth(self._got, key, waiting)
+        return result
+
+
+    def _got(self, result, key, waiting):
+        """
+        Fire the L{Deferred}s waiting for the get of C{key}.
+        """
+        if self._gets.get(key) is waiting:
+            del self._gets[key]
+        for d in waiting:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Get the given C{keys}; see L{MemCacheProtocol.getMultiple}.  The keys
+        are split by server, and the servers are asked at once.
+        """
+        byServer = {}
+        try:
+            for key in keys:
+                byServer.setdefault(self._serverFor(key), []).append(key)
+        except (ClientError, RuntimeError) as e:
+            return fail(e)
+        requests = [
+            self._send(server, "getMultiple", serverKeys, withIdentifier)
+            for (server, serverKeys) in byServer.iteritems()]
+
+        def merge(results):
+            values = {}
+            for result in results:
+                values.update(result)
+            return values
+
+        return gatherResults(requests, consumeErrors=True).addCallbacks(
+            merge, lambda reason: reason.value.subFailure)
+
+
+    def set(self, key, val, flags=0, expireTime=0):
+        """
+        Set the given C{key}; see L{MemCacheProtocol.set}.
+        """
+        return self._write(key, "set", val, flags, expireTime)
+
+
+    def add(self, key, val, flags=0, expireTime=0):
+        """
+        Add the given C{key}; see L{MemCacheProtocol.add}.
+        """
+        return self._write(key, "add", val, flags, expireTime)
+
+
+    def replace(self, key, val, flags=0, expireTime=0):
+        """
+        Replace the given C{key}; see L{MemCacheProtocol.replace}.
+        """
+        return self._write(key, "replace", val, flags, expireTime)
+
+
+    def checkAndSet(self, key, val, cas, flags=0, expireTime=0):
+        """
+        Change C{key} if C{cas} matches; see L{MemCacheProtocol.checkAndSet}.
+        """
+        return self._write(key, "checkAndSet", val, cas, flags, expireTime)
+
+
+    def append(self, key, val):
+        """
+        Append to the value of C{key}; see L{MemCacheProtocol.append}.
+        """
+        return self._write(key, "append", val)
+
+
+    def prepend(self, key, val):
+        """
+        Prepend to the value of C{key}; see L{MemCacheProtocol.prepend}.
+        """
+        return self._write(key, "prepend", val)
+
+
+    def increment(self, key, val=1):
+        """
+        Increment the value of C{key}; see L{MemCacheProtocol.increment}.
+        """
+        return self._write(key, "increment", val)
+
+
+    def decrement(self, key, val=1):
+        """
+        Decrement the value of C{key}; see L{MemCacheProtocol.decrement}.
+        """
+        return self._write(key, "decrement", val)
+
+
+    def delete(self, key):
+        """
+        Delete C{key}; see L{MemCacheProtocol.delete}.
+        """
+        return self._write(key, "delete")
+
+
+    def flushAll(self):
+        """
+        Flush all cached values of the servers in the ring.
+
+        @return: a deferred that will be called back with C{True} when all
+            the servers have been flushed.
+        @rtype: L{Deferred}
+        """
+        self._gets.clear()
+        requests = [self._send(server, "flushAll")
+                    for server in self._servers if not server.ejected]
+        return gatherResults(requests, consumeErrors=True).addCallbacks(
+            lambda results: True, lambda reason: reason.value.subFailure)
+
+
+
 __all__ = ["MemCacheProtocol", "DEFAULT_PORT", "NoSuchCommand", "ClientError",
-           "ServerError"]
+           "ServerError", "ShardedMemCacheClient"]
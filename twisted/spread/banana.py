@@ -12,7 +12,7 @@ for more details.
 @author: Glyph Lefkowitz
 """
 
-import copy, cStringIO, struct
+import copy, cStringIO, re, struct
 
 from twisted.internet import protocol
 from twisted.persisted import styles
@@ -21,14 +21,28 @@ from twisted.python import log
 class BananaError(Exception):
     pass
 
+# Base 128 encodings of the integers which fit in a single byte.
+_b128 = [chr(i) for i in range(128)]
+
 def int2b128(integer, stream):
-    if integer == 0:
-        stream(chr(0))
-        return
-    assert integer > 0, "can only encode positive integers"
+    assert integer >= 0, "can only encode positive integers"
+    stream(_prefix(integer))
+
+
+def _prefix(integer):
+    """
+    Encode a non-negative integer in base 128 as a token prefix.
+
+    @type integer: C{int} or C{long}
+    @rtype: C{str}
+    """
+    if integer < 128:
+        return _b128[integer]
+    digits = []
     while integer:
-        stream(chr(integer & 0x7f))
+        digits.append(_b128[integer & 0x7f])
         integer = integer >> 7
+    return ''.join(digits)
 
 
 def b1282int(st):
@@ -65,6 +79,20 @@ VOCAB    = chr(0x87)
 
 HIGH_BIT_SET = chr(0x80)
 
+# The type bytes as they appear in a bytearray.
+_LIST, _INT, _STRING, _NEG, _FLOAT, _LONGINT, _LONGNEG, _VOCAB = range(
+    0x80, 0x88)
+
+_unpackFloat = struct.Struct("!d").unpack_from
+
+# Finds the type byte which ends a prefix.
+_typeByte = re.compile('[\x80-\xff]')
+
+# Consumed bytes are only discarded from the front of the receive buffer once
+# there are at least this many of them and they make up at least half of it,
+# so that the cost of moving the rest of the buffer is amortized.
+_COMPACT_THRESHOLD = 64 * 1024
+
 def setPrefixLimit(limit):
     """
     Set the limit on the prefix length for all Banana connections
@@ -154,76 +182,84 @@ class Banana(protocol.Protocol, styles.Ephemeral):
         else:
             self.callExpressionReceived(item)
 
-    buffer = ''
-
     def dataReceived(self, chunk):
-        buffer = self.buffer + chunk
+        """
+        Decode as many tokens as possible from the received data.
+
+        Data is appended to a receive buffer which is read from an offset, so
+        each byte is copied a constant number of times however the data is
+        split into chunks.
+        """
+        data = self._buffer
+        data.extend(chunk)
+        offset = self._offset
+        end = len(data)
         listStack = self.listStack
         gotItem = self.gotItem
-        while buffer:
-            assert self.buffer != buffer, "This ain't right: %s %s" % (repr(self.buffer), repr(buffer))
-            self.buffer = buffer
-            pos = 0
-            for ch in buffer:
-                if ch >= HIGH_BIT_SET:
-                    break
-                pos = pos + 1
-            else:
-                if pos > self.prefixLimit:
-                    raise BananaError("Security precaution: more than %d bytes of prefix" % (self.prefixLimit,))
-                return
-            num = buffer[:pos]
-            typebyte = buffer[pos]
-            rest = buffer[pos+1:]
-            if len(num) > self.prefixLimit:
-                raise BananaError("Security precaution: longer than %d bytes worth of prefix" % (self.prefixLimit,))
-            if typebyte == LIST:
-                num = b1282int(num)
-                if num > SIZE_LIMIT:
-                    raise BananaError("Security precaution: List too long.")
-                listStack.append((num, []))
-                buffer = rest
-            elif typebyte == STRING:
-                num = b1282int(num)
-                if num > SIZE_LIMIT:
-                    raise BananaError("Security precaution: String too long.")
-                if len(rest) >= num:
-                    buffer = rest[num:]
-                    gotItem(rest[:num])
+        prefixLimit = self.prefixLimit
+        search = _typeByte.search
+        try:
+            while offset < end:
+                # Most prefixes are a single byte long.
+                if offset + 1 < end and data[offset + 1] > 0x7f:
+                    num = data[offset]
+                    pos = offset + 1
+                    if num > 0x7f:
+                        num = 0
+                        pos = offset
                 else:
-                    return
-            elif typebyte == INT:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(num)
-            elif typebyte == LONGINT:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(num)
-            elif typebyte == LONGNEG:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(-num)
-            elif typebyte == NEG:
-                buffer = rest
-                num = -b1282int(num)
-                gotItem(num)
-            elif typebyte == VOCAB:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(self.incomingVocabulary[num])
-            elif typebyte == FLOAT:
-                if len(rest) >= 8:
-                    buffer = rest[8:]
-                    gotItem(struct.unpack("!d", rest[:8])[0])
+                    match = search(data, offset, offset + prefixLimit + 1)
+                    if match is None:
+                        if end - offset > prefixLimit:
+                            raise BananaError("Security precaution: more than %d bytes of prefix" % (prefixLimit,))
+                        return
+                    pos = match.start()
+                    num = 0
+                    shift = 0
+                    for i in xrange(offset, pos):
+                        num |= data[i] << shift
+                        shift += 7
+                typebyte = data[pos]
+                rest = pos + 1
+                if typebyte == _LIST:
+                    if num > SIZE_LIMIT:
+                        raise BananaError("Security precaution: List too long.")
+                    listStack.append((num, []))
+                    offset = rest
+                elif typebyte == _STRING:
+                    if num > SIZE_LIMIT:
+                        raise BananaError("Security precaution: String too long.")
+                    if end - rest < num:
+                        return
+                    offset = rest + num
+                    gotItem(str(buffer(data, rest, num)))
+                elif typebyte == _INT or typebyte == _LONGINT:
+                    offset = rest
+                    gotItem(num)
+                elif typebyte == _NEG or typebyte == _LONGNEG:
+                    offset = rest
+                    gotItem(-num)
+                elif typebyte == _VOCAB:
+                    offset = rest
+                    gotItem(self.incomingVocabulary[num])
+                elif typebyte == _FLOAT:
+                    if end - rest < 8:
+                        return
+                    offset = rest + 8
+                    gotItem(_unpackFloat(data, rest)[0])
                 else:
-                    return
-            else:
-                raise NotImplementedError(("Invalid Type Byte %r" % (typebyte,)))
-            while listStack and (len(listStack[-1][1]) == listStack[-1][0]):
-                item = listStack.pop()[1]
-                gotItem(item)
-        self.buffer = ''
+                    raise NotImplementedError(("Invalid Type Byte %r" % (chr(typebyte),)))
+                while listStack and (len(listStack[-1][1]) == listStack[-1][0]):
+                    item = listStack.pop()[1]
+                    gotItem(item)
+        finally:
+            if offset == len(data):
+                del data[:]
+                offset = 0
+            elif offset >= _COMPACT_THRESHOLD and offset * 2 >= len(data):
+                del data[:offset]
+                offset = 0
+            self._offset = offset
 
 
     def expressionReceived(self, lst):
@@ -277,56 +313,59 @@ class Banana(protocol.Protocol, styles.Ephemeral):
 
     def __init__(self, isClient=1):
         self.listStack = []
+        self._buffer = bytearray()
+        self._offset = 0
         self.outgoingSymbols = copy.copy(self.outgoingVocabulary)
         self.outgoingSymbolCount = 0
         self.isClient = isClient
 
     def sendEncoded(self, obj):
-        io = cStringIO.StringIO()
-        self._encode(obj, io.write)
-        value = io.getvalue()
-        self.transport.write(value)
+        """
+        Encode C{obj} and write it to the transport with a single call.
+        """
+        pieces = []
+        self._encode(obj, pieces.append)
+        self.transport.write(''.join(pieces))
+
 
     def _encode(self, obj, write):
+        """
+        Encode C{obj}, passing the pieces of its encoding to C{write}.
+
+        Each token is passed as one piece, prefix and type byte together.
+        """
         if isinstance(obj, (list, tuple)):
             if len(obj) > SIZE_LIMIT:
                 raise BananaError(
                     "list/tuple is too long to send (%d)" % (len(obj),))
-            int2b128(len(obj), write)
-            write(LIST)
+            write(_prefix(len(obj)) + LIST)
+            encode = self._encode
             for elem in obj:
-                self._encode(elem, write)
+                encode(elem, write)
         elif isinstance(obj, (int, long)):
             if obj < self._smallestLongInt or obj > self._largestLongInt:
                 raise BananaError(
                     "int/long is too large to send (%d)" % (obj,))
             if obj < self._smallestInt:
-                int2b128(-obj, write)
-                write(LONGNEG)
+                write(_prefix(-obj) + LONGNEG)
             elif obj < 0:
-                int2b128(-obj, write)
-                write(NEG)
+                write(_prefix(-obj) + NEG)
             elif obj <= self._largestInt:
-                int2b128(obj, write)
-                write(INT)
+                write(_prefix(obj) + INT)
             else:
-                int2b128(obj, write)
-                write(LONGINT)
+                write(_prefix(obj) + LONGINT)
         elif isinstance(obj, float):
-            write(FLOAT)
-            write(struct.pack("!d", obj))
+            write(FLOAT + struct.pack("!d", obj))
         elif isinstance(obj, str):
             # TODO: an API for extending banana...
             if self.currentDialect == "pb" and obj in self.outgoingSymbols:
                 symbolID = self.outgoingSymbols[obj]
-                int2b128(symbolID, write)
-                write(VOCAB)
+                write(_prefix(symbolID) + VOCAB)
             else:
                 if len(obj) > SIZE_LIMIT:
                     raise BananaError(
                         "string is too long to send (%d)" % (len(obj),))
-                int2b128(len(obj), write)
-                write(STRING)
+                write(_prefix(len(obj)) + STRING)
                 write(obj)
         else:
             raise BananaError("could not send object: %r" % (obj,))
@@ -355,6 +394,7 @@ def decode(st):
     try:
         _i.dataReceived(st)
     finally:
-        _i.buffer = ''
+        del _i._buffer[:]
+        _i._offset = 0
         del _i.expressionReceived
     return l[0]
@@ -67,13 +67,9 @@ import types
 import warnings
 import decimal
 from functools import reduce
-from types import StringType
 from types import UnicodeType
-from types import IntType
 from types import TupleType
 from types import ListType
-from types import LongType
-from types import FloatType
 from types import FunctionType
 from types import MethodType
 from types import ModuleType
@@ -370,6 +366,12 @@ class _Jellier:
         self._ref_id = 1
         self.persistentStore = persistentStore
         self.invoker = invoker
+        # The taster's decisions, by type and by class.
+        self._allowedTypes = {}
+        self._allowedClasses = {}
+        self._primitiveTypes = set(
+            objType for objType in self.constantTypes
+            if self._isTypeAllowed(objType))
 
 
     def _cook(self, object):
@@ -455,98 +457,63 @@ class _Jellier:
             return self.cooked[objId]
 
 
+    def _isTypeAllowed(self, objType):
+        """
+        Ask the taster whether objects of C{objType} may be jellied, once per
+        type.
+        """
+        try:
+            return self._allowedTypes[objType]
+        except KeyError:
+            allowed = self._allowedTypes[objType] = bool(
+                self.taster.isTypeAllowed(qual(objType)))
+            return allowed
+
+
+    def _isClassAllowed(self, klass):
+        """
+        Ask the taster whether instances of C{klass} may be jellied, once per
+        class.
+        """
+        try:
+            return self._allowedClasses[klass]
+        except KeyError:
+            allowed = self._allowedClasses[klass] = bool(
+                self.taster.isClassAllowed(klass))
+            return allowed
+
+
     def jelly(self, obj):
+        objType = type(obj)
+        # Strings and numbers are the most common objects, and are never
+        # Jellyable.
+        if objType in self._primitiveTypes:
+            return obj
         if isinstance(obj, Jellyable):
             preRef = self._checkMutable(obj)
             if preRef:
                 return preRef
             return obj.jellyFor(self)
-        objType = type(obj)
-        if self.taster.isTypeAllowed(qual(objType)):
+        if self._isTypeAllowed(objType):
             # "Immutable" Types
-            if ((objType is StringType) or
-                (objType is IntType) or
-                (objType is LongType) or
-                (objType is FloatType)):
+            if objType in self.constantTypes:
                 return obj
-            elif objType is MethodType:
-                return ["method",
-                        obj.im_func.__name__,
-                        self.jelly(obj.im_self),
-                        self.jelly(obj.im_class)]
-
-            elif UnicodeType and objType is UnicodeType:
-                return ['unicode', obj.encode('UTF-8')]
-            elif objType is NoneType:
-                return ['None']
-            elif objType is FunctionType:
-                name = obj.__name__
-                return ['function', str(pickle.whichmodule(obj, obj.__name__))
-                        + '.' +
-                        name]
-            elif objType is ModuleType:
-                return ['module', obj.__name__]
-            elif objType is BooleanType:
-                return ['boolean', obj and 'true' or 'false']
-            elif objType is datetime.datetime:
-                if obj.tzinfo:
-                    raise NotImplementedError(
-                        "Currently can't jelly datetime objects with tzinfo")
-                return ['datetime', '%s %s %s %s %s %s %s' % (
-                    obj.year, obj.month, obj.day, obj.hour,
-                    obj.minute, obj.second, obj.microsecond)]
-            elif objType is datetime.time:
-                if obj.tzinfo:
-                    raise NotImplementedError(
-                        "Currently can't jelly datetime objects with tzinfo")
-                return ['time', '%s %s %s %s' % (obj.hour, obj.minute,
-                                                 obj.second, obj.microsecond)]
-            elif objType is datetime.date:
-                return ['date', '%s %s %s' % (obj.year, obj.month, obj.day)]
-            elif objType is datetime.timedelta:
-                return ['timedelta', '%s %s %s' % (obj.days, obj.seconds,
-                                                   obj.microseconds)]
-            elif objType is ClassType or issubclass(objType, type):
-                return ['class', qual(obj)]
-            elif objType is decimal.Decimal:
-                return self.jelly_decimal(obj)
+            immutable = self._immutableDispatch.get(objType)
+            if immutable is not None:
+                return immutable(self, obj)
+            elif issubclass(objType, type):
+                return self._jellyClass(obj)
             else:
                 preRef = self._checkMutable(obj)
                 if preRef:
                     return preRef
                 # "Mutable" Types
                 sxp = self.prepare(obj)
-                if objType is ListType:
-                    sxp.extend(self._jellyIterable(list_atom, obj))
-                elif objType is TupleType:
-                    sxp.extend(self._jellyIterable(tuple_atom, obj))
-                elif objType in DictTypes:
-                    sxp.append(dictionary_atom)
-                    for key, val in obj.items():
-                        sxp.append([self.jelly(key), self.jelly(val)])
-                elif objType is set or objType is _sets.Set:
-                    sxp.extend(self._jellyIterable(set_atom, obj))
-                elif objType is frozenset or objType is _sets.ImmutableSet:
-                    sxp.extend(self._jellyIterable(frozenset_atom, obj))
+                mutable = self._mutableDispatch.get(objType)
+                if mutable is not None:
+                    mutable(self, obj, sxp)
                 else:
-                    className = qual(obj.__class__)
-                    persistent = None
-                    if self.persistentStore:
-                        persistent = self.persistentStore(obj, self)
-                    if persistent is not None:
-                        sxp.append(persistent_atom)
-                        sxp.append(persistent)
-                    elif self.taster.isClassAllowed(obj.__class__):
-                        sxp.append(className)
-                        if hasattr(obj, "__getstate__"):
-                            state = obj.__getstate__()
-                        else:
-                            state = obj.__dict__
-                        sxp.append(self.jelly(state))
-                    else:
-                        self.unpersistable(
-                            "instance of class %s deemed insecure" %
-                            qual(obj.__class__), sxp)
+                    self._jellyInstance(obj, sxp)
                 return self.preserve(obj, sxp)
         else:
             if objType is InstanceType:
@@ -556,22 +523,131 @@ class _Jellier:
                                 (objType, obj))
 
 
-    def _jellyIterable(self, atom, obj):
-        """
-        Jelly an iterable object.
+    def _jellyMethod(self, obj):
+        return ["method",
+                obj.im_func.__name__,
+                self.jelly(obj.im_self),
+                self.jelly(obj.im_class)]
+
+
+    def _jellyUnicode(self, obj):
+        return ['unicode', obj.encode('UTF-8')]
+
+
+    def _jellyNone(self, obj):
+        return ['None']
+
 
-        @param atom: the identifier atom of the object.
-        @type atom: C{str}
+    def _jellyFunction(self, obj):
+        name = obj.__name__
+        return ['function', str(pickle.whichmodule(obj, obj.__name__))
+                + '.' +
+                name]
 
-        @param obj: any iterable object.
-        @type obj: C{iterable}
 
-        @return: a generator of jellied data.
-        @rtype: C{generator}
+    def _jellyModule(self, obj):
+        return ['module', obj.__name__]
+
+
+    def _jellyBoolean(self, obj):
+        return ['boolean', obj and 'true' or 'false']
+
+
+    def _jellyDatetime(self, obj):
+        if obj.tzinfo:
+            raise NotImplementedError(
+                "Currently can't jelly datetime objects with tzinfo")
+        return ['datetime', '%s %s %s %s %s %s %s' % (
+            obj.year, obj.month, obj.day, obj.hour,
+            obj.minute, obj.second, obj.microsecond)]
+
+
+    def _jellyTime(self, obj):
+        if obj.tzinfo:
+            raise NotImplementedError(
+                "Currently can't jelly datetime objects with tzinfo")
+        return ['time', '%s %s %s %s' % (obj.hour, obj.minute,
+                                         obj.second, obj.microsecond)]
+
+
+    def _jellyDate(self, obj):
+        return ['date', '%s %s %s' % (obj.year, obj.month, obj.day)]
+
+
+    def _jellyTimedelta(self, obj):
+        return ['timedelta', '%s %s %s' % (obj.days, obj.seconds,
+                                           obj.microseconds)]
+
+
+    def _jellyClass(self, obj):
+        return ['class', qual(obj)]
+
+
+    def _jellyItems(self, atom, obj, sxp):
+        """
+        Jelly the items of an iterable object into C{sxp} after C{atom}.
+
+        Items which are strings or numbers are added as they are, without a
+        call to L{jelly}.
         """
-        yield atom
+        sxp.append(atom)
+        primitiveTypes = self._primitiveTypes
+        jelly = self.jelly
+        append = sxp.append
         for item in obj:
-            yield self.jelly(item)
+            if type(item) in primitiveTypes:
+                append(item)
+            else:
+                append(jelly(item))
+
+
+    def _jellyList(self, obj, sxp):
+        self._jellyItems(list_atom, obj, sxp)
+
+
+    def _jellyTuple(self, obj, sxp):
+        self._jellyItems(tuple_atom, obj, sxp)
+
+
+    def _jellySet(self, obj, sxp):
+        self._jellyItems(set_atom, obj, sxp)
+
+
+    def _jellyFrozenset(self, obj, sxp):
+        self._jellyItems(frozenset_atom, obj, sxp)
+
+
+    def _jellyDictionary(self, obj, sxp):
+        sxp.append(dictionary_atom)
+        primitiveTypes = self._primitiveTypes
+        jelly = self.jelly
+        for key, val in obj.items():
+            if type(key) not in primitiveTypes:
+                key = jelly(key)
+            if type(val) not in primitiveTypes:
+                val = jelly(val)
+            sxp.append([key, val])
+
+
+    def _jellyInstance(self, obj, sxp):
+        className = qual(obj.__class__)
+        persistent = None
+        if self.persistentStore:
+            persistent = self.persistentStore(obj, self)
+        if persistent is not None:
+            sxp.append(persistent_atom)
+            sxp.append(persistent)
+        elif self._isClassAllowed(obj.__class__):
+            sxp.append(className)
+            if hasattr(obj, "__getstate__"):
+                state = obj.__getstate__()
+            else:
+                state = obj.__dict__
+            sxp.append(self.jelly(state))
+        else:
+            self.unpersistable(
+                "instance of class %s deemed insecure" %
+                qual(obj.__class__), sxp)
 
 
     def jelly_decimal(self, d):
@@ -603,6 +679,37 @@ class _Jellier:
         return sxp
 
 
+    # Handlers for the types of objects which are jellied without a reference
+    # of their own, taking the jellier and the object and returning its jelly.
+    _immutableDispatch = {
+        MethodType: _jellyMethod,
+        UnicodeType: _jellyUnicode,
+        NoneType: _jellyNone,
+        FunctionType: _jellyFunction,
+        ModuleType: _jellyModule,
+        BooleanType: _jellyBoolean,
+        datetime.datetime: _jellyDatetime,
+        datetime.time: _jellyTime,
+        datetime.date: _jellyDate,
+        datetime.timedelta: _jellyTimedelta,
+        ClassType: _jellyClass,
+        decimal.Decimal: jelly_decimal,
+        }
+
+    # Handlers for the types of objects which may be referred to more than
+    # once, taking the jellier, the object and the list to jelly it into.
+    # Objects of any other type are jellied as instances.
+    _mutableDispatch = {
+        ListType: _jellyList,
+        TupleType: _jellyTuple,
+        DictionaryType: _jellyDictionary,
+        set: _jellySet,
+        _sets.Set: _jellySet,
+        frozenset: _jellyFrozenset,
+        _sets.ImmutableSet: _jellyFrozenset,
+        }
+
+
 
 class _Unjellier:
 
@@ -612,6 +719,11 @@ class _Unjellier:
         self.references = {}
         self.postCallbacks = []
         self.invoker = invoker
+        # The taster's decisions about type names, the _unjelly_ methods
+        # found for them, and the classes they name.
+        self._allowedTypes = {}
+        self._thunks = {}
+        self._classes = {}
 
 
     def unjellyFull(self, obj):
@@ -625,7 +737,12 @@ class _Unjellier:
         if type(obj) is not types.ListType:
             return obj
         jelType = obj[0]
-        if not self.taster.isTypeAllowed(jelType):
+        try:
+            allowed = self._allowedTypes[jelType]
+        except KeyError:
+            allowed = self._allowedTypes[jelType] = bool(
+                self.taster.isTypeAllowed(jelType))
+        if not allowed:
             raise InsecureJelly(jelType)
         regClass = unjellyableRegistry.get(jelType)
         if regClass is not None:
@@ -650,18 +767,17 @@ class _Unjellier:
             if hasattr(inst, 'postUnjelly'):
                 self.postCallbacks.append(inst.postUnjelly)
             return inst
-        thunk = getattr(self, '_unjelly_%s'%jelType, None)
+        try:
+            thunk = self._thunks[jelType]
+        except KeyError:
+            thunk = self._thunks[jelType] = getattr(
+                self, '_unjelly_%s'%jelType, None)
         if thunk is not None:
             ret = thunk(obj[1:])
         else:
-            nameSplit = jelType.split('.')
-            modName = '.'.join(nameSplit[:-1])
-            if not self.taster.isModuleAllowed(modName):
-                raise InsecureJelly(
-                    "Module %s not allowed (in type %s)." % (modName, jelType))
-            clz = namedObject(jelType)
-            if not self.taster.isClassAllowed(clz):
-                raise InsecureJelly("Class %s not allowed." % jelType)
+            clz = self._classes.get(jelType)
+            if clz is None:
+                clz = self._classes[jelType] = self._allowedClass(jelType)
             if hasattr(clz, "__setstate__"):
                 ret = _newInstance(clz)
                 state = self.unjelly(obj[1])
@@ -674,6 +790,23 @@ class _Unjellier:
         return ret
 
 
+    def _allowedClass(self, jelType):
+        """
+        Find the class named by C{jelType}, if the taster allows it.
+
+        @raise InsecureJelly: If the class or its module is not allowed.
+        """
+        nameSplit = jelType.split('.')
+        modName = '.'.join(nameSplit[:-1])
+        if not self.taster.isModuleAllowed(modName):
+            raise InsecureJelly(
+                "Module %s not allowed (in type %s)." % (modName, jelType))
+        clz = namedObject(jelType)
+        if not self.taster.isClassAllowed(clz):
+            raise InsecureJelly("Class %s not allowed." % jelType)
+        return clz
+
+
     def _unjelly_None(self, exp):
         return None
 
@@ -758,12 +891,27 @@ class _Unjellier:
         return o
 
 
+    def _unjellyItems(self, lst):
+        """
+        Unjelly the items of a jellied sequence.
+
+        Only items which are lists are unjellied; any other jelly stands for
+        itself.
+
+        @return: A C{list} of the items and whether none of them is
+            L{NotKnown} yet.
+        """
+        l = list(lst)
+        finished = True
+        for elem, item in enumerate(lst):
+            if type(item) is ListType:
+                if isinstance(self.unjellyInto(l, elem, item), NotKnown):
+                    finished = False
+        return l, finished
+
+
     def _unjelly_tuple(self, lst):
-        l = range(len(lst))
-        finished = 1
-        for elem in l:
-            if isinstance(self.unjellyInto(l, elem, lst[elem]), NotKnown):
-                finished = 0
+        l, finished = self._unjellyItems(lst)
         if finished:
             return tuple(l)
         else:
@@ -771,10 +919,7 @@ class _Unjellier:
 
 
     def _unjelly_list(self, lst):
-        l = range(len(lst))
-        for elem in l:
-            self.unjellyInto(l, elem, lst[elem])
-        return l
+        return self._unjellyItems(lst)[0]
 
 
     def _unjellySetOrFrozenset(self, lst, containerType):
@@ -786,12 +931,7 @@ class _Unjellier:
 
         @param containerType: the type of C{set} to use.
         """
-        l = range(len(lst))
-        finished = True
-        for elem in l:
-            data = self.unjellyInto(l, elem, lst[elem])
-            if isinstance(data, NotKnown):
-                finished = False
+        l, finished = self._unjellyItems(lst)
         if not finished:
             return _Container(l, containerType)
         else:
@@ -815,6 +955,9 @@ class _Unjellier:
     def _unjelly_dictionary(self, lst):
         d = {}
         for k, v in lst:
+            if type(k) is not ListType and type(v) is not ListType:
+                d[k] = v
+                continue
             kvd = _DictKeyAndValue(d)
             self.unjellyInto(kvd, 0, k)
             self.unjellyInto(kvd, 1, v)
@@ -13,7 +13,10 @@ import types
 
 from twisted.enterprise.adbapi import ConnectionPool, ConnectionLost
 from twisted.enterprise.adbapi import Connection, Transaction
+from twisted.enterprise.adbapi import ConnectionPoolTimeout
+from twisted.enterprise.adbapi import RoutingConnectionPool
 from twisted.internet import reactor, defer, interfaces
+from twisted.internet.task import Clock
 from twisted.python.failure import Failure
 
 
@@ -663,17 +666,40 @@ class NonThreadPool(object):
 
 
 
-class DummyConnectionPool(ConnectionPool):
-    """
-    A testable L{ConnectionPool};
+class QueuedThreadPool(object):
     """
-    threadpool = NonThreadPool()
+    A fake thread pool which runs the calls given to it only when told to.
 
+    @ivar calls: A C{list} of the calls not run yet.
+    """
     def __init__(self):
+        self.calls = []
+
+
+    def callInThreadWithCallback(self, onResult, f, *a, **kw):
+        self.calls.append((onResult, f, a, kw))
+
+
+    def runNext(self):
         """
-        Don't forward init call.
+        Run the oldest call not run yet, in the calling thread.
         """
-        self.reactor = reactor
+        onResult, f, a, kw = self.calls.pop(0)
+        NonThreadPool().callInThreadWithCallback(onResult, f, *a, **kw)
+
+
+
+class DummyConnectionPool(ConnectionPool):
+    """
+    A testable L{ConnectionPool} which runs its calls synchronously and uses
+    a L{SynchronousReactor}.
+    """
+
+    def __init__(self, dbapiName='twisted.test.test_adbapi', *args, **kw):
+        kw.setdefault('cp_reactor', SynchronousReactor())
+        ConnectionPool.__init__(self, dbapiName, *args, **kw)
+        self.threadpool = NonThreadPool()
+        self.reactor = self._reactor
 
 
 
@@ -710,6 +736,43 @@ class EventReactor(object):
 
 
 
+class SynchronousReactor(Clock, EventReactor):
+    """
+    A L{Clock} which also has L{EventReactor}'s event methods, and whose
+    C{callFromThread} calls the function at once.
+    """
+    def __init__(self):
+        Clock.__init__(self)
+        EventReactor.__init__(self, False)
+
+
+    def callFromThread(self, f, *args, **kw):
+        f(*args, **kw)
+
+
+
+class RecordingTransaction(object):
+    """
+    A fake L{Transaction} which records the cursor methods called on it in
+    the C{executed} list of its pool.
+    """
+    def __init__(self, pool, connection):
+        self._pool = pool
+
+
+    def execute(self, *args, **kw):
+        self._pool.executed.append(('execute', args))
+
+
+    def executemany(self, *args, **kw):
+        self._pool.executed.append(('executemany', args))
+
+
+    def close(self):
+        pass
+
+
+
 class ConnectionPoolTestCase(unittest.TestCase):
     """
     Unit tests for L{ConnectionPool}.
@@ -817,3 +880,320 @@ class ConnectionPoolTestCase(unittest.TestCase):
         pool.close()
         # But not anymore.
         self.assertFalse(reactor.triggers)
+
+
+    def test_batchedOperationsShareTransaction(self):
+        """
+        L{ConnectionPool.runBatchedOperation} runs all the operations queued
+        in one reactor iteration in a single interaction, with consecutive
+        operations sharing a statement passed to C{executemany}.
+        """
+        class Connection(object):
+            def __init__(self, pool):
+                pass
+
+            def commit(self):
+                pass
+
+        pool = DummyConnectionPool()
+        pool.executed = []
+        pool.connectionFactory = Connection
+        pool.transactionFactory = RecordingTransaction
+        results = []
+        for i in range(3):
+            pool.runBatchedOperation(
+                "insert into simple values (?)", (i,)).addCallback(
+                results.append)
+        pool.runBatchedOperation("delete from other").addCallback(
+            results.append)
+        self.assertEqual(pool.executed, [])
+
+        pool.reactor.advance(0)
+        self.assertEqual(pool.executed, [
+                ('executemany',
+                 ("insert into simple values (?)", [(0,), (1,), (2,)])),
+                ('execute', ("delete from other",))])
+        self.assertEqual(results, [None] * 4)
+        self.assertEqual(pool.statistics()['completed'], 1)
+
+
+    def test_batchedOperationsRolledBackTogether(self):
+        """
+        If one operation of a batch fails, the batch's transaction is rolled
+        back and every operation of the batch fails.
+        """
+        pool = DummyConnectionPool('sqlite3', ':memory:')
+        pool.runOperation("create table simple (x integer)")
+        first = pool.runBatchedOperation("insert into simple values (1)")
+        second = pool.runBatchedOperation("insert into nowhere values (1)")
+        pool.reactor.advance(0)
+
+        failure = self.failureResultOf(first)
+        self.assertIdentical(self.failureResultOf(second), failure)
+        self.assertEqual(
+            self.successResultOf(pool.runQuery("select x from simple")), [])
+
+
+    def test_statementCache(self):
+        """
+        With C{cp_statement_cache}, L{ConnectionPool.runQuery} reuses the
+        cursor of a previous query with the same statement, and closes the
+        least recently used cursors beyond the cache size.
+        """
+        pool = DummyConnectionPool('sqlite3', ':memory:', cp_statement_cache=1)
+        self.assertEqual(
+            self.successResultOf(pool.runQuery("select 1")), [(1,)])
+        cache = pool._statements[pool.threadID()]
+        cursor = cache["select 1"]
+        self.assertEqual(
+            self.successResultOf(pool.runQuery("select 1")), [(1,)])
+        self.assertIdentical(cache["select 1"], cursor)
+
+        self.assertEqual(
+            self.successResultOf(pool.runQuery("select ?", (2,))), [(2,)])
+        self.assertEqual(list(cache), ["select ?"])
+        self.assertRaises(Exception, cursor.execute, "select 1")
+
+
+    def test_failedStatementNotCached(self):
+        """
+        A cursor whose statement failed is closed rather than cached.
+        """
+        pool = DummyConnectionPool('sqlite3', ':memory:', cp_statement_cache=5)
+        self.failureResultOf(pool.runOperation("insert into nowhere values (1)"))
+        self.assertEqual(pool._statements, {})
+
+
+    def test_disconnectDropsStatementCache(self):
+        """
+        Disconnecting a connection forgets the cursors cached for it.
+        """
+        pool = DummyConnectionPool('sqlite3', ':memory:', cp_statement_cache=5)
+        self.successResultOf(pool.runQuery("select 1"))
+        pool.disconnect(pool.connections[pool.threadID()])
+        self.assertEqual(pool._statements, {})
+
+
+    def test_waitTimeout(self):
+        """
+        A request which waits longer than C{cp_wait_timeout} for a pool
+        thread fails with L{ConnectionPoolTimeout}, and is not run once a
+        thread becomes free.
+        """
+        calls = []
+        pool = DummyConnectionPool(cp_wait_timeout=5)
+        pool.threadpool = QueuedThreadPool()
+        d = pool.runWithConnection(calls.append)
+        pool.reactor.advance(4)
+        self.assertNoResult(d)
+        pool.reactor.advance(1)
+        self.failureResultOf(d, ConnectionPoolTimeout)
+
+        pool.threadpool.runNext()
+        self.assertEqual(calls, [])
+        statistics = pool.statistics()
+        self.assertEqual(statistics['timedOut'], 1)
+        self.assertEqual(statistics['waiting'], 0)
+        self.assertEqual(statistics['completed'], 0)
+
+
+    def test_waitTimeoutCancelled(self):
+        """
+        The timeout of a request is cancelled once the request has been run.
+        """
+        class Connection(object):
+            def __init__(self, pool):
+                pass
+
+            def commit(self):
+                pass
+
+        pool = DummyConnectionPool(cp_wait_timeout=5)
+        pool.connectionFactory = Connection
+        pool.threadpool = QueuedThreadPool()
+        d = pool.runWithConnection(lambda connection: "result")
+        pool.threadpool.runNext()
+        self.assertEqual(self.successResultOf(d), "result")
+        self.assertEqual(pool.reactor.getDelayedCalls(), [])
+
+
+    def test_statistics(self):
+        """
+        L{ConnectionPool.statistics} counts the requests waiting for and
+        holding a connection, the requests which found the pool saturated,
+        and how long requests waited and ran.
+        """
+        class Connection(object):
+            def __init__(self, pool):
+                pass
+
+            def commit(self):
+                pass
+
+        def slow(connection):
+            pool.reactor.advance(2)
+
+        pool = DummyConnectionPool(cp_min=1, cp_max=1)
+        pool.connectionFactory = Connection
+        pool.threadpool = QueuedThreadPool()
+        pool.runWithConnection(slow)
+        pool.runWithConnection(slow)
+        statistics = pool.statistics()
+        self.assertEqual(
+            (statistics['max'], statistics['waiting'], statistics['active'],
+             statistics['saturated']),
+            (1, 2, 0, 1))
+
+        pool.reactor.advance(3)
+        pool.threadpool.runNext()
+        pool.threadpool.runNext()
+        statistics = pool.statistics()
+        self.assertEqual(
+            (statistics['waiting'], statistics['active'],
+             statistics['completed'], statistics['queueWaitMax'],
+             statistics['queueWaitTotal'], statistics['queryTimeMax'],
+             statistics['queryTimeTotal']),
+            (0, 0, 2, 5, 8, 2, 4))
+
+
+    def test_warmUp(self):
+        """
+        L{ConnectionPool.warmUp} opens C{cp_min} connections, each in its own
+        pool thread.
+        """
+        opened = []
+        # The pool closes its connections from the reactor thread.
+        pool = ConnectionPool('sqlite3', self.mktemp(), cp_min=3, cp_max=3,
+                              cp_openfun=opened.append,
+                              check_same_thread=False)
+        pool.start()
+        self.addCleanup(pool.close)
+        d = pool.warmUp()
+        def cbWarm(result):
+            self.assertIdentical(result, None)
+            self.assertEqual(len(opened), 3)
+            self.assertEqual(len(pool.connections), 3)
+        return d.addCallback(cbWarm)
+
+
+    def test_warmUpFailure(self):
+        """
+        The L{Deferred} returned by L{ConnectionPool.warmUp} fails with the
+        error of a connection attempt which failed.
+        """
+        pool = DummyConnectionPool(cp_min=1)
+        self.failureResultOf(pool.warmUp(), AttributeError)
+
+
+    def test_startWarmsUp(self):
+        """
+        L{ConnectionPool.start} warms the pool up if C{cp_warmup} is set, and
+        logs warm-up failures.
+        """
+        pool = DummyConnectionPool(cp_min=1, cp_warmup=True)
+        pool.threadpool.start = lambda: None
+        pool.start()
+        self.assertEqual(len(self.flushLoggedErrors(AttributeError)), 1)
+
+        pool = DummyConnectionPool('sqlite3', ':memory:', cp_min=1)
+        pool.threadpool.start = lambda: None
+        pool.start()
+        self.assertEqual(pool.connections, {})
+
+
+
+class RoutingConnectionPoolTestCase(unittest.TestCase):
+    """
+    Tests for L{RoutingConnectionPool}, with sqlite3 files standing in for a
+    primary database and its replicas.
+    """
+
+    def makePool(self, value):
+        """
+        Make a L{DummyConnectionPool} for a new sqlite3 database whose table
+        C{simple} holds C{value}.
+        """
+        pool = DummyConnectionPool('sqlite3', self.mktemp())
+        pool.runOperation(simple_table_schema)
+        pool.runOperation("insert into simple values (?)", (value,))
+        return pool
+
+
+    def test_queriesGoToReplicas(self):
+        """
+        L{RoutingConnectionPool.runQuery} is run by the replicas in turn when
+        they are equally loaded.
+        """
+        router = RoutingConnectionPool(
+            self.makePool(0), [self.makePool(1), self.makePool(2)])
+        results = [self.successResultOf(router.runQuery("select x from simple"))
+                   for i in range(4)]
+        self.assertEqual(results, [[(1,)], [(2,)], [(1,)], [(2,)]])
+
+
+    def test_queriesAvoidLoadedReplicas(self):
+        """
+        L{RoutingConnectionPool.runQuery} is run by the replica with the
+        fewest waiting and running requests for each of its connections.
+        """
+        busy = self.makePool(1)
+        busy.threadpool = QueuedThreadPool()
+        busy.runQuery("select x from simple")
+        router = RoutingConnectionPool(self.makePool(0), [busy, self.makePool(2)])
+        results = [self.successResultOf(router.runQuery("select x from simple"))
+                   for i in range(2)]
+        self.assertEqual(results, [[(2,)], [(2,)]])
+
+
+    def test_queriesWithoutReplicas(self):
+        """
+        Without replicas, L{RoutingConnectionPool.runQuery} is run by the
+        primary.
+        """
+        router = RoutingConnectionPool(self.makePool(0))
+        self.assertEqual(
+            self.successResultOf(router.runQuery("select x from simple")),
+            [(0,)])
+
+
+    def test_writesGoToPrimary(self):
+        """
+        L{RoutingConnectionPool.runOperation},
+        L{RoutingConnectionPool.runBatchedOperation},
+        L{RoutingConnectionPool.runInteraction} and
+        L{RoutingConnectionPool.runWithConnection} are run by the primary.
+        """
+        primary = self.makePool(0)
+        replica = self.makePool(1)
+        router = RoutingConnectionPool(primary, [replica])
+        router.runOperation("insert into simple values (10)")
+        router.runBatchedOperation("insert into simple values (11)")
+        primary.reactor.advance(0)
+        router.runInteraction(
+            lambda transaction: transaction.execute(
+                "insert into simple values (12)"))
+        router.runWithConnection(
+            lambda connection: connection.execute(
+                "insert into simple values (13)"))
+        select = "select x from simple order by x"
+        self.assertEqual(self.successResultOf(primary.runQuery(select)),
+                         [(0,), (10,), (11,), (12,), (13,)])
+        self.assertEqual(self.successResultOf(replica.runQuery(select)),
+                         [(1,)])
+
+
+    def test_startAndClose(self):
+        """
+        L{RoutingConnectionPool.start} and L{RoutingConnectionPool.close}
+        start and close all its pools.
+        """
+        pools = [self.makePool(0), self.makePool(1)]
+        for pool in pools:
+            pool.threadpool.start = lambda: None
+            pool.threadpool.stop = lambda: None
+        router = RoutingConnectionPool(pools[0], pools[1:])
+        router.start()
+        self.assertEqual([pool.running for pool in pools], [True, True])
+        router.close()
+        self.assertEqual([pool.running for pool in pools], [False, False])
+        self.assertEqual([pool.connections for pool in pools], [{}, {}])
@@ -684,6 +684,96 @@ class CommandDispatchTests(unittest.TestCase):
         self._localCallbackErrorLoggingTest(callResult)
 
 
+    def _answer(self, tag):
+        """
+        Deliver an answer to the L{Hello} command with the given tag.
+        """
+        self.dispatcher.ampBoxReceived(amp.AmpBox({
+                    'hello': "yay", '_answer': tag}))
+
+
+    def test_maxOutstandingRequests(self):
+        """
+        Once L{amp.BoxDispatcher.maxOutstandingRequests} commands are awaiting
+        an answer, further commands are queued, and sent in order as answers
+        arrive.
+        """
+        self.dispatcher.maxOutstandingRequests = 2
+        results = [self.dispatcher.callRemote(Hello, hello=str(i))
+                   for i in range(4)]
+        self.assertEqual(
+            [box['hello'] for box in self.sender.sentBoxes], ['0', '1'])
+        self._answer(self.sender.sentBoxes[1][amp.ASK])
+        self.assertEqual(
+            [box['hello'] for box in self.sender.sentBoxes], ['0', '1', '2'])
+        self._answer(self.sender.sentBoxes[0][amp.ASK])
+        self._answer(self.sender.sentBoxes[2][amp.ASK])
+        self._answer(self.sender.sentBoxes[3][amp.ASK])
+        for result in results:
+            self.assertEqual(
+                self.successResultOf(result), dict(hello="yay", Print=None))
+
+
+    def test_unthrottledCommand(self):
+        """
+        A command with C{_throttled} set to C{False} is sent even if
+        L{amp.BoxDispatcher.maxOutstandingRequests} commands are awaiting an
+        answer.
+        """
+        class UrgentHello(Hello):
+            commandName = 'hello'
+            _throttled = False
+        self.dispatcher.maxOutstandingRequests = 1
+        self.dispatcher.callRemote(Hello, hello='first')
+        self.dispatcher.callRemote(UrgentHello, hello='urgent')
+        self.assertEqual(
+            [box['hello'] for box in self.sender.sentBoxes],
+            ['first', 'urgent'])
+
+
+    def test_requiresNoAnswerNotThrottled(self):
+        """
+        Commands which do not require an answer are never queued.
+        """
+        self.dispatcher.maxOutstandingRequests = 1
+        self.dispatcher.callRemote(Hello, hello='first')
+        self.dispatcher.callRemote(NoAnswerHello, hello='second')
+        self.assertEqual(len(self.sender.sentBoxes), 2)
+
+
+    def test_waitForCapacity(self):
+        """
+        L{amp.BoxDispatcher.waitForCapacity} returns a L{Deferred} which fires
+        once a command can be sent without being queued.
+        """
+        self.successResultOf(self.dispatcher.waitForCapacity())
+        self.dispatcher.maxOutstandingRequests = 1
+        self.dispatcher.callRemote(Hello, hello='first')
+        self.dispatcher.callRemote(Hello, hello='second')
+        ready = self.dispatcher.waitForCapacity()
+        self.assertNoResult(ready)
+        self._answer(self.sender.sentBoxes[0][amp.ASK])
+        self.assertNoResult(ready)
+        self._answer(self.sender.sentBoxes[1][amp.ASK])
+        self.assertIdentical(self.successResultOf(ready), None)
+
+
+    def test_queuedRequestsFailOnConnectionLost(self):
+        """
+        Queued commands and L{amp.BoxDispatcher.waitForCapacity} L{Deferred}s
+        fail with the reason the connection was lost.
+        """
+        self.dispatcher.maxOutstandingRequests = 1
+        sent = self.dispatcher.callRemote(Hello, hello='first')
+        queued = self.dispatcher.callRemote(Hello, hello='second')
+        ready = self.dispatcher.waitForCapacity()
+        self.dispatcher.stopReceivingBoxes(
+            Failure(error.ConnectionDone("simulated")))
+        for result in sent, queued, ready:
+            self.failureResultOf(result, error.ConnectionDone)
+        self.assertEqual(len(self.sender.sentBoxes), 1)
+
+
 
 class SimpleGreeting(amp.Command):
     """
@@ -1061,6 +1151,62 @@ class BinaryProtocolTests(unittest.TestCase):
         self.assertFalse(transport.disconnecting)
 
 
+    def test_receiveBoxesInPieces(self):
+        """
+        Boxes are emitted when the last of their bytes is received, however
+        the data is split up.
+        """
+        boxes = [amp.Box({"first": "1", "second": "22"}),
+                 amp.Box({"third": "x" * 300}),
+                 amp.Box({"fourth": ""})]
+        data = ''.join([box.serialize() for box in boxes])
+        protocol = amp.BinaryBoxProtocol(self)
+        protocol.makeConnection(StringTransport())
+        for i in range(len(data)):
+            protocol.dataReceived(data[i])
+            if i == len(boxes[0].serialize()) - 2:
+                self.assertEqual(self.boxes, [])
+        self.assertEqual(self.boxes, boxes)
+        self.assertEqual(protocol.recvd, '')
+
+
+    def test_coalesceBoxesSentWhileReceiving(self):
+        """
+        Boxes sent while received data is being processed are written to the
+        transport with a single call once it has been processed.
+        """
+        protocol = amp.BinaryBoxProtocol(self)
+        protocol.makeConnection(self)
+        def ampBoxReceived(box):
+            protocol.sendBox(amp.Box(reply=box['ask']))
+        self.ampBoxReceived = ampBoxReceived
+        protocol.dataReceived(
+            amp.Box(ask='1').serialize() + amp.Box(ask='2').serialize())
+        self.assertEqual(
+            self.data,
+            [amp.Box(reply='1').serialize() + amp.Box(reply='2').serialize()])
+
+
+    def test_quitBoxWrittenBeforeDisconnecting(self):
+        """
+        A L{amp.QuitBox} sent while received data is being processed is
+        written to the transport before the connection is closed.
+        """
+        events = []
+        transport = StringTransport()
+        transport.write = lambda data: events.append(('write', data))
+        transport.loseConnection = lambda: events.append(('lose', None))
+        protocol = amp.BinaryBoxProtocol(self)
+        protocol.makeConnection(transport)
+        def ampBoxReceived(box):
+            amp.QuitBox(bye='now')._sendTo(protocol)
+        self.ampBoxReceived = ampBoxReceived
+        protocol.dataReceived(amp.Box(ask='1').serialize())
+        self.assertEqual(
+            events,
+            [('write', amp.QuitBox(bye='now').serialize()), ('lose', None)])
+
+
     def test_sendBox(self):
         """
         When a binary box protocol sends a box, it should emit the serialized
@@ -2453,7 +2599,8 @@ class NoNetworkProtocol(amp.AMP):
     L{MagicSchemaCommand}, if L{MagicSchemaCommand} has been handled by
     this protocol.
     """
-    def _sendBoxCommand(self, commandName, strings, requiresAnswer):
+    def _sendBoxCommand(self, commandName, strings, requiresAnswer,
+                        throttle=True):
         """
         Return a Deferred which fires with the original strings.
         """
@@ -260,6 +260,78 @@ class BananaTestCase(unittest.TestCase):
         self.assertEqual(encoded(baseNegIn - 3), '\x03' + baseLongNegOut)
 
 
+    def test_singleWrite(self):
+        """
+        L{banana.Banana.sendEncoded} writes the whole encoding of an object to
+        the transport with a single call.
+        """
+        writes = []
+        self.enc.transport.write = writes.append
+        self.enc.sendEncoded([1, "two", [3.0, -4, ["five"]]])
+        self.assertEqual(len(writes), 1)
+        self.enc.dataReceived(writes[0])
+        self.assertEqual(self.result, [1, "two", [3.0, -4, ["five"]]])
+
+
+    def test_largeStringInChunks(self):
+        """
+        A string which arrives in many chunks is decoded once all of it has
+        been received, and the receive buffer is emptied afterwards.
+        """
+        value = "x" * (banana.SIZE_LIMIT - 1)
+        self.enc.sendEncoded(["before", value, "after"])
+        encoded = self.io.getvalue()
+        for i in range(0, len(encoded), 1000):
+            self.enc.dataReceived(encoded[i:i + 1000])
+        self.assertEqual(self.result, ["before", value, "after"])
+        self.assertEqual(len(self.enc._buffer), 0)
+
+
+    def test_compaction(self):
+        """
+        Once enough decoded bytes have accumulated at the front of the receive
+        buffer, they are discarded while an incomplete token is kept.
+        """
+        value = "y" * banana._COMPACT_THRESHOLD
+        self.enc.sendEncoded(value)
+        self.enc.sendEncoded(value)
+        encoded = self.io.getvalue()
+        self.enc.dataReceived(encoded[:-10])
+        self.assertEqual(self.result, value)
+        self.assertEqual(self.enc._offset, 0)
+        self.assertEqual(
+            str(self.enc._buffer), encoded[len(encoded) // 2:-10])
+        del self.result
+        self.enc.dataReceived(encoded[-10:])
+        self.assertEqual(self.result, value)
+
+
+    def test_deeplyNested(self):
+        """
+        Deeply nested lists are decoded without recursion.
+        """
+        depth = 5000
+        encoded = "\x01\x80" * depth + "\x01\x81"
+        self.enc.dataReceived(encoded)
+        result = self.result
+        for i in range(depth):
+            result, = result
+        self.assertEqual(result, 1)
+
+
+    def test_decodedBeforeError(self):
+        """
+        Tokens decoded before an invalid type byte are not decoded again by
+        the next call to L{banana.Banana.dataReceived}.
+        """
+        results = []
+        self.enc.expressionReceived = results.append
+        self.assertRaises(
+            NotImplementedError, self.enc.dataReceived, "\x01\x81\x01\xff")
+        self.assertEqual(results, [1])
+        self.assertEqual(self.enc._offset, 2)
+
+
 
 class GlobalCoderTests(unittest.TestCase):
     """
@@ -102,6 +102,34 @@ class E(object):
 
 
 
+class CountingSecurityOptions(jelly.SecurityOptions):
+    """
+    Security options which record the arguments of their checks.
+
+    @ivar calls: A C{dict} mapping the name of each check to a C{list} of the
+        arguments it was called with.
+    """
+    def __init__(self):
+        jelly.SecurityOptions.__init__(self)
+        self.calls = {"type": [], "class": [], "module": []}
+
+
+    def isTypeAllowed(self, typeName):
+        self.calls["type"].append(typeName)
+        return jelly.SecurityOptions.isTypeAllowed(self, typeName)
+
+
+    def isClassAllowed(self, klass):
+        self.calls["class"].append(klass)
+        return jelly.SecurityOptions.isClassAllowed(self, klass)
+
+
+    def isModuleAllowed(self, moduleName):
+        self.calls["module"].append(moduleName)
+        return jelly.SecurityOptions.isModuleAllowed(self, moduleName)
+
+
+
 class SimpleJellyTest:
     def __init__(self, x, y):
         self.x = x
@@ -492,6 +520,42 @@ class JellyTestCase(unittest.TestCase):
         self.assertIdentical(x, A, "A came back: %s" % x)
 
 
+    def test_tasterConsultedOncePerClass(self):
+        """
+        Within one call to L{jelly.jelly} or L{jelly.unjelly}, the taster is
+        asked about each type, type name and class only once, and about a
+        module once for each class in it.
+        """
+        taster = CountingSecurityOptions()
+        taster.allowInstancesOf(A, B)
+        items = [A(), A(), B(), B(), u"x", u"y", None, None]
+        jellied = jelly.jelly(items, taster)
+        jellyCalls = taster.calls
+        taster.calls = {"type": [], "class": [], "module": []}
+        result = jelly.unjelly(jellied, taster)
+        self.assertEqual(len(result), len(items))
+        self.assertIsInstance(result[1], A)
+        self.assertEqual(result[4:], [u"x", u"y", None, None])
+        for calls in [jellyCalls["type"], jellyCalls["class"],
+                      taster.calls["type"], taster.calls["class"]]:
+            self.assertEqual(sorted(set(calls)), sorted(calls))
+        # The module of each class is checked once.
+        self.assertEqual(len(taster.calls["module"]), 2)
+
+
+    def test_primitiveItemsShareReferences(self):
+        """
+        Strings and numbers in containers are jellied as themselves, while
+        containers which appear more than once are still jellied once.
+        """
+        shared = [1, 2.5, "three"]
+        value = {"first": shared, "second": shared, 4: 5L}
+        result = jelly.unjelly(jelly.jelly(value))
+        self.assertEqual(result, value)
+        self.assertIdentical(result["first"], result["second"])
+        self.assertEqual(jelly.jelly([1, "two", 3.0]), ["list", 1, "two", 3.0])
+
+
     def test_unjellyable(self):
         """
         Test that if Unjellyable is used to deserialize a jellied object,
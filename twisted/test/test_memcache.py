@@ -5,16 +5,17 @@
 Test the memcache client protocol.
 """
 
-from twisted.internet.error import ConnectionDone
+from twisted.internet.error import ConnectionDone, ConnectionRefusedError
 
 from twisted.protocols.memcache import MemCacheProtocol, NoSuchCommand
 from twisted.protocols.memcache import ClientError, ServerError
+from twisted.protocols.memcache import ShardedMemCacheClient
 
 from twisted.trial.unittest import TestCase
 from twisted.test.proto_helpers import StringTransportWithDisconnection
 from twisted.internet.task import Clock
 from twisted.internet.defer import Deferred, gatherResults, TimeoutError
-from twisted.internet.defer import DeferredList
+from twisted.internet.defer import DeferredList, succeed, fail
 
 
 
@@ -697,3 +698,312 @@ class CommandFailureTests(CommandMixin, TestCase):
         parameters except C{d} are ignored.
         """
         return self.assertFailure(d, RuntimeError)
+
+
+
+class CountingTransport(StringTransportWithDisconnection):
+    """
+    A transport which counts its writes.
+    """
+    writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        StringTransportWithDisconnection.write(self, data)
+
+
+
+class FakeShardedClient(ShardedMemCacheClient):
+    """
+    A L{ShardedMemCacheClient} which connects its protocols to
+    L{CountingTransport}s instead of servers.
+
+    @ivar protocols: A C{dict} mapping C{(host, port)} to the last protocol
+        connected to that server.
+
+    @ivar refused: The C{(host, port)} of the servers refusing connections.
+    """
+
+    def __init__(self, servers, reactor):
+        ShardedMemCacheClient.__init__(self, servers, reactor)
+        self.protocols = {}
+        self.refused = set()
+
+
+    def _connectServer(self, host, port):
+        if (host, port) in self.refused:
+            return fail(ConnectionRefusedError())
+        protocol = MemCacheProtocol()
+        protocol.callLater = self._reactor.callLater
+        transport = CountingTransport()
+        transport.protocol = protocol
+        protocol.makeConnection(transport)
+        self.protocols[host, port] = protocol
+        return succeed(protocol)
+
+
+
+class ShardedMemCacheClientTests(TestCase):
+    """
+    Tests for L{ShardedMemCacheClient}.
+    """
+
+    servers = [("a", 1), ("b", 2), ("c", 3)]
+
+    def setUp(self):
+        self.clock = Clock()
+        self.client = FakeShardedClient(self.servers, self.clock)
+
+
+    def keysOf(self, server, count=1):
+        """
+        Return C{count} keys held by C{server}.
+        """
+        keys = []
+        i = 0
+        while len(keys) < count:
+            key = "key%d" % (i,)
+            if self.client._serverFor(key).name == "%s:%d" % server:
+                keys.append(key)
+            i += 1
+        return keys
+
+
+    def test_distribution(self):
+        """
+        Keys are spread evenly over the servers.
+        """
+        counts = {}
+        for i in range(3000):
+            name = self.client._serverFor("key%d" % (i,)).name
+            counts[name] = counts.get(name, 0) + 1
+        self.assertEqual(sorted(counts), ["a:1", "b:2", "c:3"])
+        for count in counts.values():
+            self.assertTrue(700 < count < 1300, counts)
+
+
+    def test_consistency(self):
+        """
+        Removing a server from the ring only moves the keys it held.
+        """
+        keys = ["key%d" % (i,) for i in range(1000)]
+        before = [self.client._serverFor(key).name for key in keys]
+        self.client._servers[0].ejected = True
+        self.client._buildRing()
+        after = [self.client._serverFor(key).name for key in keys]
+        for old, new in zip(before, after):
+            if old != "a:1":
+                self.assertEqual(old, new)
+            else:
+                self.assertNotEqual(new, "a:1")
+
+
+    def test_routing(self):
+        """
+        Commands on a key are sent to the server holding it.
+        """
+        key = self.keysOf(("b", 2))[0]
+        d = self.client.set(key, "value")
+        self.clock.advance(0)
+        self.assertEqual(self.client.protocols.keys(), [("b", 2)])
+        protocol = self.client.protocols["b", 2]
+        self.assertEqual(protocol.transport.value(),
+                         "set %s 0 0 5\r\nvalue\r\n" % (key,))
+        protocol.dataReceived("STORED\r\n")
+        self.assertEqual(self.successResultOf(d), True)
+
+
+    def test_pipelining(self):
+        """
+        The commands sent to a server during one reactor iteration are
+        written at its end, in a single write.
+        """
+        keys = self.keysOf(("a", 1), 3)
+        d1 = self.client.set(keys[0], "x")
+        d2 = self.client.delete(keys[1])
+        d3 = self.client.increment(keys[2], 2)
+        protocol = self.client.protocols["a", 1]
+        self.assertEqual(protocol.transport.value(), "")
+        self.clock.advance(0)
+        self.assertEqual(protocol.transport.writes, 1)
+        self.assertEqual(
+            protocol.transport.value(),
+            "set %s 0 0 1\r\nx\r\ndelete %s\r\nincr %s 2\r\n" % tuple(keys))
+        protocol.dataReceived("STORED\r\nDELETED\r\n5\r\n")
+        self.assertEqual(
+            [self.successResultOf(d) for d in (d1, d2, d3)], [True, True, 5])
+
+
+    def test_getMultiple(self):
+        """
+        L{ShardedMemCacheClient.getMultiple} asks each server for its keys
+        and merges the answers.
+        """
+        aKey = self.keysOf(("a", 1))[0]
+        cKeys = self.keysOf(("c", 3), 2)
+        d = self.client.getMultiple([aKey] + cKeys)
+        self.clock.advance(0)
+        a = self.client.protocols["a", 1]
+        c = self.client.protocols["c", 3]
+        self.assertEqual(a.transport.value(), "get %s\r\n" % (aKey,))
+        self.assertEqual(c.transport.value(), "get %s %s\r\n" % tuple(cKeys))
+        c.dataReceived("VALUE %s 0 1\r\nc\r\nEND\r\n" % (cKeys[0],))
+        self.assertNoResult(d)
+        a.dataReceived("VALUE %s 0 1\r\na\r\nEND\r\n" % (aKey,))
+        self.assertEqual(self.successResultOf(d), {
+                aKey: (0, "a"), cKeys[0]: (0, "c"), cKeys[1]: (0, None)})
+
+
+    def test_coalescedGets(self):
+        """
+        Concurrent gets of the same key share one request.
+        """
+        key = self.keysOf(("a", 1))[0]
+        d1 = self.client.get(key)
+        d2 = self.client.get(key)
+        self.clock.advance(0)
+        protocol = self.client.protocols["a", 1]
+        self.assertEqual(protocol.transport.value(), "get %s\r\n" % (key,))
+        protocol.dataReceived("VALUE %s 0 1\r\nv\r\nEND\r\n" % (key,))
+        self.assertEqual(self.successResultOf(d1), (0, "v"))
+        self.assertEqual(self.successResultOf(d2), (0, "v"))
+        self.assertEqual(self.client._gets, {})
+
+
+    def test_writeEndsCoalescing(self):
+        """
+        A get of a key issued after a write of that key does not share the
+        request of an earlier get.
+        """
+        key = self.keysOf(("a", 1))[0]
+        self.client.get(key)
+        self.client.set(key, "v")
+        self.client.get(key)
+        self.clock.advance(0)
+        self.assertEqual(
+            self.client.protocols["a", 1].transport.value(),
+            "get %s\r\nset %s 0 0 1\r\nv\r\nget %s\r\n" % (key, key, key))
+
+
+    def test_coalescedGetFailure(self):
+        """
+        All the gets sharing a request fail if it fails.
+        """
+        key = self.keysOf(("a", 1))[0]
+        d1 = self.client.get(key)
+        d2 = self.client.get(key)
+        self.clock.advance(0)
+        self.client.protocols["a", 1].transport.loseConnection()
+        self.failureResultOf(d1, ConnectionDone)
+        self.failureResultOf(d2, ConnectionDone)
+
+
+    def test_invalidKey(self):
+        """
+        Commands with an invalid key fail with L{ClientError}.
+        """
+        self.failureResultOf(self.client.get(1), ClientError)
+        self.failureResultOf(self.client.set(1, "v"), ClientError)
+        self.failureResultOf(self.client.getMultiple(["a", 1]), ClientError)
+
+
+    def test_reconnect(self):
+        """
+        A server whose connection was lost is connected to again when it is
+        next needed.
+        """
+        key = self.keysOf(("a", 1))[0]
+        d = self.client.get(key)
+        first = self.client.protocols["a", 1]
+        first.transport.loseConnection()
+        self.failureResultOf(d, ConnectionDone)
+        self.client.get(key)
+        self.assertNotIdentical(self.client.protocols["a", 1], first)
+
+
+    def test_ejection(self):
+        """
+        A server which fails C{failureLimit} times in a row is ejected from
+        the ring, so its keys go to the other servers, until C{retryDelay}
+        seconds have passed.
+        """
+        key = self.keysOf(("a", 1))[0]
+        self.client.refused.add(("a", 1))
+        for i in range(self.client.failureLimit):
+            self.failureResultOf(self.client.get(key), ConnectionRefusedError)
+        self.assertNotEqual(self.client._serverFor(key).name, "a:1")
+
+        self.client.get(key)
+        self.clock.advance(0)
+        self.assertNotIn(("a", 1), self.client.protocols)
+
+        self.client.refused.clear()
+        self.clock.advance(self.client.retryDelay)
+        self.assertEqual(self.client._serverFor(key).name, "a:1")
+
+
+    def test_lostConnectionsEject(self):
+        """
+        A connection lost with commands outstanding counts as one failure,
+        and a server which answers a command is no longer counted as
+        failing.
+        """
+        key = self.keysOf(("a", 1))[0]
+        d1 = self.client.get(key)
+        d2 = self.client.set(key, "v")
+        self.clock.advance(0)
+        self.client.protocols["a", 1].transport.loseConnection()
+        self.failureResultOf(d1, ConnectionDone)
+        self.failureResultOf(d2, ConnectionDone)
+        self.assertEqual(self.client._servers[0].failures, 1)
+
+        d = self.client.get(key)
+        self.clock.advance(0)
+        self.client.protocols["a", 1].dataReceived("END\r\n")
+        self.assertEqual(self.successResultOf(d), (0, None))
+        self.assertEqual(self.client._servers[0].failures, 0)
+
+        for i in range(self.client.failureLimit):
+            d = self.client.get(key)
+            self.client.protocols["a", 1].transport.loseConnection()
+            self.failureResultOf(d, ConnectionDone)
+        self.assertNotEqual(self.client._serverFor(key).name, "a:1")
+
+
+    def test_serverErrorsDoNotEject(self):
+        """
+        Errors reported by a server do not count as failures of the server.
+        """
+        key = self.keysOf(("a", 1))[0]
+        for i in range(self.client.failureLimit):
+            d = self.client.get(key)
+            self.clock.advance(0)
+            self.client.protocols["a", 1].dataReceived(
+                "SERVER_ERROR out of memory\r\n")
+            self.failureResultOf(d, ServerError)
+        self.flushLoggedErrors()
+        self.assertEqual(self.client._serverFor(key).name, "a:1")
+
+
+    def test_noServer(self):
+        """
+        When every server is ejected, commands fail with L{RuntimeError}.
+        """
+        for server in self.client._servers:
+            server.ejected = True
+        self.client._buildRing()
+        self.failureResultOf(self.client.get("key"), RuntimeError)
+        self.failureResultOf(self.client.getMultiple(["key"]), RuntimeError)
+
+
+    def test_flushAll(self):
+        """
+        L{ShardedMemCacheClient.flushAll} flushes every server.
+        """
+        d = self.client.flushAll()
+        self.clock.advance(0)
+        for protocol in self.client.protocols.values():
+            self.assertEqual(protocol.transport.value(), "flush_all\r\n")
+            protocol.dataReceived("OK\r\n")
+        self.assertEqual(len(self.client.protocols), 3)
+        self.assertEqual(self.successResultOf(d), True)
@@ -183,3 +183,18 @@ class Element(object):
             raise MissingTemplateLoader(self)
         return loader.load()
 
+
+    def _renderCompiled(self, request):
+        """
+        Render this element for the flattener.
+
+        If C{render} is not overridden and the loader can provide a compiled
+        form of its template, as L{twisted.web.template.XMLString} and
+        L{twisted.web.template.XMLFile} do, that is returned instead of the
+        template, so that its static parts do not have to be flattened again.
+        """
+        loadCompiled = getattr(self.loader, '_loadCompiled', None)
+        if loadCompiled is None or type(self).render != Element.render:
+            return self.render(request)
+        return loadCompiled()
+
@@ -163,6 +163,165 @@ def escapedComment(data):
 
 
 
+class _Precompiled(object):
+    """
+    A part of a template which was flattened ahead of time by
+    L{_compileTemplate}.  L{_flattenElement} writes its data out unchanged.
+
+    @ivar data: The flattened output.
+    @type data: C{bytes}
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+    def __repr__(self):
+        return '_Precompiled(%r)' % (self.data,)
+
+
+
+class _ContentHole(object):
+    """
+    A dynamic part of a template compiled by L{_compileTemplate} which was
+    found in the content of a L{Tag}.  L{_flattenElement} flattens it in the
+    context of element content, as it would when flattening the original
+    L{Tag}, regardless of the context the compiled template is flattened in.
+
+    @ivar root: The dynamic Stan object.
+    """
+    __slots__ = ('root',)
+
+    def __init__(self, root):
+        self.root = root
+
+
+    def __repr__(self):
+        return '_ContentHole(%r)' % (self.root,)
+
+
+
+def _isStatic(root):
+    """
+    Determine whether C{root} always flattens to the same bytes, in other words
+    whether it contains no slots, render directives, or anything else which
+    could produce different output each time it is flattened.
+
+    @param root: A Stan object, as found in a loaded template.
+
+    @rtype: C{bool}
+    """
+    if isinstance(root, (bytes, unicode, CDATA, Comment, CharRef)):
+        return True
+    if isinstance(root, Tag):
+        if root.render is not None or root.slotData is not None:
+            return False
+        for value in root.attributes.itervalues():
+            if not _isStatic(value):
+                return False
+        return _isStatic(root.children)
+    if isinstance(root, (tuple, list)):
+        for element in root:
+            if not _isStatic(element):
+                return False
+        return True
+    return False
+
+
+
+def _flattenStatic(root):
+    """
+    Flatten a static Stan object, as identified by L{_isStatic}, in the
+    context of element content.
+
+    @rtype: C{bytes}
+    """
+    return ''.join(_flattenTree(None, root))
+
+
+
+def _compileElement(root, compiled, inTag):
+    """
+    Append the compiled form of C{root} to C{compiled}.
+
+    @param root: A Stan object, as found in a loaded template.
+
+    @param compiled: A C{list} to which the compiled form of C{root} is
+        appended.
+
+    @param inTag: C{True} if C{root} is part of the content of a L{Tag}, in
+        which case text is always escaped with L{escapeForContent}.  Otherwise
+        how text is escaped depends on where the template is flattened, so
+        text is left to be escaped at that time.
+    """
+    if isinstance(root, (bytes, unicode)):
+        if inTag:
+            compiled.append(_Precompiled(escapeForContent(root)))
+        else:
+            compiled.append(root)
+    elif isinstance(root, (tuple, list)):
+        for element in root:
+            _compileElement(element, compiled, inTag)
+    elif isinstance(root, (CDATA, Comment, CharRef)):
+        compiled.append(_Precompiled(_flattenStatic(root)))
+    elif (isinstance(root, Tag) and root.render is None and
+          root.slotData is None):
+        if not root.tagName:
+            _compileElement(root.children, compiled, inTag)
+        elif _isStatic(root):
+            compiled.append(_Precompiled(_flattenStatic(root)))
+        elif _isStatic(root.attributes.values()):
+            # Flattening the tag with a single empty child yields exactly its
+            # start and end tags.
+            empty = _flattenStatic(
+                Tag(root.tagName, attributes=root.attributes, children=['']))
+            end = empty.rindex('</')
+            compiled.append(_Precompiled(empty[:end]))
+            _compileElement(root.children, compiled, True)
+            compiled.append(_Precompiled(empty[end:]))
+        elif inTag:
+            compiled.append(_ContentHole(root))
+        else:
+            compiled.append(root)
+    elif inTag:
+        compiled.append(_ContentHole(root))
+    else:
+        compiled.append(root)
+
+
+
+def _compileTemplate(document):
+    """
+    Flatten the parts of a loaded template which never change ahead of time.
+
+    Static text and markup are turned into L{_Precompiled} chunks of bytes,
+    leaving slots, tags with render directives and any other dynamic parts of
+    the template in place between them (wrapped in L{_ContentHole} if they
+    were inside a L{Tag}).  Flattening the result produces the
+    same output as flattening C{document}, but only the dynamic parts have to
+    be traversed and escaped each time.
+
+    @param document: A C{list} of Stan objects, as returned by
+        L{ITemplateLoader.load}.  It must not be modified after it has been
+        compiled.
+
+    @return: A C{list} of L{_Precompiled} and L{_ContentHole} instances and
+        Stan objects from C{document}.
+    """
+    compiled = []
+    _compileElement(document, compiled, False)
+    merged = []
+    for element in compiled:
+        if (isinstance(element, _Precompiled) and merged and
+                isinstance(merged[-1], _Precompiled)):
+            merged[-1] = _Precompiled(merged[-1].data + element.data)
+        else:
+            merged.append(element)
+    return merged
+
+
+
 def _getSlotValue(name, slotData, default=None):
     """
     Find the value of the named slot in the given stack of slot data.
@@ -217,7 +376,11 @@ def _flattenElement(request, root, slotData, renderFactory, dataEscaper):
                   renderFactory=renderFactory):
         return _flattenElement(request, newRoot, slotData, renderFactory,
                                dataEscaper)
-    if isinstance(root, (bytes, unicode)):
+    if type(root) is _Precompiled:
+        yield root.data
+    elif type(root) is _ContentHole:
+        yield keepGoing(root.root, escapeForContent)
+    elif isinstance(root, (bytes, unicode)):
         yield dataEscaper(root)
     elif isinstance(root, slot):
         slotValue = _getSlotValue(root.name, slotData, root.default)
@@ -283,7 +446,11 @@ def _flattenElement(request, root, slotData, renderFactory, dataEscaper):
     elif isinstance(root, Deferred):
         yield root.addCallback(lambda result: (result, keepGoing(result)))
     elif IRenderable.providedBy(root):
-        result = root.render(request)
+        renderCompiled = getattr(root, '_renderCompiled', None)
+        if renderCompiled is not None:
+            result = renderCompiled(request)
+        else:
+            result = root.render(request)
         yield keepGoing(result, renderFactory=root)
     else:
         raise UnsupportedType(root)
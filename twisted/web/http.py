@@ -529,6 +529,41 @@ class HTTPClient(basic.LineReceiver):
 NO_BODY_CODES = (204, 304)
 
 
+
+def _statusLine(version, code, message):
+    """
+    Format the status line which begins an HTTP response.
+
+    @param version: The HTTP version of the response, for example
+        C{b"HTTP/1.1"}.
+    @type version: C{bytes}
+
+    @param code: The response code.
+    @type code: C{int}
+
+    @param message: The reason phrase for the response code.
+    @type message: C{str}
+
+    @return: The status line, including the trailing CRLF.
+    @rtype: C{bytes}
+    """
+    return (
+        version + b" " + intToBytes(code) + b" " + networkString(message) +
+        b"\r\n")
+
+
+
+# Status lines for every well-known response code with its standard reason
+# phrase, encoded once at import time rather than once per response.
+_statusLines = {}
+for _version in (b"HTTP/1.0", b"HTTP/1.1"):
+    for _code, _message in RESPONSES.items():
+        _statusLines[_version, _code, _message] = _statusLine(
+            _version, _code, _message)
+del _version, _code, _message
+
+
+
 @implementer(interfaces.IConsumer)
 class Request:
     """
@@ -966,10 +1001,12 @@ class Request:
             self.startedWriting = 1
             version = self.clientproto
             l = []
-            l.append(
-                version + b" " +
-                intToBytes(self.code) + b" " +
-                networkString(self.code_message) + b"\r\n")
+            statusLine = _statusLines.get(
+                (version, self.code, self.code_message))
+            if statusLine is None:
+                statusLine = _statusLine(
+                    version, self.code, self.code_message)
+            l.append(statusLine)
 
             # if we don't have a content length, we send data in
             # chunked mode, so that we can support pipelining in
@@ -992,7 +1029,9 @@ class Request:
             if self.etag is not None:
                 self.responseHeaders.setRawHeaders(b'ETag', [self.etag])
 
+            append = l.append
             for name, values in self.responseHeaders.getAllRawHeaders():
+                prefix = name + b": "
                 for value in values:
                     if not isinstance(value, bytes):
                         warnings.warn(
@@ -1001,7 +1040,7 @@ class Request:
                             category=DeprecationWarning, stacklevel=2)
                         # Backward compatible cast for non-bytes values
                         value = networkString('%s' % (value,))
-                    l.extend([name, b": ", value, b"\r\n"])
+                    append(prefix + value + b"\r\n")
 
             for cookie in self.cookies:
                 l.append(networkString('Set-Cookie: %s\r\n' % (cookie,)))
@@ -1942,6 +1981,11 @@ class HTTPFactory(protocol.ServerFactory):
         log datetime string.
     @type _logDateTimeCall: L{IDelayedCall} provided
 
+    @ivar _responseDate: A cached HTTP datetime string for the I{Date} header
+        of responses, updated by C{_logDateTimeCall} along with
+        C{_logDateTime}, or C{None} if the factory is not running.
+    @type _responseDate: C{bytes}
+
     @ivar _logFormatter: See the C{logFormatter} parameter to L{__init__}
 
     @ivar _nativeize: A flag that indicates whether the log file being written
@@ -1961,6 +2005,8 @@ class HTTPFactory(protocol.ServerFactory):
 
     _reactor = reactor
 
+    _responseDate = None
+
     def __init__(self, logPath=None, timeout=60*60*12, logFormatter=None):
         """
         @param logFormatter: An object to format requests into log lines for
@@ -1975,16 +2021,21 @@ class HTTPFactory(protocol.ServerFactory):
             logFormatter = combinedLogFormatter
         self._logFormatter = logFormatter
 
-        # For storing the cached log datetime and the callback to update it
+        # For storing the cached log and response datetimes and the callback
+        # to update them
         self._logDateTime = None
         self._logDateTimeCall = None
+        self._responseDate = None
 
 
     def _updateLogDateTime(self):
         """
-        Update log datetime periodically, so we aren't always recalculating it.
+        Update log and response datetimes periodically, so we aren't always
+        recalculating them.
         """
-        self._logDateTime = datetimeToLogString(self._reactor.seconds())
+        now = self._reactor.seconds()
+        self._logDateTime = datetimeToLogString(now)
+        self._responseDate = datetimeToString(now)
         self._logDateTimeCall = self._reactor.callLater(1, self._updateLogDateTime)
 
 
@@ -2020,6 +2071,7 @@ class HTTPFactory(protocol.ServerFactory):
         if self._logDateTimeCall is not None and self._logDateTimeCall.active():
             self._logDateTimeCall.cancel()
             self._logDateTimeCall = None
+        self._responseDate = None
 
 
     def _openLogFile(self, path):
@@ -111,6 +111,11 @@ class Headers(object):
     @cvar _caseMappings: A C{dict} that maps lowercase header names
         to their canonicalized representation.
 
+    @cvar _canonicalNames: A C{dict} caching the capitalization of header
+        names not found in C{_caseMappings}, so that the same headers are not
+        re-capitalized for every message.  At most C{_maxCanonicalNames}
+        entries are kept.
+
     @ivar _rawHeaders: A C{dict} mapping header names as C{bytes} to C{lists} of
         header values as C{bytes}.
     """
@@ -123,6 +128,9 @@ class Headers(object):
         b'www-authenticate': b'WWW-Authenticate',
         b'x-xss-protection': b'X-XSS-Protection'}
 
+    _canonicalNames = {}
+    _maxCanonicalNames = 1000
+
     def __init__(self, rawHeaders=None):
         self._rawHeaders = {}
         if rawHeaders is not None:
@@ -255,7 +263,14 @@ class Headers(object):
         @rtype: C{bytes}
         @return: The canonical name of the header.
         """
-        return self._caseMappings.get(name, _dashCapitalize(name))
+        canonical = self._caseMappings.get(name)
+        if canonical is None:
+            canonical = self._canonicalNames.get(name)
+            if canonical is None:
+                canonical = _dashCapitalize(name)
+                if len(self._canonicalNames) < self._maxCanonicalNames:
+                    self._canonicalNames[name] = canonical
+        return canonical
 
 
 __all__ = ['Headers']
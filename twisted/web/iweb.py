@@ -623,6 +623,77 @@ class _IRequestEncoderFactory(Interface):
 
 
 
+class ISessionStore(Interface):
+    """
+    A container for the L{twisted.web.server.Session} instances of a
+    L{twisted.web.server.Site}, responsible for expiring them once they have
+    been idle for longer than their C{sessionTimeout}.
+
+    A store is installed by assigning it to L{twisted.web.server.Site.sessions}
+    and is used through the mapping operations below, keyed by session uid.
+    """
+
+    def add(session):
+        """
+        Store a newly created session and start tracking its expiration.
+
+        @param session: The new session.
+        @type session: L{twisted.web.server.Session}
+        """
+
+
+    def touch(session):
+        """
+        Record activity on a session, called by
+        L{twisted.web.server.Session.touch} after it updates the session's
+        C{lastModified}.
+
+        @param session: A session previously given to L{add} or returned by
+            C{__getitem__}.
+        @type session: L{twisted.web.server.Session}
+        """
+
+
+    def __getitem__(uid):
+        """
+        Get a live session.
+
+        @param uid: The unique identifier of the session.
+        @type uid: C{bytes}
+
+        @raise KeyError: If there is no such session or it has expired.
+
+        @rtype: L{twisted.web.server.Session}
+        """
+
+
+    def __delitem__(uid):
+        """
+        Forget a session, called by L{twisted.web.server.Session.expire}.
+
+        @param uid: The unique identifier of the session.
+        @type uid: C{bytes}
+
+        @raise KeyError: If there is no such session.
+        """
+
+
+    def __contains__(uid):
+        """
+        @param uid: The unique identifier of a session.
+        @type uid: C{bytes}
+
+        @return: C{True} if the session is live, C{False} otherwise.
+        """
+
+
+    def __len__():
+        """
+        @return: The number of live sessions in this store.
+        """
+
+
+
 class IClientRequest(Interface):
     """
     An object representing an HTTP request to make to an HTTP server.
@@ -782,6 +853,6 @@ UNKNOWN_LENGTH = u"twisted.web.iweb.UNKNOWN_LENGTH"
 __all__ = [
     "IUsernameDigestHash", "ICredentialFactory", "IRequest",
     "IBodyProducer", "IRenderable", "IResponse", "_IRequestEncoder",
-    "_IRequestEncoderFactory", "IClientRequest",
+    "_IRequestEncoderFactory", "ISessionStore", "IClientRequest",
 
     "UNKNOWN_LENGTH"]
@@ -100,6 +100,19 @@ def getChildForRequest(resource, request):
 
 
 
+# Incremented whenever the static children of any Resource change, so that
+# _StaticIndex instances know to discard what they have indexed.
+_staticGeneration = 0
+
+def _staticChildrenChanged():
+    """
+    Record that the static children of some L{Resource} have changed.
+    """
+    global _staticGeneration
+    _staticGeneration += 1
+
+
+
 @implementer(IResource)
 class Resource:
     """
@@ -152,9 +165,11 @@ class Resource:
 
     def delEntity(self, name):
         del self.children[name]
+        _staticChildrenChanged()
 
     def reallyPutEntity(self, name, entity):
         self.children[name] = entity
+        _staticChildrenChanged()
 
     # Concrete HTTP interface
 
@@ -218,6 +233,7 @@ class Resource:
         """
         self.children[path] = child
         child.server = self.server
+        _staticChildrenChanged()
 
 
     def render(self, request):
@@ -261,6 +277,91 @@ class Resource:
 
 
 
+class _StaticIndexNode(object):
+    """
+    A node of a L{_StaticIndex}.
+
+    @ivar resource: The resource found at the path leading to this node.
+
+    @ivar static: C{True} if the children of C{resource} are looked up with
+        L{Resource.getChildWithDefault}, so that a child in
+        C{resource.children} is found without calling anything.
+
+    @ivar children: A C{dict} mapping path segments to the nodes of the static
+        children of C{resource} which have been looked up so far.
+    """
+    __slots__ = ('resource', 'static', 'children')
+
+    def __init__(self, resource):
+        self.resource = resource
+        getChildWithDefault = getattr(resource, 'getChildWithDefault', None)
+        self.static = (
+            getattr(getChildWithDefault, '__func__', None) is
+            Resource.__dict__['getChildWithDefault'] and
+            isinstance(getattr(resource, 'children', None), dict))
+        self.children = {}
+
+
+
+class _StaticIndex(object):
+    """
+    A trie of the static children of a resource tree, as registered with
+    L{Resource.putChild}, used to find the resource for a request without
+    calling C{getChildWithDefault} for each segment of its path.
+
+    Traversal uses the index for as long as the path names static children of
+    resources which do not customize C{getChildWithDefault}, and falls back
+    to L{getChildForRequest} at the first segment which is not static.  The
+    trie is filled in as paths are looked up, and is discarded whenever
+    L{Resource.putChild}, L{Resource.reallyPutEntity} or
+    L{Resource.delEntity} is called on any resource.  Changes made by other
+    means, such as modifying C{children} directly or changing C{isLeaf} of a
+    resource which was already indexed, are not noticed.
+
+    @ivar resource: The root of the resource tree.
+
+    @ivar _root: The L{_StaticIndexNode} for C{resource}.
+
+    @ivar _generation: The value of C{_staticGeneration} when C{_root} was
+        created.
+    """
+
+    def __init__(self, resource):
+        self.resource = resource
+        self._root = _StaticIndexNode(resource)
+        self._generation = _staticGeneration
+
+
+    def getChildForRequest(self, request):
+        """
+        Traverse the resource tree to find who will handle the request, like
+        L{getChildForRequest} starting at C{self.resource}.
+        """
+        if self._generation != _staticGeneration:
+            self._root = _StaticIndexNode(self.resource)
+            self._generation = _staticGeneration
+        node = self._root
+        postpath = request.postpath
+        count = 0
+        for pathElement in postpath:
+            resource = node.resource
+            if not node.static or resource.isLeaf:
+                break
+            child = node.children.get(pathElement)
+            if child is None:
+                if pathElement not in resource.children:
+                    break
+                child = _StaticIndexNode(resource.children[pathElement])
+                node.children[pathElement] = child
+            node = child
+            count += 1
+        if count:
+            request.prepath.extend(postpath[:count])
+            del postpath[:count]
+        return getChildForRequest(node.resource, request)
+
+
+
 def _computeAllowedMethods(resource):
     """
     Compute the allowed methods on a C{Resource} based on defined render_FOO
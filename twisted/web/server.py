@@ -10,7 +10,9 @@ infrastructure.
 from __future__ import division, absolute_import
 
 import copy
+import heapq
 import os
+import string
 try:
     from urllib import quote
 except ImportError:
@@ -19,6 +21,7 @@ except ImportError:
     def quote(string, *args, **kwargs):
         return _quote(string.decode('charmap'), *args, **kwargs).encode('charmap')
 
+import time
 import zlib
 
 from zope.interface import implementer
@@ -32,9 +35,12 @@ if _PY3:
 else:
     from twisted.spread.pb import Copyable, ViewPoint
 from twisted.internet import address
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThreadPool
 from twisted.web import iweb, http, html
 from twisted.web.http import unquote
 from twisted.python import log, reflect, failure, components
+from twisted.python.runtime import platform
 from twisted import copyright
 # Re-enable as part of #6178 when twisted.web.util is ported to Python 3:
 if not _PY3:
@@ -54,10 +60,47 @@ else:
 
 NOT_DONE_YET = 1
 
+try:
+    import resource as _resource
+except ImportError:
+    _resource = None
+    _RUSAGE_THREAD = None
+else:
+    # Python 2 does not define RUSAGE_THREAD, though Linux supports it.
+    _RUSAGE_THREAD = getattr(_resource, 'RUSAGE_THREAD', None)
+    if _RUSAGE_THREAD is None and platform.isLinux():
+        _RUSAGE_THREAD = 1
+
+
+
+def _threadCPUTime():
+    """
+    Get the processor time used by the calling thread so far, as reported by
+    C{getrusage(RUSAGE_THREAD)}.
+
+    @return: The user and system time of this thread, in seconds.
+    @rtype: C{float}
+    """
+    usage = _resource.getrusage(_RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+
+if hasattr(time, 'thread_time'):
+    _compressionClock = time.thread_time
+elif _RUSAGE_THREAD is not None:
+    _compressionClock = _threadCPUTime
+else:
+    # The processor time of the whole process, which also counts the work of
+    # any other thread compressing at the same time.
+    _compressionClock = getattr(time, 'process_time', time.clock)
+
 __all__ = [
     'supportedMethods',
     'Request',
     'Session',
+    'MemorySessionStore',
+    'DirectorySessionStore',
     'Site',
     'version',
     'NOT_DONE_YET',
@@ -174,7 +217,8 @@ class Request(Copyable, http.Request, components.Componentized):
 
         # set various default headers
         self.setHeader(b'server', version)
-        self.setHeader(b'date', http.datetimeToString())
+        self.setHeader(
+            b'date', self.site._responseDate or http.datetimeToString())
 
         # Resource Identification
         self.prepath = []
@@ -223,11 +267,46 @@ class Request(Copyable, http.Request, components.Componentized):
         """
         if self._encoder:
             data = self._encoder.finish()
+            if isinstance(data, Deferred):
+                # The encoder is still working on earlier data; finish once it
+                # is done with all of it.
+                self._encoder = None
+                data.addCallback(self._finishEncoding)
+                data.addErrback(self._failEncoding)
+                return
             if data:
                 http.Request.write(self, data)
         return http.Request.finish(self)
 
 
+    def _finishEncoding(self, data):
+        """
+        Write the last of the data from an encoder which finished
+        asynchronously and finish the request.
+
+        @param data: The remaining encoded data.
+        @type data: C{bytes}
+        """
+        if self._disconnected:
+            return
+        if data:
+            http.Request.write(self, data)
+        http.Request.finish(self)
+
+
+    def _failEncoding(self, reason):
+        """
+        Log a failure of an encoder which finished asynchronously and drop the
+        connection, since the response cannot be completed.
+
+        @param reason: The failure.
+        @type reason: L{failure.Failure}
+        """
+        log.err(reason, "Encoding the response failed.")
+        if not self._disconnected:
+            self.channel.transport.loseConnection()
+
+
     def render(self, resrc):
         """
         Ask a resource to render itself.
@@ -446,11 +525,108 @@ class GzipEncoderFactory(object):
     @cvar compressLevel: The compression level used by the compressor, default
         to 9 (highest).
 
+    @cvar compressedTypes: The default value of the C{excludedTypes} parameter
+        to L{__init__}: media types whose content is already compressed.
+    @type compressedTypes: C{frozenset} of C{bytes}
+
+    @ivar minimumSize: See L{__init__}.
+    @ivar excludedTypes: See L{__init__}.
+    @ivar blockSize: See L{__init__}.
+    @ivar threadThreshold: See L{__init__}.
+
+    @ivar _reactor: The L{IReactorThreads} provider used to run compression in
+        C{_threadpool}.
+    @ivar _threadpool: The L{ThreadPool} compression of large blocks is moved
+        to, or C{None} to always compress in the reactor thread.
+
+    @ivar responsesCompressed: The number of responses which were compressed.
+    @type responsesCompressed: C{int}
+
+    @ivar responsesSkipped: The number of responses which were sent without
+        compression because of their type or size.
+    @type responsesSkipped: C{int}
+
+    @ivar bytesIn: The number of bytes given to encoders to be compressed.
+    @type bytesIn: C{int}
+
+    @ivar bytesOut: The number of compressed bytes produced by encoders.
+    @type bytesOut: C{int}
+
+    @ivar compressionTime: The processor time, in seconds, spent compressing
+        data.  This is the time of the compressing thread where Python or the
+        platform can measure it, as on Linux.  Otherwise it is the time of the
+        whole process, which is only an approximation: it also counts the
+        work of other threads, and it is elapsed time with Python 2 on
+        Windows, where C{time.clock} measures wall time.
+    @type compressionTime: C{float}
+
     @since: 12.3
     """
 
     compressLevel = 9
 
+    compressedTypes = frozenset([
+        b'application/gzip', b'application/x-gzip', b'application/zip',
+        b'application/x-bzip2', b'application/x-xz',
+        b'application/x-7z-compressed', b'application/x-rar-compressed',
+        b'application/pdf', b'image/gif', b'image/jpeg', b'image/png',
+        b'image/webp', b'audio/*', b'video/*'])
+
+    def __init__(self, compressLevel=None, minimumSize=0, excludedTypes=None,
+                 blockSize=0, reactor=None, threadpool=None,
+                 threadThreshold=64 * 1024):
+        """
+        @param compressLevel: If not C{None}, the compression level to use
+            instead of L{compressLevel}.
+
+        @param minimumSize: Responses with a I{Content-Length} smaller than
+            this many bytes are not compressed.
+        @type minimumSize: C{int}
+
+        @param excludedTypes: Media types of responses which are not
+            compressed, for example C{b"image/png"}, or C{b"video/*"} for all
+            subtypes of one type.  Defaults to L{compressedTypes}.
+        @type excludedTypes: iterable of C{bytes}
+
+        @param blockSize: Response data is collected until at least this many
+            bytes are available before it is compressed, so that many small
+            writes are compressed at once.
+        @type blockSize: C{int}
+
+        @param reactor: The reactor used to run compression in C{threadpool}.
+            Defaults to the global reactor.
+
+        @param threadpool: If not C{None}, a L{ThreadPool} in which blocks of
+            at least C{threadThreshold} bytes are compressed.  The compressed
+            data is still written in the order in which it was given to the
+            encoder.
+        @type threadpool: L{twisted.python.threadpool.ThreadPool}
+
+        @param threadThreshold: The size in bytes of the smallest block which
+            is compressed in C{threadpool}.
+        @type threadThreshold: C{int}
+        """
+        if compressLevel is not None:
+            self.compressLevel = compressLevel
+        self.minimumSize = minimumSize
+        if excludedTypes is None:
+            excludedTypes = self.compressedTypes
+        self.excludedTypes = frozenset(
+            [mediaType.lower() for mediaType in excludedTypes])
+        self.blockSize = blockSize
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._threadpool = threadpool
+        self.threadThreshold = threadThreshold
+
+        self.responsesCompressed = 0
+        self.responsesSkipped = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.compressionTime = 0.0
+
+
     def encoderForRequest(self, request):
         """
         Check the headers if the client accepts gzip encoding, and encodes the
@@ -460,16 +636,72 @@ class GzipEncoderFactory(object):
             'accept-encoding', [])
         supported = ','.join(acceptHeaders).split(',')
         if 'gzip' in supported:
-            encoding = request.responseHeaders.getRawHeaders(
-                'content-encoding')
-            if encoding:
-                encoding = '%s,gzip' % ','.join(encoding)
-            else:
-                encoding = 'gzip'
+            return _GzipEncoder(self, request)
+
+
+    def compressionRatio(self):
+        """
+        Return the ratio of the size of the data produced by this factory's
+        encoders to the size of the data they were given.
+
+        @return: The compression ratio, or C{None} if nothing has been
+            compressed yet.
+        @rtype: C{float}
+        """
+        if not self.bytesIn:
+            return None
+        return self.bytesOut / self.bytesIn
+
+
+    def _shouldCompress(self, request):
+        """
+        Decide whether the response to C{request} should be compressed,
+        based on the response headers set so far.
+
+        @rtype: C{bool}
+        """
+        contentType = request.responseHeaders.getRawHeaders(b'content-type')
+        if contentType:
+            mediaType = contentType[-1].split(b';', 1)[0].strip().lower()
+            if (mediaType in self.excludedTypes or
+                    mediaType.split(b'/', 1)[0] + b'/*' in self.excludedTypes):
+                return False
+        if self.minimumSize:
+            contentLength = request.responseHeaders.getRawHeaders(
+                b'content-length')
+            if contentLength:
+                try:
+                    length = int(contentLength[-1])
+                except ValueError:
+                    pass
+                else:
+                    if length < self.minimumSize:
+                        return False
+        return True
+
 
-            request.responseHeaders.setRawHeaders('content-encoding',
-                                                  [encoding])
-            return _GzipEncoder(self.compressLevel, request)
+
+def _compress(compressor, data, flush):
+    """
+    Compress C{data} with C{compressor}, measuring the time spent.
+
+    @param compressor: A compression object from L{zlib.compressobj}.
+
+    @param data: The data to compress.
+    @type data: C{bytes}
+
+    @param flush: If C{True}, also flush and finish the compressed stream.
+    @type flush: C{bool}
+
+    @return: The compressed data and the time spent compressing it, as
+        measured by C{_compressionClock}.
+    @rtype: 2-C{tuple} of C{bytes} and C{float}
+    """
+    before = _compressionClock()
+    result = compressor.compress(data)
+    if flush:
+        result += compressor.flush()
+    return result, _compressionClock() - before
 
 
 
@@ -478,41 +710,145 @@ class _GzipEncoder(object):
     """
     An encoder which supports gzip.
 
+    Whether the response is compressed at all is decided when the first data
+    is encoded, or when the response is finished without any data, since only
+    then are all the response headers known.
+
     @ivar _zlibCompressor: The zlib compressor instance used to compress the
-        stream.
+        stream, or C{None} if the response is not being compressed.
+
+    @ivar _factory: The L{GzipEncoderFactory} which created this encoder.
 
     @ivar _request: A reference to the originating request.
 
+    @ivar _compress: C{None} until it has been decided whether to compress the
+        response, then C{True} or C{False}.
+
+    @ivar _buffer: A C{list} of C{bytes} waiting to be compressed once there
+        are at least C{_factory.blockSize} of them.
+    @ivar _buffered: The total length of the data in C{_buffer}.
+
+    @ivar _pending: C{None}, or a L{Deferred} which fires when the last block
+        passed to the factory's thread pool has been compressed and written.
+
     @since: 12.3
     """
 
     _zlibCompressor = None
+    _compress = None
+    _pending = None
 
-    def __init__(self, compressLevel, request):
-        self._zlibCompressor = zlib.compressobj(
-            compressLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    def __init__(self, factory, request):
+        self._factory = factory
         self._request = request
+        self._buffer = []
+        self._buffered = 0
+
+
+    def _start(self):
+        """
+        Decide whether to compress the response and, if so, set up the
+        response headers and compressor.
+        """
+        factory = self._factory
+        request = self._request
+        self._compress = factory._shouldCompress(request)
+        if not self._compress:
+            factory.responsesSkipped += 1
+            return
+
+        factory.responsesCompressed += 1
+        encoding = request.responseHeaders.getRawHeaders('content-encoding')
+        if encoding:
+            encoding = '%s,gzip' % ','.join(encoding)
+        else:
+            encoding = 'gzip'
+        request.responseHeaders.setRawHeaders('content-encoding', [encoding])
+        # Remove the content-length header, we can't honor it because we
+        # compress on the fly.
+        request.responseHeaders.removeHeader(b'content-length')
+        self._zlibCompressor = zlib.compressobj(
+            factory.compressLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+    def _compressBlock(self, flush):
+        """
+        Compress the buffered data, in the factory's thread pool if it is large
+        enough or if earlier blocks are still being compressed there.
+
+        @param flush: If C{True}, finish the compressed stream.
+
+        @return: The compressed data, or a L{Deferred} which fires with
+            C{b""} once the compressed data has been written to the request.
+        """
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        factory = self._factory
+        factory.bytesIn += len(data)
+        compressor = self._zlibCompressor
+        if flush:
+            self._zlibCompressor = None
+
+        if factory._threadpool is not None and (
+                self._pending is not None or
+                len(data) >= factory.threadThreshold):
+            if self._pending is None:
+                self._pending = succeed(None)
+
+            def compress(ignored):
+                return deferToThreadPool(
+                    factory._reactor, factory._threadpool,
+                    _compress, compressor, data, flush)
+
+            def write(result):
+                compressed, elapsed = result
+                factory.bytesOut += len(compressed)
+                factory.compressionTime += elapsed
+                if compressed and not self._request._disconnected:
+                    http.Request.write(self._request, compressed)
+
+            self._pending.addCallback(compress).addCallback(write)
+            pending = self._pending
+            if flush:
+                self._pending = None
+                return pending.addCallback(lambda ignored: b'')
+            return b''
+
+        compressed, elapsed = _compress(compressor, data, flush)
+        factory.bytesOut += len(compressed)
+        factory.compressionTime += elapsed
+        return compressed
 
 
     def encode(self, data):
         """
         Write to the request, automatically compressing data on the fly.
         """
-        if not self._request.startedWriting:
-            # Remove the content-length header, we can't honor it
-            # because we compress on the fly.
-            self._request.responseHeaders.removeHeader(b'content-length')
-        return self._zlibCompressor.compress(data)
+        if self._compress is None:
+            self._start()
+        if not self._compress:
+            return data
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered < self._factory.blockSize:
+            return b''
+        return self._compressBlock(False)
 
 
     def finish(self):
         """
         Finish handling the request request, flushing any data from the zlib
         buffer.
+
+        @return: The remaining compressed data, or a L{Deferred} which fires
+            with it once compression in the factory's thread pool is done.
         """
-        remain = self._zlibCompressor.flush()
-        self._zlibCompressor = None
-        return remain
+        if self._compress is None:
+            self._start()
+        if not self._compress:
+            return b''
+        return self._compressBlock(True)
 
 
 
@@ -534,10 +870,13 @@ class Session(components.Componentized):
     @ivar _reactor: An object providing L{IReactorTime} to use for scheduling
         expiration.
     @ivar sessionTimeout: timeout of a session, in seconds.
+    @ivar _store: The L{iweb.ISessionStore} provider tracking the expiration
+        of this session, or C{None} if it uses its own delayed call.
     """
     sessionTimeout = 900
 
     _expireCall = None
+    _store = None
 
     def __init__(self, site, uid, reactor=None):
         """
@@ -594,6 +933,289 @@ class Session(components.Componentized):
         self.lastModified = self._reactor.seconds()
         if self._expireCall is not None:
             self._expireCall.reset(self.sessionTimeout)
+        if self._store is not None:
+            self._store.touch(self)
+
+
+
+@implementer(iweb.ISessionStore)
+class MemorySessionStore(object):
+    """
+    An in-memory L{iweb.ISessionStore} which expires all of its idle sessions
+    from a single periodic sweep, rather than keeping one delayed call per
+    session in the reactor.
+
+    Sessions are expired between C{sessionTimeout} and C{sessionTimeout +
+    sweepInterval} seconds after their last activity.
+
+    @ivar sweepInterval: The number of seconds between two sweeps.
+    @ivar _reactor: An object providing L{IReactorTime} used to schedule the
+        sweeps.
+    @ivar _sessions: A C{dict} mapping session uids to live sessions.
+    @ivar _expiries: A heap of C{(deadline, uid)} tuples, at most one per
+        session.  A session is only checked, and the deadline of a session
+        which has been touched since it was pushed only moved, when a sweep
+        reaches its entry.
+    @ivar _sweepCall: The L{IDelayedCall} of the next sweep, or C{None} if
+        there are no sessions to expire.
+    """
+    _sweepCall = None
+
+    def __init__(self, reactor=None, sweepInterval=60):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.sweepInterval = sweepInterval
+        self._sessions = {}
+        self._expiries = []
+
+
+    def add(self, session):
+        """
+        Store C{session} and schedule a sweep if none is pending.
+
+        @see: L{iweb.ISessionStore.add}
+        """
+        session._store = self
+        self._sessions[session.uid] = session
+        heapq.heappush(
+            self._expiries,
+            (session.lastModified + session.sessionTimeout, session.uid))
+        if self._sweepCall is None:
+            self._sweepCall = self._reactor.callLater(
+                self.sweepInterval, self._sweep)
+
+
+    def touch(self, session):
+        """
+        Do nothing: the new C{lastModified} of C{session} is taken into account
+        when a sweep reaches its old deadline.
+
+        @see: L{iweb.ISessionStore.touch}
+        """
+
+
+    def _sweep(self):
+        """
+        Expire every session which has been idle for longer than its
+        C{sessionTimeout} and schedule the next sweep.
+        """
+        self._sweepCall = None
+        now = self._reactor.seconds()
+        expiries = self._expiries
+        sessions = self._sessions
+        while expiries and expiries[0][0] <= now:
+            deadline, uid = heapq.heappop(expiries)
+            session = sessions.get(uid)
+            if session is None:
+                continue
+            deadline = session.lastModified + session.sessionTimeout
+            if deadline <= now:
+                session.expire()
+            else:
+                heapq.heappush(expiries, (deadline, uid))
+        if expiries:
+            self._sweepCall = self._reactor.callLater(
+                self.sweepInterval, self._sweep)
+
+
+    def __getitem__(self, uid):
+        return self._sessions[uid]
+
+
+    def __delitem__(self, uid):
+        session = self._sessions.pop(uid)
+        session._store = None
+
+
+    def __contains__(self, uid):
+        return uid in self._sessions
+
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+
+@implementer(iweb.ISessionStore)
+class DirectorySessionStore(object):
+    """
+    An L{iweb.ISessionStore} which records the sessions of a L{Site} as empty
+    files in a directory, so that the processes of a site served by several
+    workers sharing that directory recognize each other's sessions.
+
+    The modification time of each file is the time of the last activity on
+    the session in any process, and whichever process sweeps first removes
+    the files of idle sessions.  Only the existence and activity of sessions
+    are shared: the components of a L{Session} stay in the process which set
+    them, and other processes create a fresh L{Site.sessionFactory} instance
+    when they first see the session.
+
+    @ivar site: The L{Site} whose C{sessionFactory} creates the local
+        L{Session} instances.
+    @ivar path: A L{FilePath} of the directory holding the session files.
+    @ivar sweepInterval: The number of seconds between two sweeps.
+    @ivar sessionTimeout: The number of seconds after which an idle session is
+        removed, which should be the C{sessionTimeout} of the sessions of
+        C{site}.  Unlike L{MemorySessionStore}, this store cannot rely on the
+        session instances, which may not exist in this process.
+    @ivar _reactor: An object providing L{IReactorTime} used to schedule the
+        sweeps.
+    @ivar _sessions: A C{dict} mapping session uids to the L{Session} instances
+        of this process.
+    @ivar _sweepCall: The L{IDelayedCall} of the next sweep, or C{None} if
+        this process has no sessions and the directory was empty after the
+        last sweep.
+    """
+    _sweepCall = None
+
+    def __init__(self, site, path, reactor=None, sweepInterval=60,
+                 sessionTimeout=Session.sessionTimeout):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.site = site
+        self.path = path
+        self.sweepInterval = sweepInterval
+        self.sessionTimeout = sessionTimeout
+        self._sessions = {}
+        if not path.isdir():
+            path.makedirs()
+
+
+    def _fileFor(self, uid):
+        """
+        Get the file recording a session.
+
+        @raise KeyError: If C{uid} is not a session uid generated by
+            L{Site._mkuid}; uids come from request cookies and must not be
+            allowed to name arbitrary files.
+        """
+        try:
+            name = nativeString(uid)
+        except UnicodeError:
+            raise KeyError(uid)
+        if not name or name.strip(string.hexdigits):
+            raise KeyError(uid)
+        return self.path.child(networkString(name))
+
+
+    def _lastModified(self, sessionFile):
+        """
+        @return: The time of the last activity recorded in C{sessionFile}, or
+            C{None} if the session has been removed.
+        """
+        try:
+            return os.stat(sessionFile.path).st_mtime
+        except OSError:
+            return None
+
+
+    def add(self, session):
+        """
+        Create the file of C{session} and start sweeping if this is the first
+        session of this process.
+
+        @see: L{iweb.ISessionStore.add}
+        """
+        self._fileFor(session.uid).create().close()
+        self._sessions[session.uid] = session
+        session._store = self
+        self.touch(session)
+        if self._sweepCall is None:
+            self._sweepCall = self._reactor.callLater(
+                self.sweepInterval, self._sweep)
+
+
+    def touch(self, session):
+        """
+        Record the C{lastModified} time of C{session} as the modification time
+        of its file.
+
+        @see: L{iweb.ISessionStore.touch}
+        """
+        now = session.lastModified
+        try:
+            os.utime(self._fileFor(session.uid).path, (now, now))
+        except OSError:
+            # Expired by another process, the next lookup will notice.
+            pass
+
+
+    def _sweep(self):
+        """
+        Remove the files of all idle sessions, expire the local sessions which
+        are gone, and schedule the next sweep unless there is nothing left to
+        sweep.
+        """
+        self._sweepCall = None
+        deadline = self._reactor.seconds() - self.sessionTimeout
+        remaining = 0
+        for sessionFile in self.path.children():
+            lastModified = self._lastModified(sessionFile)
+            if lastModified is None:
+                continue
+            if lastModified <= deadline:
+                try:
+                    sessionFile.remove()
+                    continue
+                except OSError:
+                    pass
+            remaining += 1
+        for uid, session in list(self._sessions.items()):
+            if self._lastModified(self._fileFor(uid)) is None:
+                session.expire()
+        if self._sessions or remaining:
+            self._sweepCall = self._reactor.callLater(
+                self.sweepInterval, self._sweep)
+
+
+    def __getitem__(self, uid):
+        """
+        Get the local session for C{uid}, creating it if the session was
+        created by another process, or expire it if another process did.
+
+        @see: L{iweb.ISessionStore.__getitem__}
+        """
+        lastModified = self._lastModified(self._fileFor(uid))
+        session = self._sessions.get(uid)
+        if lastModified is None:
+            if session is not None:
+                session.expire()
+            raise KeyError(uid)
+        if session is None:
+            if lastModified + self.sessionTimeout <= self._reactor.seconds():
+                # Idle, but not swept yet.
+                raise KeyError(uid)
+            session = self.site.sessionFactory(self.site, uid)
+            session.lastModified = lastModified
+            session._store = self
+            self._sessions[uid] = session
+            if self._sweepCall is None:
+                self._sweepCall = self._reactor.callLater(
+                    self.sweepInterval, self._sweep)
+        return session
+
+
+    def __delitem__(self, uid):
+        session = self._sessions.pop(uid)
+        session._store = None
+        try:
+            self._fileFor(uid).remove()
+        except OSError:
+            pass
+
+
+    def __contains__(self, uid):
+        try:
+            self[uid]
+        except KeyError:
+            return False
+        return True
+
+
+    def __len__(self):
+        return len(self.path.listdir())
 
 
 version = networkString("TwistedWeb/%s" % (copyright.version,))
@@ -609,13 +1231,26 @@ class Site(http.HTTPFactory):
     @ivar displayTracebacks: if set, Twisted internal errors are displayed on
         rendered pages. Default to C{True}.
     @ivar sessionFactory: factory for sessions objects. Default to L{Session}.
+    @ivar sessions: A C{dict} mapping uids to live sessions, each of which
+        schedules its own expiration, or an L{iweb.ISessionStore} provider
+        such as L{MemorySessionStore} or L{DirectorySessionStore} which expires
+        them.
     @ivar sessionCheckTime: Deprecated.  See L{Session.sessionTimeout} instead.
+    @ivar useStaticIndex: if set, resources registered with
+        L{resource.Resource.putChild} are found through an index of the
+        static parts of the resource tree, and C{getChildWithDefault} is only
+        called from the first path segment which is not static.  Default to
+        C{False}.
+    @ivar _staticIndex: The L{resource._StaticIndex} used when
+        C{useStaticIndex} is set, or C{None} if it has not been created yet.
     """
     counter = 0
     requestFactory = Request
     displayTracebacks = True
     sessionFactory = Session
     sessionCheckTime = 1800
+    useStaticIndex = False
+    _staticIndex = None
 
     def __init__(self, resource, *args, **kwargs):
         """
@@ -637,6 +1272,7 @@ class Site(http.HTTPFactory):
     def __getstate__(self):
         d = self.__dict__.copy()
         d['sessions'] = {}
+        d.pop('_staticIndex', None)
         return d
 
     def _mkuid(self):
@@ -655,8 +1291,12 @@ class Site(http.HTTPFactory):
         Generate a new Session instance, and store it for future reference.
         """
         uid = self._mkuid()
-        session = self.sessions[uid] = self.sessionFactory(self, uid)
-        session.startCheckingExpiration()
+        session = self.sessionFactory(self, uid)
+        if iweb.ISessionStore.providedBy(self.sessions):
+            self.sessions.add(session)
+        else:
+            self.sessions[uid] = session
+            session.startCheckingExpiration()
         return session
 
     def getSession(self, uid):
@@ -703,4 +1343,10 @@ class Site(http.HTTPFactory):
         # Sitepath is used to determine cookie names between distributed
         # servers and disconnected sites.
         request.sitepath = copy.copy(request.prepath)
+        if self.useStaticIndex:
+            index = self._staticIndex
+            if index is None or index.resource is not self.resource:
+                index = self._staticIndex = resource._StaticIndex(
+                    self.resource)
+            return index.getChildForRequest(request)
         return resource.getChildForRequest(self.resource, request)
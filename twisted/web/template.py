@@ -381,9 +381,16 @@ class XMLString(object):
 
     @ivar _loadedTemplate: The loaded document.
     @type _loadedTemplate: a C{list} of Stan objects.
+
+    @ivar _compiledTemplate: The loaded document with its static parts
+        flattened ahead of time, or C{None}, if not compiled yet.
+    @type _compiledTemplate: a C{list} as returned by L{_compileTemplate}, or
+        C{None}.
     """
     implements(ITemplateLoader)
 
+    _compiledTemplate = None
+
     def __init__(self, s):
         """
         Run the parser on a StringIO copy of the string.
@@ -404,6 +411,19 @@ class XMLString(object):
         return self._loadedTemplate
 
 
+    def _loadCompiled(self):
+        """
+        Return the document with its static parts flattened ahead of time,
+        first compiling it if necessary.
+
+        @return: the compiled document.
+        @rtype: a C{list} as returned by L{_compileTemplate}.
+        """
+        if self._compiledTemplate is None:
+            self._compiledTemplate = _compileTemplate(self.load())
+        return self._compiledTemplate
+
+
 
 class XMLFile(object):
     """
@@ -412,11 +432,18 @@ class XMLFile(object):
     @ivar _loadedTemplate: The loaded document, or C{None}, if not loaded.
     @type _loadedTemplate: a C{list} of Stan objects, or C{None}.
 
+    @ivar _compiledTemplate: The loaded document with its static parts
+        flattened ahead of time, or C{None}, if not compiled yet.
+    @type _compiledTemplate: a C{list} as returned by L{_compileTemplate}, or
+        C{None}.
+
     @ivar _path: The L{FilePath}, file object, or filename that is being
         loaded from.
     """
     implements(ITemplateLoader)
 
+    _compiledTemplate = None
+
     def __init__(self, path):
         """
         Run the parser on a file.
@@ -466,6 +493,19 @@ class XMLFile(object):
         return self._loadedTemplate
 
 
+    def _loadCompiled(self):
+        """
+        Return the document with its static parts flattened ahead of time,
+        first loading and compiling it if necessary.
+
+        @return: the compiled document.
+        @rtype: a C{list} as returned by L{_compileTemplate}.
+        """
+        if self._compiledTemplate is None:
+            self._compiledTemplate = _compileTemplate(self.load())
+        return self._compiledTemplate
+
+
 
 # Last updated October 2011, using W3Schools as a reference. Link:
 # http://www.w3schools.com/html5/html5_reference.asp
@@ -562,5 +602,5 @@ def renderElement(request, element,
 
 
 from twisted.web._element import Element, renderer
-from twisted.web._flatten import flatten, flattenString
+from twisted.web._flatten import flatten, flattenString, _compileTemplate
 import twisted.web.util
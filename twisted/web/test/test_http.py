@@ -1273,6 +1273,40 @@ class RequestTests(unittest.TestCase, ResponseTestMixin):
             b'(no clientproto yet) 202 happily accepted')
 
 
+    def test_statusLineWellKnownCode(self):
+        """
+        For a well-known response code with its standard message,
+        L{http.Request.write} sends the pre-encoded status line for the
+        request's HTTP version.
+        """
+        channel = DummyChannel()
+        req = http.Request(channel, False)
+        req.clientproto = b"HTTP/1.0"
+        req.setResponseCode(404)
+        req.write(b'')
+        self.assertEqual(
+            http._statusLines[b"HTTP/1.0", 404, http.RESPONSES[404]],
+            b"HTTP/1.0 404 Not Found\r\n")
+        self.assertEqual(
+            channel.transport.written.getvalue().splitlines()[0],
+            b"HTTP/1.0 404 Not Found")
+
+
+    def test_statusLineUnknownCode(self):
+        """
+        L{http.Request.write} formats a status line for a response code which
+        has no pre-encoded status line.
+        """
+        channel = DummyChannel()
+        req = http.Request(channel, False)
+        req.clientproto = b"HTTP/1.1"
+        req.setResponseCode(599)
+        req.write(b'')
+        self.assertEqual(
+            channel.transport.written.getvalue().splitlines()[0],
+            b"HTTP/1.1 599 Unknown Status")
+
+
     def test_setResponseCodeAcceptsIntegers(self):
         """
         L{http.Request.setResponseCode} accepts C{int} for the code parameter
@@ -2194,3 +2228,39 @@ class DeprecatedRequestAttributesTests(unittest.TestCase):
                     "in Twisted 14.1.0; please use Twisted Names to "
                     "resolve hostnames instead")},
                          sub(["category", "message"], warnings[0]))
+
+
+
+class HTTPFactoryTests(unittest.TestCase):
+    """
+    Tests for L{http.HTTPFactory}.
+    """
+    def test_responseDate(self):
+        """
+        Once started, L{http.HTTPFactory} caches the formatted current time
+        for use in the I{Date} header of responses and refreshes it every
+        second using its reactor.
+        """
+        reactor = Clock()
+        reactor.advance(1234567890)
+        factory = http.HTTPFactory()
+        factory._reactor = reactor
+        self.assertIdentical(factory._responseDate, None)
+        factory.startFactory()
+        self.addCleanup(factory.stopFactory)
+        self.assertEqual(
+            factory._responseDate, b"Fri, 13 Feb 2009 23:31:30 GMT")
+        reactor.advance(1)
+        self.assertEqual(
+            factory._responseDate, b"Fri, 13 Feb 2009 23:31:31 GMT")
+
+
+    def test_responseDateClearedOnStop(self):
+        """
+        L{http.HTTPFactory.stopFactory} discards the cached response date.
+        """
+        factory = http.HTTPFactory()
+        factory._reactor = Clock()
+        factory.startFactory()
+        factory.stopFactory()
+        self.assertIdentical(factory._responseDate, None)
@@ -152,6 +152,31 @@ class HeadersTests(TestCase):
                           b"X-XSS-Protection")
 
 
+    def test_canonicalNameCapsCached(self):
+        """
+        L{Headers._canonicalNameCaps} remembers the capitalization of header
+        names which are not in L{Headers._caseMappings}.
+        """
+        self.patch(Headers, "_canonicalNames", {})
+        h = Headers()
+        self.assertEqual(h._canonicalNameCaps(b"x-foo-bar"), b"X-Foo-Bar")
+        self.assertEqual(h._canonicalNameCaps(b"etag"), b"ETag")
+        self.assertEqual(Headers._canonicalNames, {b"x-foo-bar": b"X-Foo-Bar"})
+
+
+    def test_canonicalNameCapsCacheLimit(self):
+        """
+        L{Headers._canonicalNameCaps} stops remembering new header names once
+        L{Headers._maxCanonicalNames} of them are cached.
+        """
+        self.patch(Headers, "_canonicalNames", {})
+        self.patch(Headers, "_maxCanonicalNames", 1)
+        h = Headers()
+        self.assertEqual(h._canonicalNameCaps(b"x-foo"), b"X-Foo")
+        self.assertEqual(h._canonicalNameCaps(b"x-bar"), b"X-Bar")
+        self.assertEqual(Headers._canonicalNames, {b"x-foo": b"X-Foo"})
+
+
     def test_getAllRawHeaders(self):
         """
         L{Headers.getAllRawHeaders} returns an iterable of (k, v) pairs, where
@@ -10,7 +10,7 @@ from twisted.trial.unittest import TestCase
 from twisted.web.error import UnsupportedMethod
 from twisted.web.resource import (
     NOT_FOUND, FORBIDDEN, Resource, ErrorPage, NoResource, ForbiddenResource,
-    getChildForRequest)
+    getChildForRequest, _StaticIndex)
 from twisted.web.test.requesthelper import DummyRequest
 
 
@@ -259,3 +259,122 @@ class GetChildForRequestTests(TestCase):
         self.assertIdentical(child, getChildForRequest(root, request))
         self.assertEqual(request.prepath, [b"foo"])
         self.assertEqual(request.postpath, [b"bar"])
+
+
+
+class CustomLookup(Resource):
+    """
+    A L{Resource} which overrides C{getChildWithDefault} and records the path
+    segments it is asked for.
+    """
+    def __init__(self):
+        Resource.__init__(self)
+        self.lookups = []
+
+
+    def getChildWithDefault(self, path, request):
+        self.lookups.append(path)
+        return Resource.getChildWithDefault(self, path, request)
+
+
+
+class StaticIndexTests(TestCase):
+    """
+    Tests for L{_StaticIndex}.
+    """
+    def test_staticChildren(self):
+        """
+        L{_StaticIndex.getChildForRequest} finds static children, moving the
+        traversed segments from C{postpath} to C{prepath}, and keeps finding
+        them once they are indexed.
+        """
+        root = Resource()
+        foo = Resource()
+        bar = Resource()
+        root.putChild(b"foo", foo)
+        foo.putChild(b"bar", bar)
+        index = _StaticIndex(root)
+        for i in range(2):
+            request = DummyRequest([b"foo", b"bar"])
+            self.assertIdentical(bar, index.getChildForRequest(request))
+            self.assertEqual(request.prepath, [b"foo", b"bar"])
+            self.assertEqual(request.postpath, [])
+
+
+    def test_dynamicFallback(self):
+        """
+        At the first segment which does not name a static child,
+        L{_StaticIndex.getChildForRequest} continues the traversal with
+        L{getChildForRequest}.
+        """
+        root = Resource()
+        dynamic = DynamicChildren()
+        root.putChild(b"foo", dynamic)
+        request = DummyRequest([b"foo", b"bar"])
+        child = _StaticIndex(root).getChildForRequest(request)
+        self.assertIsInstance(child, DynamicChild)
+        self.assertEqual(child.path, b"bar")
+        self.assertEqual(request.prepath, [b"foo", b"bar"])
+
+
+    def test_leafResource(self):
+        """
+        L{_StaticIndex.getChildForRequest} stops at a resource with C{isLeaf}
+        set, leaving the rest of the path in C{postpath}.
+        """
+        root = Resource()
+        leaf = Resource()
+        leaf.isLeaf = True
+        leaf.putChild(b"bar", Resource())
+        root.putChild(b"foo", leaf)
+        request = DummyRequest([b"foo", b"bar"])
+        self.assertIdentical(
+            leaf, _StaticIndex(root).getChildForRequest(request))
+        self.assertEqual(request.postpath, [b"bar"])
+
+
+    def test_customGetChildWithDefault(self):
+        """
+        Resources which override C{getChildWithDefault} are not indexed; their
+        C{getChildWithDefault} is called for the segment after them.
+        """
+        root = Resource()
+        custom = CustomLookup()
+        bar = Resource()
+        root.putChild(b"foo", custom)
+        custom.putChild(b"bar", bar)
+        request = DummyRequest([b"foo", b"bar"])
+        self.assertIdentical(
+            bar, _StaticIndex(root).getChildForRequest(request))
+        self.assertEqual(custom.lookups, [b"bar"])
+
+
+    def test_putChildInvalidates(self):
+        """
+        Calling L{Resource.putChild} on any resource discards the static
+        children indexed so far.
+        """
+        root = Resource()
+        foo = Resource()
+        root.putChild(b"foo", foo)
+        index = _StaticIndex(root)
+        self.assertIdentical(
+            foo, index.getChildForRequest(DummyRequest([b"foo"])))
+        replacement = Resource()
+        root.putChild(b"foo", replacement)
+        self.assertIdentical(
+            replacement, index.getChildForRequest(DummyRequest([b"foo"])))
+
+
+    def test_delEntityInvalidates(self):
+        """
+        Calling L{Resource.delEntity} on any resource discards the static
+        children indexed so far.
+        """
+        root = Resource()
+        root.putChild(b"foo", Resource())
+        index = _StaticIndex(root)
+        index.getChildForRequest(DummyRequest([b"foo"]))
+        root.delEntity(b"foo")
+        self.assertIsInstance(
+            index.getChildForRequest(DummyRequest([b"foo"])), NoResource)
@@ -22,8 +22,9 @@ from twisted.web.iweb import ITemplateLoader
 from twisted.web.error import (FlattenerError, MissingTemplateLoader,
     MissingRenderMethod)
 
-from twisted.web.template import renderElement
+from twisted.web.template import renderElement, slot, Tag
 from twisted.web._element import UnexposedMethodError
+from twisted.web._flatten import _compileTemplate, _Precompiled, _ContentHole
 from twisted.web.test._util import FlattenTestCase
 from twisted.web.test.test_web import DummyRequest
 from twisted.web.server import NOT_DONE_YET
@@ -818,3 +819,143 @@ class TestRenderElement(TestCase):
         renderElement(self.request, element, doctype=None)
 
         return d
+
+
+
+class CompiledTemplateTests(FlattenTestCase):
+    """
+    Tests for L{_compileTemplate} and the compiled templates of L{XMLString}
+    and L{XMLFile}.
+    """
+    namespace = 'xmlns:t="http://twistedmatrix.com/ns/twisted.web.template/0.1"'
+
+    def test_static(self):
+        """
+        A template with no dynamic parts compiles to a single L{_Precompiled}
+        chunk containing its flattened output.
+        """
+        document = XMLString(
+            '<div class="a&amp;b"><p>x &lt; y</p><!-- c --><br /></div>'
+            ).load()
+        compiled = _compileTemplate(document)
+        self.assertEqual(len(compiled), 1)
+        self.assertIsInstance(compiled[0], _Precompiled)
+        self.assertEqual(
+            compiled[0].data,
+            '<div class="a&amp;b"><p>x &lt; y</p><!-- c --><br /></div>')
+
+
+    def test_dynamicHoles(self):
+        """
+        Slots and tags with render directives inside a L{Tag} are left in
+        place, wrapped in L{_ContentHole}, between L{_Precompiled} chunks for
+        the static markup around them.
+        """
+        document = XMLString(
+            '<div %s class="x"><t:slot name="a" /> &amp; '
+            '<span t:render="r" /></div>' % (self.namespace,)).load()
+        compiled = _compileTemplate(document)
+        self.assertEqual(
+            [type(element) for element in compiled],
+            [_Precompiled, _ContentHole, _Precompiled, _ContentHole,
+             _Precompiled])
+        self.assertEqual(compiled[0].data, '<div class="x">')
+        self.assertIsInstance(compiled[1].root, slot)
+        self.assertEqual(compiled[2].data, ' &amp; ')
+        self.assertIsInstance(compiled[3].root, Tag)
+        self.assertEqual(compiled[3].root.render, 'r')
+        self.assertEqual(compiled[4].data, '</div>')
+
+
+    def test_dynamicAttribute(self):
+        """
+        A L{Tag} with a dynamic attribute is left in place entirely.
+        """
+        document = XMLString(
+            '<p %s><a><t:attr name="href"><t:slot name="url" /></t:attr>'
+            'link</a></p>' % (self.namespace,)).load()
+        compiled = _compileTemplate(document)
+        self.assertEqual(compiled[0].data, '<p>')
+        self.assertEqual(compiled[1].root.tagName, 'a')
+        self.assertEqual(compiled[2].data, '</p>')
+
+
+    def test_topLevelText(self):
+        """
+        Text which is not inside any L{Tag} is not escaped ahead of time,
+        since how it must be escaped depends on where the template is
+        flattened.
+        """
+        compiled = _compileTemplate([u'a & b', Tag('p')('c & d')])
+        self.assertEqual(compiled[0], u'a & b')
+        self.assertEqual(compiled[1].data, '<p>c &amp; d</p>')
+
+
+    def test_flattensIdentically(self):
+        """
+        Flattening an L{Element} with a compiled template produces the same
+        output as flattening its template without compiling it, including
+        when the element is flattened within an attribute.
+        """
+        class Compiled(Element):
+            loader = XMLString(
+                '<t:transparent %s>one &amp; '
+                '<p class="c"><t:slot name="s" /> &lt; '
+                '<em t:render="r">two</em><![CDATA[<x>]]></p>'
+                '</t:transparent>' % (self.namespace,))
+
+            @renderer
+            def r(self, request, tag):
+                return tag.fillSlots(s=u'<three>')(u' & four')
+
+            def render(self, request):
+                return Tag('')(self.document(request)).fillSlots(s=u'<five>')
+
+            def document(self, request):
+                return self.loader._loadCompiled()
+
+        class Uncompiled(Compiled):
+            def document(self, request):
+                return self.loader.load()
+
+        content = (
+            'one &amp; <p class="c">&lt;five&gt; &lt; <em>two &amp; four</em>'
+            '<![CDATA[<x>]]></p>')
+        attribute = (
+            '<a href="one &amp; &lt;p class=&quot;c&quot;&gt;&amp;lt;five'
+            '&amp;gt; &amp;lt; &lt;em&gt;two &amp;amp; four&lt;/em&gt;'
+            '&lt;![CDATA[&lt;x&gt;]]&gt;&lt;/p&gt;"></a>')
+        for factory in Compiled, Uncompiled:
+            self.assertFlattensImmediately(factory(), content)
+            self.assertFlattensImmediately(tags.a(href=factory()), attribute)
+
+
+    def test_loadersCacheCompiledTemplate(self):
+        """
+        L{XMLString} and L{XMLFile} compile their template once, and the
+        flattener uses the compiled template of an L{Element} while
+        L{Element.render} still returns the loaded template.
+        """
+        path = FilePath(self.mktemp())
+        path.setContent('<p>Hello, world.</p>')
+        for loader in XMLString('<p>Hello, world.</p>'), XMLFile(path):
+            compiled = loader._loadCompiled()
+            self.assertIdentical(loader._loadCompiled(), compiled)
+            self.assertEqual(compiled[0].data, '<p>Hello, world.</p>')
+            element = Element(loader)
+            self.assertIdentical(element.render(None), loader.load())
+            self.assertIdentical(element._renderCompiled(None), compiled)
+
+
+    def test_overriddenRenderNotCompiled(self):
+        """
+        The flattener uses what the C{render} method of an L{Element} subclass
+        which overrides it returns, rather than the compiled template.
+        """
+        class Replaced(Element):
+            loader = XMLString('<p>template</p>')
+
+            def render(self, request):
+                return tags.p('replaced')
+
+        self.assertFlattensImmediately(Replaced(), '<p>replaced</p>')
@@ -6,6 +6,7 @@ Tests for various parts of L{twisted.web}.
 """
 
 import os
+import time
 import zlib
 
 from zope.interface import implementer
@@ -84,6 +85,29 @@ class SiteTest(unittest.TestCase):
             sres2, "Got the wrong resource.")
 
 
+    def test_staticIndex(self):
+        """
+        If L{Site.useStaticIndex} is set, L{Site.getResourceFor} finds
+        resources through a L{resource._StaticIndex} of its root resource,
+        which is replaced if the root resource is.
+        """
+        sres1 = SimpleResource()
+        sres2 = SimpleResource()
+        sres1.putChild(b"foo", sres2)
+        site = server.Site(sres1)
+        site.useStaticIndex = True
+        request = DummyRequest([b"foo"])
+        self.assertIdentical(site.getResourceFor(request), sres2)
+        self.assertEqual(request.prepath, [b"foo"])
+        self.assertIdentical(site._staticIndex.resource, sres1)
+
+        site.resource = sres2
+        sres2.putChild(b"bar", sres1)
+        self.assertIdentical(
+            site.getResourceFor(DummyRequest([b"bar"])), sres1)
+        self.assertIdentical(site._staticIndex.resource, sres2)
+
+
 
 class SessionTest(unittest.TestCase):
     """
@@ -185,6 +209,296 @@ class SessionTest(unittest.TestCase):
 
 
 
+class SessionStoreTestsMixin(object):
+    """
+    Tests for L{iweb.ISessionStore} implementations, mixed into a
+    L{unittest.TestCase} which defines C{createStore} to return a store for
+    the site C{self.site}.
+    """
+    def setUp(self):
+        """
+        Create a site using the store returned by C{createStore}, whose
+        sessions and store use a deterministic clock.
+        """
+        self.clock = Clock()
+        self.site = server.Site(resource.Resource())
+        self.site.sessionFactory = self.sessionFactory
+        self.store = self.site.sessions = self.createStore()
+
+
+    def sessionFactory(self, site, uid):
+        """
+        Create a L{server.Session} using C{self.clock}.
+        """
+        return server.Session(site, uid, self.clock)
+
+
+    def test_interface(self):
+        """
+        The store provides L{iweb.ISessionStore}.
+        """
+        self.assertTrue(verifyObject(iweb.ISessionStore, self.store))
+
+
+    def test_makeSession(self):
+        """
+        L{server.Site.makeSession} adds the new session to the store instead
+        of scheduling a delayed call for it.
+        """
+        session = self.site.makeSession()
+        self.assertIn(session.uid, self.store)
+        self.assertIdentical(self.site.getSession(session.uid), session)
+        self.assertEqual(len(self.store), 1)
+        self.assertIdentical(session._expireCall, None)
+
+
+    def test_getUnknownSession(self):
+        """
+        L{server.Site.getSession} raises L{KeyError} for a uid which is not in
+        the store.
+        """
+        self.assertRaises(KeyError, self.site.getSession, b'abc123')
+        self.assertNotIn(b'abc123', self.store)
+
+
+    def test_expire(self):
+        """
+        L{server.Session.expire} removes the session from the store and runs
+        its expiration callbacks.
+        """
+        expired = []
+        session = self.site.makeSession()
+        session.notifyOnExpire(lambda: expired.append(True))
+        session.expire()
+        self.assertNotIn(session.uid, self.store)
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(expired, [True])
+
+
+    def test_sweep(self):
+        """
+        A session is expired by the first sweep after it has been idle for
+        its C{sessionTimeout}.
+        """
+        session = self.site.makeSession()
+        interval = self.store.sweepInterval
+        self.clock.advance(session.sessionTimeout - 1)
+        self.assertIn(session.uid, self.store)
+        self.clock.advance(interval)
+        self.assertNotIn(session.uid, self.store)
+
+
+    def test_touchDelaysExpiration(self):
+        """
+        L{server.Session.touch} pushes the expiration of the session back by
+        C{sessionTimeout} seconds.
+        """
+        session = self.site.makeSession()
+        interval = self.store.sweepInterval
+        self.clock.advance(session.sessionTimeout - 1)
+        session.touch()
+        self.clock.advance(session.sessionTimeout - interval)
+        self.assertIn(session.uid, self.store)
+        self.clock.advance(interval * 2)
+        self.assertNotIn(session.uid, self.store)
+
+
+    def test_sweepMany(self):
+        """
+        A single sweep expires all of the idle sessions and keeps the others.
+        """
+        idle = [self.site.makeSession() for i in range(5)]
+        active = [self.site.makeSession() for i in range(5)]
+        timeout = server.Session.sessionTimeout
+        for i in range(timeout // self.store.sweepInterval + 1):
+            self.clock.advance(self.store.sweepInterval)
+            for session in active:
+                session.touch()
+        for session in idle:
+            self.assertNotIn(session.uid, self.store)
+        for session in active:
+            self.assertIn(session.uid, self.store)
+        self.assertEqual(len(self.store), 5)
+
+
+
+class MemorySessionStoreTests(SessionStoreTestsMixin, unittest.TestCase):
+    """
+    Tests for L{server.MemorySessionStore}.
+    """
+    def createStore(self):
+        """
+        Create a L{server.MemorySessionStore} using C{self.clock}.
+        """
+        return server.MemorySessionStore(self.clock, sweepInterval=10)
+
+
+    def test_defaultReactor(self):
+        """
+        If no reactor is passed to L{server.MemorySessionStore.__init__}, the
+        global reactor is used.
+        """
+        self.assertIdentical(server.MemorySessionStore()._reactor, reactor)
+
+
+    def test_singleDelayedCall(self):
+        """
+        However many sessions it holds, the store has at most one pending
+        delayed call, and none once all its sessions are gone.
+        """
+        for i in range(10):
+            self.site.makeSession()
+        self.assertEqual(len(self.clock.calls), 1)
+        self.clock.advance(server.Session.sessionTimeout + 10)
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.clock.calls, [])
+
+
+    def test_expiryIndex(self):
+        """
+        The store keeps a single entry per session in its expiry index, even
+        if the session is touched many times.
+        """
+        session = self.site.makeSession()
+        for i in range(server.Session.sessionTimeout // 10):
+            self.clock.advance(10)
+            session.touch()
+        self.assertEqual(len(self.store._expiries), 1)
+
+
+
+class DirectorySessionStoreTests(SessionStoreTestsMixin, unittest.TestCase):
+    """
+    Tests for L{server.DirectorySessionStore}.
+    """
+    def createStore(self, site=None):
+        """
+        Create a L{server.DirectorySessionStore} for C{site}, or C{self.site},
+        using C{self.clock} and a directory shared by all the stores of a test.
+        """
+        if site is None:
+            site = self.site
+            self.path = FilePath(networkString(self.mktemp()))
+        return server.DirectorySessionStore(
+            site, self.path, self.clock, sweepInterval=10)
+
+
+    def otherSite(self):
+        """
+        Create another site with a store sharing the directory of C{self.store},
+        as another worker process would.
+        """
+        site = server.Site(resource.Resource())
+        site.sessionFactory = self.sessionFactory
+        site.sessions = self.createStore(site)
+        return site
+
+
+    def test_createsDirectory(self):
+        """
+        L{server.DirectorySessionStore} creates its directory if it does not
+        exist.
+        """
+        self.assertTrue(self.path.isdir())
+
+
+    def test_sessionFile(self):
+        """
+        Each session is recorded as a file named after its uid whose
+        modification time is the time of the last activity on the session.
+        """
+        self.clock.advance(1000)
+        session = self.site.makeSession()
+        sessionFile = self.path.child(networkString(session.uid))
+        self.assertEqual(sessionFile.getModificationTime(), 1000)
+        self.clock.advance(5)
+        session.touch()
+        sessionFile.restat()
+        self.assertEqual(sessionFile.getModificationTime(), 1005)
+
+
+    def test_sharedSession(self):
+        """
+        A session created by one site is found by another site using the same
+        directory, and activity in either keeps it alive.
+        """
+        other = self.otherSite()
+        self.clock.advance(1000)
+        session = self.site.makeSession()
+        otherSession = other.getSession(session.uid)
+        self.assertEqual(otherSession.uid, session.uid)
+        self.assertEqual(otherSession.lastModified, 1000)
+        self.assertIdentical(other.getSession(session.uid), otherSession)
+
+        self.clock.advance(session.sessionTimeout - 1)
+        otherSession.touch()
+        self.clock.advance(20)
+        self.assertIn(session.uid, self.site.sessions)
+
+
+    def test_sharedExpire(self):
+        """
+        When a session is expired by one site, the other sites expire their
+        instance of it on the next lookup.
+        """
+        other = self.otherSite()
+        session = self.site.makeSession()
+        otherSession = other.getSession(session.uid)
+        expired = []
+        otherSession.notifyOnExpire(lambda: expired.append(True))
+        session.expire()
+        self.assertRaises(KeyError, other.getSession, session.uid)
+        self.assertEqual(expired, [True])
+
+
+    def test_idleNotRestored(self):
+        """
+        An idle session which has not been swept yet is not restored by a site
+        which has not seen it before.
+        """
+        session = self.site.makeSession()
+        self.clock.advance(session.sessionTimeout)
+        self.assertRaises(KeyError, self.otherSite().getSession, session.uid)
+
+
+    def test_sweepingStops(self):
+        """
+        The store stops sweeping once it has no sessions and the directory is
+        empty, and starts again when a session is added.
+        """
+        session = self.site.makeSession()
+        self.clock.advance(session.sessionTimeout + 10)
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.clock.calls, [])
+        self.site.makeSession()
+        self.assertEqual(len(self.clock.calls), 1)
+
+
+    def test_sweepingStartsForSharedSession(self):
+        """
+        A store which has stopped sweeping starts again when it finds a session
+        created by another site.
+        """
+        session = self.site.makeSession()
+        self.clock.advance(session.sessionTimeout + 10)
+        self.assertEqual(self.clock.calls, [])
+        session = self.otherSite().makeSession()
+        self.assertEqual(len(self.clock.calls), 1)
+        self.site.getSession(session.uid)
+        self.assertEqual(len(self.clock.calls), 2)
+
+
+    def test_invalidUID(self):
+        """
+        Session uids, which come from cookies, cannot name files outside the
+        directory of the store.
+        """
+        self.path.sibling(b'secret').touch()
+        for uid in [b'../secret', b'', b'\xff', b'.']:
+            self.assertRaises(KeyError, self.site.getSession, uid)
+            self.assertNotIn(uid, self.store)
+
+
 # Conditional requests:
 # If-None-Match, If-Modified-Since
 
@@ -469,6 +783,38 @@ class RequestTests(unittest.TestCase):
 
 
 
+    def test_processUsesSiteResponseDate(self):
+        """
+        L{Request.process} uses the I{Date} header value cached by the site
+        the request was received by.
+        """
+        d = DummyChannel()
+        d.site = server.Site(resource.Resource())
+        d.site._responseDate = b"Fri, 13 Feb 2009 23:31:30 GMT"
+        request = server.Request(d, 1)
+        request.gotLength(0)
+        request.requestReceived(b'GET', b'/', b'HTTP/1.0')
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b'date'),
+            [b"Fri, 13 Feb 2009 23:31:30 GMT"])
+
+
+    def test_processWithoutSiteResponseDate(self):
+        """
+        L{Request.process} formats the current time for the I{Date} header if
+        the site has no cached value, for example because it is not running.
+        """
+        self.patch(http, 'datetimeToString', lambda: b"Tuesday")
+        d = DummyChannel()
+        d.site = server.Site(resource.Resource())
+        request = server.Request(d, 1)
+        request.gotLength(0)
+        request.requestReceived(b'GET', b'/', b'HTTP/1.0')
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b'date'), [b"Tuesday"])
+
+
+
 class GzipEncoderTests(unittest.TestCase):
 
     if _PY3:
@@ -596,6 +942,154 @@ class GzipEncoderTests(unittest.TestCase):
 
 
 
+    def _request(self, factory, body=b"Some data", contentType=b"text/plain"):
+        """
+        Make a request with an I{Accept-Encoding} header which mentions gzip
+        for a resource wrapped with C{factory}.
+
+        @return: The headers and the body of the response, separately.
+        """
+        root = resource.Resource()
+        root.putChild(b"foo", resource.EncodingResourceWrapper(
+            Data(body, contentType), [factory]))
+        self.channel.site = server.Site(root)
+        request = server.Request(self.channel, False)
+        request.gotLength(0)
+        request.requestHeaders.setRawHeaders(b"Accept-Encoding", [b"gzip"])
+        request.requestReceived(b'GET', b'/foo', b'HTTP/1.0')
+        data = self.channel.transport.written.getvalue()
+        return data.split(b"\r\n\r\n", 1)
+
+
+    def test_excludedTypes(self):
+        """
+        L{server.GzipEncoderFactory} doesn't compress responses whose media
+        type is in its C{excludedTypes}, which by default contains the
+        types of already compressed content.
+        """
+        factory = server.GzipEncoderFactory()
+        headers, body = self._request(factory, contentType=b"image/PNG")
+        self.assertIn(b"Content-Length: 9\r\n", headers)
+        self.assertNotIn(b"Content-Encoding", headers)
+        self.assertEqual(b"Some data", body)
+        self.assertEqual(
+            (factory.responsesCompressed, factory.responsesSkipped), (0, 1))
+
+
+    def test_excludedTypesWildcard(self):
+        """
+        An entry like C{b"video/*"} in the C{excludedTypes} of
+        L{server.GzipEncoderFactory} matches every subtype of that type, and
+        media type parameters are ignored.
+        """
+        factory = server.GzipEncoderFactory(excludedTypes=[b"video/*"])
+        headers, body = self._request(
+            factory, contentType=b"video/mp4; codecs=avc1")
+        self.assertNotIn(b"Content-Encoding", headers)
+        self.assertEqual(b"Some data", body)
+
+
+    def test_minimumSize(self):
+        """
+        L{server.GzipEncoderFactory} doesn't compress responses with a
+        I{Content-Length} smaller than its C{minimumSize}.
+        """
+        factory = server.GzipEncoderFactory(minimumSize=10)
+        headers, body = self._request(factory)
+        self.assertIn(b"Content-Length: 9\r\n", headers)
+        self.assertNotIn(b"Content-Encoding", headers)
+        self.assertEqual(b"Some data", body)
+
+        factory = server.GzipEncoderFactory(minimumSize=9)
+        self.channel = DummyChannel()
+        headers, body = self._request(factory)
+        self.assertIn(b"Content-Encoding: gzip\r\n", headers)
+
+
+    def test_blockSize(self):
+        """
+        L{server._GzipEncoder} collects written data until at least the
+        C{blockSize} of its factory is available before compressing it.
+        """
+        factory = server.GzipEncoderFactory(blockSize=10)
+        request = server.Request(self.channel, False)
+        encoder = server._GzipEncoder(factory, request)
+        self.assertEqual(encoder.encode(b"12345"), b"")
+        self.assertEqual(factory.bytesIn, 0)
+        compressed = encoder.encode(b"67890") + encoder.finish()
+        self.assertEqual(factory.bytesIn, 10)
+        self.assertEqual(
+            zlib.decompress(compressed, 16 + zlib.MAX_WBITS), b"1234567890")
+
+
+    def test_statistics(self):
+        """
+        L{server.GzipEncoderFactory} counts the bytes given to and produced by
+        its encoders, and the time spent compressing.
+        """
+        factory = server.GzipEncoderFactory()
+        self.assertIdentical(factory.compressionRatio(), None)
+        headers, body = self._request(factory, body=b"x" * 1000)
+        self.assertEqual(factory.responsesCompressed, 1)
+        self.assertEqual(factory.bytesIn, 1000)
+        self.assertEqual(factory.bytesOut, len(body))
+        self.assertEqual(factory.compressionRatio(), len(body) / 1000.0)
+        self.assertTrue(factory.compressionTime >= 0)
+
+
+    def test_threadCPUTime(self):
+        """
+        L{server._threadCPUTime} measures processor time, so time spent
+        sleeping does not count.
+        """
+        before = server._threadCPUTime()
+        time.sleep(0.2)
+        self.assertTrue(server._threadCPUTime() - before < 0.1)
+
+    if server._RUSAGE_THREAD is None:
+        test_threadCPUTime.skip = "getrusage(RUSAGE_THREAD) is not available"
+
+
+    def test_threadpool(self):
+        """
+        If L{server.GzipEncoderFactory} is given a thread pool, blocks of at
+        least C{threadThreshold} bytes are compressed in it.  Later data is
+        written after the data compressed in the thread pool, and the request
+        is finished once all of it has been written.
+        """
+        calls = []
+        class ThreadPool(object):
+            def callInThreadWithCallback(self, onResult, f, *args):
+                calls.append(lambda: onResult(True, f(*args)))
+
+        class Reactor(object):
+            def callFromThread(self, f, *args):
+                f(*args)
+
+        factory = server.GzipEncoderFactory(
+            reactor=Reactor(), threadpool=ThreadPool(), threadThreshold=5)
+        request = server.Request(self.channel, False)
+        request.gotLength(0)
+        request.method = b"GET"
+        request._encoder = server._GzipEncoder(factory, request)
+        finished = []
+        request.notifyFinish().addCallback(finished.append)
+
+        request.write(b"first")
+        request.write(b"2nd")
+        request.finish()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(finished, [])
+        while calls:
+            calls.pop(0)()
+        self.assertEqual(finished, [None])
+
+        data = self.channel.transport.written.getvalue()
+        body = data[data.find(b"\r\n\r\n") + 4:]
+        self.assertEqual(
+            zlib.decompress(body, 16 + zlib.MAX_WBITS), b"first2nd")
+
+
 class RootResource(resource.Resource):
     isLeaf=0
     def getChildWithDefault(self, name, request):
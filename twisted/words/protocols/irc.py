@@ -76,19 +76,17 @@ def parsemsg(s):
     """Breaks a message from an IRC server into its prefix, command, and arguments.
     """
     prefix = ''
-    trailing = []
     if not s:
         raise IRCBadMessage("Empty line.")
     if s[0] == ':':
         prefix, s = s[1:].split(' ', 1)
-    if s.find(' :') != -1:
-        s, trailing = s.split(' :', 1)
-        args = s.split()
-        args.append(trailing)
+    trailing = s.find(' :')
+    if trailing != -1:
+        args = s[:trailing].split()
+        args.append(s[trailing + 2:])
     else:
         args = s.split()
-    command = args.pop(0)
-    return prefix, command, args
+    return prefix, args[0], args[1:]
 
 
 
@@ -2414,14 +2412,50 @@ class IRCClient(basic.LineReceiver):
             self.register(self.nickname)
 
     def dataReceived(self, data):
-        basic.LineReceiver.dataReceived(self, data.replace('\r', ''))
+        """
+        Split received data into lines and handle them.
+
+        All of the lines in C{data} are split from it at once, rather than
+        one at a time, for as long as the client stays in line mode and is
+        not paused; otherwise, L{basic.LineReceiver} takes over.
+        """
+        data = data.replace('\r', '')
+        if self._busyReceiving or not self.line_mode or self.paused:
+            return basic.LineReceiver.dataReceived(self, data)
+
+        delimiter = self.delimiter
+        self._busyReceiving = True
+        try:
+            lines = (self._buffer + data).split(delimiter)
+            self._buffer = lines.pop()
+            for i, line in enumerate(lines):
+                if len(line) > self.MAX_LENGTH:
+                    exceeded = delimiter.join(lines[i:] + [self._buffer])
+                    self._buffer = ''
+                    return self.lineLengthExceeded(exceeded)
+                why = self.lineReceived(line)
+                stop = (why or self.transport and
+                        self.transport.disconnecting)
+                if stop or not self.line_mode or self.paused:
+                    # Anything received while handling this line is already
+                    # in the buffer, after the lines not handled yet.
+                    self._buffer = delimiter.join(
+                        lines[i + 1:] + [self._buffer])
+                    if stop:
+                        return why
+                    break
+        finally:
+            self._busyReceiving = False
+        if self._buffer and (delimiter in self._buffer or
+                             not self.line_mode or
+                             len(self._buffer) > self.MAX_LENGTH):
+            return basic.LineReceiver.dataReceived(self, '')
 
     def lineReceived(self, line):
         line = lowDequote(line)
         try:
             prefix, command, params = parsemsg(line)
-            if command in numeric_to_symbolic:
-                command = numeric_to_symbolic[command]
+            command = numeric_to_symbolic.get(command, command)
             self.handleCommand(command, prefix, params)
         except IRCBadMessage:
             self.badMessage(line, *sys.exc_info())
@@ -3385,6 +3419,8 @@ def lowQuote(s):
     return s
 
 def lowDequote(s):
+    if M_QUOTE not in s:
+        return s
     def sub(matchobj, mDequoteTable=mDequoteTable):
         s = matchobj.group()[1]
         try:
@@ -101,14 +101,42 @@ class Group(object):
 
 
     def receive(self, sender, recipient, message):
+        """
+        Deliver C{message} from C{sender} to every other member.
+
+        Members which are L{IRCUser}s have the message formatted once for
+        all of those sharing a host name and encoding, and the same bytes
+        written to each of them; other members have their C{receive} method
+        called.
+        """
         assert recipient is self
         receives = []
-        for p in self.users.itervalues():
-            if p is not sender:
+        frames = {}
+        ircReceive = IRCUser.receive.im_func
+        # A slow member may be disconnected, and so leave, along the way.
+        for p in self.users.values():
+            if p is sender:
+                continue
+            frame = None
+            if getattr(p.receive, 'im_func', None) is ircReceive:
+                key = (p.hostname, p.encoding)
+                if key in frames:
+                    frame = frames[key]
+                else:
+                    try:
+                        frame = p._messageFrame(sender, self, message)
+                    except Exception:
+                        # Leave reporting the problem to the usual path.
+                        pass
+                    frames[key] = frame
+            if frame is not None:
+                p._writeBroadcast(frame)
+            else:
                 d = defer.maybeDeferred(p.receive, sender, self, message)
                 d.addErrback(self._ebUserCall, p=p)
                 receives.append(d)
-        defer.DeferredList(receives).addCallback(self._cbUserCall)
+        if receives:
+            defer.DeferredList(receives).addCallback(self._cbUserCall)
         return defer.succeed(None)
 
 
@@ -177,12 +205,44 @@ class User(object):
 NICKSERV = 'NickServ!NickServ@services'
 
 
+def _sendBufferFull(transport):
+    """
+    Determine whether the write buffer of C{transport} is full, following
+    protocol wrappers such as TLS down to the transport which buffers the
+    bytes they write.
+
+    @return: C{True} if the buffer is full, C{False} if it is not or if the
+        transport does not say.
+    """
+    while transport is not None:
+        isFull = getattr(transport, '_isSendBufferFull', None)
+        if isFull is not None:
+            return isFull()
+        transport = getattr(transport, 'transport', None)
+    return False
+
+
+
 class IRCUser(irc.IRC):
     """
     Protocol instance representing an IRC user connected to the server.
+
+    @ivar broadcastBacklogLimit: The number of bytes of channel messages which
+        may be written once the transport's write buffer is full, before the
+        client is considered too slow to keep up.
+
+    @ivar slowClientPolicy: What to do with channel messages for a client
+        which is too slow to keep up: C{"drop"} them until its buffer has
+        drained, or C{"disconnect"} it.
     """
     implements(iwords.IChatClient)
 
+    broadcastBacklogLimit = 1024 * 1024
+    slowClientPolicy = "disconnect"
+
+    _broadcastBacklog = 0
+    _tooSlow = False
+
     # A list of IGroups in which I am participating
     groups = None
 
@@ -254,6 +314,52 @@ class IRCUser(irc.IRC):
                 L)
 
 
+    def _messageFrame(self, sender, recipient, message):
+        """
+        Format the bytes L{receive} would write for a message to a group.
+
+        @return: The encoded C{PRIVMSG} lines, ready to be written to any
+            L{IRCUser} with the same host name and encoding.
+        @rtype: C{str}
+        """
+        prefix = '%s!%s@%s' % (sender.name, sender.name, self.hostname)
+        text = message.get('text', '<an unrepresentable message>')
+        frame = ''.join([
+            ":%s PRIVMSG #%s :%s%s%s" % (
+                prefix, recipient.name, irc.lowQuote(L), irc.CR, irc.LF)
+            for L in text.splitlines()])
+        if isinstance(frame, unicode):
+            frame = frame.encode(self.encoding)
+        return frame
+
+
+    def _writeBroadcast(self, frame):
+        """
+        Write C{frame}, a message sent to a group, to the client, unless it is
+        too slow to keep up, in which case apply L{slowClientPolicy}.
+        """
+        if self._tooSlow:
+            return
+        if _sendBufferFull(self.transport):
+            backlog = self._broadcastBacklog + len(frame)
+            if backlog > self.broadcastBacklogLimit:
+                if self.slowClientPolicy == "drop":
+                    return
+                log.msg("Disconnecting %s, which cannot keep up" % (
+                        self.name,))
+                self._tooSlow = True
+                abort = getattr(self.transport, 'abortConnection', None)
+                if abort is None:
+                    self.transport.loseConnection()
+                else:
+                    abort()
+                return
+            self._broadcastBacklog = backlog
+        else:
+            self._broadcastBacklog = 0
+        self.transport.write(frame)
+
+
     def groupMetaUpdate(self, group, meta):
         if 'topic' in meta:
             topic = meta['topic']
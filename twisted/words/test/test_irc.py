@@ -195,6 +195,24 @@ class MiscTests(unittest.TestCase):
             [[[[[], 4], 3], 2], 1])
 
 
+    def test_parsemsg(self):
+        """
+        L{irc.parsemsg} splits a line into its prefix, command and
+        parameters, the last of which may contain spaces if it follows a
+        colon.
+        """
+        self.assertEqual(
+            irc.parsemsg(':nick!user@host PRIVMSG #chan :hello : there'),
+            ('nick!user@host', 'PRIVMSG', ['#chan', 'hello : there']))
+        self.assertEqual(
+            irc.parsemsg('MODE #chan +o  nick'),
+            ('', 'MODE', ['#chan', '+o', 'nick']))
+        self.assertEqual(
+            irc.parsemsg(':server 001 nick :'),
+            ('server', '001', ['nick', '']))
+        self.assertRaises(irc.IRCBadMessage, irc.parsemsg, '')
+
+
 
 class FormattedTextTests(unittest.TestCase):
     """
@@ -507,6 +525,14 @@ class QuotingTest(unittest.TestCase):
             self.assertEqual(s, irc.lowDequote(irc.lowQuote(s)))
 
 
+    def test_lowDequoteUnquoted(self):
+        """
+        L{irc.lowDequote} returns a string without any quoting unchanged.
+        """
+        s = 'nothing to see here'
+        self.assertIdentical(irc.lowDequote(s), s)
+
+
     def test_ctcpquoteSanity(self):
         """
         Testing CTCP message level quote/dequote.
@@ -1217,6 +1243,194 @@ def pop(dict, key, default):
 
 
 
+class CommandHandlerTests(unittest.TestCase):
+    """
+    Tests for the lookup of C{irc_} methods by L{irc.IRCClient.handleCommand}
+    and L{irc.IRC.handleCommand}.
+    """
+    def test_perClass(self):
+        """
+        Each class has commands dispatched to its own methods, even when a
+        base class has already handled the same command.
+        """
+        calls = []
+        class Base(irc.IRCClient):
+            def irc_FOO(self, prefix, params):
+                calls.append(('base', prefix, params))
+        class Derived(Base):
+            def irc_FOO(self, prefix, params):
+                calls.append(('derived', prefix, params))
+
+        Base().handleCommand('FOO', 'a', ['1'])
+        Derived().handleCommand('FOO', 'b', ['2'])
+        Base().handleCommand('FOO', 'c', ['3'])
+        self.assertEqual(
+            calls,
+            [('base', 'a', ['1']), ('derived', 'b', ['2']),
+             ('base', 'c', ['3'])])
+
+
+    def test_instanceMethod(self):
+        """
+        A handler set on an instance is used in preference to the method of
+        its class, and the method of the class is used again once it is
+        removed.
+        """
+        calls = []
+        class Server(irc.IRC):
+            def irc_FOO(self, prefix, params):
+                calls.append('class')
+        server = Server()
+        server.handleCommand('FOO', '', [])
+        server.irc_FOO = lambda prefix, params: calls.append('instance')
+        server.handleCommand('FOO', '', [])
+        del server.irc_FOO
+        server.handleCommand('FOO', '', [])
+        self.assertEqual(calls, ['class', 'instance', 'class'])
+
+
+    def test_classMethodReplaced(self):
+        """
+        A handler replaced on the class after it has handled a command is used
+        for the next one.
+        """
+        calls = []
+        class Client(irc.IRCClient):
+            def irc_FOO(self, prefix, params):
+                calls.append('original')
+        Client().handleCommand('FOO', '', [])
+        Client.irc_FOO = lambda self, prefix, params: calls.append('patched')
+        Client().handleCommand('FOO', '', [])
+        self.assertEqual(calls, ['original', 'patched'])
+
+
+    def test_unknown(self):
+        """
+        A command without a handler is passed to C{irc_unknown}.
+        """
+        unknown = []
+        class Client(irc.IRCClient):
+            def irc_unknown(self, prefix, command, params):
+                unknown.append((prefix, command, params))
+        Client().handleCommand('NOSUCHCOMMAND', 'p', ['x'])
+        self.assertEqual(unknown, [('p', 'NOSUCHCOMMAND', ['x'])])
+
+
+
+class LineRecordingClient(irc.IRCClient):
+    """
+    An L{irc.IRCClient} which records the lines and raw data it receives
+    instead of handling them.
+    """
+    performLogin = False
+
+    def connectionMade(self):
+        irc.IRCClient.connectionMade(self)
+        self.received = []
+
+
+    def lineReceived(self, line):
+        self.received.append(('line', line))
+
+
+    def rawDataReceived(self, data):
+        self.received.append(('raw', data))
+
+
+
+class ClientDataReceivedTests(unittest.TestCase):
+    """
+    Tests for the splitting of received data into lines by
+    L{irc.IRCClient.dataReceived}.
+    """
+    def setUp(self):
+        self.client = LineRecordingClient()
+        self.client.makeConnection(StringTransport())
+
+
+    def test_lines(self):
+        """
+        Lines ending in CR LF or LF alone are passed to C{lineReceived} in
+        order, with an incomplete line kept until it is finished.
+        """
+        self.client.dataReceived('one\r\ntwo\nthr')
+        self.client.dataReceived('ee\r\n')
+        self.assertEqual(
+            self.client.received,
+            [('line', 'one'), ('line', 'two'), ('line', 'three')])
+
+
+    def test_rawMode(self):
+        """
+        If the client switches to raw mode while handling a line, the rest
+        of the data already received is passed to C{rawDataReceived}.
+        """
+        client = self.client
+        def lineReceived(line):
+            client.received.append(('line', line))
+            if line == 'raw':
+                client.setRawMode()
+        client.lineReceived = lineReceived
+        client.dataReceived('one\nraw\nthree\nfou')
+        self.assertEqual(
+            client.received,
+            [('line', 'one'), ('line', 'raw'), ('raw', 'three\nfou')])
+
+
+    def test_paused(self):
+        """
+        If the client is paused while handling a line, the lines after it are
+        passed to C{lineReceived} only once it is resumed, along with any
+        received while it was paused.
+        """
+        client = self.client
+        def lineReceived(line):
+            client.received.append(('line', line))
+            if line == 'pause':
+                client.pauseProducing()
+        client.lineReceived = lineReceived
+        client.dataReceived('pause\ntwo\n')
+        client.dataReceived('three\n')
+        self.assertEqual(client.received, [('line', 'pause')])
+        client.resumeProducing()
+        self.assertEqual(
+            client.received,
+            [('line', 'pause'), ('line', 'two'), ('line', 'three')])
+
+
+    def test_reentrant(self):
+        """
+        Data received while a line is being handled is split into lines
+        after those already received.
+        """
+        client = self.client
+        def lineReceived(line):
+            client.received.append(('line', line))
+            if line == 'one':
+                client.dataReceived('four\n')
+        client.lineReceived = lineReceived
+        client.dataReceived('one\ntwo\n')
+        client.dataReceived('five\n')
+        self.assertEqual(
+            client.received,
+            [('line', 'one'), ('line', 'two'), ('line', 'four'),
+             ('line', 'five')])
+
+
+    def test_lineTooLong(self):
+        """
+        A line longer than C{MAX_LENGTH} is passed to C{lineLengthExceeded}
+        along with everything after it.
+        """
+        exceeded = []
+        self.client.lineLengthExceeded = exceeded.append
+        self.client.MAX_LENGTH = 10
+        self.client.dataReceived('short\n%s\nafter\n' % ('x' * 11,))
+        self.assertEqual(self.client.received, [('line', 'short')])
+        self.assertEqual(exceeded, ['x' * 11 + '\nafter\n'])
+
+
+
 class ClientImplementationTests(unittest.TestCase):
     def setUp(self):
         self.transport = StringTransport()
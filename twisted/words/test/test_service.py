@@ -16,6 +16,13 @@ from twisted.words.protocols import irc
 from twisted.spread import pb
 from twisted.internet.defer import Deferred, DeferredList, maybeDeferred, succeed
 from twisted.internet import address, defer, reactor
+from twisted.internet.protocol import ClientFactory, Protocol
+
+try:
+    from twisted.protocols import tls
+    from twisted.test.ssl_helpers import ClientTLSContext, ServerTLSContext
+except ImportError:
+    tls = None
 
 class RealmTestCase(unittest.TestCase):
     def _entityCreationTest(self, kind):
@@ -519,6 +526,174 @@ class IRCProtocolTestCase(unittest.TestCase):
         self.assertEqual(event[0][2], ['#somechannel', 'Hello, world.'])
 
 
+    def _channelWithMembers(self, *names):
+        """
+        Create the group C{somechannel} and log in and join the users named
+        C{names} to it, and return them with their transports cleared.
+        """
+        self.successResultOf(self.realm.createGroup(u"somechannel"))
+        users = []
+        for name in names:
+            user = self._loggedInUser(name)
+            user.write("JOIN #somechannel\r\n")
+            users.append(user)
+        for user in users:
+            user.transport.clear()
+        return users
+
+
+    def test_groupMessageBytes(self):
+        """
+        Every member of a group is sent the same C{PRIVMSG} lines for a
+        message to the group, one for each line of the message.
+        """
+        user, other, third = self._channelWithMembers(
+            u'useruser', u'otheruser', u'someguy')
+        group = self.successResultOf(self.realm.getGroup(u"somechannel"))
+        user.protocol.avatar.send(group, {"text": "Hello,\nworld."})
+        expected = (
+            ':useruser!useruser@realmname PRIVMSG #somechannel :Hello,\r\n'
+            ':useruser!useruser@realmname PRIVMSG #somechannel :world.\r\n')
+        self.assertEqual(user.transport.value(), '')
+        self.assertEqual(other.transport.value(), expected)
+        self.assertEqual(third.transport.value(), expected)
+
+
+    def test_groupMessageOverriddenReceive(self):
+        """
+        A member of a group which is not a plain L{service.IRCUser} has its
+        C{receive} method called for messages to the group.
+        """
+        class Recorder(object):
+            name = u'recorder'
+            received = []
+
+            def receive(self, sender, recipient, message):
+                self.received.append((sender.name, recipient.name, message))
+
+        user, = self._channelWithMembers(u'useruser')
+        group = self.successResultOf(self.realm.getGroup(u"somechannel"))
+        group.users[Recorder.name] = Recorder()
+        user.write('PRIVMSG #somechannel :Hello.\r\n')
+        self.assertEqual(
+            Recorder.received,
+            [(u'useruser', u'somechannel', {"text": "Hello."})])
+
+
+    def _setSendBufferFull(self, user, full):
+        """
+        Make the transport of C{user} report whether its write buffer is full
+        as a L{twisted.internet.abstract.FileDescriptor} does.
+        """
+        user.transport._isSendBufferFull = lambda: full
+
+
+    def test_noProducer(self):
+        """
+        L{service.IRCUser} does not register a producer with its transport,
+        which leaves that to others and lets it close TLS connections.
+        """
+        user = self._loggedInUser(u'useruser')
+        self.assertIdentical(user.transport.producer, None)
+
+
+    def test_slowClientDisconnected(self):
+        """
+        A member whose transport's write buffer is full and which is sent more
+        than L{service.IRCUser.broadcastBacklogLimit} bytes of group messages
+        is disconnected, and so leaves the group.
+        """
+        user, other = self._channelWithMembers(u'useruser', u'otheruser')
+        other.protocol.broadcastBacklogLimit = 100
+        self._setSendBufferFull(other, True)
+
+        user.write('PRIVMSG #somechannel :%s\r\n' % ('x' * 20,))
+        self.assertTrue(other.transport.connected)
+        user.write('PRIVMSG #somechannel :%s\r\n' % ('x' * 60,))
+        self.assertFalse(other.transport.connected)
+
+        group = self.successResultOf(self.realm.getGroup(u"somechannel"))
+        self.assertEqual(group.users.keys(), [u'useruser'])
+
+
+    def test_slowClientDropped(self):
+        """
+        If L{service.IRCUser.slowClientPolicy} is C{"drop"}, group messages
+        beyond L{service.IRCUser.broadcastBacklogLimit} for a member whose
+        transport's write buffer is full are dropped until it has drained.
+        """
+        user, other = self._channelWithMembers(u'useruser', u'otheruser')
+        other.protocol.broadcastBacklogLimit = 100
+        other.protocol.slowClientPolicy = "drop"
+        self._setSendBufferFull(other, True)
+
+        for text in ['first', 'x' * 100, 'second is dropped too']:
+            user.write('PRIVMSG #somechannel :%s\r\n' % (text,))
+        self._setSendBufferFull(other, False)
+        user.write('PRIVMSG #somechannel :third\r\n')
+
+        self.assertTrue(other.transport.connected)
+        self.assertEqual(
+            [params[1] for (prefix, command, params)
+             in self._response(other, 'PRIVMSG')],
+            ['first', 'third'])
+
+
+    def test_slowClientBehindWrapper(self):
+        """
+        The write buffer of the transport wrapped by a protocol wrapper, such
+        as TLS, is the one which decides whether a member is too slow.
+        """
+        transport = proto_helpers.StringTransport()
+        transport._isSendBufferFull = lambda: True
+        wrapper = proto_helpers.StringTransport()
+        wrapper.transport = transport
+        self.assertTrue(service._sendBufferFull(wrapper))
+        self.assertFalse(
+            service._sendBufferFull(proto_helpers.StringTransport()))
+
+
+    def test_quitOverTLS(self):
+        """
+        A client which sends I{QUIT} over TLS is disconnected.
+        """
+        serverFactory = tls.TLSMemoryBIOFactory(
+            ServerTLSContext(), False, self.factory)
+        server = serverFactory.buildProtocol(
+            address.IPv4Address('TCP', '127.0.0.1', 54321))
+        serverTransport = proto_helpers.StringTransport()
+        server.makeConnection(serverTransport)
+
+        clientFactory = ClientFactory()
+        clientFactory.protocol = Protocol
+        clientWrapperFactory = tls.TLSMemoryBIOFactory(
+            ClientTLSContext(), True, clientFactory)
+        client = clientWrapperFactory.buildProtocol(None)
+        clientTransport = proto_helpers.StringTransport()
+        client.makeConnection(clientTransport)
+
+        def pump():
+            while clientTransport.value() or serverTransport.value():
+                data = clientTransport.value()
+                clientTransport.clear()
+                if data:
+                    server.dataReceived(data)
+                data = serverTransport.value()
+                serverTransport.clear()
+                if data:
+                    client.dataReceived(data)
+
+        client.write('PASS useruser_password\r\nNICK useruser\r\n')
+        pump()
+        self.assertFalse(serverTransport.disconnecting)
+        client.write('QUIT\r\n')
+        pump()
+        self.assertTrue(serverTransport.disconnecting)
+
+    if tls is None:
+        test_quitOverTLS.skip = "TLS support is not available."
+
+
     def testPrivateMessage(self):
         user = self._loggedInUser(u'useruser')
 